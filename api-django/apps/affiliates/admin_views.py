@@ -1,12 +1,14 @@
-from rest_framework import viewsets, filters
+from rest_framework import viewsets, filters, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Count, Sum
+from django.db.models import Count, F
 from .models import Referral, ReferralPayout, ReferralCommission
 from .serializers import ReferralSerializer, ReferralPayoutSerializer, ReferralCommissionSerializer
-from apps.users.models import User
+from apps.common.aggregates import subquery_aggregate
+from apps.reports.statistics import collect_statistics, kpi
+from apps.users.models import User, UserAccountSummary
 
 
 class IsAdminOrFinanceManager(IsAuthenticated):
@@ -35,29 +37,28 @@ class ReferralAdminViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['get'])
     def statistics(self, request):
-        """Статистика по реферальной программе"""
-        total_referrals = Referral.objects.count()
-        active_referrals = Referral.objects.filter(status='active').count()
-        total_earned = Referral.objects.aggregate(
-            total=Sum('total_earned')
-        )['total'] or 0
-        total_paid_out = Referral.objects.aggregate(
-            total=Sum('paid_out')
-        )['total'] or 0
+        """Статистика по реферальной программе (агрегаты apps.reports, параметры как у заказов)"""
+        try:
+            stats = collect_statistics(request.query_params, {
+                'referrals': {'total_referrals': kpi(), 'active_referrals': kpi(status='active')},
+                'referral_commissions': {'total_earned': kpi('amount')},
+                'referral_payouts': {'total_paid_out': kpi('amount', status='paid')},
+            })
+        except ValueError as e:
+            return Response({'success': False, 'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Топ рефералов
-        top_referrers = Referral.objects.values('referrer__email').annotate(
-            count=Count('id'),
-            total_earned=Sum('total_earned')
-        ).order_by('-total_earned')[:10]
+        # Топ рефералов: по предрасчитанным итогам пользователей (за все время)
+        top_referrers = (
+            UserAccountSummary.objects.filter(referral_earned__gt=0)
+            .annotate(
+                referrer__email=F('user__email'),
+                count=subquery_aggregate(Referral.objects.all(), 'referrer', Count('id'), outer_field='user_id'),
+            )
+            .order_by('-referral_earned')
+            .values('referrer__email', 'count', total_earned=F('referral_earned'))[:10]
+        )
         
-        return Response({
-            'total_referrals': total_referrals,
-            'active_referrals': active_referrals,
-            'total_earned': float(total_earned),
-            'total_paid_out': float(total_paid_out),
-            'top_referrers': list(top_referrers),
-        })
+        return Response(stats.response(**stats.totals, top_referrers=list(top_referrers)))
 
 
 class ReferralPayoutAdminViewSet(viewsets.ModelViewSet):
@@ -6,3 +6,8 @@ class AffiliatesConfig(AppConfig):
     name = 'apps.affiliates'
     verbose_name = 'Аффилиаты'
 
+    
+    def ready(self):
+        """Подписываем журнал баланса партнеров на комиссии и выплаты"""
+        from apps.affiliates.ledger import connect_signals
+        connect_signals()
@@ -1,9 +1,17 @@
+from decimal import Decimal
 from rest_framework import views, status
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Q, Sum, Count
+from django.db import transaction
+from django.db.models import Count, DecimalField, Q, Sum
 from django.utils import timezone
+from apps.common.aggregates import subquery_aggregate
+from apps.common.batching import stream_queryset
+from apps.common.pagination import CreatedAtCursorPagination
+from apps.common.streaming import StreamingJSONResponse
+from apps.users.account_summary import get_account_summary
 from apps.users.models import User
+from .ledger import get_available_balance, lock_balance
 from .models import Referral, ReferralPayout, ReferralCommission
 from .serializers import ReferralSerializer, ReferralPayoutSerializer, ReferralCommissionSerializer
 
@@ -15,76 +23,74 @@ class ClientReferralsView(views.APIView):
     def get(self, request):
         user = request.user
         
-        # Статистика
-        referrals = Referral.objects.filter(referrer=user).select_related('referred_user')
-        total_referrals = referrals.count()
-        active_referrals = referrals.filter(status='active').count()
-        
-        # Заработано
-        total_earned = ReferralCommission.objects.filter(
-            referral__referrer=user
-        ).aggregate(total=Sum('commission_amount'))['total'] or 0
+        # Статистика одним запросом
+        referrals = Referral.objects.filter(referrer=user)
+        counts = referrals.aggregate(
+            total=Count('id'),
+            active=Count('id', filter=Q(status='active')),
+        )
         
-        # Выплачено
-        total_paid = ReferralPayout.objects.filter(
-            referrer=user,
-            status='paid'
-        ).aggregate(total=Sum('amount'))['total'] or 0
+        # Заработано / выплачено - из предрасчитанных итогов пользователя
+        summary = get_account_summary(user)
+        total_earned = summary.referral_earned
+        total_paid = summary.payouts_paid
         
-        # Доступно к выводу
+        # Заработано за вычетом выплаченного; к выводу - еще и за вычетом заявок в обработке
         available_balance = float(total_earned) - float(total_paid)
+        withdrawable_balance = float(get_available_balance(user.id))
         
-        # Список рефералов
-        referrals_list = referrals.order_by('-created_at')[:50]
-        referrals_data = []
-        for ref in referrals_list:
-            # Рассчитываем сумму комиссий из ReferralCommission для этого реферала
-            ref_total_earned = ReferralCommission.objects.filter(
-                referral=ref
-            ).aggregate(total=Sum('commission_amount'))['total'] or 0
-            
-            # Рассчитываем сумму выплаченных комиссий для этого реферала
-            ref_paid_out = ReferralCommission.objects.filter(
-                referral=ref,
-                payout__status='paid'
-            ).aggregate(total=Sum('commission_amount'))['total'] or 0
-            
-            referrals_data.append({
+        # Список рефералов: суммы комиссий - подзапросами в том же запросе, страницы по курсору
+        money = DecimalField(max_digits=12, decimal_places=2)
+        referrals_list = referrals.select_related('referred_user').annotate(
+            commissions_earned=subquery_aggregate(
+                ReferralCommission.objects.all(), 'referral', Sum('commission_amount'),
+                default=Decimal('0'), output_field=money,
+            ),
+            commissions_paid_out=subquery_aggregate(
+                ReferralCommission.objects.filter(payout__status='paid'), 'referral', Sum('commission_amount'),
+                default=Decimal('0'), output_field=money,
+            ),
+        )
+        paginator = CreatedAtCursorPagination()
+        page = paginator.paginate_queryset(referrals_list, request, view=self)
+        referrals_data = [
+            {
                 'id': str(ref.id),
                 'referred_user': {
                     'email': ref.referred_user.email,
                     'name': ref.referred_user.name,
                 },
                 'status': ref.status,
-                'total_earned': float(ref_total_earned),
-                'paid_out': float(ref_paid_out),
+                'total_earned': float(ref.commissions_earned),
+                'paid_out': float(ref.commissions_paid_out),
                 'created_at': ref.created_at.isoformat() if ref.created_at else None,
-            })
+            }
+            for ref in page
+        ]
         
         # Реферальная ссылка
         referral_link = f"https://miniapp.expert/?ref={user.referral_code}"
         
         # Комиссия (берем из первого реферала или используем дефолтное значение 20%)
-        # Если у пользователя есть рефералы, берем commission_rate из первого, иначе 20%
         commission_rate = 20.00
-        if referrals.exists():
-            first_referral = referrals.first()
-            if first_referral.commission_rate:
-                commission_rate = float(first_referral.commission_rate)
-        # Если нет рефералов, можно использовать дефолтное значение или получить из настроек
+        first_rate = referrals.values_list('commission_rate', flat=True).first() if counts['total'] else None
+        if first_rate:
+            commission_rate = float(first_rate)
         
         return Response({
             'success': True,
             'referral_link': referral_link,
             'commission_rate': commission_rate,
             'stats': {
-                'total_referrals': total_referrals,
-                'active_referrals': active_referrals,
+                'total_referrals': counts['total'],
+                'active_referrals': counts['active'],
                 'total_earned': float(total_earned),
                 'total_paid': float(total_paid),
                 'available_balance': available_balance,
+                'withdrawable_balance': withdrawable_balance,
             },
-            'referrals': referrals_data
+            'referrals': referrals_data,
+            **paginator.get_page_links(),
         })
 
 
@@ -116,8 +122,11 @@ class ClientRequestPayoutView(views.APIView):
             )
         
         try:
-            amount = float(amount)
-        except (ValueError, TypeError):
+            amount = Decimal(str(amount)).quantize(Decimal('0.01'))
+        except (ArithmeticError, ValueError, TypeError):
+            amount = None
+        # NaN и Infinity проходят quantize, но не сравниваются с нулем
+        if amount is None or not amount.is_finite() or amount <= 0:
             return Response(
                 {'success': False, 'message': 'Invalid amount'},
                 status=status.HTTP_400_BAD_REQUEST
@@ -125,34 +134,26 @@ class ClientRequestPayoutView(views.APIView):
         
         user = request.user
         
-        # Проверить доступный баланс
-        total_earned = ReferralCommission.objects.filter(
-            referral__referrer=user
-        ).aggregate(total=Sum('commission_amount'))['total'] or 0
-        
-        total_paid = ReferralPayout.objects.filter(
-            referrer=user,
-            status__in=['pending', 'processing', 'paid']
-        ).aggregate(total=Sum('amount'))['total'] or 0
-        
-        available_balance = float(total_earned) - float(total_paid)
-        
-        if amount > available_balance:
-            return Response(
-                {'success': False, 'message': 'Insufficient balance'},
-                status=status.HTTP_400_BAD_REQUEST
+        with transaction.atomic():
+            # Строка баланса блокируется: параллельные заявки проверяют баланс по очереди
+            balance = lock_balance(user.id)
+            
+            if amount > balance.balance:
+                return Response(
+                    {'success': False, 'message': 'Insufficient balance'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            # Создать заявку на вывод (резерв в журнале баланса - сигналом под той же блокировкой)
+            payout = ReferralPayout.objects.create(
+                referrer=user,
+                amount=amount,
+                currency='RUB',
+                status='pending',
+                payment_method=payment_method,
+                notes=f'Запрос на вывод через {payment_method}'
             )
         
-        # Создать заявку на вывод
-        payout = ReferralPayout.objects.create(
-            referrer=user,
-            amount=amount,
-            currency='RUB',
-            status='pending',
-            payment_method=payment_method,
-            notes=f'Запрос на вывод через {payment_method}'
-        )
-        
         serializer = ReferralPayoutSerializer(payout)
         
         return Response({
@@ -162,61 +163,94 @@ class ClientRequestPayoutView(views.APIView):
         }, status=status.HTTP_201_CREATED)
 
 
+def _commission_order(commission):
+    order = commission.order
+    if order is None:
+        return None
+    return {
+        'id': str(order.id),
+        'order_id': order.order_id,
+        'amount': float(order.amount),
+        'currency': order.currency,
+        'product': {'name': order.product.name} if order.product else None,
+        'created_at': order.created_at.isoformat() if order.created_at else None,
+    }
+
+
+def _commission_payout(commission):
+    payout = commission.payout
+    if payout is None:
+        return None
+    return {
+        'id': str(payout.id),
+        'status': payout.status,
+        'amount': float(payout.amount),
+        'created_at': payout.created_at.isoformat() if payout.created_at else None,
+    }
+
+
+# Поля комиссии в ответе: (нужные select_related, значение)
+COMMISSION_FIELDS = {
+    'id': ((), lambda c: str(c.id)),
+    'referral': (('referral__referred_user',), lambda c: {
+        'id': str(c.referral.id),
+        'referred_user': {
+            'email': c.referral.referred_user.email,
+            'name': c.referral.referred_user.name or c.referral.referred_user.email,
+        },
+    }),
+    'order': (('order__product',), _commission_order),
+    # Сумма заказа
+    'amount': (('order',), lambda c: float(c.order.amount) if c.order else float(c.amount)),
+    'commission_rate': ((), lambda c: float(c.commission_rate)),  # Процент комиссии
+    'commission_amount': ((), lambda c: float(c.commission_amount)),  # Сумма комиссии
+    'status': ((), lambda c: c.status),
+    'payout': (('payout',), _commission_payout),
+    'created_at': ((), lambda c: c.created_at.isoformat() if c.created_at else None),
+}
+
+
 class ClientReferralCommissionsView(views.APIView):
-    """История начислений комиссий за рефералов"""
+    """История начислений комиссий за рефералов
+
+    Параметры:
+        fields: поля комиссии через запятую (по умолчанию все), JOIN-ы - только для выбранных
+        cursor, page_size: курсорная пагинация (новые первыми)
+        stream=1: вся история одним потоковым JSON-ответом (выгрузка)
+    """
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
-        user = request.user
+        fields = request.query_params.get('fields')
+        fields = [name.strip() for name in fields.split(',') if name.strip()] if fields else list(COMMISSION_FIELDS)
+        unknown = [name for name in fields if name not in COMMISSION_FIELDS]
+        if unknown:
+            return Response(
+                {'success': False, 'message': f'Unknown fields: {", ".join(unknown)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        # Получаем все комиссии пользователя с деталями
-        commissions = ReferralCommission.objects.filter(
-            referral__referrer=user
-        ).select_related(
-            'referral',
-            'referral__referred_user',
-            'order',
-            'order__product',
-            'payout'
-        ).order_by('-created_at')
-        
-        commissions_data = []
-        for commission in commissions:
-            commissions_data.append({
-                'id': str(commission.id),
-                'referral': {
-                    'id': str(commission.referral.id),
-                    'referred_user': {
-                        'email': commission.referral.referred_user.email,
-                        'name': commission.referral.referred_user.name or commission.referral.referred_user.email,
-                    }
-                },
-                'order': {
-                    'id': str(commission.order.id) if commission.order else None,
-                    'order_id': commission.order.order_id if commission.order else 'N/A',
-                    'amount': float(commission.order.amount) if commission.order else float(commission.amount),
-                    'currency': commission.order.currency if commission.order else 'RUB',
-                    'product': {
-                        'name': commission.order.product.name if commission.order and commission.order.product else 'N/A',
-                    } if commission.order and commission.order.product else None,
-                    'created_at': commission.order.created_at.isoformat() if commission.order and commission.order.created_at else None,
-                } if commission.order else None,
-                'amount': float(commission.order.amount) if commission.order else float(commission.amount),  # Сумма заказа
-                'commission_rate': float(commission.commission_rate),  # Процент комиссии
-                'commission_amount': float(commission.commission_amount),  # Сумма комиссии
-                'status': commission.status,
-                'payout': {
-                    'id': str(commission.payout.id),
-                    'status': commission.payout.status,
-                    'amount': float(commission.payout.amount),
-                    'created_at': commission.payout.created_at.isoformat() if commission.payout.created_at else None,
-                } if commission.payout else None,
-                'created_at': commission.created_at.isoformat() if commission.created_at else None,
-            })
+        related = sorted({path for name in fields for path in COMMISSION_FIELDS[name][0]})
+        commissions = ReferralCommission.objects.filter(referral__referrer=request.user).select_related(*related)
+        getters = [(name, COMMISSION_FIELDS[name][1]) for name in fields]
+        
+        def serialize(commission):
+            return {name: getter(commission) for name, getter in getters}
+        
+        if request.query_params.get('stream') in ('1', 'true'):
+            rows = stream_queryset(commissions.order_by(*CreatedAtCursorPagination.ordering))
+            return StreamingJSONResponse(
+                (serialize(commission) for commission in rows),
+                'commissions', envelope={'success': True}, total_key='total',
+            )
+        
+        paginator = CreatedAtCursorPagination()
+        page = paginator.paginate_queryset(commissions, request, view=self)
+        commissions_data = [serialize(commission) for commission in page]
         
         return Response({
             'success': True,
             'commissions': commissions_data,
-            'total': len(commissions_data)
+            'total': commissions.count(),  # Всего начислений (на странице - len(commissions))
+            **paginator.get_page_links(),
         })
-
@@ -0,0 +1,133 @@
+"""
+Начисление реферальных комиссий по подтвержденным заказам.
+
+Webhook оплаты только ставит начисление в Celery (после коммита), сама операция
+идемпотентна: комиссия одна на пару (реферал, заказ) - уникальное ограничение
+плюс get_or_create, поэтому повторная доставка webhook или повтор задачи не
+создают вторую комиссию. Referral.total_earned увеличивается через F() одним
+UPDATE, без чтения-изменения-записи.
+
+Пропущенные начисления (брокер недоступен, исторические заказы) добирает
+accrue_missing_commissions - из Celery Beat и команды backfill_referral_commissions.
+"""
+import logging
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Optional
+
+from django.db import transaction
+from django.db.models import DecimalField, Exists, F, OuterRef, Sum
+
+from apps.common.aggregates import subquery_aggregate
+from apps.common.batching import iter_chunks
+from apps.orders.models import Order
+from .models import Referral, ReferralCommission
+
+logger = logging.getLogger(__name__)
+
+# Процент комиссии новой реферальной связи
+DEFAULT_COMMISSION_RATE = Decimal('20.00')
+
+
+def schedule_commission(order_id):
+    """Поставить начисление комиссии по заказу в Celery после коммита текущей транзакции"""
+    transaction.on_commit(lambda: _enqueue(order_id))
+
+
+def _enqueue(order_id):
+    from .tasks import accrue_referral_commission
+    try:
+        accrue_referral_commission.delay(str(order_id))
+    except Exception as e:
+        # Заказ уже подтвержден в БД, комиссию доберет accrue_missing_commissions
+        logger.error(f"Failed to schedule referral commission for order {order_id}: {e}")
+
+
+def commission_amount(amount, rate) -> Decimal:
+    return (Decimal(amount) * Decimal(rate) / 100).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def accrue_commission(order_id) -> Optional[ReferralCommission]:
+    """Начислить комиссию по подтвержденному заказу (повторный вызов ничего не меняет)
+
+    Returns:
+        созданная комиссия или None (уже начислена / заказ не реферальный)
+    """
+    with transaction.atomic():
+        order = Order.objects.filter(pk=order_id).only('id', 'user_id', 'referred_by_id', 'amount', 'status').first()
+        if (
+            order is None
+            or order.status != 'CONFIRMED'
+            or not order.user_id
+            or not order.referred_by_id
+            or order.referred_by_id == order.user_id
+        ):
+            return None
+
+        referral, created = Referral.objects.get_or_create(
+            referrer_id=order.referred_by_id,
+            referred_user_id=order.user_id,
+            defaults={'status': 'active', 'commission_rate': DEFAULT_COMMISSION_RATE},
+        )
+        if not created and referral.status != 'active':
+            referral.status = 'active'
+            referral.save(update_fields=['status', 'updated_at'])
+
+        commission, created = ReferralCommission.objects.get_or_create(
+            referral=referral,
+            order=order,
+            defaults={
+                'amount': order.amount,
+                'commission_rate': referral.commission_rate,
+                'commission_amount': commission_amount(order.amount, referral.commission_rate),
+                'status': 'pending',
+            },
+        )
+        if not created:
+            return None
+        Referral.objects.filter(pk=referral.pk).update(total_earned=F('total_earned') + commission.commission_amount)
+
+    logger.info(f"Referral commission {commission.commission_amount} accrued for order {order_id}")
+    return commission
+
+
+def missing_commission_orders():
+    """Подтвержденные реферальные заказы без начисленной комиссии"""
+    return (
+        Order.objects.filter(status='CONFIRMED', user__isnull=False, referred_by__isnull=False)
+        .exclude(referred_by=F('user'))
+        .filter(~Exists(ReferralCommission.objects.filter(order=OuterRef('pk'))))
+    )
+
+
+def accrue_missing_commissions(since=None, chunk_size=None, dry_run=False):
+    """Начислить комиссии по заказам, пропущенным при обработке оплаты
+
+    Returns:
+        (найдено заказов, начислено комиссий)
+    """
+    orders = missing_commission_orders()
+    if since is not None:
+        orders = orders.filter(updated_at__gte=since)
+    found, accrued = 0, 0
+    for chunk in iter_chunks(orders.only('id'), chunk_size=chunk_size):
+        found += len(chunk)
+        if dry_run:
+            continue
+        for order in chunk:
+            try:
+                if accrue_commission(order.pk):
+                    accrued += 1
+            except Exception as e:
+                logger.error(f"Failed to accrue referral commission for order {order.pk}: {e}")
+    return found, accrued
+
+
+def recompute_referral_totals(referral_ids=None) -> int:
+    """Пересчитать Referral.total_earned по комиссиям (одним UPDATE)"""
+    referrals = Referral.objects.all()
+    if referral_ids is not None:
+        referrals = referrals.filter(pk__in=referral_ids)
+    return referrals.update(total_earned=subquery_aggregate(
+        ReferralCommission.objects.all(), 'referral', Sum('commission_amount'),
+        default=Decimal('0'), output_field=DecimalField(max_digits=12, decimal_places=2),
+    ))
@@ -0,0 +1,125 @@
+"""
+Журнал баланса партнера (AffiliateLedgerEntry) и текущий баланс (AffiliateBalance).
+
+Каждое изменение баланса - новая запись журнала с остатком после операции; запись
+и новый остаток пишутся под SELECT FOR UPDATE строки AffiliateBalance, поэтому
+параллельные операции одного партнера выстраиваются в очередь, а чтение
+доступного баланса - поиск одной строки.
+
+Вклад в баланс: комиссия +commission_amount, выплата в статусе pending/processing/paid
+-amount (резерв), failed/cancelled - 0 (резерв возвращается). Изменения приходят
+сигналами (регистрируются в AffiliatesConfig.ready()) в транзакции бизнес-операции.
+Прежний вклад изменяемой записи читается под SELECT FOR UPDATE в транзакции ее
+сохранения (save моделей открывает ее сам), поэтому параллельные изменения одной
+комиссии или выплаты не учитывают один и тот же переход дважды.
+"""
+from decimal import Decimal
+from typing import Optional, Tuple
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from .models import AffiliateBalance, AffiliateLedgerEntry, Referral, ReferralCommission, ReferralPayout
+
+# Статусы выплаты, в которых ее сумма списана с баланса
+RESERVED_PAYOUT_STATUSES = ('pending', 'processing', 'paid')
+
+
+def get_available_balance(referrer_id) -> Decimal:
+    """Доступно к выводу (одна строка AffiliateBalance)"""
+    balance = AffiliateBalance.objects.filter(referrer_id=referrer_id).values_list('balance', flat=True).first()
+    return balance if balance is not None else Decimal('0')
+
+
+def lock_balance(referrer_id) -> AffiliateBalance:
+    """Строка баланса под SELECT FOR UPDATE (вызывать внутри transaction.atomic)"""
+    AffiliateBalance.objects.get_or_create(referrer_id=referrer_id)
+    return AffiliateBalance.objects.select_for_update().get(referrer_id=referrer_id)
+
+
+def post_entry(referrer_id, entry_type: str, amount, commission=None, payout=None) -> Optional[AffiliateLedgerEntry]:
+    """Записать движение баланса и обновить остаток"""
+    amount = Decimal(amount)
+    if not referrer_id or not amount:
+        return None
+    with transaction.atomic():
+        balance = lock_balance(referrer_id)
+        balance.balance += amount
+        balance.save(update_fields=['balance', 'updated_at'])
+        return AffiliateLedgerEntry.objects.create(
+            referrer_id=referrer_id,
+            entry_type=entry_type,
+            amount=amount,
+            balance_after=balance.balance,
+            commission=commission,
+            payout=payout,
+        )
+
+
+def _contribution(instance) -> Tuple[Optional[int], Decimal]:
+    """(партнер, вклад в баланс) для комиссии или выплаты"""
+    if isinstance(instance, ReferralCommission):
+        if not instance.referral_id:
+            return None, Decimal('0')
+        referral = instance._state.fields_cache.get('referral')
+        if referral is not None and referral.pk == instance.referral_id:
+            referrer_id = referral.referrer_id
+        else:
+            referrer_id = Referral.objects.filter(pk=instance.referral_id).values_list('referrer_id', flat=True).first()
+        return referrer_id, Decimal(instance.commission_amount or 0)
+    if instance.status in RESERVED_PAYOUT_STATUSES:
+        return instance.referrer_id, -Decimal(instance.amount or 0)
+    return instance.referrer_id, Decimal('0')
+
+
+def _entry_type(instance, delta, created):
+    if isinstance(instance, ReferralCommission):
+        return 'commission' if created else 'commission_adjustment'
+    return 'payout_reserve' if delta < 0 else 'payout_release'
+
+
+def _links(instance, deleted=False):
+    if deleted:
+        return {}
+    if isinstance(instance, ReferralCommission):
+        return {'commission': instance}
+    return {'payout': instance}
+
+
+def _remember_previous(sender, instance, raw=False, **kwargs):
+    instance._ledger_previous = None
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    previous = sender.objects.select_for_update().filter(pk=instance.pk).first()
+    if previous is not None:
+        instance._ledger_previous = _contribution(previous)
+
+
+def _on_save(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    referrer_id, value = _contribution(instance)
+    previous = getattr(instance, '_ledger_previous', None)
+    if previous is None:
+        post_entry(referrer_id, _entry_type(instance, value, created), value, **_links(instance))
+        return
+    previous_referrer_id, previous_value = previous
+    if previous_referrer_id == referrer_id:
+        delta = value - previous_value
+        post_entry(referrer_id, _entry_type(instance, delta, False), delta, **_links(instance))
+    else:
+        post_entry(previous_referrer_id, _entry_type(instance, -previous_value, False), -previous_value, **_links(instance))
+        post_entry(referrer_id, _entry_type(instance, value, False), value, **_links(instance))
+
+
+def _on_delete(sender, instance, **kwargs):
+    referrer_id, value = _contribution(instance)
+    post_entry(referrer_id, _entry_type(instance, -value, False), -value, **_links(instance, deleted=True))
+
+
+def connect_signals():
+    for model in (ReferralCommission, ReferralPayout):
+        uid = f'affiliate_ledger_{model.__name__}'
+        pre_save.connect(_remember_previous, sender=model, dispatch_uid=f'{uid}_pre')
+        post_save.connect(_on_save, sender=model, dispatch_uid=f'{uid}_post')
+        post_delete.connect(_on_delete, sender=model, dispatch_uid=f'{uid}_delete')
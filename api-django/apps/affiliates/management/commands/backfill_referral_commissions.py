@@ -0,0 +1,40 @@
+"""
+Начисление комиссий по историческим подтвержденным реферальным заказам пачками
+и пересчет Referral.total_earned по фактическим комиссиям.
+"""
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.affiliates.commissions import accrue_missing_commissions, recompute_referral_totals
+
+
+class Command(BaseCommand):
+    help = 'Начисляет пропущенные реферальные комиссии и пересчитывает заработок рефералов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=str, help='Только заказы, измененные с даты (YYYY-MM-DD)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Размер пачки заказов')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать заказы без комиссии')
+        parser.add_argument('--skip-recompute', action='store_true', help='Не пересчитывать Referral.total_earned')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = timezone.make_aware(datetime.combine(datetime.strptime(options['since'], '%Y-%m-%d'), time.min))
+            except ValueError:
+                raise CommandError('--since: ожидается дата в формате YYYY-MM-DD')
+
+        found, accrued = accrue_missing_commissions(
+            since=since, chunk_size=options['batch_size'], dry_run=options['dry_run'],
+        )
+        if options['dry_run']:
+            self.stdout.write(f'Заказов без комиссии: {found}')
+            return
+        self.stdout.write(self.style.SUCCESS(f'Начислено комиссий: {accrued} из {found} заказов'))
+
+        if not options['skip_recompute']:
+            updated = recompute_referral_totals()
+            self.stdout.write(self.style.SUCCESS(f'Пересчитан заработок {updated} рефералов'))
@@ -0,0 +1,143 @@
+"""
+Бенчмарк реферальной программы клиента (ClientReferralsView): число запросов и время ответа
+для партнера с большим числом рефералов - прежняя схема (агрегаты комиссий на каждого
+реферала) против подзапросов в одном запросе и курсорной пагинации.
+
+Синтетические данные создаются в транзакции, которая откатывается в конце.
+"""
+import time
+import uuid
+from decimal import Decimal
+from urllib.parse import parse_qs, urlparse
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from apps.affiliates.client_views import ClientReferralsView
+from apps.affiliates.models import Referral, ReferralCommission, ReferralPayout
+from apps.orders.models import Order
+from apps.products.models import Product
+from apps.users.models import User
+
+
+def _cursor(link):
+    return parse_qs(urlparse(link).query)['cursor'][0]
+
+
+def legacy_referrals(user):
+    """Прежний список рефералов: первые 50, по два агрегата на каждого"""
+    referrals = Referral.objects.filter(referrer=user).select_related('referred_user')
+    referrals.count()
+    referrals.filter(status='active').count()
+    data = []
+    for ref in referrals.order_by('-created_at')[:50]:
+        earned = ReferralCommission.objects.filter(referral=ref).aggregate(total=Sum('commission_amount'))['total']
+        paid = ReferralCommission.objects.filter(
+            referral=ref, payout__status='paid'
+        ).aggregate(total=Sum('commission_amount'))['total']
+        data.append((ref.id, ref.referred_user.email, earned or 0, paid or 0))
+    if referrals.exists():
+        referrals.first()
+    return data
+
+
+class Command(BaseCommand):
+    help = 'Измеряет число запросов и время ответа списка рефералов (данные откатываются)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--referrals', type=int, default=10_000, help='Количество рефералов партнера')
+        parser.add_argument('--commissions', type=int, default=3, help='Комиссий на реферала')
+        parser.add_argument('--repeat', type=int, default=5, help='Повторов на режим')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            partner = self._seed(options['referrals'], options['commissions'])
+            self._run(partner, options['repeat'])
+            transaction.set_rollback(True)
+        self.stdout.write('Синтетические данные откатаны')
+
+    def _seed(self, total, per_referral):
+        started = time.perf_counter()
+        prefix = uuid.uuid4().hex[:8]
+        partner = User.objects.create(email=f'bench-{prefix}-partner@bench.local', password='!')
+        users = User.objects.bulk_create(
+            [User(email=f'bench-{prefix}-{i}@bench.local', password='!') for i in range(total)],
+            batch_size=5000,
+        )
+        referrals = Referral.objects.bulk_create(
+            [Referral(referrer=partner, referred_user=user, status='active', commission_rate=20) for user in users],
+            batch_size=5000,
+        )
+        product = Product.objects.create(name='Bench', slug=f'bench-{prefix}', price=990, product_type='subscription')
+        payout = ReferralPayout.objects.create(referrer=partner, amount=0, status='paid')
+
+        orders, commissions = [], []
+        for index, referral in enumerate(referrals):
+            for number in range(per_referral):
+                order = Order(
+                    order_id=f'bench-{prefix}-{index}-{number}', user_id=referral.referred_user_id,
+                    product=product, amount=990, status='CONFIRMED',
+                )
+                orders.append(order)
+                commissions.append(ReferralCommission(
+                    referral=referral, order=order, amount=990, commission_rate=20,
+                    commission_amount=Decimal('198.00'), payout=payout if number == 0 else None,
+                ))
+        Order.objects.bulk_create(orders, batch_size=5000)
+        ReferralCommission.objects.bulk_create(commissions, batch_size=5000)
+        self.stdout.write(
+            f'Создано {len(referrals)} рефералов и {len(commissions)} комиссий за {time.perf_counter() - started:.1f} с'
+        )
+        return partner
+
+    def _run(self, partner, repeat):
+        factory = APIRequestFactory(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+        view = ClientReferralsView.as_view()
+
+        def call_view(params=None):
+            request = factory.get('/api/client/referrals/', params or {})
+            force_authenticate(request, user=partner)
+            response = view(request)
+            assert response.status_code == 200, response.data
+            return response.data
+
+        # Итоги пользователя создаются при первом обращении - прогреваем
+        first_page = call_view()
+
+        def walk_all_pages():
+            data, pages = call_view({'page_size': 200}), 1
+            while data['next']:
+                data = call_view({'cursor': _cursor(data['next']), 'page_size': 200})
+                pages += 1
+            return pages
+
+        cases = [
+            ('прежняя схема (50)', lambda: legacy_referrals(partner)),
+            ('подзапросы, 1-я стр. (50)', lambda: call_view()),
+            ('подзапросы, 2-я стр. (50)', lambda: call_view({'cursor': _cursor(first_page['next'])})),
+        ]
+
+        self.stdout.write('\n' + '=' * 60)
+        self.stdout.write(f'{"режим":<32}{"запросов":>10}{"мс/ответ":>12}')
+        for label, func in cases:
+            with CaptureQueriesContext(connection) as queries:
+                func()
+            started = time.perf_counter()
+            for _ in range(repeat):
+                func()
+            elapsed = (time.perf_counter() - started) / repeat
+            self.stdout.write(f'{label:<32}{len(queries):>10}{elapsed * 1000:>12.1f}')
+
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            pages = walk_all_pages()
+            elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'Все рефералы страницами по 200: {pages} стр., {len(queries)} запросов, '
+            f'{elapsed:.2f} с ({elapsed / pages * 1000:.1f} мс/стр.)'
+        )
+        self.stdout.write('=' * 60)
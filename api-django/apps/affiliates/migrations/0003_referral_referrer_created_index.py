@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-18 12:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('affiliates', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='referral',
+            index=models.Index(fields=['referrer', '-created_at', '-id'], name='referrals_referrer_created_idx'),
+        ),
+    ]
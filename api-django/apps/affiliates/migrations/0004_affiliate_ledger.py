@@ -0,0 +1,86 @@
+# Generated by Django 4.2.16 on 2026-10-18 12:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_opening_balances(apps, schema_editor):
+    """Начальный остаток партнеров: комиссии минус выплаты pending/processing/paid"""
+    ReferralCommission = apps.get_model('affiliates', 'ReferralCommission')
+    ReferralPayout = apps.get_model('affiliates', 'ReferralPayout')
+    AffiliateBalance = apps.get_model('affiliates', 'AffiliateBalance')
+    AffiliateLedgerEntry = apps.get_model('affiliates', 'AffiliateLedgerEntry')
+
+    balances = {}
+    earned = (
+        ReferralCommission.objects.values('referral__referrer_id')
+        .annotate(total=models.Sum('commission_amount')).order_by()
+    )
+    for row in earned:
+        balances[row['referral__referrer_id']] = row['total'] or 0
+    reserved = (
+        ReferralPayout.objects.filter(status__in=['pending', 'processing', 'paid'])
+        .values('referrer_id').annotate(total=models.Sum('amount')).order_by()
+    )
+    for row in reserved:
+        balances[row['referrer_id']] = balances.get(row['referrer_id'], 0) - (row['total'] or 0)
+
+    AffiliateBalance.objects.bulk_create(
+        [AffiliateBalance(referrer_id=referrer_id, balance=balance) for referrer_id, balance in balances.items()],
+        batch_size=1000,
+    )
+    AffiliateLedgerEntry.objects.bulk_create(
+        [
+            AffiliateLedgerEntry(referrer_id=referrer_id, entry_type='opening', amount=balance, balance_after=balance)
+            for referrer_id, balance in balances.items()
+            if balance
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_user_account_summary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('affiliates', '0003_referral_referrer_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AffiliateBalance',
+            fields=[
+                ('referrer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='affiliate_balance', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Баланс партнера',
+                'verbose_name_plural': 'Балансы партнеров',
+                'db_table': 'affiliate_balances',
+            },
+        ),
+        migrations.CreateModel(
+            name='AffiliateLedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_type', models.CharField(choices=[('opening', 'Начальный остаток'), ('commission', 'Начисление комиссии'), ('commission_adjustment', 'Корректировка комиссии'), ('payout_reserve', 'Резерв под выплату'), ('payout_release', 'Возврат резерва выплаты')], max_length=30)),
+                ('amount', models.DecimalField(decimal_places=2, help_text='Изменение баланса (со знаком)', max_digits=14)),
+                ('balance_after', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('commission', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='affiliates.referralcommission')),
+                ('payout', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='affiliates.referralpayout')),
+                ('referrer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='affiliate_ledger', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Движение баланса партнера',
+                'verbose_name_plural': 'Журнал баланса партнеров',
+                'db_table': 'affiliate_ledger',
+                'ordering': ['-id'],
+                'indexes': [models.Index(fields=['referrer', '-id'], name='affiliate_ledger_referrer_idx')],
+            },
+        ),
+        migrations.RunPython(create_opening_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 4.2.16 on 2026-10-18 12:54
+
+from django.db import migrations, models
+
+
+def remove_duplicate_commissions(apps, schema_editor):
+    """Удалить повторные комиссии по одному заказу (оставляем привязанную к выплате или первую)
+
+    Баланс партнера и итоги пользователя уменьшаются на сумму удаленных,
+    Referral.total_earned пересчитывается по оставшимся комиссиям.
+    """
+    ReferralCommission = apps.get_model('affiliates', 'ReferralCommission')
+    Referral = apps.get_model('affiliates', 'Referral')
+    AffiliateBalance = apps.get_model('affiliates', 'AffiliateBalance')
+    AffiliateLedgerEntry = apps.get_model('affiliates', 'AffiliateLedgerEntry')
+    UserAccountSummary = apps.get_model('users', 'UserAccountSummary')
+
+    duplicates = (
+        ReferralCommission.objects.values('referral_id', 'order_id')
+        .annotate(count=models.Count('id')).filter(count__gt=1).order_by()
+    )
+    for group in duplicates:
+        commissions = list(
+            ReferralCommission.objects.filter(referral_id=group['referral_id'], order_id=group['order_id'])
+            .select_related('referral')
+            .order_by(models.F('payout_id').asc(nulls_last=True), 'created_at', 'id')
+        )
+        for commission in commissions[1:]:
+            referrer_id = commission.referral.referrer_id
+            amount = commission.commission_amount
+            commission.delete()
+            UserAccountSummary.objects.filter(user_id=referrer_id).update(
+                referral_earned=models.F('referral_earned') - amount
+            )
+            balance = AffiliateBalance.objects.select_for_update().filter(referrer_id=referrer_id).first()
+            if balance is not None:
+                balance.balance -= amount
+                balance.save(update_fields=['balance'])
+                AffiliateLedgerEntry.objects.create(
+                    referrer_id=referrer_id,
+                    entry_type='commission_adjustment',
+                    amount=-amount,
+                    balance_after=balance.balance,
+                )
+        earned = ReferralCommission.objects.filter(referral_id=group['referral_id']).aggregate(
+            total=models.Sum('commission_amount')
+        )['total']
+        Referral.objects.filter(pk=group['referral_id']).update(total_earned=earned or 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('affiliates', '0004_affiliate_ledger'),
+        ('users', '0004_user_account_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_commissions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='referralcommission',
+            constraint=models.UniqueConstraint(fields=('referral', 'order'), name='referral_commissions_referral_order_uniq'),
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from apps.users.models import User
 from apps.orders.models import Order
 import uuid
@@ -28,6 +28,10 @@ class Referral(models.Model):
         verbose_name_plural = 'Рефералы'
         ordering = ['-created_at']
         unique_together = [['referrer', 'referred_user']]
+        indexes = [
+            # Список рефералов партнера постранично (курсор по created_at)
+            models.Index(fields=['referrer', '-created_at', '-id'], name='referrals_referrer_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.referrer.email} -> {self.referred_user.email}"
@@ -62,6 +66,12 @@ class ReferralPayout(models.Model):
     
     def __str__(self):
         return f"Payout {self.id} - {self.amount} {self.currency}"
+    
+    def save(self, *args, **kwargs):
+        # Прежняя строка читается для журнала баланса под блокировкой (apps.affiliates.ledger):
+        # чтение, сохранение и запись в журнал - одна транзакция
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
 
 class ReferralCommission(models.Model):
@@ -81,7 +91,70 @@ class ReferralCommission(models.Model):
         verbose_name = 'Комиссия реферала'
         verbose_name_plural = 'Комиссии рефералов'
         ordering = ['-created_at']
+        constraints = [
+            # Одна комиссия на заказ реферала (повторная доставка webhook, повтор задачи)
+            models.UniqueConstraint(fields=['referral', 'order'], name='referral_commissions_referral_order_uniq'),
+        ]
     
     def __str__(self):
         return f"Commission {self.id} - {self.commission_amount} {self.order.currency}"
+    
+    def save(self, *args, **kwargs):
+        # Прежняя строка читается для журнала баланса под блокировкой (apps.affiliates.ledger):
+        # чтение, сохранение и запись в журнал - одна транзакция
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 
+
+class AffiliateBalance(models.Model):
+    """Текущий баланс партнера (доступно к выводу) - итог AffiliateLedgerEntry
+    
+    Меняется только вместе с записью в журнал под блокировкой строки (apps.affiliates.ledger).
+    """
+    referrer = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='affiliate_balance')
+    balance = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'affiliate_balances'
+        verbose_name = 'Баланс партнера'
+        verbose_name_plural = 'Балансы партнеров'
+    
+    def __str__(self):
+        return f"Balance {self.referrer_id}: {self.balance}"
+
+
+class AffiliateLedgerEntry(models.Model):
+    """Журнал движений баланса партнера (только добавление записей)"""
+    ENTRY_TYPES = [
+        ('opening', 'Начальный остаток'),
+        ('commission', 'Начисление комиссии'),
+        ('commission_adjustment', 'Корректировка комиссии'),
+        ('payout_reserve', 'Резерв под выплату'),
+        ('payout_release', 'Возврат резерва выплаты'),
+    ]
+    
+    referrer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='affiliate_ledger')
+    entry_type = models.CharField(max_length=30, choices=ENTRY_TYPES)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, help_text='Изменение баланса (со знаком)')
+    balance_after = models.DecimalField(max_digits=14, decimal_places=2)
+    commission = models.ForeignKey(
+        ReferralCommission, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries'
+    )
+    payout = models.ForeignKey(
+        ReferralPayout, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'affiliate_ledger'
+        verbose_name = 'Движение баланса партнера'
+        verbose_name_plural = 'Журнал баланса партнеров'
+        ordering = ['-id']
+        indexes = [
+            models.Index(fields=['referrer', '-id'], name='affiliate_ledger_referrer_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_entry_type_display()} {self.amount} -> {self.balance_after}"
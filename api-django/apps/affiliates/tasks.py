@@ -0,0 +1,44 @@
+"""
+Celery tasks реферальной программы: начисление комиссий (apps.affiliates.commissions)
+"""
+from celery import shared_task
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(
+    name='apps.affiliates.tasks.accrue_referral_commission',
+    bind=True,
+    acks_late=True,
+    max_retries=5,
+)
+def accrue_referral_commission(self, order_id):
+    """
+    Начисление комиссии по подтвержденному заказу.
+    Ставится после коммита обработки оплаты; повторы безопасны (комиссия одна на заказ).
+    """
+    from apps.affiliates.commissions import accrue_commission
+
+    try:
+        commission = accrue_commission(order_id)
+    except Exception as e:
+        logger.error(f'Error accruing referral commission for order {order_id}: {e}')
+        raise self.retry(exc=e, countdown=min(300, 10 * 2 ** self.request.retries))
+    return str(commission.id) if commission else None
+
+
+@shared_task(name='apps.affiliates.tasks.accrue_missing_commissions')
+def accrue_missing_commissions(days=3):
+    """
+    Добор комиссий по заказам, подтвержденным за последние дни, если задача начисления
+    не была поставлена (например, брокер был недоступен). Запускается через Celery Beat каждый час.
+    """
+    from datetime import timedelta
+    from django.utils import timezone
+    from apps.affiliates.commissions import accrue_missing_commissions as accrue
+
+    found, accrued = accrue(since=timezone.now() - timedelta(days=days))
+    if found:
+        logger.warning(f'Accrued {accrued} of {found} missing referral commissions')
+    return {'found': found, 'accrued': accrued}
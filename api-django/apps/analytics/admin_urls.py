@@ -0,0 +1,10 @@
+from django.urls import path, include
+from rest_framework.routers import DefaultRouter
+from .admin_views import AnalyticsSessionAdminViewSet
+
+router = DefaultRouter()
+router.register(r'analytics/sessions', AnalyticsSessionAdminViewSet, basename='admin-analytics-session')
+
+urlpatterns = [
+    path('', include(router.urls)),
+]
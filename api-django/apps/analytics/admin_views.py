@@ -0,0 +1,47 @@
+from rest_framework import viewsets, filters, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.permissions import IsAuthenticated
+from django_filters.rest_framework import DjangoFilterBackend
+from apps.reports.statistics import resolve_period
+from .funnels import funnel
+from .models import AnalyticsSession
+from .serializers import AnalyticsSessionSerializer
+
+
+class IsAdminOrFinanceManager(IsAuthenticated):
+    def has_permission(self, request, view):
+        if not super().has_permission(request, view):
+            return False
+        return request.user.role in ['admin', 'finance_manager']
+
+
+class AnalyticsSessionAdminViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint сессий посетителей и воронки продаж (apps.analytics.funnels).
+    Данные обновляются фоновой задачей с задержкой ANALYTICS_LATENESS_SECONDS.
+    """
+    queryset = AnalyticsSession.objects.select_related('order')
+    serializer_class = AnalyticsSessionSerializer
+    permission_classes = [IsAdminOrFinanceManager]
+    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filterset_fields = ['step', 'referral_code', 'pre_order', 'order']
+    search_fields = ['session_key', 'user_identifier', 'cart_id', 'landing_page']
+    ordering_fields = ['started_at', 'last_event_at', 'events_count', 'step']
+    ordering = ['-started_at']
+    
+    @action(detail=False, methods=['get'])
+    def funnel(self, request):
+        """Воронка лендинг → предзаказ → оплата → CONFIRMED по дням начала сессий
+        (period или date_from/date_to, referral_code - только сессии с этим кодом, пустой - без кода)"""
+        try:
+            period, start, end = resolve_period(request.query_params)
+        except ValueError as e:
+            return Response({'success': False, 'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'period': period,
+            'date_from': start.isoformat() if start else None,
+            'date_to': end.isoformat(),
+            **funnel(start, end, request.query_params.get('referral_code')),
+        })
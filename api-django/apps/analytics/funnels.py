@@ -0,0 +1,421 @@
+"""
+Сессии и воронка продаж по фронтовым событиям (TrackingEvent).
+
+Воронка: лендинг (сессия) → предзаказ → оплата (создан заказ) → заказ CONFIRMED.
+
+Расчет инкрементальный (refresh, через Celery Beat каждые 5 минут), история не перечитывается:
+- события читаются только после водяного знака tracking_events (created_at - индекс и
+  помесячные секции) и до now - ANALYTICS_LATENESS_SECONDS - отставание Redis-буфера
+  событий (самое старое несохраненное событие): события, которые write-behind буфер
+  сохраняет с опозданием, не оказываются позади водяного знака;
+- события раскладываются по сессиям: ключ - sessionId (или userId), пауза дольше
+  ANALYTICS_SESSION_TIMEOUT_MINUTES начинает новую сессию, незакрытая сессия
+  продолжается следующим запуском;
+- сессия связывается с PreOrder/Order по cartId событий (или data.pre_order_id):
+  ID предзаказа или номер заказа; реферальный код - из заказа/предзаказа, иначе из события;
+- заказы, измененные после водяного знака orders (updated_at), продвигают шаг связанных сессий;
+- дни, в которых изменились сессии, пересчитываются в FunnelDailyRollup из сессий этого дня.
+Источники читаются пачками по возрастанию created_at/updated_at (keyset от водяного знака).
+Каждая пачка - своя транзакция: сессии, пересчет затронутых дней и сдвиг водяного знака
+на конец пачки; сбойный запуск продолжается с последней сохраненной пачки. Параллельный
+запуск ждет блокировку строки водяного знака и, увидев, что знак уже сдвинут, останавливается.
+"""
+import logging
+import uuid
+from datetime import date, datetime, time, timedelta
+from functools import partial
+from typing import Dict, Iterable, Optional, Set
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from apps.audit.buffer import get_buffer
+from apps.audit.models import TrackingEvent
+from apps.common.batching import DEFAULT_CHUNK_SIZE
+from apps.orders.models import Order, PreOrder
+from .models import AnalyticsSession, AnalyticsWatermark, FunnelDailyRollup
+
+logger = logging.getLogger(__name__)
+
+STEPS = (
+    ('landing', 'sessions', AnalyticsSession.STEP_LANDING),
+    ('pre_order', 'pre_orders', AnalyticsSession.STEP_PRE_ORDER),
+    ('payment', 'payments', AnalyticsSession.STEP_PAYMENT),
+    ('confirmed', 'confirmed', AnalyticsSession.STEP_CONFIRMED),
+)
+REFERRAL_KEYS = ('referral_code', 'referralCode', 'ref')
+PRE_ORDER_KEYS = ('pre_order_id', 'preOrderId')
+ORDER_FIELDS = ('id', 'order_id', 'pre_order_id', 'status', 'referral_code', 'created_at')
+
+
+# Строк источника на транзакцию refresh
+CHUNK_SIZE = DEFAULT_CHUNK_SIZE
+
+
+def _keyset_chunks(queryset, field: str, start: datetime, end: datetime, key, size: Optional[int] = None):
+    """Строки queryset с field в (start, end] пачками по возрастанию field
+
+    Строки с одинаковым field не разрываются между пачками: конец пачки - граница
+    водяного знака, следующая пачка читается с field > конца.
+
+    Yields:
+        (пачка, конец пачки - field последней строки)
+    """
+    size = size or CHUNK_SIZE
+    position = start
+    while True:
+        chunk = list(queryset.filter(**{f'{field}__gt': position, f'{field}__lte': end}).order_by(field)[:size])
+        if not chunk:
+            return
+        position = key(chunk[-1])
+        if len(chunk) == size:
+            chunk = [row for row in chunk if key(row) != position] + list(queryset.filter(**{field: position}))
+        yield chunk, position
+
+
+class WatermarkMoved(Exception):
+    """Водяной знак сдвинул другой запуск refresh"""
+
+
+def _commit(source: str, position: datetime, new_position: datetime, days: Set[date], save=None):
+    """Транзакция пачки: сохранить сессии, пересчитать дни и сдвинуть водяной знак на new_position
+
+    Raises:
+        WatermarkMoved: знак уже не на position - пачку учел параллельный запуск
+    """
+    with transaction.atomic():
+        watermark = AnalyticsWatermark.objects.select_for_update().get(source=source)
+        if watermark.position != position:
+            raise WatermarkMoved(f'{source} watermark moved to {watermark.position.isoformat()}')
+        if save is not None:
+            save()
+        rebuild_daily(days)
+        watermark.position = new_position
+        watermark.save(update_fields=['position', 'updated_at'])
+
+
+def _is_uuid(value: str) -> bool:
+    try:
+        uuid.UUID(value)
+    except ValueError:
+        return False
+    return True
+
+
+def _payload_value(payload, keys) -> str:
+    if not isinstance(payload, dict):
+        return ''
+    for key in keys:
+        if payload.get(key):
+            return str(payload[key])
+    return ''
+
+
+def _start_date(session: AnalyticsSession) -> date:
+    return timezone.localtime(session.started_at).date()
+
+
+# Связь сессий с предзаказами и заказами
+
+def _better(order: Optional[Dict], candidate: Dict) -> Dict:
+    """Заказ для шага воронки: подтвержденный, иначе последний созданный"""
+    if order is None:
+        return candidate
+    rank = lambda item: (item['status'] == 'CONFIRMED', item['created_at'])
+    return candidate if rank(candidate) > rank(order) else order
+
+
+def _orders_by_cart(orders: Iterable[Dict]) -> Dict[str, Dict]:
+    """Заказы по ключам cartId: номер заказа и ID предзаказа"""
+    result = {}
+    for order in orders:
+        keys = [order['order_id']] + ([str(order['pre_order_id'])] if order['pre_order_id'] else [])
+        for key in keys:
+            result[key] = _better(result.get(key), order)
+    return result
+
+
+def _advance(session: AnalyticsSession, pre_order=None, order: Optional[Dict] = None) -> bool:
+    """Продвинуть сессию по воронке (шаг только растет: возврат не отменяет конверсию)"""
+    before = (session.step, session.pre_order_id, session.order_id, session.referral_code)
+    if pre_order is not None:
+        session.pre_order_id = pre_order[0]
+        session.referral_code = pre_order[1] or session.referral_code
+        session.step = max(session.step, AnalyticsSession.STEP_PRE_ORDER)
+    if order is not None:
+        session.order_id = order['id']
+        session.pre_order_id = order['pre_order_id'] or session.pre_order_id
+        session.referral_code = order['referral_code'] or session.referral_code
+        reached = AnalyticsSession.STEP_CONFIRMED if order['status'] == 'CONFIRMED' else AnalyticsSession.STEP_PAYMENT
+        session.step = max(session.step, reached)
+    return (session.step, session.pre_order_id, session.order_id, session.referral_code) != before
+
+
+def link_sessions(sessions: Iterable[AnalyticsSession]):
+    """Связать сессии с предзаказами и заказами по cartId (двумя запросами на пачку)"""
+    pending = [s for s in sessions if s.cart_id and s.step < AnalyticsSession.STEP_CONFIRMED]
+    keys = {s.cart_id for s in pending}
+    if not keys:
+        return
+    uuids = {key for key in keys if _is_uuid(key)}
+    pre_orders = {
+        str(pk): (pk, referral_code)
+        for pk, referral_code in PreOrder.objects.filter(pk__in=uuids).values_list('pk', 'referral_code')
+    }
+    orders = _orders_by_cart(
+        Order.objects.filter(Q(order_id__in=keys) | Q(pre_order_id__in=uuids)).values(*ORDER_FIELDS)
+    )
+    for session in pending:
+        _advance(session, pre_orders.get(session.cart_id), orders.get(session.cart_id))
+
+
+# Сессии из событий
+
+def _load_open_sessions(keys: Set[str], since: datetime) -> Dict[str, AnalyticsSession]:
+    """Последние сессии ключей, которые еще могут продолжиться (последнее событие не раньше since)"""
+    sessions = {}
+    queryset = AnalyticsSession.objects.filter(session_key__in=keys, last_event_at__gte=since)
+    for session in queryset.order_by('session_key', 'last_event_at'):
+        sessions[session.session_key] = session
+    return sessions
+
+
+def sessionize(start: datetime, end: datetime, dirty: Set[date]) -> int:
+    """Разложить события (start, end] по сессиям, сдвигая водяной знак tracking_events по пачкам
+
+    Returns:
+        количество обработанных событий
+    """
+    timeout = timedelta(minutes=settings.ANALYTICS_SESSION_TIMEOUT_MINUTES)
+    events = (
+        TrackingEvent.objects
+        .exclude(session_id='', user_identifier='')
+        .values_list('session_id', 'user_identifier', 'page', 'referrer', 'cart_id', 'payload', 'created_at')
+    )
+
+    open_sessions: Dict[str, AnalyticsSession] = {}
+    processed = 0
+    position = start
+    for chunk, chunk_end in _keyset_chunks(events, 'created_at', start, end, key=lambda row: row[-1]):
+        keys = {session_id or f'user:{user_identifier}' for session_id, user_identifier, *_ in chunk}
+        open_sessions.update(_load_open_sessions(keys - open_sessions.keys(), chunk[0][-1] - timeout))
+
+        touched = {}
+        for session_id, user_identifier, page, referrer, cart_id, payload, created_at in chunk:
+            key = session_id or f'user:{user_identifier}'
+            session = open_sessions.get(key)
+            if session is None or created_at - session.last_event_at > timeout:
+                session = AnalyticsSession(
+                    session_key=key,
+                    user_identifier=user_identifier,
+                    started_at=created_at,
+                    last_event_at=created_at,
+                    landing_page=page,
+                    referrer=referrer,
+                )
+                open_sessions[key] = session
+            session.last_event_at = max(session.last_event_at, created_at)
+            session.events_count += 1
+            session.cart_id = cart_id or _payload_value(payload, PRE_ORDER_KEYS)[:120] or session.cart_id
+            session.referral_code = session.referral_code or _payload_value(payload, REFERRAL_KEYS)[:50]
+            touched[id(session)] = session
+
+        sessions = list(touched.values())
+        link_sessions(sessions)
+        new = [s for s in sessions if s._state.adding]
+        existing = [s for s in sessions if not s._state.adding]
+        for session in existing:
+            # bulk_update не проставляет auto_now
+            session.updated_at = timezone.now()
+
+        def save():
+            AnalyticsSession.objects.bulk_create(new)
+            AnalyticsSession.objects.bulk_update(
+                existing,
+                ['last_event_at', 'events_count', 'cart_id', 'referral_code', 'pre_order', 'order', 'step', 'updated_at'],
+            )
+
+        days = {_start_date(session) for session in sessions}
+        _commit('tracking_events', position, chunk_end, days, save)
+        position = chunk_end
+        dirty.update(days)
+        processed += len(chunk)
+
+        # Сессии, которые уже не продолжатся, больше не держим в памяти
+        horizon = chunk_end - timeout
+        open_sessions = {key: s for key, s in open_sessions.items() if s.last_event_at >= horizon}
+    _commit('tracking_events', position, end, set())
+    return processed
+
+
+# Изменения заказов
+
+def apply_orders(start: datetime, end: datetime, dirty: Set[date]) -> int:
+    """Продвинуть сессии по заказам, измененным в (start, end], сдвигая водяной знак orders по пачкам
+
+    Returns:
+        количество обработанных заказов
+    """
+    orders = Order.objects.values(*ORDER_FIELDS, 'updated_at')
+    processed = 0
+    position = start
+    for chunk, chunk_end in _keyset_chunks(orders, 'updated_at', start, end, key=lambda order: order['updated_at']):
+        by_cart = _orders_by_cart(chunk)
+        by_id = {order['id']: order for order in chunk}
+        pre_order_ids = {order['pre_order_id'] for order in chunk if order['pre_order_id']}
+        sessions = AnalyticsSession.objects.filter(
+            Q(order_id__in=by_id) | Q(pre_order_id__in=pre_order_ids) | Q(cart_id__in=by_cart),
+            step__lt=AnalyticsSession.STEP_CONFIRMED,
+        )
+
+        changed = []
+        for session in sessions:
+            order = (
+                by_id.get(session.order_id)
+                or by_cart.get(str(session.pre_order_id))
+                or by_cart.get(session.cart_id)
+            )
+            if _advance(session, order=order):
+                session.updated_at = timezone.now()
+                changed.append(session)
+
+        days = {_start_date(session) for session in changed}
+        _commit('orders', position, chunk_end, days, partial(
+            AnalyticsSession.objects.bulk_update, changed, ['pre_order', 'order', 'referral_code', 'step', 'updated_at'],
+        ))
+        position = chunk_end
+        dirty.update(days)
+        processed += len(chunk)
+    _commit('orders', position, end, set())
+    return processed
+
+
+# Дневные агрегаты
+
+def day_bounds(day: date):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+
+
+def rebuild_daily(days: Iterable[date]) -> int:
+    """Пересчитать FunnelDailyRollup за дни из сессий этих дней
+
+    Returns:
+        количество строк агрегатов
+    """
+    created = 0
+    for day in sorted(days):
+        start, end = day_bounds(day)
+        rows = (
+            AnalyticsSession.objects
+            .filter(started_at__gte=start, started_at__lt=end)
+            .order_by()
+            .values('referral_code')
+            .annotate(
+                **{field: Count('pk', filter=Q(step__gte=step)) for _, field, step in STEPS},
+                confirmed_amount=Sum('order__amount', filter=Q(step=AnalyticsSession.STEP_CONFIRMED), default=0),
+            )
+        )
+        FunnelDailyRollup.objects.filter(date=day).delete()
+        created += len(FunnelDailyRollup.objects.bulk_create([FunnelDailyRollup(date=day, **row) for row in rows]))
+    return created
+
+
+# Запуск
+
+def buffer_lag() -> Optional[timedelta]:
+    """Отставание Redis-буфера событий: возраст самого старого несохраненного события
+
+    Буфер в памяти (TRACKING_BUFFER_BACKEND=memory) живет в процессах веб-сервера и отсюда
+    не виден - его задержка сброса должна укладываться в ANALYTICS_LATENESS_SECONDS.
+
+    Returns:
+        None - Redis недоступен, до какого момента события сохранены, неизвестно
+    """
+    if settings.TRACKING_BUFFER_BACKEND != 'redis':
+        return timedelta(0)
+    try:
+        return timedelta(seconds=get_buffer().metrics()['lag_seconds'])
+    except Exception as e:
+        logger.warning(f"Tracking buffer lag unavailable, analytics events are not advanced: {e}")
+        return None
+
+
+def refresh(now: Optional[datetime] = None) -> Dict[str, int]:
+    """Учесть новые события и изменения заказов после водяных знаков
+
+    Первый запуск начинает с now - ANALYTICS_BACKFILL_DAYS.
+    """
+    now = now or timezone.now()
+    until = now - timedelta(seconds=settings.ANALYTICS_LATENESS_SECONDS)
+    backfill = now - timedelta(days=settings.ANALYTICS_BACKFILL_DAYS)
+    lag = buffer_lag()
+    result = {'events': 0, 'orders': 0, 'days': 0}
+
+    dirty: Set[date] = set()
+    sources = (
+        ('tracking_events', 'events', sessionize, until - lag if lag is not None else None),
+        ('orders', 'orders', apply_orders, until),
+    )
+    for source, counter, apply, source_until in sources:
+        watermark, _ = AnalyticsWatermark.objects.get_or_create(source=source, defaults={'position': backfill})
+        if source_until is None or watermark.position >= source_until:
+            continue
+        try:
+            result[counter] = apply(watermark.position, source_until, dirty)
+        except WatermarkMoved as e:
+            logger.info(f"Analytics refresh of {source} stopped, another run is ahead: {e}")
+    result['days'] = len(dirty)
+
+    logger.info(f"Analytics refreshed until {until.isoformat()}: {result}")
+    return result
+
+
+def computed_until() -> Optional[datetime]:
+    """До какого момента учтены события (None - аналитика еще не считалась)"""
+    return AnalyticsWatermark.objects.filter(source='tracking_events').values_list('position', flat=True).first()
+
+
+# Чтение
+
+def _with_conversion(row: Dict) -> Dict:
+    """Строка воронки с конверсией каждого шага из предыдущего и из сессий"""
+    row = dict(row)
+    previous = sessions = row['sessions']
+    for name, field, _ in STEPS[1:]:
+        row[f'{name}_conversion'] = round(row[field] / previous, 4) if previous else 0.0
+        previous = row[field]
+    row['conversion'] = round(row['confirmed'] / sessions, 4) if sessions else 0.0
+    return row
+
+
+def funnel(start: Optional[datetime], end: datetime, referral_code: Optional[str] = None) -> Dict:
+    """Воронка за дни начала сессий [start, end): итог, ряд по дням и разбивка по реферальным кодам"""
+    queryset = FunnelDailyRollup.objects.filter(date__lte=timezone.localtime(end - timedelta(microseconds=1)).date())
+    if start is not None:
+        queryset = queryset.filter(date__gte=timezone.localtime(start).date())
+    if referral_code is not None:
+        queryset = queryset.filter(referral_code=referral_code)
+
+    sums = {field: Sum(field, default=0) for _, field, _ in STEPS}
+    sums['confirmed_amount'] = Sum('confirmed_amount', default=0)
+    totals = _with_conversion(queryset.aggregate(**sums))
+    until = computed_until()
+    return {
+        'computed_until': until.isoformat() if until else None,
+        'steps': [
+            {'step': name, 'title': title, 'count': totals[field]}
+            for (name, field, step), (_, title) in zip(STEPS, AnalyticsSession.STEP_CHOICES)
+        ],
+        'totals': totals,
+        'series': [
+            _with_conversion(row)
+            for row in queryset.order_by('date').values('date').annotate(**sums)
+        ],
+        'referral_stats': [
+            _with_conversion(row)
+            for row in queryset.order_by().values('referral_code').annotate(**sums).order_by('-sessions')
+        ],
+    }
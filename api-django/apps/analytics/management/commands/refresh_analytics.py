@@ -0,0 +1,29 @@
+"""
+Инкрементальный расчет сессий и воронки продаж (apps.analytics.funnels):
+учитывает события и изменения заказов после водяных знаков.
+--rebuild-days пересчитывает дневные агрегаты воронки из уже собранных сессий.
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.analytics.funnels import rebuild_daily, refresh
+
+
+class Command(BaseCommand):
+    help = 'Обновляет сессии и воронку продаж по новым событиям и заказам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild-days', type=int, help='Пересчитать агрегаты воронки за последние N дней')
+
+    def handle(self, *args, **options):
+        result = refresh()
+        self.stdout.write(
+            f"Событий: {result['events']}, заказов: {result['orders']}, пересчитано дней: {result['days']}"
+        )
+        if options['rebuild_days']:
+            today = timezone.localdate()
+            rows = rebuild_daily(today - timedelta(days=n) for n in range(options['rebuild_days']))
+            self.stdout.write(f'Строк агрегатов: {rows}')
+        self.stdout.write(self.style.SUCCESS('Готово'))
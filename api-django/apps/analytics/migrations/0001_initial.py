@@ -0,0 +1,94 @@
+# Generated by Django 4.2.16 on 2026-10-18 13:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('orders', '0005_order_orders_updated_1bd457_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalyticsSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(help_text='sessionId фронтенда или user:<userId>', max_length=130)),
+                ('user_identifier', models.CharField(blank=True, default='', max_length=120)),
+                ('started_at', models.DateTimeField(db_index=True)),
+                ('last_event_at', models.DateTimeField()),
+                ('events_count', models.PositiveIntegerField(default=0)),
+                ('landing_page', models.CharField(blank=True, default='', max_length=255)),
+                ('referrer', models.TextField(blank=True, default='')),
+                ('referral_code', models.CharField(blank=True, db_index=True, default='', max_length=50)),
+                ('cart_id', models.CharField(blank=True, default='', max_length=120)),
+                ('step', models.PositiveSmallIntegerField(choices=[(1, 'Лендинг'), (2, 'Предзаказ'), (3, 'Оплата'), (4, 'Оплачен')], default=1, help_text='Дальний шаг воронки')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Сессия',
+                'verbose_name_plural': 'Сессии',
+                'db_table': 'analytics_sessions',
+                'ordering': ['-started_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='AnalyticsWatermark',
+            fields=[
+                ('source', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('position', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Водяной знак аналитики',
+                'verbose_name_plural': 'Водяные знаки аналитики',
+                'db_table': 'analytics_watermarks',
+            },
+        ),
+        migrations.CreateModel(
+            name='FunnelDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('referral_code', models.CharField(blank=True, default='', max_length=50)),
+                ('sessions', models.PositiveIntegerField(default=0)),
+                ('pre_orders', models.PositiveIntegerField(default=0)),
+                ('payments', models.PositiveIntegerField(default=0)),
+                ('confirmed', models.PositiveIntegerField(default=0)),
+                ('confirmed_amount', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Воронка за день',
+                'verbose_name_plural': 'Воронка по дням',
+                'db_table': 'analytics_funnel_daily',
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='funneldailyrollup',
+            constraint=models.UniqueConstraint(fields=('date', 'referral_code'), name='analytics_funnel_daily_uniq'),
+        ),
+        migrations.AddField(
+            model_name='analyticssession',
+            name='order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='analytics_sessions', to='orders.order'),
+        ),
+        migrations.AddField(
+            model_name='analyticssession',
+            name='pre_order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='analytics_sessions', to='orders.preorder'),
+        ),
+        migrations.AddIndex(
+            model_name='analyticssession',
+            index=models.Index(fields=['session_key', '-last_event_at'], name='analytics_s_session_bbeb8f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analyticssession',
+            index=models.Index(fields=['cart_id'], name='analytics_s_cart_id_73de87_idx'),
+        ),
+    ]
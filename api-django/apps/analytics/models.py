@@ -0,0 +1,85 @@
+from django.db import models
+
+from apps.orders.models import Order, PreOrder
+
+
+class AnalyticsSession(models.Model):
+    """Сессия посетителя, собранная из фронтовых событий (apps.analytics.funnels)
+    
+    Ключ - sessionId фронтенда (или userId, если sessionId нет); пауза дольше
+    ANALYTICS_SESSION_TIMEOUT_MINUTES начинает новую сессию с тем же ключом.
+    Связь с предзаказом и заказом - по cartId событий (ID предзаказа или номер заказа).
+    """
+    STEP_CHOICES = [
+        (1, 'Лендинг'),
+        (2, 'Предзаказ'),
+        (3, 'Оплата'),
+        (4, 'Оплачен'),
+    ]
+    STEP_LANDING, STEP_PRE_ORDER, STEP_PAYMENT, STEP_CONFIRMED = 1, 2, 3, 4
+    
+    session_key = models.CharField(max_length=130, help_text='sessionId фронтенда или user:<userId>')
+    user_identifier = models.CharField(max_length=120, blank=True, default='')
+    started_at = models.DateTimeField(db_index=True)
+    last_event_at = models.DateTimeField()
+    events_count = models.PositiveIntegerField(default=0)
+    landing_page = models.CharField(max_length=255, blank=True, default='')
+    referrer = models.TextField(blank=True, default='')
+    referral_code = models.CharField(max_length=50, blank=True, default='', db_index=True)
+    cart_id = models.CharField(max_length=120, blank=True, default='')
+    pre_order = models.ForeignKey(PreOrder, on_delete=models.SET_NULL, null=True, blank=True, related_name='analytics_sessions')
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='analytics_sessions')
+    step = models.PositiveSmallIntegerField(choices=STEP_CHOICES, default=STEP_LANDING, help_text='Дальний шаг воронки')
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'analytics_sessions'
+        verbose_name = 'Сессия'
+        verbose_name_plural = 'Сессии'
+        ordering = ['-started_at']
+        indexes = [
+            models.Index(fields=['session_key', '-last_event_at']),
+            models.Index(fields=['cart_id']),
+        ]
+    
+    def __str__(self):
+        return f"{self.session_key} {self.started_at:%Y-%m-%d %H:%M} - {self.get_step_display()}"
+
+
+class FunnelDailyRollup(models.Model):
+    """Воронка за день начала сессий (по TIME_ZONE) и реферальный код: сколько сессий дошло до шага"""
+    date = models.DateField()
+    referral_code = models.CharField(max_length=50, blank=True, default='')
+    sessions = models.PositiveIntegerField(default=0)
+    pre_orders = models.PositiveIntegerField(default=0)
+    payments = models.PositiveIntegerField(default=0)
+    confirmed = models.PositiveIntegerField(default=0)
+    confirmed_amount = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'analytics_funnel_daily'
+        verbose_name = 'Воронка за день'
+        verbose_name_plural = 'Воронка по дням'
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'referral_code'], name='analytics_funnel_daily_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.date} {self.referral_code or '-'}: {self.sessions} / {self.confirmed}"
+
+
+class AnalyticsWatermark(models.Model):
+    """До какого момента источник (tracking_events, orders) уже учтен в аналитике"""
+    source = models.CharField(max_length=50, primary_key=True)
+    position = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'analytics_watermarks'
+        verbose_name = 'Водяной знак аналитики'
+        verbose_name_plural = 'Водяные знаки аналитики'
+    
+    def __str__(self):
+        return f"{self.source}: {self.position:%Y-%m-%d %H:%M:%S}"
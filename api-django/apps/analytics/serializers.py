@@ -0,0 +1,15 @@
+from rest_framework import serializers
+from .models import AnalyticsSession
+
+
+class AnalyticsSessionSerializer(serializers.ModelSerializer):
+    step_display = serializers.CharField(source='get_step_display', read_only=True)
+    order_number = serializers.CharField(source='order.order_id', read_only=True, default=None)
+    
+    class Meta:
+        model = AnalyticsSession
+        fields = [
+            'id', 'session_key', 'user_identifier', 'started_at', 'last_event_at', 'events_count',
+            'landing_page', 'referrer', 'referral_code', 'cart_id', 'pre_order', 'order', 'order_number',
+            'step', 'step_display',
+        ]
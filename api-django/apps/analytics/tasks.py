@@ -0,0 +1,18 @@
+"""
+Celery tasks аналитики: инкрементальный расчет сессий и воронки (apps.analytics.funnels)
+"""
+from celery import shared_task
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(name='apps.analytics.tasks.refresh_analytics')
+def refresh_analytics():
+    """
+    Учет новых фронтовых событий и изменений заказов после водяных знаков.
+    Запускается через Celery Beat каждые 5 минут.
+    """
+    from apps.analytics.funnels import refresh
+    
+    return refresh()
@@ -0,0 +1,361 @@
+"""
+Write-behind буфер фронтовых событий (TrackingEvent).
+
+Анонимные endpoints событий и корзины не делают INSERT в запросе: событие (id и время
+приема уже назначены) кладется в буфер, ответ - 202, а фоновый флашер сохраняет
+накопленное одним bulk_create раз в TRACKING_BUFFER_FLUSH_INTERVAL_MS или по
+TRACKING_BUFFER_FLUSH_SIZE событий.
+
+TRACKING_BUFFER_BACKEND:
+    sync - INSERT в запросе, как раньше (по умолчанию)
+    memory - буфер в памяти процесса и поток сброса; у каждого воркера gunicorn свой буфер,
+        при аварийном завершении процесса несброшенные события теряются
+    redis - Redis stream (TRACKING_BUFFER_STREAM); сбрасывает отдельный процесс
+        `manage.py run_tracking_flusher` (consumer group, XREADGROUP), события упавшего
+        флашера забираются через XAUTOCLAIM
+
+Переполнение (больше TRACKING_BUFFER_MAX_PENDING событий ждут сброса) -
+TRACKING_BUFFER_OVERFLOW: drop - событие отбрасывается (учитывается в метриках),
+block - запрос ждет места до TRACKING_BUFFER_BLOCK_TIMEOUT_MS, затем сохраняет событие сам.
+Повторный сброс той же пачки безопасен: id событий назначаются при приеме.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, close_old_connections, transaction
+from django.utils import timezone
+
+from .models import TrackingEvent
+
+logger = logging.getLogger(__name__)
+
+ROW_FIELDS = (
+    'id', 'session_id', 'user_identifier', 'event', 'category', 'page', 'referrer', 'cart_id',
+    'cart_status', 'payload', 'ip_address', 'user_agent', 'created_at',
+)
+# Ошибки недоступности БД: пачка остается в буфере и сбрасывается повторно
+DATABASE_ERRORS = (OperationalError, InterfaceError)
+
+
+def to_row(event: TrackingEvent) -> Dict:
+    row = {field: getattr(event, field) for field in ROW_FIELDS}
+    row['id'] = str(row['id'])
+    row['created_at'] = row['created_at'].isoformat()
+    return row
+
+
+def from_row(row: Dict) -> TrackingEvent:
+    return TrackingEvent(**{**row, 'created_at': datetime.fromisoformat(row['created_at'])})
+
+
+def persist_rows(rows: List[Dict]) -> int:
+    """Сохранить пачку одним bulk_create; при ошибке данных - по одному, пропуская плохие
+
+    Returns:
+        сколько событий не удалось сохранить (уже сохраненные повторно - тоже здесь)
+    Raises:
+        OperationalError / InterfaceError: БД недоступна, пачку нужно повторить
+    """
+    events = [from_row(row) for row in rows]
+    try:
+        TrackingEvent.objects.bulk_create(events, batch_size=settings.TRACKING_BUFFER_FLUSH_SIZE)
+        return 0
+    except DATABASE_ERRORS:
+        raise
+    except Exception as e:
+        logger.warning(f"Tracking events batch insert failed, falling back to row inserts: {e}")
+
+    failed = 0
+    for event in events:
+        try:
+            with transaction.atomic():
+                event.save(force_insert=True)
+        except DATABASE_ERRORS:
+            raise
+        except Exception as e:
+            failed += 1
+            logger.error(f"Failed to persist tracking event {event.id}: {e}")
+    return failed
+
+
+class MemoryBuffer:
+    """Буфер событий в памяти процесса с потоком сброса"""
+
+    def __init__(self, max_pending=None, flush_size=None, flush_interval=None, overflow=None, block_timeout=None):
+        self.max_pending = max_pending or settings.TRACKING_BUFFER_MAX_PENDING
+        self.flush_size = flush_size or settings.TRACKING_BUFFER_FLUSH_SIZE
+        self.flush_interval = (flush_interval or settings.TRACKING_BUFFER_FLUSH_INTERVAL_MS) / 1000
+        self.overflow = overflow or settings.TRACKING_BUFFER_OVERFLOW
+        self.block_timeout = (block_timeout or settings.TRACKING_BUFFER_BLOCK_TIMEOUT_MS) / 1000
+        self._items = deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self.accepted = self.dropped = self.flushed = self.failed = 0
+        self.last_flush_at = None
+
+    def put(self, rows: List[Dict]) -> List[Dict]:
+        """Поставить события в буфер
+
+        Returns:
+            события, не поместившиеся в буфер (для overflow=block - после ожидания)
+        """
+        self._ensure_thread()
+        overflow = []
+        with self._condition:
+            for row in rows:
+                if len(self._items) >= self.max_pending and self.overflow == 'block':
+                    self._condition.notify_all()
+                    self._condition.wait_for(lambda: len(self._items) < self.max_pending, timeout=self.block_timeout)
+                if len(self._items) >= self.max_pending:
+                    overflow.append(row)
+                    continue
+                self._items.append((time.monotonic(), row))
+                self.accepted += 1
+            if self.overflow == 'drop':
+                self.dropped += len(overflow)
+            if len(self._items) >= self.flush_size:
+                self._condition.notify_all()
+        return overflow
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='tracking-buffer-flusher', daemon=True)
+            self._thread.start()
+
+    def _take(self, wait=True) -> List[Tuple[float, Dict]]:
+        with self._condition:
+            if wait:
+                self._condition.wait_for(
+                    lambda: self._stopped or len(self._items) >= self.flush_size, timeout=self.flush_interval,
+                )
+            batch = [self._items.popleft() for _ in range(min(self.flush_size, len(self._items)))]
+            self._condition.notify_all()
+        return batch
+
+    def _flush(self, batch) -> bool:
+        close_old_connections()
+        try:
+            failed = persist_rows([row for _, row in batch])
+        except DATABASE_ERRORS as e:
+            logger.error(f"Tracking buffer flush failed, {len(batch)} events kept: {e}")
+            with self._condition:
+                self._items.extendleft(reversed(batch))
+            return False
+        with self._condition:
+            self.flushed += len(batch) - failed
+            self.failed += failed
+            self.last_flush_at = timezone.now()
+        return True
+
+    def _run(self):
+        while not self._stopped:
+            batch = self._take()
+            if batch and not self._flush(batch):
+                time.sleep(self.flush_interval)
+
+    def flush_all(self):
+        """Сбросить все накопленное (при завершении процесса)"""
+        while True:
+            batch = self._take(wait=False)
+            if not batch or not self._flush(batch):
+                return
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self.flush_all()
+
+    def metrics(self) -> Dict:
+        with self._condition:
+            oldest = self._items[0][0] if self._items else None
+            return {
+                'backend': 'memory',
+                'pid': os.getpid(),
+                'pending': len(self._items),
+                'lag_seconds': round(time.monotonic() - oldest, 3) if oldest is not None else 0,
+                'accepted': self.accepted,
+                'dropped': self.dropped,
+                'flushed': self.flushed,
+                'failed': self.failed,
+                'last_flush_at': self.last_flush_at,
+            }
+
+
+class RedisStreamBuffer:
+    """Буфер событий в Redis stream; сброс - consumer group (run_tracking_flusher)
+
+    persist/group/flush_size позволяют использовать тот же буфер для других строк
+    (журнал аудита, apps.audit.writer).
+    """
+
+    group = 'tracking-flusher'
+
+    def __init__(self, client=None, stream=None, max_pending=None, overflow=None, block_timeout=None,
+                 persist=None, group=None, flush_size=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(settings.TRACKING_BUFFER_REDIS_URL)
+        self.client = client
+        self.stream = stream or settings.TRACKING_BUFFER_STREAM
+        self.max_pending = max_pending or settings.TRACKING_BUFFER_MAX_PENDING
+        self.overflow = overflow or settings.TRACKING_BUFFER_OVERFLOW
+        self.block_timeout = (block_timeout or settings.TRACKING_BUFFER_BLOCK_TIMEOUT_MS) / 1000
+        self.persist = persist or persist_rows
+        self.group = group or self.group
+        self.flush_size = flush_size or settings.TRACKING_BUFFER_FLUSH_SIZE
+
+    def _counter(self, name):
+        return f'{self.stream}:{name}'
+
+    def _has_room(self, count) -> bool:
+        if self.client.xlen(self.stream) + count <= self.max_pending:
+            return True
+        if self.overflow != 'block':
+            return False
+        deadline = time.monotonic() + self.block_timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.01)
+            if self.client.xlen(self.stream) + count <= self.max_pending:
+                return True
+        return False
+
+    def put(self, rows: List[Dict]) -> List[Dict]:
+        if not self._has_room(len(rows)):
+            if self.overflow == 'drop':
+                self.client.incrby(self._counter('dropped'), len(rows))
+            return rows
+        pipeline = self.client.pipeline(transaction=False)
+        for row in rows:
+            pipeline.xadd(self.stream, {'row': json.dumps(row, ensure_ascii=False)})
+        pipeline.incrby(self._counter('accepted'), len(rows))
+        pipeline.execute()
+        return []
+
+    def ensure_group(self):
+        import redis
+        try:
+            self.client.xgroup_create(self.stream, self.group, id='0', mkstream=True)
+        except redis.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def flush(self, consumer: str, count: Optional[int] = None, block_ms: Optional[int] = None) -> int:
+        """Одна пачка: события, брошенные упавшими флашерами (XAUTOCLAIM), иначе новые (XREADGROUP)
+
+        block_ms: сколько ждать новых событий (по умолчанию TRACKING_BUFFER_FLUSH_INTERVAL_MS),
+            0 - не ждать
+
+        Returns:
+            сколько событий сброшено в БД
+        """
+        count = count or self.flush_size
+        block_ms = settings.TRACKING_BUFFER_FLUSH_INTERVAL_MS if block_ms is None else block_ms
+        # Событие считается брошенным, если не подтверждено за 60 интервалов сброса (не меньше минуты)
+        idle_ms = max(60_000, 60 * settings.TRACKING_BUFFER_FLUSH_INTERVAL_MS)
+        entries = self.client.xautoclaim(self.stream, self.group, consumer, idle_ms, start_id='0-0', count=count)[1]
+        if not entries:
+            # BLOCK 0 в Redis - ждать бесконечно, поэтому без ожидания BLOCK не передается
+            response = self.client.xreadgroup(
+                self.group, consumer, {self.stream: '>'}, count=count, block=block_ms or None,
+            )
+            entries = response[0][1] if response else []
+        entries = [(entry_id, fields) for entry_id, fields in entries if fields]
+        if not entries:
+            return 0
+
+        close_old_connections()
+        failed = self.persist([json.loads(fields[b'row']) for _, fields in entries])
+        ids = [entry_id for entry_id, _ in entries]
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.xack(self.stream, self.group, *ids)
+        pipeline.xdel(self.stream, *ids)
+        pipeline.incrby(self._counter('flushed'), len(ids) - failed)
+        pipeline.incrby(self._counter('failed'), failed)
+        pipeline.set(self._counter('last_flush_at'), timezone.now().isoformat())
+        pipeline.execute()
+        return len(ids) - failed
+
+    def metrics(self) -> Dict:
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.xlen(self.stream)
+        pipeline.xrange(self.stream, count=1)
+        for name in ('accepted', 'dropped', 'flushed', 'failed', 'last_flush_at'):
+            pipeline.get(self._counter(name))
+        length, first, accepted, dropped, flushed, failed, last_flush_at = pipeline.execute()
+        # id записи stream - миллисекунды времени добавления
+        oldest_ms = int(first[0][0].split(b'-')[0]) if first else None
+        return {
+            'backend': 'redis',
+            'pending': length,
+            'lag_seconds': round(max(time.time() - oldest_ms / 1000, 0), 3) if oldest_ms else 0,
+            'accepted': int(accepted or 0),
+            'dropped': int(dropped or 0),
+            'flushed': int(flushed or 0),
+            'failed': int(failed or 0),
+            'last_flush_at': last_flush_at.decode() if last_flush_at else None,
+        }
+
+
+_buffer = {'pid': None, 'instance': None}
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """Буфер текущего процесса по TRACKING_BUFFER_BACKEND (None - синхронная запись)"""
+    backend = settings.TRACKING_BUFFER_BACKEND
+    if backend == 'sync':
+        return None
+    with _buffer_lock:
+        if _buffer['instance'] is None or _buffer['pid'] != os.getpid():
+            if backend == 'memory':
+                instance = MemoryBuffer()
+                atexit.register(instance.stop)
+            elif backend == 'redis':
+                instance = RedisStreamBuffer()
+            else:
+                raise ValueError(f'Unknown TRACKING_BUFFER_BACKEND: {backend}')
+            _buffer.update(pid=os.getpid(), instance=instance)
+        return _buffer['instance']
+
+
+def submit(events: List[TrackingEvent]) -> Tuple[bool, int]:
+    """Принять события
+
+    Returns:
+        (отложены ли в буфер, сколько отброшено при переполнении)
+    """
+    buffer = get_buffer()
+    if buffer is None:
+        TrackingEvent.objects.bulk_create(events)
+        return False, 0
+
+    rows = [to_row(event) for event in events]
+    try:
+        overflow = buffer.put(rows)
+    except Exception as e:
+        # Буфер недоступен (Redis) - это не переполнение, события пишем сами
+        logger.error(f"Tracking buffer unavailable, writing {len(rows)} events synchronously: {e}")
+        persist_rows(rows)
+        return False, 0
+    if overflow and settings.TRACKING_BUFFER_OVERFLOW == 'block':
+        persist_rows(overflow)
+        return True, 0
+    return True, len(overflow)
+
+
+def get_buffer_metrics() -> Dict:
+    """Метрики буфера: глубина, лаг старейшего события, счетчики приема/сброса/отбрасывания"""
+    buffer = get_buffer()
+    if buffer is None:
+        return {'backend': 'sync'}
+    return buffer.metrics()
@@ -0,0 +1,33 @@
+"""
+Обслуживание помесячных секций tracking_events и audit_logs (apps.audit.partitions):
+создает секции на будущие месяцы и отключает/удаляет секции старше срока хранения.
+Ежедневно запускается через Celery Beat (apps.audit.tasks.maintain_partitions).
+"""
+from django.core.management.base import BaseCommand
+
+from apps.audit.partitions import maintain, supported
+
+
+class Command(BaseCommand):
+    help = 'Создает будущие секции tracking_events/audit_logs и обрабатывает истекшие'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, help='На сколько месяцев вперед создать секции')
+        parser.add_argument('--action', choices=['detach', 'drop'], help='Что делать с истекшими секциями')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, что будет сделано')
+
+    def handle(self, *args, **options):
+        if not supported():
+            self.stdout.write('Секционирование доступно только на PostgreSQL')
+            return
+
+        result = maintain(options['months_ahead'], options['action'], dry_run=options['dry_run'])
+        if not result:
+            self.stdout.write('Секционированных таблиц нет (миграция audit 0006 не применена?)')
+        for table, changes in result.items():
+            self.stdout.write(
+                f"{table}: создано {', '.join(changes['created']) or '-'}; "
+                f"истекло {', '.join(changes['expired']) or '-'}"
+            )
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('Dry run: изменения не применены'))
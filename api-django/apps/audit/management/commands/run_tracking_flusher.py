@@ -0,0 +1,42 @@
+"""
+Флашер write-behind буфера фронтовых событий в Redis stream (TRACKING_BUFFER_BACKEND=redis):
+читает события пачками через consumer group и сохраняет их в tracking_events.
+Можно запускать несколько процессов - пачки между ними не пересекаются.
+"""
+import os
+import signal
+import socket
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.audit.buffer import RedisStreamBuffer, get_buffer
+
+
+class Command(BaseCommand):
+    help = 'Сбрасывает события из Redis stream буфера в tracking_events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--consumer', type=str, help='Имя consumer (по умолчанию host:pid)')
+        parser.add_argument('--once', action='store_true', help='Сбросить накопленное и завершиться')
+
+    def handle(self, *args, **options):
+        buffer = get_buffer()
+        if not isinstance(buffer, RedisStreamBuffer):
+            raise CommandError('TRACKING_BUFFER_BACKEND должен быть redis')
+
+        consumer = options['consumer'] or f'{socket.gethostname()}:{os.getpid()}'
+        buffer.ensure_group()
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+        self.stdout.write(f'Флашер {consumer}: stream {buffer.stream}')
+
+        total = 0
+        try:
+            while not stopping:
+                flushed = buffer.flush(consumer, block_ms=0 if options['once'] else None)
+                total += flushed
+                if options['once'] and not flushed:
+                    break
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Сброшено событий: {total}'))
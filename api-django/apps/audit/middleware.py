@@ -1,5 +1,4 @@
-from .models import AuditLog
-import json
+from .writer import build_row, write
 
 
 class AuditLogMiddleware:
@@ -12,20 +11,9 @@ class AuditLogMiddleware:
     
     @staticmethod
     def log(action, entity_type, entity_id, actor, before=None, after=None, request=None):
-        """Создать запись в журнале аудита"""
+        """Создать запись в журнале аудита (сразу или через очередь, см. apps.audit.writer)"""
         try:
-            AuditLog.objects.create(
-                entity_type=entity_type,
-                entity_id=str(entity_id),
-                action=action,
-                actor=actor,
-                actor_email=actor.email if actor else '',
-                actor_role=actor.role if actor and hasattr(actor, 'role') else None,
-                before=before,
-                after=after,
-                ip_address=request.META.get('REMOTE_ADDR') if request else None,
-                user_agent=request.META.get('HTTP_USER_AGENT') if request else None,
-            )
+            write(build_row(action, entity_type, entity_id, actor, before=before, after=after, request=request))
         except Exception as e:
             # Логируем ошибку, но не прерываем выполнение
             import logging
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.16 on 2026-10-18 13:08
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audit', '0004_rename_tracking_e_event_d18da2_idx_tracking_ev_event_f6abee_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='trackingevent',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+def partition_tables(apps, schema_editor):
+    """Помесячное секционирование tracking_events и audit_logs (только PostgreSQL)"""
+    from apps.audit.partitions import convert_to_partitioned
+
+    for table in ('tracking_events', 'audit_logs'):
+        convert_to_partitioned(table, connection=schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY и VALIDATE CONSTRAINT - вне транзакции миграции
+    atomic = False
+
+    dependencies = [
+        ('audit', '0005_tracking_event_created_at_default'),
+    ]
+
+    operations = [
+        # Схема моделей не меняется: секционирование и PK (id, created_at) - только на уровне БД
+        migrations.RunPython(partition_tables, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 from apps.users.models import User
@@ -17,7 +18,8 @@ class AuditLog(models.Model):
     after = models.JSONField(default=dict, blank=True, null=True)
     ip_address = models.GenericIPAddressField(blank=True, null=True)
     user_agent = models.TextField(blank=True, null=True)
-    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    # Время действия (при записи через очередь apps.audit.writer - раньше INSERT)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
     
     class Meta:
         db_table = 'audit_logs'
@@ -48,7 +50,8 @@ class TrackingEvent(models.Model):
     payload = models.JSONField(default=dict, blank=True)
     ip_address = models.GenericIPAddressField(blank=True, null=True)
     user_agent = models.TextField(blank=True, null=True)
-    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    # Время приема события (при записи через буфер apps.audit.buffer - раньше INSERT)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
 
     class Meta:
         db_table = 'tracking_events'
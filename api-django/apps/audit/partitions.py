@@ -0,0 +1,239 @@
+"""
+Помесячное секционирование tracking_events и audit_logs (PostgreSQL, PARTITION BY RANGE (created_at)).
+
+Секция - календарный месяц по TIME_ZONE: <таблица>_pYYYYMM. Вторичные индексы строятся
+по секциям, поэтому вставка не замедляется с ростом всей таблицы, а запросы с диапазоном
+created_at читают только нужные секции (partition pruning).
+
+Перевод существующей таблицы (миграция audit 0006): таблица переименовывается в
+<таблица>_legacy и подключается секцией FROM (MINVALUE) TO (начало следующего месяца) -
+без копирования строк; первичный ключ секционированной таблицы - (id, created_at).
+Долгие проходы по старой таблице (уникальный индекс (id, created_at) и проверка границы
+секции) выполняются до переименования без блокировки записи, поэтому ATTACH их не повторяет.
+Секция <таблица>_default ловит строки вне созданных секций.
+
+Обслуживание (manage.py manage_partitions, ежедневно через Celery Beat): создает секции
+на PARTITION_MONTHS_AHEAD месяцев вперед и отключает (detach) или удаляет (drop) секции
+старше срока хранения таблицы (PARTITION_RETENTION_ACTION).
+На других СУБД (SQLite в тестах) все операции - no-op.
+"""
+import logging
+from datetime import datetime, time, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.db import connection as default_connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def retention_months() -> Dict[str, int]:
+    """Срок хранения по таблицам, месяцев (0 - хранить все)"""
+    return {
+        'tracking_events': settings.TRACKING_EVENTS_RETENTION_MONTHS,
+        'audit_logs': settings.AUDIT_LOGS_RETENTION_MONTHS,
+    }
+
+
+def month_start(moment: datetime, months: int = 0) -> datetime:
+    local = timezone.localtime(moment)
+    start = datetime.combine(local.date().replace(day=1), time.min) + relativedelta(months=months)
+    return timezone.make_aware(start)
+
+
+def partition_name(table: str, start: datetime) -> str:
+    return f'{table}_p{timezone.localtime(start):%Y%m}'
+
+
+def _legacy_name(name: str) -> str:
+    return f'{name[:55]}_legacy'
+
+
+def supported(connection=None) -> bool:
+    return (connection or default_connection).vendor == 'postgresql'
+
+
+def is_partitioned(table: str, connection=None) -> bool:
+    connection = connection or default_connection
+    if not supported(connection):
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)', [table])
+        return cursor.fetchone() is not None
+
+
+def list_partitions(table: str, connection=None) -> List[Tuple[str, Optional[datetime], Optional[datetime]]]:
+    """Секции таблицы: (имя, нижняя граница или None - MINVALUE/DEFAULT, верхняя или None - DEFAULT)"""
+    connection = connection or default_connection
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT c.relname,
+                   substring(pg_get_expr(c.relpartbound, c.oid) from 'FROM \\(''([^'']+)''\\)')::timestamptz,
+                   substring(pg_get_expr(c.relpartbound, c.oid) from 'TO \\(''([^'']+)''\\)')::timestamptz
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(%s)
+            ORDER BY 3 NULLS LAST
+            """,
+            [table],
+        )
+        return cursor.fetchall()
+
+
+def create_partition(table: str, start: datetime, connection=None) -> str:
+    """Секция месяца, начинающегося в start"""
+    connection = connection or default_connection
+    quote = connection.ops.quote_name
+    name = partition_name(table, start)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS {quote(name)} PARTITION OF {quote(table)} FOR VALUES FROM (%s) TO (%s)',
+            [start, month_start(start, 1)],
+        )
+    return name
+
+
+def ensure_partitions(table: str, months_ahead: Optional[int] = None, now=None, connection=None,
+                      dry_run: bool = False) -> List[str]:
+    """Создать секции с текущего месяца на months_ahead месяцев вперед (кроме уже покрытых)"""
+    connection = connection or default_connection
+    months_ahead = settings.PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    now = now or timezone.now()
+    covered = [(lower, upper) for _, lower, upper in list_partitions(table, connection) if upper is not None]
+
+    created = []
+    for offset in range(months_ahead + 1):
+        start, end = month_start(now, offset), month_start(now, offset + 1)
+        if any((lower is None or lower < end) and start < upper for lower, upper in covered):
+            continue
+        if not dry_run:
+            create_partition(table, start, connection)
+        created.append(partition_name(table, start))
+    return created
+
+
+def expire_partitions(table: str, months: int, action: Optional[str] = None, now=None, connection=None,
+                      dry_run: bool = False) -> List[str]:
+    """Отключить (detach) или удалить (drop) секции, целиком старше months месяцев"""
+    if not months:
+        return []
+    connection = connection or default_connection
+    action = action or settings.PARTITION_RETENTION_ACTION
+    if action not in ('detach', 'drop'):
+        raise ValueError(f'Unknown partition retention action: {action}')
+    quote = connection.ops.quote_name
+    cutoff = month_start(now or timezone.now(), -months)
+
+    expired = [name for name, _, upper in list_partitions(table, connection) if upper is not None and upper <= cutoff]
+    if dry_run:
+        return expired
+    with connection.cursor() as cursor:
+        for name in expired:
+            cursor.execute(f'ALTER TABLE {quote(table)} DETACH PARTITION {quote(name)}')
+            if action == 'drop':
+                cursor.execute(f'DROP TABLE {quote(name)}')
+            logger.info(f'Partition {name} of {table} {action}ed (older than {months} months)')
+    return expired
+
+
+def convert_to_partitioned(table: str, connection=None, now=None) -> bool:
+    """Перевести обычную таблицу в секционированную по месяцам без копирования строк
+
+    Старая таблица становится секцией <table>_legacy до начала следующего месяца
+    (ее индексы подключаются к индексам новой таблицы), дальше - помесячные секции
+    и секция по умолчанию. Вызывать вне транзакции (CREATE INDEX CONCURRENTLY):
+    подготовка идет без блокировки записи, само переключение - одной транзакцией.
+
+    Returns:
+        False - не PostgreSQL или таблица уже секционирована
+    """
+    connection = connection or default_connection
+    if not supported(connection) or is_partitioned(table, connection):
+        return False
+    quote = connection.ops.quote_name
+    legacy = f'{table}_legacy'
+    unique_index = f'{table}_id_created_at_uniq'
+    bound_check = f'{table}_partition_bound_check'
+    now = now or timezone.now()
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT max(created_at) FROM {quote(table)}')
+        newest = cursor.fetchone()[0]
+        # Запас в сутки: строки, вставленные во время перевода, тоже должны пройти проверку границы
+        legacy_end = month_start(max(now, newest or now) + timedelta(days=1), 1)
+
+        # Индекс под первичный ключ (id, created_at): ATTACH подключит его, а не построит заново
+        cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {quote(unique_index)}')
+        cursor.execute(f'CREATE UNIQUE INDEX CONCURRENTLY {quote(unique_index)} ON {quote(table)} (id, created_at)')
+        # Граница секции, доказанная заранее: VALIDATE не блокирует запись, ATTACH не сканирует таблицу
+        cursor.execute(f'ALTER TABLE {quote(table)} DROP CONSTRAINT IF EXISTS {quote(bound_check)}')
+        cursor.execute(
+            f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(bound_check)} CHECK (created_at < %s) NOT VALID',
+            [legacy_end],
+        )
+        cursor.execute(f'ALTER TABLE {quote(table)} VALIDATE CONSTRAINT {quote(bound_check)}')
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s",
+            [table],
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = to_regclass(%s) AND contype IN ('p', 'f')",
+            [table],
+        )
+        constraints = cursor.fetchall()
+        primary_key = next(name for name, kind, _ in constraints if kind == 'p')
+
+        # Старые имена индексов и ограничений переходят к новой таблице (как в состоянии миграций)
+        cursor.execute(f'ALTER TABLE {quote(table)} RENAME TO {quote(legacy)}')
+        for name, kind, _ in constraints:
+            cursor.execute(f'ALTER TABLE {quote(legacy)} RENAME CONSTRAINT {quote(name)} TO {quote(_legacy_name(name))}')
+        for name, _ in indexes:
+            if name not in (primary_key, unique_index):
+                cursor.execute(f'ALTER INDEX {quote(name)} RENAME TO {quote(_legacy_name(name))}')
+
+        cursor.execute(
+            f'CREATE TABLE {quote(table)} (LIKE {quote(legacy)} INCLUDING DEFAULTS INCLUDING STORAGE) '
+            f'PARTITION BY RANGE (created_at)'
+        )
+        # Уникальность на секционированной таблице - только вместе с ключом секционирования
+        cursor.execute(f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(primary_key)} PRIMARY KEY (id, created_at)')
+        for name, definition in indexes:
+            if name not in (primary_key, unique_index):
+                # indexdef получен до переименования: CREATE INDEX <имя> ON <схема>.<table> ...
+                cursor.execute(definition)
+        for name, kind, definition in constraints:
+            if kind == 'f':
+                cursor.execute(f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} {definition}')
+
+        cursor.execute(
+            f'ALTER TABLE {quote(table)} ATTACH PARTITION {quote(legacy)} FOR VALUES FROM (MINVALUE) TO (%s)',
+            [legacy_end],
+        )
+        # Граница теперь задана секцией
+        cursor.execute(f'ALTER TABLE {quote(legacy)} DROP CONSTRAINT {quote(bound_check)}')
+        ensure_partitions(table, now=now, connection=connection)
+        cursor.execute(f'CREATE TABLE {quote(table + "_default")} PARTITION OF {quote(table)} DEFAULT')
+    logger.info(f'Table {table} converted to monthly partitions')
+    return True
+
+
+def maintain(months_ahead: Optional[int] = None, action: Optional[str] = None, dry_run: bool = False,
+             connection=None) -> Dict[str, Dict[str, List[str]]]:
+    """Создать будущие секции и обработать истекшие для всех секционированных таблиц"""
+    connection = connection or default_connection
+    result = {}
+    for table, months in retention_months().items():
+        if not is_partitioned(table, connection):
+            continue
+        result[table] = {
+            'created': ensure_partitions(table, months_ahead, connection=connection, dry_run=dry_run),
+            'expired': expire_partitions(table, months, action, connection=connection, dry_run=dry_run),
+        }
+    return result
@@ -0,0 +1,35 @@
+"""
+Celery tasks аудита: обслуживание секций tracking_events и audit_logs (apps.audit.partitions),
+сброс очереди журнала аудита (apps.audit.writer)
+"""
+from celery import shared_task
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(name='apps.audit.tasks.maintain_partitions')
+def maintain_partitions():
+    """
+    Создание секций на PARTITION_MONTHS_AHEAD месяцев вперед и отключение/удаление
+    секций старше срока хранения. Запускается через Celery Beat раз в день.
+    """
+    from apps.audit.partitions import maintain
+
+    result = maintain()
+    logger.info(f'Partitions maintained: {result}')
+    return result
+
+
+@shared_task(name='apps.audit.tasks.flush_audit_log')
+def flush_audit_log():
+    """
+    Сохранение записей журнала аудита из очереди (AUDIT_LOG_WRITER=redis) пачками,
+    включая записи, не подтвержденные упавшим воркером. Запускается через Celery Beat раз в минуту.
+    """
+    from apps.audit.writer import flush
+    
+    flushed = flush()
+    if flushed:
+        logger.info(f'Audit log entries flushed: {flushed}')
+    return flushed
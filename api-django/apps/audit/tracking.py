@@ -0,0 +1,135 @@
+"""
+Прием фронтовых событий (TrackingEvent) поодиночке и пачками.
+
+Пачка (TrackingEventBatchView): JSON-массив, {"events": [...]} или NDJSON (событие на строку),
+тело можно сжать gzip (Content-Encoding: gzip). События разбираются и обрезаются по длинам
+полей за один проход, некорректные отклоняются поштучно (индекс и причина в ответе),
+остальные сохраняются одним bulk_create (или через write-behind буфер apps.audit.buffer) -
+одно соединение и один INSERT на пачку вместо запроса на событие.
+"""
+import ipaddress
+import json
+import zlib
+
+from django.conf import settings
+
+from .models import TrackingEvent
+
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/jsonl', 'application/x-jsonlines')
+
+
+class BatchError(ValueError):
+    """Тело пачки не удалось разобрать целиком"""
+
+
+def truncate(value, limit):
+    if value is None:
+        return ''
+    value = str(value)
+    if len(value) > limit:
+        return value[:limit]
+    return value
+
+
+def client_ip(request):
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    ip = x_forwarded_for.split(',')[0].strip() if x_forwarded_for else request.META.get('REMOTE_ADDR')
+    try:
+        # Некорректный X-Forwarded-For не должен ронять INSERT (GenericIPAddressField)
+        return str(ipaddress.ip_address(ip)) if ip else None
+    except ValueError:
+        return None
+
+
+def build_event(payload, ip_address=None, user_agent=None) -> TrackingEvent:
+    """TrackingEvent из тела события фронтенда (поля обрезаются по длинам модели)"""
+    nested_data = payload.get('data') if isinstance(payload.get('data'), dict) else {}
+    return TrackingEvent(
+        event=truncate(payload.get('event') or 'custom_event', 100),
+        category=truncate(payload.get('category') or 'frontend', 50),
+        session_id=truncate(payload.get('sessionId') or payload.get('session_id'), 120),
+        user_identifier=truncate(payload.get('userId') or payload.get('user_id'), 120),
+        page=truncate(payload.get('page') or nested_data.get('page'), 255),
+        referrer=truncate(payload.get('referrer') or nested_data.get('referrer'), 512),
+        cart_id=truncate(payload.get('cartId') or nested_data.get('cartId'), 120),
+        payload=nested_data or payload,
+        ip_address=ip_address,
+        user_agent=user_agent,
+    )
+
+
+def read_body(request) -> bytes:
+    """Тело запроса, распакованное из gzip/deflate не больше TRACKING_BATCH_MAX_BYTES"""
+    body = request.body
+    encoding = request.META.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+    if encoding in ('', 'identity'):
+        if len(body) > settings.TRACKING_BATCH_MAX_BYTES:
+            raise BatchError('Request body is too large')
+        return body
+    if encoding not in ('gzip', 'deflate'):
+        raise BatchError(f'Unsupported Content-Encoding: {encoding}')
+
+    # wbits: 16 + MAX_WBITS - gzip, MAX_WBITS - zlib (deflate)
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS)
+    try:
+        data = decompressor.decompress(body, settings.TRACKING_BATCH_MAX_BYTES + 1)
+    except zlib.error:
+        raise BatchError(f'Invalid {encoding} body')
+    if len(data) > settings.TRACKING_BATCH_MAX_BYTES:
+        raise BatchError('Decompressed body is too large')
+    return data
+
+
+def parse_batch(data: bytes, content_type: str):
+    """Элементы пачки: [(событие или None, причина отклонения или None)]"""
+    if content_type.split(';')[0].strip().lower() in NDJSON_CONTENT_TYPES:
+        items = []
+        for line in data.decode('utf-8', errors='replace').splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append((json.loads(line), None))
+            except ValueError:
+                items.append((None, 'invalid JSON'))
+        return items
+
+    try:
+        body = json.loads(data)
+    except ValueError:
+        raise BatchError('Invalid JSON body')
+    if isinstance(body, dict) and isinstance(body.get('events'), list):
+        body = body['events']
+    if not isinstance(body, list):
+        raise BatchError('Expected a JSON array of events, {"events": [...]} or NDJSON')
+    return [(item, None) for item in body]
+
+
+def _rejection(item):
+    if not isinstance(item, dict):
+        return 'event must be a JSON object'
+    if item.get('event') is not None and not isinstance(item['event'], str):
+        return 'event name must be a string'
+    if item.get('data') is not None and not isinstance(item['data'], dict):
+        return 'data must be a JSON object'
+    if '\\u0000' in json.dumps(item):
+        # PostgreSQL не хранит NUL в text/jsonb: одно такое событие уронило бы INSERT всей пачки
+        return 'NUL characters are not allowed'
+    return None
+
+
+def prepare_batch(items, ip_address=None, user_agent=None):
+    """Проверить пачку и построить события
+
+    Returns:
+        (события для сохранения, [{'index': i, 'error': причина}])
+    """
+    limit = settings.TRACKING_BATCH_MAX_EVENTS
+    user_agent = truncate(user_agent, 512)
+    events, rejected = [], []
+    for index, (item, error) in enumerate(items):
+        error = error or ('batch limit exceeded' if index >= limit else _rejection(item))
+        if error:
+            rejected.append({'index': index, 'error': error})
+        else:
+            events.append(build_event(item, ip_address, user_agent))
+    return events, rejected
@@ -1,10 +1,12 @@
 from django.urls import path
 
-from .views import TrackingEventView, CartTrackingView
+from .views import TrackingEventView, TrackingEventBatchView, CartTrackingView, TrackingBufferMetricsView
 
 urlpatterns = [
     path('events', TrackingEventView.as_view(), name='tracking-events'),
+    path('events/batch', TrackingEventBatchView.as_view(), name='tracking-events-batch'),
     path('cart/track', CartTrackingView.as_view(), name='cart-track'),
+    path('admin/tracking-buffer/metrics/', TrackingBufferMetricsView.as_view(), name='admin-tracking-buffer-metrics'),
 ]
 
 
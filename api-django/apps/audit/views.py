@@ -1,28 +1,26 @@
 import logging
 
 from rest_framework import status, views
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
+from .buffer import get_buffer_metrics, submit
 from .models import TrackingEvent
+from .tracking import BatchError, truncate, build_event, client_ip, parse_batch, prepare_batch, read_body
 
 logger = logging.getLogger(__name__)
 
 
-def _truncate(value, limit):
-    if value is None:
-        return ''
-    value = str(value)
-    if len(value) > limit:
-        return value[:limit]
-    return value
+class IsAdmin(IsAuthenticated):
+    def has_permission(self, request, view):
+        if not super().has_permission(request, view):
+            return False
+        return request.user.role == 'admin'
 
 
-def _client_ip(request):
-    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    if x_forwarded_for:
-        return x_forwarded_for.split(',')[0].strip()
-    return request.META.get('REMOTE_ADDR')
+def _accepted_status(deferred):
+    """202 - событие в write-behind буфере (apps.audit.buffer), 201 - уже сохранено"""
+    return status.HTTP_202_ACCEPTED if deferred else status.HTTP_201_CREATED
 
 
 class TrackingEventView(views.APIView):
@@ -36,28 +34,59 @@ class TrackingEventView(views.APIView):
 
     def post(self, request):
         payload = request.data if isinstance(request.data, dict) else {}
-        nested_data = payload.get('data') if isinstance(payload.get('data'), dict) else {}
-        event_name = payload.get('event') or 'custom_event'
-        category = payload.get('category') or 'frontend'
 
         try:
-            TrackingEvent.objects.create(
-                event=_truncate(event_name, 100),
-                category=_truncate(category, 50),
-                session_id=_truncate(payload.get('sessionId') or payload.get('session_id'), 120),
-                user_identifier=_truncate(payload.get('userId') or payload.get('user_id'), 120),
-                page=_truncate(payload.get('page') or nested_data.get('page'), 255),
-                referrer=_truncate(payload.get('referrer') or nested_data.get('referrer'), 512),
-                cart_id=_truncate(payload.get('cartId') or nested_data.get('cartId'), 120),
-                payload=nested_data or payload,
-                ip_address=_client_ip(request),
-                user_agent=_truncate(request.META.get('HTTP_USER_AGENT'), 512),
-            )
+            deferred, _ = submit([build_event(
+                payload,
+                ip_address=client_ip(request),
+                user_agent=truncate(request.META.get('HTTP_USER_AGENT'), 512),
+            )])
         except Exception:
             logger.exception('Failed to persist tracking event')
             return Response({'success': False}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        return Response({'success': True}, status=status.HTTP_201_CREATED)
+        return Response({'success': True}, status=_accepted_status(deferred))
+
+
+class TrackingEventBatchView(views.APIView):
+    """
+    Пачка фронтовых событий одним запросом: JSON-массив, {"events": [...]} или NDJSON,
+    тело можно сжать gzip. Анонимно, без CSRF.
+    Некорректные события отклоняются поштучно, остальные сохраняются одним INSERT.
+    """
+
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    # Тело разбирается в apps.audit.tracking (NDJSON, gzip)
+    parser_classes = []
+
+    def post(self, request):
+        try:
+            items = parse_batch(read_body(request), request.content_type or '')
+        except BatchError as e:
+            return Response({'success': False, 'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if not items:
+            return Response({'success': False, 'message': 'No events'}, status=status.HTTP_400_BAD_REQUEST)
+
+        events, rejected = prepare_batch(
+            items, ip_address=client_ip(request), user_agent=request.META.get('HTTP_USER_AGENT'),
+        )
+        if not events:
+            return Response(
+                {'success': False, 'accepted': 0, 'rejected': rejected},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            deferred, dropped = submit(events)
+        except Exception:
+            logger.exception('Failed to persist tracking event batch')
+            return Response({'success': False}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response(
+            {'success': True, 'accepted': len(events) - dropped, 'dropped': dropped, 'rejected': rejected},
+            status=_accepted_status(deferred),
+        )
 
 
 class CartTrackingView(views.APIView):
@@ -74,23 +103,35 @@ class CartTrackingView(views.APIView):
         status_label = payload.get('status') or payload.get('cartStatus')
 
         try:
-            TrackingEvent.objects.create(
+            deferred, _ = submit([TrackingEvent(
                 event='cart_update',
                 category='cart',
-                session_id=_truncate(payload.get('sessionId') or payload.get('session_id'), 120),
-                user_identifier=_truncate(payload.get('userId') or payload.get('user_id'), 120),
-                cart_id=_truncate(cart_id, 120),
-                cart_status=_truncate(status_label, 50),
-                page=_truncate(payload.get('page'), 255),
+                session_id=truncate(payload.get('sessionId') or payload.get('session_id'), 120),
+                user_identifier=truncate(payload.get('userId') or payload.get('user_id'), 120),
+                cart_id=truncate(cart_id, 120),
+                cart_status=truncate(status_label, 50),
+                page=truncate(payload.get('page'), 255),
                 payload=payload,
-                ip_address=_client_ip(request),
-                user_agent=_truncate(request.META.get('HTTP_USER_AGENT'), 512),
-            )
+                ip_address=client_ip(request),
+                user_agent=truncate(request.META.get('HTTP_USER_AGENT'), 512),
+            )])
         except Exception:
             logger.exception('Failed to persist cart tracking event')
             return Response({'success': False}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        return Response({'success': True}, status=status.HTTP_201_CREATED)
+        return Response({'success': True}, status=_accepted_status(deferred))
+
+
+class TrackingBufferMetricsView(views.APIView):
+    """
+    Метрики write-behind буфера событий: глубина, лаг, принятые/сброшенные/отброшенные.
+    Для TRACKING_BUFFER_BACKEND=memory - буфер процесса, обработавшего запрос.
+    """
+
+    permission_classes = [IsAdmin]
+
+    def get(self, request):
+        return Response(get_buffer_metrics())
 
 
 
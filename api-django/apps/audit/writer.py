@@ -0,0 +1,184 @@
+"""
+Запись журнала аудита (AuditLog) из запросов админки.
+
+AUDIT_LOG_WRITER:
+    sync - INSERT в запросе (по умолчанию)
+    redis - запись после коммита транзакции запроса кладется в Redis stream (AUDIT_LOG_STREAM),
+        Celery-задача flush_audit_log раз в минуту сохраняет накопленное пачками bulk_create.
+        Сброс идет через consumer group: запись подтверждается (XACK) только после INSERT,
+        записи упавшего воркера забирает следующий запуск (XAUTOCLAIM) - at-least-once.
+        Повтор пачки не дублирует строки: id и created_at назначаются при постановке
+        в очередь, вставка - ignore_conflicts. Если Redis недоступен или в очереди больше
+        AUDIT_LOG_MAX_PENDING записей, запись сохраняется в запросе.
+
+AUDIT_LOG_STORAGE:
+    full - before/after целиком (по умолчанию)
+    diff - только измененные поля: before - старые значения, after - новые
+        (создание и удаление хранятся целиком)
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from .buffer import DATABASE_ERRORS, RedisStreamBuffer
+from .models import AuditLog
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд задача сброса разбирает очередь за запуск (запускается раз в минуту)
+FLUSH_TIME_LIMIT = 50
+
+
+def _jsonable(value):
+    """Снимок сериализатора в виде JSON (UUID, Decimal, даты - строками)"""
+    if value is None:
+        return None
+    return json.loads(json.dumps(value, cls=DjangoJSONEncoder))
+
+
+def diff(before: Optional[Dict], after: Optional[Dict]) -> Tuple[Optional[Dict], Optional[Dict]]:
+    """Только измененные поля снимков; если одного из снимков нет - оба как есть"""
+    if not isinstance(before, dict) or not isinstance(after, dict):
+        return before, after
+    changed = [key for key in {**before, **after} if before.get(key) != after.get(key)]
+    return {key: before.get(key) for key in changed}, {key: after.get(key) for key in changed}
+
+
+def build_row(action, entity_type, entity_id, actor, before=None, after=None, request=None) -> Dict:
+    """Запись журнала в виде JSON-совместимого словаря (id и время назначаются здесь)"""
+    before, after = _jsonable(before), _jsonable(after)
+    if settings.AUDIT_LOG_STORAGE == 'diff':
+        before, after = diff(before, after)
+    return {
+        'id': str(uuid.uuid4()),
+        'entity_type': entity_type,
+        'entity_id': str(entity_id),
+        'action': action,
+        'actor_id': actor.pk if actor else None,
+        'actor_email': actor.email if actor else '',
+        'actor_role': actor.role if actor and hasattr(actor, 'role') else None,
+        'before': before,
+        'after': after,
+        'ip_address': request.META.get('REMOTE_ADDR') if request else None,
+        'user_agent': request.META.get('HTTP_USER_AGENT') if request else None,
+        'created_at': timezone.now().isoformat(),
+    }
+
+
+def from_row(row: Dict) -> AuditLog:
+    return AuditLog(**{**row, 'created_at': datetime.fromisoformat(row['created_at'])})
+
+
+def persist_rows(rows: List[Dict]) -> int:
+    """Сохранить пачку одним bulk_create (уже сохраненные записи пропускаются);
+    при ошибке данных - по одной, пропуская плохие
+
+    Returns:
+        сколько записей не удалось сохранить
+    Raises:
+        OperationalError / InterfaceError: БД недоступна, пачку нужно повторить
+    """
+    entries = [from_row(row) for row in rows]
+    try:
+        AuditLog.objects.bulk_create(entries, batch_size=settings.AUDIT_LOG_FLUSH_SIZE, ignore_conflicts=True)
+        return 0
+    except DATABASE_ERRORS:
+        raise
+    except Exception as e:
+        logger.warning(f"Audit log batch insert failed, falling back to row inserts: {e}")
+
+    failed = 0
+    for entry in entries:
+        try:
+            with transaction.atomic():
+                AuditLog.objects.bulk_create([entry], ignore_conflicts=True)
+        except DATABASE_ERRORS:
+            raise
+        except Exception as e:
+            failed += 1
+            logger.error(f"Failed to persist audit log {entry.id}: {e}")
+    return failed
+
+
+_writer = {'pid': None, 'instance': None}
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> Optional[RedisStreamBuffer]:
+    """Очередь журнала аудита текущего процесса по AUDIT_LOG_WRITER (None - запись в запросе)"""
+    backend = settings.AUDIT_LOG_WRITER
+    if backend == 'sync':
+        return None
+    if backend != 'redis':
+        raise ValueError(f'Unknown AUDIT_LOG_WRITER: {backend}')
+    with _writer_lock:
+        if _writer['instance'] is None or _writer['pid'] != os.getpid():
+            import redis
+            _writer.update(pid=os.getpid(), instance=RedisStreamBuffer(
+                client=redis.Redis.from_url(settings.AUDIT_LOG_REDIS_URL),
+                stream=settings.AUDIT_LOG_STREAM,
+                max_pending=settings.AUDIT_LOG_MAX_PENDING,
+                # Не drop и не block: не поместившееся в очередь сразу сохраняется в запросе
+                overflow='sync',
+                persist=persist_rows,
+                group='audit-flusher',
+                flush_size=settings.AUDIT_LOG_FLUSH_SIZE,
+            ))
+        return _writer['instance']
+
+
+def _enqueue(writer: RedisStreamBuffer, row: Dict):
+    try:
+        overflow = writer.put([row])
+    except Exception as e:
+        logger.error(f"Audit log queue unavailable, writing {row['id']} synchronously: {e}")
+        overflow = [row]
+    if overflow:
+        try:
+            persist_rows(overflow)
+        except Exception as e:
+            logger.error(f"Failed to create audit log: {e}")
+
+
+def write(row: Dict):
+    """Сохранить запись журнала: сразу или, для AUDIT_LOG_WRITER=redis, в очередь после коммита"""
+    writer = get_writer()
+    if writer is None:
+        from_row(row).save(force_insert=True)
+        return
+    # Откат транзакции запроса не должен оставлять запись о несостоявшемся изменении
+    transaction.on_commit(partial(_enqueue, writer, row))
+
+
+def flush(consumer: Optional[str] = None, time_limit: float = FLUSH_TIME_LIMIT) -> int:
+    """Разобрать очередь журнала аудита пачками (не дольше time_limit секунд)
+
+    Returns:
+        сколько записей сохранено
+    """
+    writer = get_writer()
+    if writer is None:
+        return 0
+    consumer = consumer or f'{socket.gethostname()}:{os.getpid()}'
+    writer.ensure_group()
+    deadline = time.monotonic() + time_limit
+    total = 0
+    while time.monotonic() < deadline:
+        # block_ms=0 - без ожидания: пустая очередь сразу завершает запуск
+        flushed = writer.flush(consumer, block_ms=0)
+        if not flushed:
+            break
+        total += flushed
+    return total
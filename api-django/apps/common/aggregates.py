@@ -0,0 +1,31 @@
+"""
+Агрегаты связанных таблиц скалярными подзапросами.
+
+subquery_aggregate строит коррелированный подзапрос «агрегат по строкам, связанным
+с внешней строкой» для .annotate(): несколько счетчиков и сумм по разным таблицам
+приходят одним запросом, без JOIN-ов, размножающих строки (и искажающих SUM).
+"""
+from django.db.models import IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def subquery_aggregate(queryset, link_field, aggregate, default=0, output_field=None, outer_field='pk'):
+    """Коррелированный подзапрос: aggregate по строкам queryset, где link_field = внешняя строка
+
+    Args:
+        queryset: выборка агрегируемых строк (фильтры - как обычно)
+        link_field: поле queryset, ссылающееся на внешнюю строку (например 'user')
+        aggregate: Count/Sum/... (условная агрегация - через filter=Q(...))
+        default: значение при отсутствии строк
+        output_field: тип результата (по умолчанию IntegerField, для сумм - DecimalField)
+        outer_field: поле внешней строки, с которым сравнивается link_field
+    """
+    output_field = output_field or IntegerField()
+    subquery = (
+        queryset.filter(**{link_field: OuterRef(outer_field)})
+        .order_by()
+        .values(link_field)
+        .annotate(value=aggregate)
+        .values('value')[:1]
+    )
+    return Coalesce(Subquery(subquery, output_field=output_field), Value(default), output_field=output_field)
@@ -0,0 +1,42 @@
+"""
+Итерация больших выборок для фоновых задач с ограниченным расходом памяти.
+
+iter_chunks / iter_queryset - keyset-пагинация: каждая пачка отдельным запросом
+WHERE key > последний ORDER BY key LIMIT n. Устойчива к изменению строк во время
+обработки (строка, вышедшая из фильтра, не сдвигает следующие пачки, как OFFSET),
+не держит открытую транзакцию между пачками.
+
+stream_queryset - один запрос с потоковым чтением: на PostgreSQL это server-side
+cursor (QuerySet.iterator), в памяти одновременно не больше chunk_size строк.
+Подходит для выборок только на чтение.
+"""
+from django.conf import settings
+
+DEFAULT_CHUNK_SIZE = getattr(settings, 'BATCH_ITERATION_CHUNK_SIZE', 1000)
+
+
+def iter_chunks(queryset, chunk_size=None, key='pk'):
+    """Пачки объектов queryset (списки), упорядоченные по уникальному полю key"""
+    chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+    queryset = queryset.order_by(key)
+    last = None
+    while True:
+        page = queryset if last is None else queryset.filter(**{f'{key}__gt': last})
+        chunk = list(page[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last = getattr(chunk[-1], key)
+
+
+def iter_queryset(queryset, chunk_size=None, key='pk'):
+    """Объекты queryset по одному, загружаемые keyset-пачками"""
+    for chunk in iter_chunks(queryset, chunk_size=chunk_size, key=key):
+        yield from chunk
+
+
+def stream_queryset(queryset, chunk_size=None):
+    """Потоковое чтение queryset одним запросом (server-side cursor на PostgreSQL)"""
+    return queryset.iterator(chunk_size=chunk_size or DEFAULT_CHUNK_SIZE)
@@ -0,0 +1,19 @@
+"""
+Курсорная пагинация для длинных списков клиента.
+
+В отличие от PageNumberPagination не считает COUNT(*) и не использует OFFSET:
+следующая страница - WHERE created_at < курсор ORDER BY created_at DESC, id DESC LIMIT n,
+стоимость одинакова для первой и тысячной страницы (при индексе по фильтру + created_at).
+"""
+from rest_framework.pagination import CursorPagination
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """Новые записи первыми; id - для однозначного порядка при равном created_at"""
+    ordering = ('-created_at', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+    def get_page_links(self):
+        return {'next': self.get_next_link(), 'previous': self.get_previous_link()}
@@ -0,0 +1,50 @@
+"""
+Потоковые JSON-ответы для полных выгрузок.
+
+Ответ собирается по мере чтения строк (stream_queryset) и отдается кусками
+по ~64 КБ: в памяти воркера одновременно только пачка строк и буфер,
+а не весь список объектов и сериализованный JSON целиком.
+"""
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+STREAM_BUFFER_SIZE = 64 * 1024
+
+
+def iter_json_envelope(items, key, envelope=None, total_key=None, buffer_size=STREAM_BUFFER_SIZE):
+    """JSON-объект {**envelope, key: [...items], total_key: количество} по частям
+
+    Args:
+        items: итератор уже подготовленных словарей (json-сериализуемых)
+        key: ключ массива
+        envelope: прочие ключи ответа (идут перед массивом)
+        total_key: ключ с количеством элементов (в конце ответа)
+    """
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    head = [f'{json.dumps(name)}: {encoder.encode(value)}' for name, value in (envelope or {}).items()]
+    buffer = ['{' + ''.join(f'{part}, ' for part in head) + f'{json.dumps(key)}: [']
+    size = 0
+    total = 0
+    for item in items:
+        chunk = encoder.encode(item)
+        buffer.append(chunk if not total else ',' + chunk)
+        size += len(chunk)
+        total += 1
+        if size >= buffer_size:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    buffer.append(']')
+    if total_key:
+        buffer.append(f', {json.dumps(total_key)}: {total}')
+    buffer.append('}')
+    yield ''.join(buffer)
+
+
+class StreamingJSONResponse(StreamingHttpResponse):
+    """Потоковый JSON-ответ (см. iter_json_envelope)"""
+
+    def __init__(self, items, key, envelope=None, total_key=None, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(iter_json_envelope(items, key, envelope=envelope, total_key=total_key), **kwargs)
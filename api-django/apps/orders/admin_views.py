@@ -1,12 +1,13 @@
-from rest_framework import viewsets, filters
+from rest_framework import viewsets, filters, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
-from django.utils import timezone
-from datetime import timedelta
-from django.db.models import Sum, Count, Q
+from django.db.models import Q
 from .models import Order
+from apps.products.models import Product
+from apps.reports.exports import ExportMixin
+from apps.reports.statistics import breakdown, collect_statistics, kpi
 from .serializers import OrderSerializer, OrderListSerializer
 from apps.users.models import User
 from apps.audit.middleware import AuditLogMiddleware
@@ -19,7 +20,7 @@ class IsAdminOrFinanceManager(IsAuthenticated):
         return request.user.role in ['admin', 'finance_manager']
 
 
-class OrderAdminViewSet(viewsets.ModelViewSet):
+class OrderAdminViewSet(ExportMixin, viewsets.ModelViewSet):
     """
     API endpoint для управления заказами в админке
     Показывает все продажи с фильтрацией и статистикой
@@ -32,6 +33,20 @@ class OrderAdminViewSet(viewsets.ModelViewSet):
     search_fields = ['order_id', 'customer_email', 'customer_name', 'customer_phone', 'payment_id']
     ordering_fields = ['created_at', 'amount', 'status']
     ordering = ['-created_at']
+    export_filename = 'orders'
+    export_fields = [
+        ('Номер заказа', 'order_id'),
+        ('Создан', 'created_at'),
+        ('Статус', 'status'),
+        ('Сумма', 'amount'),
+        ('Валюта', 'currency'),
+        ('Продукт', 'product__name'),
+        ('Клиент', 'customer_name'),
+        ('Email', 'customer_email'),
+        ('Телефон', 'customer_phone'),
+        ('Пользователь', 'user__email'),
+        ('ID платежа', 'payment_id'),
+    ]
     
     def get_serializer_class(self):
         if self.action == 'list':
@@ -58,72 +73,52 @@ class OrderAdminViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['get'])
     def statistics(self, request):
-        """Статистика по продажам"""
-        queryset = self.get_queryset()
+        """Статистика по продажам (агрегаты apps.reports; period или date_from/date_to, bucket - ряд)
         
-        # Период
-        period = request.query_params.get('period', 'all')  # all, today, week, month, year
-        now = timezone.now()
-        
-        if period == 'today':
-            queryset = queryset.filter(created_at__date=now.date())
-        elif period == 'week':
-            queryset = queryset.filter(created_at__gte=now - timedelta(days=7))
-        elif period == 'month':
-            queryset = queryset.filter(created_at__gte=now - timedelta(days=30))
-        elif period == 'year':
-            queryset = queryset.filter(created_at__gte=now - timedelta(days=365))
-        
-        # Статистика
-        total_orders = queryset.count()
-        total_amount = queryset.filter(status='CONFIRMED').aggregate(
-            total=Sum('amount')
-        )['total'] or 0
-        
-        confirmed_orders = queryset.filter(status='CONFIRMED').count()
-        pending_orders = queryset.filter(status__in=['NEW', 'AUTHORIZING']).count()
-        failed_orders = queryset.filter(status__in=['REJECTED', 'AUTH_FAIL']).count()
-        
-        # По статусам
-        status_stats = queryset.values('status').annotate(
-            count=Count('id'),
-            total_amount=Sum('amount')
-        ).order_by('-count')
+        С user_id - по заказам пользователя: агрегаты не разбиты по пользователям,
+        поэтому такие цифры считаются по таблице заказов.
+        """
+        user_id = request.query_params.get('user_id')
+        try:
+            stats = collect_statistics(
+                request.query_params,
+                {'orders': {
+                    'total_orders': kpi(),
+                    'total_amount': kpi('amount', status='CONFIRMED'),
+                    'confirmed_orders': kpi(status='CONFIRMED'),
+                    'pending_orders': kpi(status=['NEW', 'AUTHORIZING']),
+                    'failed_orders': kpi(status=['REJECTED', 'AUTH_FAIL']),
+                }},
+                breakdowns={'orders': ('status', 'product')},
+                scopes={'orders': Q(user_id=user_id)} if user_id else None,
+            )
+        except ValueError as e:
+            return Response({'success': False, 'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        rows = stats.rows['orders']
         
         # По продуктам
-        product_stats = queryset.filter(status='CONFIRMED').values('product__name').annotate(
-            count=Count('id'),
-            total_amount=Sum('amount')
-        ).order_by('-total_amount')
+        product_ids = {row['product'] for row in rows if row['product']}
+        names = {str(pk): name for pk, name in Product.objects.filter(pk__in=product_ids).values_list('id', 'name')}
         
-        return Response({
-            'period': period,
-            'total_orders': total_orders,
-            'total_amount': float(total_amount),
-            'confirmed_orders': confirmed_orders,
-            'pending_orders': pending_orders,
-            'failed_orders': failed_orders,
-            'status_stats': list(status_stats),
-            'product_stats': list(product_stats),
-        })
+        return Response(stats.response(
+            **stats.totals,
+            status_stats=breakdown(rows, 'status'),
+            product_stats=breakdown(
+                rows, 'product', label='product__name', order_by='total_amount', labels=names, status='CONFIRMED',
+            ),
+        ))
     
-    def update(self, request, *args, **kwargs):
-        """Обновление заказа с аудитом"""
-        instance = self.get_object()
-        before = OrderListSerializer(instance).data
-        
-        response = super().update(request, *args, **kwargs)
-        
-        after = OrderListSerializer(self.get_object()).data
+    def perform_update(self, serializer):
+        """Обновление заказа с аудитом: снимок до изменения - с уже загруженного объекта"""
+        before = OrderListSerializer(serializer.instance).data
+        instance = serializer.save()
         AuditLogMiddleware.log(
             action='order_updated',
             entity_type='Order',
             entity_id=str(instance.id),
-            actor=request.user,
+            actor=self.request.user,
             before=before,
-            after=after,
-            request=request
+            after=OrderListSerializer(instance).data,
+            request=self.request
         )
-        
-        return response
 
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-18 13:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_order_is_card_binding'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['updated_at'], name='orders_updated_1bd457_idx'),
+        ),
+    ]
@@ -96,6 +96,7 @@ class Order(models.Model):
             models.Index(fields=['customer_email']),
             models.Index(fields=['-created_at']),
             models.Index(fields=['referral_code']),
+            models.Index(fields=['updated_at']),
         ]
     
     def __str__(self):
@@ -1,13 +1,18 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .admin_views import PaymentAdminViewSet, ManualChargeAdminViewSet, TransactionAdminViewSet
+from .admin_views import (
+    PaymentAdminViewSet, ManualChargeAdminViewSet, TransactionAdminViewSet, PaymentNotificationMetricsView,
+    BillingRunAdminViewSet,
+)
 
 router = DefaultRouter()
 router.register(r'payments', PaymentAdminViewSet, basename='admin-payment')
 router.register(r'manual-charges', ManualChargeAdminViewSet, basename='admin-manual-charge')
 router.register(r'transactions', TransactionAdminViewSet, basename='admin-transaction')
+router.register(r'billing-runs', BillingRunAdminViewSet, basename='admin-billing-run')
 
 urlpatterns = [
+    path('payment-notifications/metrics/', PaymentNotificationMetricsView.as_view(), name='admin-payment-notifications-metrics'),
     path('', include(router.urls)),
 ]
 
@@ -1,13 +1,16 @@
-from rest_framework import viewsets, filters
+from rest_framework import viewsets, filters, status, views
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
-from django.utils import timezone
-from datetime import timedelta
-from django.db.models import Sum, Count, Q
-from .models import Payment, ManualCharge, Transaction
-from .serializers import PaymentSerializer, ManualChargeSerializer, TransactionSerializer
+from .models import Payment, ManualCharge, Transaction, BillingRun
+from .serializers import (
+    PaymentSerializer, ManualChargeSerializer, TransactionSerializer,
+    BillingRunSerializer, BillingAttemptSerializer,
+)
+from .webhooks import get_notification_queue_metrics
+from apps.reports.exports import ExportMixin
+from apps.reports.statistics import breakdown, collect_statistics, kpi
 from apps.audit.middleware import AuditLogMiddleware
 
 
@@ -18,7 +21,7 @@ class IsAdminOrFinanceManager(IsAuthenticated):
         return request.user.role in ['admin', 'finance_manager']
 
 
-class PaymentAdminViewSet(viewsets.ModelViewSet):
+class PaymentAdminViewSet(ExportMixin, viewsets.ModelViewSet):
     """
     API endpoint для управления платежами в админке
     """
@@ -30,6 +33,19 @@ class PaymentAdminViewSet(viewsets.ModelViewSet):
     search_fields = ['provider_ref', 'order__order_id', 'user__email']
     ordering_fields = ['created_at', 'amount', 'status']
     ordering = ['-created_at']
+    export_filename = 'payments'
+    export_fields = [
+        ('ID', 'id'),
+        ('Создан', 'created_at'),
+        ('Статус', 'status'),
+        ('Метод', 'method'),
+        ('Сумма', 'amount'),
+        ('Валюта', 'currency'),
+        ('Заказ', 'order__order_id'),
+        ('Пользователь', 'user__email'),
+        ('ID у провайдера', 'provider_ref'),
+        ('Причина отказа', 'failure_reason'),
+    ]
     
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -37,47 +53,23 @@ class PaymentAdminViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['get'])
     def statistics(self, request):
-        """Статистика по платежам"""
-        queryset = self.get_queryset()
+        """Статистика по платежам (агрегаты apps.reports; period или date_from/date_to, bucket - ряд)"""
+        try:
+            stats = collect_statistics(
+                request.query_params,
+                {'payments': {
+                    'total_payments': kpi(),
+                    'total_amount': kpi('amount', status='success'),
+                    'successful_payments': kpi(status='success'),
+                    'failed_payments': kpi(status='failed'),
+                    'pending_payments': kpi(status='pending'),
+                }},
+                breakdowns={'payments': ('method',)},
+            )
+        except ValueError as e:
+            return Response({'success': False, 'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Период
-        period = request.query_params.get('period', 'all')
-        now = timezone.now()
-        
-        if period == 'today':
-            queryset = queryset.filter(created_at__date=now.date())
-        elif period == 'week':
-            queryset = queryset.filter(created_at__gte=now - timedelta(days=7))
-        elif period == 'month':
-            queryset = queryset.filter(created_at__gte=now - timedelta(days=30))
-        elif period == 'year':
-            queryset = queryset.filter(created_at__gte=now - timedelta(days=365))
-        
-        # Статистика
-        total_payments = queryset.count()
-        total_amount = queryset.filter(status='success').aggregate(
-            total=Sum('amount')
-        )['total'] or 0
-        
-        successful_payments = queryset.filter(status='success').count()
-        failed_payments = queryset.filter(status='failed').count()
-        pending_payments = queryset.filter(status='pending').count()
-        
-        # По методам
-        method_stats = queryset.values('method').annotate(
-            count=Count('id'),
-            total_amount=Sum('amount')
-        ).order_by('-count')
-        
-        return Response({
-            'period': period,
-            'total_payments': total_payments,
-            'total_amount': float(total_amount),
-            'successful_payments': successful_payments,
-            'failed_payments': failed_payments,
-            'pending_payments': pending_payments,
-            'method_stats': list(method_stats),
-        })
+        return Response(stats.response(**stats.totals, method_stats=breakdown(stats.rows['payments'], 'method')))
 
 
 class ManualChargeAdminViewSet(viewsets.ModelViewSet):
@@ -112,7 +104,7 @@ class ManualChargeAdminViewSet(viewsets.ModelViewSet):
         return instance
 
 
-class TransactionAdminViewSet(viewsets.ReadOnlyModelViewSet):
+class TransactionAdminViewSet(ExportMixin, viewsets.ReadOnlyModelViewSet):
     """
     API endpoint для просмотра всех транзакций в админке
     """
@@ -124,6 +116,18 @@ class TransactionAdminViewSet(viewsets.ReadOnlyModelViewSet):
     search_fields = ['user__email', 'order__order_id', 'provider_ref', 'description']
     ordering_fields = ['created_at', 'amount']
     ordering = ['-created_at']
+    export_filename = 'transactions'
+    export_fields = [
+        ('ID', 'id'),
+        ('Создана', 'created_at'),
+        ('Тип', 'transaction_type'),
+        ('Сумма', 'amount'),
+        ('Валюта', 'currency'),
+        ('Пользователь', 'user__email'),
+        ('Заказ', 'order__order_id'),
+        ('ID у провайдера', 'provider_ref'),
+        ('Описание', 'description'),
+    ]
     
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -131,38 +135,54 @@ class TransactionAdminViewSet(viewsets.ReadOnlyModelViewSet):
     
     @action(detail=False, methods=['get'])
     def statistics(self, request):
-        """Статистика по транзакциям"""
-        queryset = self.get_queryset()
+        """Статистика по транзакциям (агрегаты apps.reports; period или date_from/date_to, bucket - ряд)"""
+        try:
+            stats = collect_statistics(
+                request.query_params,
+                {'transactions': {'total_transactions': kpi(), 'total_amount': kpi('amount')}},
+                breakdowns={'transactions': ('kind',)},
+            )
+        except ValueError as e:
+            return Response({'success': False, 'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Период
-        period = request.query_params.get('period', 'all')
-        now = timezone.now()
-        
-        if period == 'today':
-            queryset = queryset.filter(created_at__date=now.date())
-        elif period == 'week':
-            queryset = queryset.filter(created_at__gte=now - timedelta(days=7))
-        elif period == 'month':
-            queryset = queryset.filter(created_at__gte=now - timedelta(days=30))
-        elif period == 'year':
-            queryset = queryset.filter(created_at__gte=now - timedelta(days=365))
-        
-        # Статистика
-        total_transactions = queryset.count()
-        total_amount = queryset.aggregate(
-            total=Sum('amount')
-        )['total'] or 0
-        
-        # По типам
-        type_stats = queryset.values('transaction_type').annotate(
-            count=Count('id'),
-            total_amount=Sum('amount')
-        ).order_by('-count')
-        
-        return Response({
-            'period': period,
-            'total_transactions': total_transactions,
-            'total_amount': float(total_amount),
-            'type_stats': list(type_stats),
-        })
+        return Response(stats.response(
+            **stats.totals,
+            type_stats=breakdown(stats.rows['transactions'], 'kind', label='transaction_type'),
+        ))
+
 
+class BillingRunAdminViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint для мониторинга прогонов рекуррентных списаний:
+    прогресс и скорость (списаний в секунду) обновляются после каждой пачки
+    """
+    queryset = BillingRun.objects.all()
+    serializer_class = BillingRunSerializer
+    permission_classes = [IsAdminOrFinanceManager]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+    filterset_fields = ['status']
+    ordering_fields = ['started_at']
+    ordering = ['-started_at']
+    
+    @action(detail=True, methods=['get'])
+    def attempts(self, request, pk=None):
+        """Попытки списания прогона (фильтр ?status=)"""
+        run = self.get_object()
+        queryset = run.attempts.select_related('user_product__user', 'user_product__product', 'order')
+        attempt_status = request.query_params.get('status')
+        if attempt_status:
+            queryset = queryset.filter(status=attempt_status)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(BillingAttemptSerializer(page, many=True).data)
+        return Response(BillingAttemptSerializer(queryset, many=True).data)
+
+
+class PaymentNotificationMetricsView(views.APIView):
+    """
+    Метрики очереди уведомлений T-Bank: глубина, лаг и задержка обработки
+    """
+    permission_classes = [IsAdminOrFinanceManager]
+    
+    def get(self, request):
+        return Response(get_notification_queue_metrics())
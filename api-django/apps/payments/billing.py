@@ -0,0 +1,758 @@
+"""
+Движок рекуррентных списаний: параллельные вызовы T-Bank с ограничением скорости
+и пакетная запись результатов в БД.
+
+Работа с БД (создание заказов и платежей, запись результатов, письма) идет в основном
+потоке пачками по RECURRING_BILLING_BATCH_SIZE, в пуле потоков выполняются только
+сетевые вызовы charge_mit (Init + Charge) по основной и альтернативным картам.
+
+Прогон фиксируется в BillingRun, по каждой подписке - чекпоинт BillingAttempt:
+незавершенный прогон продолжается с необработанных подписок, а заказ и платеж
+попытки, прерванной посреди списания, переиспользуются. Пока пачка списывается,
+основной поток раз в RECURRING_BILLING_HEARTBEAT_SECONDS продлевает heartbeat прогона
+и своих попыток: живой прогон не принимается за упавший, а его попытки не забираются.
+"""
+import logging
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Callable, Dict, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from apps.common.batching import iter_chunks, stream_queryset
+from apps.orders.models import Order
+from apps.products.models import UserProduct
+from apps.reports.rollups import record_changes, snapshot
+from apps.users.account_summary import apply_deltas, payment_contribution
+from .models import BillingAttempt, BillingRun, Payment, PaymentMethod
+from .services import TBankService
+
+logger = logging.getLogger(__name__)
+
+CHARGED_STATUSES = ['CONFIRMED', 'AUTHORIZED']
+
+
+class TokenBucketRateLimiter:
+    """Ограничение скорости запросов (token bucket), потокобезопасное"""
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, int(rate)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Дождаться свободного токена"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_rate_limiters: Dict[str, TokenBucketRateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(terminal_key: str) -> TokenBucketRateLimiter:
+    """Общий на процесс лимитер списаний для терминала (мерчанта) T-Bank"""
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(terminal_key)
+        if limiter is None:
+            limiter = TokenBucketRateLimiter(settings.RECURRING_BILLING_RATE_LIMIT)
+            _rate_limiters[terminal_key] = limiter
+        return limiter
+
+
+@dataclass
+class BillingResult:
+    """Итоги прогона списаний"""
+    success: int = 0
+    failed: int = 0
+    skipped: int = 0
+
+    def add(self, other: 'BillingResult'):
+        self.success += other.success
+        self.failed += other.failed
+        self.skipped += other.skipped
+
+    def as_dict(self) -> Dict[str, int]:
+        return {'success': self.success, 'failed': self.failed, 'skipped': self.skipped}
+
+
+@dataclass
+class _ChargeItem:
+    """Подписка в обработке: подготовленные заказ/платеж и результат списания"""
+    user_product: UserProduct
+    attempt: Optional[BillingAttempt] = None
+    resumed: bool = False
+    rebill_id: str = ''
+    end_date: object = None
+    alternative_cards: List[PaymentMethod] = field(default_factory=list)
+    order: Optional[Order] = None
+    payment: Optional[Payment] = None
+    result: Optional[Dict] = None
+    retry_result: Optional[Dict] = None
+    retry_card: Optional[PaymentMethod] = None
+    retry_attempts: List[PaymentMethod] = field(default_factory=list)
+    error: Optional[Exception] = None
+    emails_queued: Dict[str, bool] = field(default_factory=dict)
+
+
+def next_end_date(user_product: UserProduct):
+    """Дата окончания подписки после продления на один период"""
+    if user_product.product.subscription_period == 'yearly':
+        return user_product.end_date + timedelta(days=365)
+    return user_product.end_date + timedelta(days=30)
+
+
+def due_subscriptions(days_ahead: int = 0, now=None):
+    """Подписки к списанию: истекают в течение 3 дней от целевой даты (или pending
+    в grace period) и имеют активный привязанный платежный метод (RebillId)"""
+    now = now or timezone.now()
+    grace_period_date = now + timedelta(days=days_ahead) + timedelta(days=3)
+    # next_charge_at заполнен только у active/pending подписок (включая pending для
+    # повторных попыток): range scan по user_products_next_charge_idx
+    return UserProduct.objects.filter(
+        next_charge_at__lte=grace_period_date,
+        payment_method__isnull=False,
+        payment_method__status='active',
+    ).select_related('user', 'product', 'payment_method')
+
+
+def is_due(user_product: UserProduct, days_ahead: int = 0, now=None) -> bool:
+    """Подписка все еще подлежит списанию (те же условия, что в due_subscriptions)"""
+    now = now or timezone.now()
+    payment_method = user_product.payment_method
+    next_charge_at = user_product.compute_next_charge_at()
+    return (
+        next_charge_at is not None
+        and next_charge_at <= now + timedelta(days=days_ahead) + timedelta(days=3)
+        and payment_method is not None
+        and payment_method.status == 'active'
+    )
+
+
+class BillingRunInProgress(Exception):
+    """Другой прогон списаний еще выполняется (heartbeat свежий)"""
+
+
+def start_or_resume_run(days_ahead: int = 0, now=None):
+    """Продолжить незавершенный прогон или начать новый
+    
+    Незавершенный прогон, heartbeat которого старше RECURRING_BILLING_RUN_STALE_SECONDS,
+    считается упавшим и продолжается. Если heartbeat свежий - прогон еще идет,
+    выбрасывается BillingRunInProgress. Захваченные попытки продолженного прогона
+    движок забирает у прежнего владельца отдельно (take_over_attempts).
+    
+    Продолженный прогон покрывает только подписки, которые были к списанию на момент
+    его начала: после его завершения вызывающий снова вызывает start_or_resume_run,
+    чтобы в том же запуске начать прогон на сегодня.
+    
+    Returns:
+        (run, resumed)
+    """
+    now = now or timezone.now()
+    stale_before = now - timedelta(seconds=settings.RECURRING_BILLING_RUN_STALE_SECONDS)
+    
+    with transaction.atomic():
+        run = BillingRun.objects.select_for_update().filter(status='running').order_by('-started_at').first()
+        if run is not None:
+            if (run.heartbeat_at or run.started_at) > stale_before:
+                raise BillingRunInProgress(f'Billing run {run.id} is in progress')
+            run.resumed_count += 1
+            run.heartbeat_at = now
+            run.save(update_fields=['resumed_count', 'heartbeat_at'])
+            return run, True
+        
+        run = BillingRun.objects.create(days_ahead=days_ahead, heartbeat_at=now)
+        due_ids = due_subscriptions(days_ahead=days_ahead, now=now).values_list('id', flat=True)
+        BillingAttempt.objects.bulk_create(
+            (BillingAttempt(run=run, user_product_id=pk) for pk in stream_queryset(due_ids)),
+            batch_size=1000,
+        )
+        run.total = run.attempts.count()
+        run.save(update_fields=['total'])
+    return run, False
+
+
+def finish_run(run: BillingRun) -> BillingRun:
+    """Завершить прогон, если в нем не осталось необработанных подписок"""
+    run.refresh_from_db()
+    if not run.attempts.filter(status__in=BillingAttempt.OPEN_STATUSES).exists():
+        run.status = 'completed'
+        run.finished_at = timezone.now()
+        run.save(update_fields=['status', 'finished_at'])
+    return run
+
+
+def claim_subscriptions(user_product_ids, now=None, lease_seconds=None, run=None, owner=None):
+    """Захватить подписки под списание (аренда billing_locked_until)
+    
+    SELECT ... FOR UPDATE SKIP LOCKED: строки, которые прямо сейчас захватывает другой
+    шард или параллельный прогон, пропускаются, а уже арендованные - не берутся до
+    истечения аренды. Аренда не снимается после списания, поэтому пересекающиеся
+    прогоны не спишут подписку повторно в течение RECURRING_BILLING_LEASE_SECONDS.
+    
+    Если передан run, попытки прогона по захваченным подпискам в той же транзакции
+    помечаются claimed за владельцем owner: после сбоя прогон продолжит их без
+    повторного захвата (см. take_over_attempts).
+    
+    Returns:
+        set id захваченных подписок
+    """
+    now = now or timezone.now()
+    lease_seconds = lease_seconds or settings.RECURRING_BILLING_LEASE_SECONDS
+    with transaction.atomic():
+        claimed = list(
+            UserProduct.objects.select_for_update(skip_locked=True)
+            .filter(id__in=list(user_product_ids))
+            .filter(Q(billing_locked_until__isnull=True) | Q(billing_locked_until__lte=now))
+            .values_list('id', flat=True)
+        )
+        if claimed:
+            UserProduct.objects.filter(id__in=claimed).update(
+                billing_locked_until=now + timedelta(seconds=lease_seconds)
+            )
+            if run is not None:
+                BillingAttempt.objects.filter(run=run, user_product_id__in=claimed).update(
+                    status='claimed', owner=owner, updated_at=now,
+                )
+    return set(claimed)
+
+
+def take_over_attempts(run, attempt_ids, owner, now=None):
+    """Забрать захваченные попытки прогона (claimed/charging) под владельца owner
+    
+    Условный UPDATE: забираются только попытки, которые прежний владелец не продлевал
+    дольше RECURRING_BILLING_RUN_STALE_SECONDS (упал или завис). Попытки живого движка
+    остаются за ним, а из двух одновременных продолжений попытку забирает только одно:
+    второе после коммита первого видит свежий updated_at.
+    
+    Returns:
+        set id забранных попыток
+    """
+    now = now or timezone.now()
+    stale_before = now - timedelta(seconds=settings.RECURRING_BILLING_RUN_STALE_SECONDS)
+    attempt_ids = list(attempt_ids)
+    with transaction.atomic():
+        BillingAttempt.objects.filter(
+            run=run, id__in=attempt_ids, status__in=['claimed', 'charging'], updated_at__lte=stale_before,
+        ).update(owner=owner, updated_at=now)
+        return set(BillingAttempt.objects.filter(id__in=attempt_ids, owner=owner).values_list('id', flat=True))
+
+
+class RecurringBillingEngine:
+    """Параллельное рекуррентное списание с сохранением посубъектной логики
+    команды process_recurring_payments
+
+    report(level, message) - вывод хода обработки (level: info, success, warning, error),
+    по умолчанию пишет в лог.
+    """
+
+    def __init__(
+        self,
+        tbank: Optional[TBankService] = None,
+        workers: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        dry_run: bool = False,
+        report: Optional[Callable[[str, str], None]] = None,
+        now=None,
+        run: Optional[BillingRun] = None,
+    ):
+        self.tbank = tbank or TBankService()
+        self.workers = workers or settings.RECURRING_BILLING_WORKERS
+        self.batch_size = batch_size or settings.RECURRING_BILLING_BATCH_SIZE
+        self.dry_run = dry_run
+        self.report = report or self._log_report
+        self.billing_run = run
+        # Владелец попыток, захваченных этим движком
+        self.owner = uuid.uuid4().hex
+        # Для продолженного прогона - время его старта: те же OrderId и grace period
+        self.now = run.started_at if run is not None else (now or timezone.now())
+        self.rate_limiter = get_rate_limiter(self.tbank.terminal_key)
+
+    @staticmethod
+    def _log_report(level, message):
+        logger.log(logging.ERROR if level == 'error' else logging.INFO, message.strip())
+
+    def run(self, user_products) -> BillingResult:
+        """Списать по всем переданным подпискам (queryset или список)"""
+        total = BillingResult()
+        batch = []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='billing') as executor:
+            for user_product in user_products:
+                batch.append(user_product)
+                if len(batch) >= self.batch_size:
+                    total.add(self.process_batch(batch, executor))
+                    batch = []
+            if batch:
+                total.add(self.process_batch(batch, executor))
+        return total
+
+    def run_attempts(self, user_product_ids=None) -> BillingResult:
+        """Обработать необработанные попытки прогона (всего или шарда user_product_ids)"""
+        run = self.billing_run
+        attempts = run.attempts.filter(status__in=BillingAttempt.OPEN_STATUSES)
+        if user_product_ids is not None:
+            attempts = attempts.filter(user_product_id__in=list(user_product_ids))
+        attempts = attempts.select_related(
+            'user_product__user', 'user_product__product', 'user_product__payment_method',
+            'order', 'payment',
+        )
+        
+        total = BillingResult()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='billing') as executor:
+            for batch in iter_chunks(attempts, chunk_size=self.batch_size, key='id'):
+                total.add(self.process_batch([a.user_product for a in batch], executor, attempts=batch))
+        return total
+
+    def process_batch(
+        self,
+        user_products: List[UserProduct],
+        executor: ThreadPoolExecutor,
+        attempts: Optional[List[BillingAttempt]] = None,
+    ) -> BillingResult:
+        """Обработать пачку подписок: подготовка в БД, параллельные списания, запись итогов"""
+        result = BillingResult()
+        # Карта и дата окончания до списания - для отчета
+        items = [
+            _ChargeItem(user_product=up, rebill_id=up.payment_method.rebill_id if up.payment_method else '', end_date=up.end_date)
+            for up in user_products
+        ]
+        if attempts is not None:
+            for item, attempt in zip(items, attempts):
+                item.attempt = attempt
+                item.resumed = attempt.status in ('claimed', 'charging')
+
+        if self.dry_run:
+            for item in items:
+                self._report_header(item)
+                self.report('warning', '   ⏭️  Пропущено (dry-run)')
+                result.skipped += 1
+            return result
+
+        # Попытки, захваченные прогоном до сбоя, подписка уже за прогоном: забираем их у прежнего
+        # владельца, только если он перестал продлевать heartbeat (иначе они в работе)
+        resumed = [item for item in items if item.resumed]
+        if resumed:
+            taken = take_over_attempts(self.billing_run, [item.attempt.id for item in resumed], self.owner)
+            busy = [item for item in resumed if item.attempt.id not in taken]
+            if busy:
+                logger.info(f'{len(busy)} billing attempts are still processed by their owner, skipping')
+                items = [item for item in items if item not in busy]
+
+        if attempts is not None:
+            # Подписки, переставшие быть к списанию (продлены или отменены после старта прогона)
+            not_due = [
+                item for item in items
+                if item.attempt.status != 'charging' and not is_due(item.user_product, self.billing_run.days_ahead, self.now)
+            ]
+            items = [item for item in items if item not in not_due]
+            self._skip(not_due, 'Подписка больше не подлежит списанию', result)
+
+        to_claim = [item for item in items if not item.resumed]
+        claimed = claim_subscriptions(
+            [item.user_product.id for item in to_claim], run=self.billing_run, owner=self.owner,
+        )
+        not_claimed = [item for item in to_claim if item.user_product.id not in claimed]
+        if not_claimed:
+            logger.info(f'{len(not_claimed)} subscriptions are claimed by another billing run, skipping')
+            if attempts is not None:
+                self._skip(not_claimed, 'Подписка захвачена другим прогоном', result)
+        items = [item for item in items if item.resumed or item.user_product.id in claimed]
+        if not items:
+            return result
+
+        try:
+            self._prepare(items)
+        except Exception as e:
+            logger.exception(f'Failed to prepare recurring payments batch: {e}')
+            for item in items:
+                item.error = e
+
+        pending = [item for item in items if item.error is None]
+        self._charge_all(pending, executor)
+
+        self._save_results(items)
+
+        for item in items:
+            self._report_item(item, result)
+        return result
+
+    def _charge_all(self, items: List[_ChargeItem], executor: ThreadPoolExecutor):
+        """Списания пачки в пуле потоков; пока они идут, основной поток продлевает heartbeat"""
+        futures = [executor.submit(self._charge, item) for item in items]
+        not_done = futures
+        while not_done:
+            _, not_done = wait(not_done, timeout=settings.RECURRING_BILLING_HEARTBEAT_SECONDS)
+            if not_done:
+                self._heartbeat(items)
+        for future in futures:
+            future.result()
+
+    def _heartbeat(self, items: List[_ChargeItem]):
+        """Продлить heartbeat прогона и попыток пачки, которыми все еще владеет движок"""
+        if self.billing_run is None:
+            return
+        now = timezone.now()
+        BillingRun.objects.filter(id=self.billing_run.id).update(heartbeat_at=now)
+        BillingAttempt.objects.filter(
+            id__in=[item.attempt.id for item in items if item.attempt is not None], owner=self.owner,
+        ).update(updated_at=now)
+
+    def _skip(self, items: List[_ChargeItem], reason: str, result: BillingResult):
+        """Закрыть попытки прогона без списания"""
+        if not items:
+            return
+        # Только еще не захваченные или свои: попытку, которую успел захватить другой движок, не трогаем
+        skipped = BillingAttempt.objects.filter(
+            Q(status='pending') | Q(owner=self.owner), id__in=[item.attempt.id for item in items],
+        ).update(status='skipped', error=reason, updated_at=timezone.now())
+        BillingRun.objects.filter(id=self.billing_run.id).update(skipped_count=F('skipped_count') + skipped)
+        result.skipped += skipped
+
+    def _prepare(self, items: List[_ChargeItem]):
+        """Загрузить альтернативные карты и создать заказы/платежи пачкой
+        
+        Попытка, прерванная посреди списания, переиспользует свои заказ и платеж.
+        """
+        user_ids = {item.user_product.user_id for item in items}
+        cards_by_user = defaultdict(list)
+        for card in PaymentMethod.objects.filter(user_id__in=user_ids, status='active'):
+            cards_by_user[card.user_id].append(card)
+
+        timestamp = self.now.strftime("%Y%m%d%H%M%S")
+        for item in items:
+            user_product = item.user_product
+            user = user_product.user
+            product = user_product.product
+            item.alternative_cards = [
+                card for card in cards_by_user[user.id]
+                if card.id != user_product.payment_method_id
+            ]
+            if item.attempt is not None and item.attempt.order_id and item.attempt.payment_id:
+                item.order = item.attempt.order
+                item.payment = item.attempt.payment
+                continue
+            item.order = Order(
+                user=user,
+                product=product,
+                amount=product.price,
+                currency=product.currency,
+                status='NEW',
+                order_id=f'RECURRING_{user_product.id}_{timestamp}',
+                customer_email=user.email,
+                customer_name=user.name,
+                customer_phone=user.phone,
+                description=f'Автоматическое продление подписки: {product.name}',
+            )
+            item.payment = Payment(
+                user=user,
+                order=item.order,
+                amount=product.price,
+                currency=product.currency,
+                status='pending',
+                method='card',
+            )
+
+        new_items = [item for item in items if item.order._state.adding]
+        with transaction.atomic():
+            Order.objects.bulk_create([item.order for item in new_items])
+            Payment.objects.bulk_create([item.payment for item in new_items])
+            # bulk_create не шлет сигналы - агрегаты статистики обновляем явно
+            record_changes('orders', [(None, snapshot(item.order, 'orders')) for item in new_items])
+            record_changes('payments', [(None, snapshot(item.payment, 'payments')) for item in new_items])
+            attempts = [item.attempt for item in items if item.attempt is not None]
+            for item in items:
+                if item.attempt is not None:
+                    item.attempt.order = item.order
+                    item.attempt.payment = item.payment
+                    item.attempt.status = 'charging'
+                    item.attempt.updated_at = timezone.now()
+            BillingAttempt.objects.bulk_update(attempts, ['order', 'payment', 'status', 'updated_at'])
+
+    def _charge_mit(self, rebill_id, item: _ChargeItem, description: str) -> Dict:
+        user = item.user_product.user
+        product = item.user_product.product
+        self.rate_limiter.acquire()
+        return self.tbank.charge_mit(
+            rebill_id=rebill_id,
+            amount=float(product.price),
+            order_id=item.order.order_id,
+            description=description,
+            email=user.email,
+            phone=user.phone,
+            product_name=product.name,
+        )
+
+    def _charge(self, item: _ChargeItem):
+        """Сетевая часть обработки подписки (выполняется в пуле потоков, без обращений к БД)"""
+        product = item.user_product.product
+        if item.order.status in CHARGED_STATUSES:
+            # Списание прошло до сбоя, результат уже пришел webhook-ом
+            item.result = {'Success': True, 'Status': item.order.status, 'PaymentId': item.order.payment_id}
+            return
+        if item.resumed and item.attempt.status == 'charging':
+            # Прогон упал между Charge и записью результата: не списываем повторно, если платеж по заказу уже прошел
+            try:
+                item.result = self._find_charged_payment(item)
+            except Exception as e:
+                item.error = e
+                return
+            if item.result:
+                return
+        try:
+            item.result = self._charge_mit(
+                item.rebill_id,
+                item,
+                f'Автоматическое продление подписки: {product.name}',
+            )
+        except Exception as e:
+            item.error = e
+            return
+
+        if self._is_charged(item.result):
+            return
+
+        # Попробовать списать с других привязанных карт
+        for alt_card in item.alternative_cards:
+            item.retry_attempts.append(alt_card)
+            try:
+                retry_result = self._charge_mit(
+                    alt_card.rebill_id,
+                    item,
+                    f'Автоматическое продление подписки (повтор): {product.name}',
+                )
+            except Exception as retry_error:
+                logger.error(f'Retry with alternative card failed: {retry_error}')
+                continue
+            if self._is_charged(retry_result):
+                item.retry_result = retry_result
+                item.retry_card = alt_card
+                return
+
+    def _find_charged_payment(self, item: _ChargeItem) -> Optional[Dict]:
+        """Успешный платеж по заказу в T-Bank (CheckOrder) или None"""
+        self.rate_limiter.acquire()
+        check = self.tbank.check_order(item.order.order_id)
+        if not check.get('Success'):
+            raise RuntimeError(f"CheckOrder failed: {check.get('Message') or check.get('ErrorCode')}")
+        for payment in check.get('Payments') or []:
+            if payment.get('Status') in CHARGED_STATUSES:
+                return {'Success': True, 'Status': payment.get('Status'), 'PaymentId': payment.get('PaymentId')}
+        return None
+
+    @staticmethod
+    def _is_charged(result: Optional[Dict]) -> bool:
+        return bool(result and result.get('Success') and result.get('Status') in CHARGED_STATUSES)
+
+    def _save_results(self, items: List[_ChargeItem]):
+        """Записать итоги списаний пачкой (bulk_update) и чекпоинт прогона"""
+        orders, payments, user_products, attempts = [], [], [], []
+        success, failed = 0, 0
+        summary_deltas = defaultdict(dict)
+        order_changes, payment_changes = [], []
+        now = timezone.now()
+
+        for item in items:
+            if item.attempt is not None:
+                charged = item.error is None and (self._is_charged(item.result) or item.retry_result)
+                item.attempt.status = 'success' if charged else 'failed'
+                item.attempt.error = str(item.error) if item.error is not None else None
+                item.attempt.updated_at = now
+                attempts.append(item.attempt)
+                if charged:
+                    success += 1
+                else:
+                    failed += 1
+            if item.error is not None:
+                continue
+            order, payment, user_product = item.order, item.payment, item.user_product
+            order_before, payment_before = snapshot(order, 'orders'), snapshot(payment, 'payments')
+
+            if self._is_charged(item.result):
+                payment.status = 'success'
+                payment.provider_ref = item.result.get('PaymentId')
+                order.status = 'CONFIRMED'
+                order.payment_id = item.result.get('PaymentId')
+                user_product.end_date = next_end_date(user_product)
+            else:
+                payment.failure_reason = item.result.get('Message', 'Unknown error')
+                if item.retry_result:
+                    payment.status = 'success'
+                    payment.provider_ref = item.retry_result.get('PaymentId')
+                    order.status = 'CONFIRMED'
+                    order.payment_id = item.retry_result.get('PaymentId')
+                    user_product.end_date = next_end_date(user_product)
+                    user_product.payment_method = item.retry_card  # Обновляем карту по умолчанию
+                else:
+                    payment.status = 'failed'
+                    order.status = 'DECLINED'
+                    # Все попытки не удались - даем grace period 3 дня
+                    if (user_product.end_date - self.now).days > -3:
+                        user_product.status = 'pending'
+                    else:
+                        user_product.status = 'expired'
+
+            if payment.status == 'success':
+                _, contribution = payment_contribution(payment.user_id, payment.status, payment.amount)
+                for name, value in contribution.items():
+                    summary_deltas[payment.user_id][name] = summary_deltas[payment.user_id].get(name, 0) + value
+
+            user_product.next_charge_at = user_product.compute_next_charge_at()
+            order.updated_at = payment.updated_at = user_product.updated_at = now
+            orders.append(order)
+            payments.append(payment)
+            user_products.append(user_product)
+            order_changes.append((order_before, snapshot(order, 'orders')))
+            payment_changes.append((payment_before, snapshot(payment, 'payments')))
+
+        with transaction.atomic():
+            Payment.objects.bulk_update(payments, ['status', 'provider_ref', 'failure_reason', 'updated_at'])
+            Order.objects.bulk_update(orders, ['status', 'payment_id', 'updated_at'])
+            UserProduct.objects.bulk_update(
+                user_products, ['end_date', 'status', 'payment_method', 'next_charge_at', 'updated_at']
+            )
+            # bulk_update не шлет сигналы - итоги пользователей и агрегаты статистики обновляем явно
+            apply_deltas(summary_deltas)
+            record_changes('orders', order_changes)
+            record_changes('payments', payment_changes)
+            if self.billing_run is not None:
+                BillingAttempt.objects.bulk_update(attempts, ['status', 'error', 'updated_at'])
+                BillingRun.objects.filter(id=self.billing_run.id).update(
+                    success_count=F('success_count') + success,
+                    failed_count=F('failed_count') + failed,
+                    heartbeat_at=now,
+                )
+            # Письма в outbox в той же транзакции: уйдут только вместе с итогами списаний
+            self._queue_emails(items)
+
+    def _report_header(self, item: _ChargeItem):
+        user_product = item.user_product
+        self.report('info', f'\n📋 Обработка: {user_product.user.email} - {user_product.product.name}')
+        self.report('info', f'   RebillId: {item.rebill_id}')
+        self.report('info', f'   Сумма: {user_product.product.price} {user_product.product.currency}')
+        self.report('info', f'   Истекает: {item.end_date}')
+
+    def _queue_emails(self, items: List[_ChargeItem]):
+        """Письма пользователям по итогам пачки в outbox (отправит dispatch_email_outbox)"""
+        from apps.products.email_services import (
+            build_renewal_failed_email,
+            build_subscription_renewed_email,
+            build_subscription_suspended_email,
+        )
+        from apps.users.outbox import enqueue_emails
+
+        outgoing = []
+        for item in items:
+            if item.error is not None:
+                continue
+            user_product = item.user_product
+            user = user_product.user
+            builders = []
+            if self._is_charged(item.result) or item.retry_result:
+                builders.append(('renewed', lambda: build_subscription_renewed_email(
+                    user, user_product, user_product.product.price)))
+            else:
+                if user_product.status != 'pending':
+                    builders.append(('suspended', lambda: build_subscription_suspended_email(user, user_product)))
+                failure_message = item.result.get('Message', 'Unknown error')
+                builders.append(('renewal_failed', lambda: build_renewal_failed_email(
+                    user, user_product, failure_message)))
+            for kind, build in builders:
+                try:
+                    outgoing.append((item, kind, build()))
+                except Exception as e:
+                    logger.error(f'Failed to build {kind} email for {user.email}: {e}')
+                    item.emails_queued[kind] = False
+
+        if not outgoing:
+            return
+        try:
+            # Savepoint: сбой записи писем не должен откатить итоги списаний
+            with transaction.atomic():
+                enqueue_emails([(kind, message) for _, kind, message in outgoing])
+        except Exception as e:
+            logger.error(f'Failed to queue recurring billing emails: {e}')
+            return
+        for item, kind, _ in outgoing:
+            item.emails_queued[kind] = True
+
+    def _report_item(self, item: _ChargeItem, result: BillingResult):
+        """Отчет по подписке (после записи итогов и писем в БД)"""
+        user_product = item.user_product
+        user = user_product.user
+        product = user_product.product
+        self._report_header(item)
+
+        if item.error is not None:
+            result.failed += 1
+            self.report('error', f'   ❌ Исключение при обработке: {str(item.error)}')
+            logger.error(f'Exception processing recurring payment for user {user.email}: {item.error}')
+            return
+
+        if self._is_charged(item.result):
+            result.success += 1
+            self.report('success', f'   ✅ Успешно списано! PaymentId: {item.result.get("PaymentId")}')
+            self.report('info', f'   📅 Подписка продлена до: {user_product.end_date}')
+            logger.info(
+                f'Recurring payment success: user={user.email}, '
+                f'product={product.name}, amount={product.price}, '
+                f'payment_id={item.result.get("PaymentId")}'
+            )
+            if item.emails_queued.get('renewed'):
+                self.report('info', '   📧 Email о продлении поставлен в очередь')
+            else:
+                logger.error(f'Failed to queue renewal email to {user.email}')
+            return
+
+        failure_message = item.result.get('Message', 'Unknown error')
+        self.report('error', f'   ❌ Ошибка списания: {failure_message}')
+        for alt_card in item.retry_attempts:
+            self.report('info', f'   🔄 Пробуем другую карту: {alt_card.pan_mask}')
+
+        if item.retry_result:
+            result.success += 1
+            self.report(
+                'success',
+                f'   ✅ Успешно списано с другой карты! PaymentId: {item.retry_result.get("PaymentId")}'
+            )
+            if not item.emails_queued.get('renewed'):
+                logger.error(f'Failed to queue renewal email to {user.email}')
+            return
+
+        days_until_expiry = (user_product.end_date - self.now).days
+        if user_product.status == 'pending':
+            self.report('warning', f'   ⏸️  Подписка приостановлена (grace period: {3 + days_until_expiry} дней)')
+        else:
+            self.report('error', '   ❌ Подписка отменена (grace period истек)')
+            if not item.emails_queued.get('suspended'):
+                logger.error(f'Failed to queue suspended email to {user.email}')
+
+        if item.emails_queued.get('renewal_failed'):
+            self.report('info', '   📧 Email о неудачном списании поставлен в очередь')
+        else:
+            logger.error(f'Failed to queue renewal failed email to {user.email}')
+
+        result.failed += 1
+        logger.error(
+            f'Recurring payment failed: user={user.email}, '
+            f'product={product.name}, error={failure_message}'
+        )
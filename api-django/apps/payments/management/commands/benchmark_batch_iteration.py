@@ -0,0 +1,98 @@
+"""
+Бенчмарк памяти фоновых задач: итерация полной выборки UserProduct с select_related
+против keyset-пачек (iter_queryset) и потокового чтения (stream_queryset).
+
+Синтетические данные создаются в транзакции, которая откатывается в конце.
+"""
+import gc
+import time
+import tracemalloc
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from apps.common.batching import iter_queryset, stream_queryset
+from apps.products.models import Product, UserProduct
+from apps.users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Измеряет пиковую память при обходе больших выборок (данные откатываются)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=500_000, help='Количество подписок')
+        parser.add_argument('--users', type=int, default=5_000, help='Количество пользователей')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Размер пачки')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self._seed(options['rows'], options['users'])
+            self._run(options['chunk_size'])
+            transaction.set_rollback(True)
+        self.stdout.write('Синтетические данные откатаны')
+
+    def _seed(self, total, user_count):
+        started = time.perf_counter()
+        prefix = uuid.uuid4().hex[:8]
+        products_per_user = -(-total // user_count)
+        now = timezone.now()
+
+        users = User.objects.bulk_create(
+            [User(email=f'bench-{prefix}-{i}@bench.local', password='!') for i in range(user_count)],
+            batch_size=5000,
+        )
+        products = Product.objects.bulk_create([
+            Product(name=f'Bench {i}', slug=f'bench-{prefix}-{i}', price=990,
+                    product_type='subscription', subscription_period='monthly')
+            for i in range(products_per_user)
+        ])
+
+        batch = []
+        created = 0
+        for index in range(total):
+            end_date = now + timedelta(days=index % 30)
+            batch.append(UserProduct(
+                user=users[index % user_count],
+                product=products[index // user_count],
+                status='active',
+                start_date=now - timedelta(days=30),
+                end_date=end_date,
+                next_charge_at=end_date,
+            ))
+            if len(batch) == 5000:
+                UserProduct.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        if batch:
+            UserProduct.objects.bulk_create(batch)
+            created += len(batch)
+
+        self.stdout.write(f'Создано {created} подписок за {time.perf_counter() - started:.1f} с')
+
+    def _run(self, chunk_size):
+        queryset = UserProduct.objects.filter(status='active').select_related('user', 'product')
+        cases = [
+            ('полная выборка', lambda: queryset.all()),
+            ('stream_queryset', lambda: stream_queryset(queryset, chunk_size=chunk_size)),
+            ('iter_queryset', lambda: iter_queryset(queryset, chunk_size=chunk_size)),
+        ]
+
+        self.stdout.write('\n' + '=' * 60)
+        self.stdout.write(f'{"способ":<20}{"строк":>10}{"пик памяти, МБ":>16}{"время, с":>12}')
+        for label, make_iterable in cases:
+            gc.collect()
+            tracemalloc.start()
+            started = time.perf_counter()
+            rows = 0
+            for user_product in make_iterable():
+                # Обращение к связанным объектам, как в задачах (email, название продукта)
+                user_product.user.email, user_product.product.name
+                rows += 1
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.stdout.write(f'{label:<20}{rows:>10}{peak / 1024 / 1024:>16.1f}{elapsed:>12.1f}')
+        self.stdout.write('=' * 60)
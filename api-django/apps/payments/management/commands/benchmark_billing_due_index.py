@@ -0,0 +1,168 @@
+"""
+Бенчмарк выборки подписок к списанию/напоминанию: фильтр по end_date с join-ами
+против range scan по next_charge_at (user_products_next_charge_idx).
+
+Синтетические данные создаются в транзакции, которая откатывается в конце.
+Только PostgreSQL.
+"""
+import statistics
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from apps.payments.billing import due_subscriptions
+from apps.payments.models import PaymentMethod
+from apps.products.models import Product, UserProduct
+from apps.users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает выборку подписок к списанию до и после индекса next_charge_at (PostgreSQL, данные откатываются)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscriptions', type=int, default=1_000_000, help='Количество подписок')
+        parser.add_argument('--users', type=int, default=10_000, help='Количество пользователей')
+        parser.add_argument('--repeat', type=int, default=5, help='Повторов каждого запроса')
+        parser.add_argument('--explain', action='store_true', help='Показать планы запросов (EXPLAIN ANALYZE)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Бенчмарк работает только на PostgreSQL')
+
+        with transaction.atomic():
+            self._seed(options['subscriptions'], options['users'])
+            self._run(options['repeat'], options['explain'])
+            transaction.set_rollback(True)
+        self.stdout.write('Синтетические данные откатаны')
+
+    def _seed(self, total, user_count):
+        products_per_user = -(-total // user_count)
+        started = time.perf_counter()
+        prefix = uuid.uuid4().hex[:8]
+
+        users = User.objects.bulk_create(
+            [User(email=f'bench-{prefix}-{i}@bench.local', password='!') for i in range(user_count)],
+            batch_size=5000,
+        )
+        products = Product.objects.bulk_create([
+            Product(
+                name=f'Bench {i}',
+                slug=f'bench-{prefix}-{i}',
+                price=990,
+                product_type='subscription' if i % 5 else 'one_time',
+                subscription_period='monthly',
+            )
+            for i in range(products_per_user)
+        ])
+        PaymentMethod.objects.bulk_create(
+            [
+                PaymentMethod(
+                    user=user,
+                    rebill_id=f'bench-{prefix}-{user.id}',
+                    pan_mask='430000******0777',
+                    status='active' if user.id % 10 else 'expired',
+                )
+                for user in users
+            ],
+            batch_size=5000,
+        )
+
+        # 1M строк одним INSERT ... SELECT: пользователи x продукты, ~80% active, ~5% pending,
+        # дата окончания в пределах [-30, +365] дней
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO user_products (
+                    id, user_id, product_id, status, start_date, end_date,
+                    payment_method_id, next_charge_at, created_at, updated_at
+                )
+                SELECT
+                    md5(random()::text || clock_timestamp()::text)::uuid,
+                    u.id,
+                    p.id,
+                    s.status,
+                    now() - interval '30 days',
+                    s.end_date,
+                    pm.id,
+                    CASE WHEN s.status IN ('active', 'pending') AND p.product_type = 'subscription'
+                         THEN s.end_date END,
+                    now(),
+                    now()
+                FROM (SELECT id FROM users WHERE email LIKE %s ORDER BY id) u
+                CROSS JOIN (SELECT id, product_type FROM products WHERE slug LIKE %s) p
+                JOIN payment_methods pm ON pm.user_id = u.id
+                CROSS JOIN LATERAL (
+                    SELECT
+                        CASE WHEN r < 0.80 THEN 'active' WHEN r < 0.85 THEN 'pending'
+                             WHEN r < 0.95 THEN 'cancelled' ELSE 'expired' END AS status,
+                        now() + (floor(random() * 396) - 30) * interval '1 day'
+                              + floor(random() * 86400) * interval '1 second' AS end_date
+                    FROM (SELECT random() AS r, u.id AS uid, p.id AS pid) x
+                ) s
+                LIMIT %s
+                """,
+                [f'bench-{prefix}-%', f'bench-{prefix}-%', total],
+            )
+            inserted = cursor.rowcount
+            cursor.execute('ANALYZE user_products')
+            cursor.execute('ANALYZE payment_methods')
+
+        self.stdout.write(
+            f'Создано {inserted} подписок ({user_count} пользователей, {len(products)} продуктов) '
+            f'за {time.perf_counter() - started:.1f} с'
+        )
+
+    def _run(self, repeat, explain):
+        now = timezone.now()
+        grace_period_date = now + timedelta(days=3)
+        target_date = now + timedelta(days=3)
+        day_start = timezone.localtime(target_date).replace(hour=0, minute=0, second=0, microsecond=0)
+
+        cases = [
+            (
+                'списание: end_date + join-ы',
+                UserProduct.objects.filter(
+                    status__in=['active', 'pending'],
+                    product__product_type='subscription',
+                    end_date__lte=grace_period_date,
+                    payment_method__isnull=False,
+                    payment_method__status='active',
+                ),
+            ),
+            ('списание: next_charge_at', due_subscriptions(now=now)),
+            (
+                'напоминания: end_date__date',
+                UserProduct.objects.filter(
+                    status='active',
+                    product__product_type='subscription',
+                    end_date__date=target_date.date(),
+                ),
+            ),
+            (
+                'напоминания: next_charge_at',
+                UserProduct.objects.filter(
+                    status='active',
+                    next_charge_at__gte=day_start,
+                    next_charge_at__lt=day_start + timedelta(days=1),
+                ),
+            ),
+        ]
+
+        self.stdout.write('\n' + '=' * 72)
+        self.stdout.write(f'{"запрос":<36}{"строк":>10}{"p50, мс":>12}{"макс, мс":>12}')
+        for label, queryset in cases:
+            ids = queryset.values_list('id', flat=True)
+            timings = []
+            rows = 0
+            for _ in range(repeat):
+                started = time.perf_counter()
+                rows = len(list(ids))
+                timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(f'{label:<36}{rows:>10}{statistics.median(timings):>12.1f}{max(timings):>12.1f}')
+            if explain:
+                self.stdout.write(ids.explain(analyze=True, buffers=True))
+        self.stdout.write('=' * 72)
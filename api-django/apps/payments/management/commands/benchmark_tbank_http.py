@@ -0,0 +1,187 @@
+"""
+Бенчмарк HTTP-слоя TBankService: запросы без пула (requests.post на каждый вызов)
+против общего keep-alive пула. Работает против локального stub-сервера, в T-Bank не ходит.
+"""
+import json
+import os
+import ssl
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+import urllib3
+from django.core.management.base import BaseCommand
+
+from apps.payments.services import TBankService, _build_session, get_endpoint_timeout
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1, иначе сервер закрывает соединение после каждого ответа и keep-alive не работает
+    protocol_version = 'HTTP/1.1'
+    # Заголовки и тело уходят отдельными write: без TCP_NODELAY замер упирается в delayed ACK
+    disable_nagle_algorithm = True
+    latency = 0.0
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        if self.latency:
+            time.sleep(self.latency)
+        body = json.dumps({
+            'Success': True,
+            'ErrorCode': '0',
+            'Status': 'NEW',
+            'PaymentId': '1000000',
+            'PaymentURL': 'https://securepay.tinkoff.ru/stub',
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _UnpooledTBankService(TBankService):
+    """Поведение до пула: новое TCP(+TLS) соединение на каждый вызов"""
+
+    verify = True
+
+    def _post(self, endpoint, payload):
+        return requests.post(
+            f"{self.api_url}/{endpoint}",
+            json=payload,
+            timeout=get_endpoint_timeout(endpoint),
+            verify=self.verify,
+        )
+
+
+def _self_signed_cert(directory):
+    """Самоподписанный сертификат для stub-сервера (нужен для замера TLS-рукопожатия)"""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, '127.0.0.1')])
+    now = datetime.utcnow()
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = os.path.join(directory, 'stub.crt')
+    key_path = os.path.join(directory, 'stub.key')
+    with open(cert_path, 'wb') as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, 'wb') as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption(),
+        ))
+    return cert_path, key_path
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает латентность вызовов T-Bank API с пулом соединений и без него (stub-сервер)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Количество запросов на режим')
+        parser.add_argument('--concurrency', type=int, default=4, help='Количество параллельных потоков')
+        parser.add_argument('--latency-ms', type=float, default=0, help='Искусственная задержка ответа stub-сервера')
+        parser.add_argument('--no-tls', action='store_true', help='Stub-сервер без TLS (только TCP-рукопожатие)')
+
+    def handle(self, *args, **options):
+        total = options['requests']
+        concurrency = options['concurrency']
+        _StubHandler.latency = options['latency_ms'] / 1000.0
+        use_tls = not options['no_tls']
+        # Stub-сервер с самоподписанным сертификатом, проверка отключена намеренно
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), _StubHandler)
+        server.daemon_threads = True
+        tmpdir = tempfile.TemporaryDirectory()
+        if use_tls:
+            cert_path, key_path = _self_signed_cert(tmpdir.name)
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(cert_path, key_path)
+            server.socket = context.wrap_socket(server.socket, server_side=True)
+        scheme = 'https' if use_tls else 'http'
+        stub_url = f'{scheme}://127.0.0.1:{server.server_address[1]}/v2'
+
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        self.stdout.write(
+            f'Stub: {stub_url}, запросов: {total}, потоков: {concurrency}, '
+            f'задержка: {options["latency_ms"]} мс'
+        )
+
+        try:
+            unpooled = _UnpooledTBankService()
+            unpooled.verify = False
+            session = _build_session()
+            session.verify = False
+            # Иначе REQUESTS_CA_BUNDLE из окружения перекрывает verify=False
+            session.trust_env = False
+            pooled = TBankService(session=session)
+
+            results = []
+            for label, service in (('без пула', unpooled), ('с пулом', pooled)):
+                service.api_url = stub_url
+                # Прогрев: в режиме с пулом открываем соединения заранее
+                self._run(service, concurrency, concurrency)
+                latencies, elapsed = self._run(service, total, concurrency)
+                results.append((label, latencies, elapsed))
+            session.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+            tmpdir.cleanup()
+
+        self.stdout.write('\n' + '=' * 60)
+        self.stdout.write(f'{"режим":<12}{"p50, мс":>10}{"p99, мс":>10}{"среднее, мс":>14}{"RPS":>10}')
+        for label, latencies, elapsed in results:
+            self.stdout.write(
+                f'{label:<12}'
+                f'{_percentile(latencies, 50):>10.2f}'
+                f'{_percentile(latencies, 99):>10.2f}'
+                f'{statistics.mean(latencies):>14.2f}'
+                f'{len(latencies) / elapsed:>10.1f}'
+            )
+        self.stdout.write('=' * 60)
+
+    def _run(self, service, total, concurrency):
+        payload = {'TerminalKey': service.terminal_key, 'PaymentId': '1000000'}
+
+        def call(_):
+            started = time.perf_counter()
+            service._post('GetState', payload).json()
+            return (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = sorted(executor.map(call, range(total)))
+        return latencies, time.perf_counter() - started
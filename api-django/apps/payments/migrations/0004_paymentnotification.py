@@ -0,0 +1,35 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0003_payment_purpose'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_id', models.CharField(db_index=True, max_length=255)),
+                ('payment_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('tbank_status', models.CharField(blank=True, max_length=50, null=True)),
+                ('payload', models.JSONField(default=dict)),
+                ('status', models.CharField(choices=[('pending', 'Ожидает'), ('processed', 'Обработано'), ('failed', 'Ошибка')], default='pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Уведомление T-Bank',
+                'verbose_name_plural': 'Уведомления T-Bank',
+                'db_table': 'payment_notifications',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['order_id', 'status'], name='payment_not_order_i_5bf7d2_idx'), models.Index(fields=['status', 'received_at'], name='payment_not_status_6c07d6_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.16 on 2026-10-18 12:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0004_paymentnotification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedWebhook',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payment_id', models.CharField(max_length=255)),
+                ('status', models.CharField(max_length=50)),
+                ('order_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_seen_at', models.DateTimeField(blank=True, null=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Обработанное уведомление T-Bank',
+                'verbose_name_plural': 'Обработанные уведомления T-Bank',
+                'db_table': 'processed_webhooks',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='processedwebhook',
+            constraint=models.UniqueConstraint(fields=('payment_id', 'status'), name='uniq_processed_webhook'),
+        ),
+    ]
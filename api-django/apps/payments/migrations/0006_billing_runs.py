@@ -0,0 +1,64 @@
+# Generated by Django 4.2.16 on 2026-10-18 12:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_order_is_card_binding'),
+        ('products', '0003_userproduct_billing_locked_until'),
+        ('payments', '0005_processedwebhook_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillingRun',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('running', 'Выполняется'), ('completed', 'Завершен')], default='running', max_length=20)),
+                ('days_ahead', models.IntegerField(default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('success_count', models.PositiveIntegerField(default=0)),
+                ('failed_count', models.PositiveIntegerField(default=0)),
+                ('skipped_count', models.PositiveIntegerField(default=0)),
+                ('resumed_count', models.PositiveIntegerField(default=0, help_text='Сколько раз прогон продолжался после сбоя')),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Прогон рекуррентных списаний',
+                'verbose_name_plural': 'Прогоны рекуррентных списаний',
+                'db_table': 'billing_runs',
+                'ordering': ['-started_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='BillingAttempt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает'), ('claimed', 'Захвачена'), ('charging', 'Списание'), ('success', 'Успешно'), ('failed', 'Ошибка'), ('skipped', 'Пропущена')], default='pending', max_length=20)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='billing_attempts', to='orders.order')),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='billing_attempts', to='payments.payment')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attempts', to='payments.billingrun')),
+                ('user_product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='billing_attempts', to='products.userproduct')),
+            ],
+            options={
+                'verbose_name': 'Попытка рекуррентного списания',
+                'verbose_name_plural': 'Попытки рекуррентного списания',
+                'db_table': 'billing_attempts',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['run', 'status'], name='billing_att_run_id_1c7dd5_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='billingattempt',
+            constraint=models.UniqueConstraint(fields=('run', 'user_product'), name='uniq_billing_attempt'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 13:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0006_billing_runs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='billingattempt',
+            name='owner',
+            field=models.CharField(blank=True, help_text='Движок прогона, который ведет попытку', max_length=32, null=True),
+        ),
+    ]
@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 from apps.users.models import User
 from apps.orders.models import Order
 import uuid
@@ -110,6 +111,12 @@ class Payment(models.Model):
     
     def __str__(self):
         return f"Payment {self.id} - {self.amount} {self.currency}"
+    
+    def save(self, *args, **kwargs):
+        # Прежняя строка читается для итогов пользователя под блокировкой (apps.users.account_summary):
+        # чтение, сохранение и изменение итогов - одна транзакция
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
 
 class ManualCharge(models.Model):
@@ -194,3 +201,154 @@ class Transaction(models.Model):
     def __str__(self):
         return f"Transaction {self.id} - {self.amount} {self.currency}"
 
+
+
+class PaymentNotification(models.Model):
+    """Уведомление T-Bank в очереди асинхронной обработки (PAYMENT_WEBHOOK_ASYNC)
+    
+    Webhook только сохраняет сырое уведомление и отвечает OK, обработку делает Celery.
+    Автоинкрементный id задает порядок обработки уведомлений одного OrderId.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Ожидает'),
+        ('processed', 'Обработано'),
+        ('failed', 'Ошибка'),
+    ]
+    
+    order_id = models.CharField(max_length=255, db_index=True)
+    payment_id = models.CharField(max_length=255, blank=True, null=True)
+    tbank_status = models.CharField(max_length=50, blank=True, null=True)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, null=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        db_table = 'payment_notifications'
+        verbose_name = 'Уведомление T-Bank'
+        verbose_name_plural = 'Уведомления T-Bank'
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['order_id', 'status']),
+            models.Index(fields=['status', 'received_at']),
+        ]
+    
+    def __str__(self):
+        return f"Notification {self.id} - {self.order_id} {self.tbank_status}"
+
+
+class ProcessedWebhook(models.Model):
+    """Уже обработанное уведомление T-Bank (PaymentId, Status) для отсечения повторов
+    
+    T-Bank повторяет одно и то же уведомление несколько раз; повтор отсекается одним
+    UPDATE по уникальному индексу до любой другой работы с БД и вызовов T-Bank.
+    hits - сколько повторов было отсечено.
+    """
+    payment_id = models.CharField(max_length=255)
+    status = models.CharField(max_length=50)
+    order_id = models.CharField(max_length=255, blank=True, null=True)
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_seen_at = models.DateTimeField(blank=True, null=True)
+    expires_at = models.DateTimeField(db_index=True)
+    
+    class Meta:
+        db_table = 'processed_webhooks'
+        verbose_name = 'Обработанное уведомление T-Bank'
+        verbose_name_plural = 'Обработанные уведомления T-Bank'
+        constraints = [
+            models.UniqueConstraint(fields=['payment_id', 'status'], name='uniq_processed_webhook'),
+        ]
+    
+    def __str__(self):
+        return f"{self.payment_id} {self.status} ({self.hits} повторов)"
+
+
+class BillingRun(models.Model):
+    """Прогон рекуррентных списаний с чекпоинтами по подпискам (BillingAttempt)
+    
+    Незавершенный прогон (упал или уперся в лимит времени Celery) продолжается
+    следующим запуском: обрабатываются только необработанные попытки.
+    """
+    STATUS_CHOICES = [
+        ('running', 'Выполняется'),
+        ('completed', 'Завершен'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    days_ahead = models.IntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    success_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    skipped_count = models.PositiveIntegerField(default=0)
+    resumed_count = models.PositiveIntegerField(default=0, help_text='Сколько раз прогон продолжался после сбоя')
+    started_at = models.DateTimeField(auto_now_add=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        db_table = 'billing_runs'
+        verbose_name = 'Прогон рекуррентных списаний'
+        verbose_name_plural = 'Прогоны рекуррентных списаний'
+        ordering = ['-started_at']
+    
+    def __str__(self):
+        return f"BillingRun {self.started_at:%Y-%m-%d %H:%M} - {self.status}"
+    
+    @property
+    def processed(self):
+        return self.success_count + self.failed_count + self.skipped_count
+    
+    @property
+    def charges_per_second(self):
+        """Скорость обработки (списаний в секунду) с начала прогона"""
+        end = self.finished_at or timezone.now()
+        elapsed = (end - self.started_at).total_seconds()
+        charged = self.success_count + self.failed_count
+        return round(charged / elapsed, 2) if elapsed > 0 else 0
+
+
+class BillingAttempt(models.Model):
+    """Чекпоинт прогона по одной подписке: заказ и платеж создаются один раз и
+    переиспользуются, если прогон продолжается после сбоя
+    
+    owner - движок (RecurringBillingEngine), который ведет захваченную попытку; пока он жив,
+    updated_at продлевается heartbeat-ом, и продолжение прогона попытку не забирает.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Ожидает'),
+        ('claimed', 'Захвачена'),
+        ('charging', 'Списание'),
+        ('success', 'Успешно'),
+        ('failed', 'Ошибка'),
+        ('skipped', 'Пропущена'),
+    ]
+    OPEN_STATUSES = ['pending', 'claimed', 'charging']
+    
+    run = models.ForeignKey(BillingRun, on_delete=models.CASCADE, related_name='attempts')
+    user_product = models.ForeignKey('products.UserProduct', on_delete=models.CASCADE, related_name='billing_attempts')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='billing_attempts')
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True, related_name='billing_attempts')
+    owner = models.CharField(max_length=32, blank=True, null=True, help_text='Движок прогона, который ведет попытку')
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'billing_attempts'
+        verbose_name = 'Попытка рекуррентного списания'
+        verbose_name_plural = 'Попытки рекуррентного списания'
+        ordering = ['id']
+        constraints = [
+            models.UniqueConstraint(fields=['run', 'user_product'], name='uniq_billing_attempt'),
+        ]
+        indexes = [
+            models.Index(fields=['run', 'status']),
+        ]
+    
+    def __str__(self):
+        return f"{self.run_id} - {self.user_product_id} {self.status}"
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Payment, ManualCharge, Transaction, PaymentMethod, Mandate
+from .models import Payment, ManualCharge, Transaction, PaymentMethod, Mandate, BillingRun, BillingAttempt
 from apps.users.serializers import UserSerializer
 from apps.orders.serializers import OrderListSerializer
 
@@ -74,3 +74,35 @@ class MandateSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
 
+
+class BillingRunSerializer(serializers.ModelSerializer):
+    processed = serializers.IntegerField(read_only=True)
+    progress = serializers.SerializerMethodField()
+    charges_per_second = serializers.FloatField(read_only=True)
+    
+    class Meta:
+        model = BillingRun
+        fields = [
+            'id', 'status', 'days_ahead', 'total', 'processed', 'progress',
+            'success_count', 'failed_count', 'skipped_count', 'resumed_count',
+            'charges_per_second', 'started_at', 'heartbeat_at', 'finished_at'
+        ]
+        read_only_fields = fields
+    
+    def get_progress(self, obj):
+        """Доля обработанных подписок, %"""
+        return round(obj.processed * 100 / obj.total, 1) if obj.total else 100.0
+
+
+class BillingAttemptSerializer(serializers.ModelSerializer):
+    user_email = serializers.EmailField(source='user_product.user.email', read_only=True)
+    product_name = serializers.CharField(source='user_product.product.name', read_only=True)
+    order_id = serializers.CharField(source='order.order_id', read_only=True, default=None)
+    
+    class Meta:
+        model = BillingAttempt
+        fields = [
+            'id', 'user_product', 'user_email', 'product_name', 'status',
+            'order_id', 'payment', 'error', 'created_at', 'updated_at'
+        ]
+        read_only_fields = fields
@@ -1,16 +1,114 @@
+import os
+import threading
 import requests
 import hashlib
+from requests.adapters import HTTPAdapter
 from django.conf import settings
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
+
+
+# Таймауты по умолчанию (connect, read) в секундах для методов T-Bank API.
+# Переопределяются через settings.TBANK_HTTP_TIMEOUTS
+DEFAULT_TBANK_TIMEOUTS = {
+    'default': (5, 30),
+    'Init': (5, 30),
+    'GetState': (5, 15),
+    'Confirm': (5, 30),
+    'Cancel': (5, 30),
+    'Charge': (5, 60),
+}
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def _build_session() -> requests.Session:
+    """Создание HTTP-сессии с пулом keep-alive соединений к T-Bank"""
+    pool_size = getattr(settings, 'TBANK_HTTP_POOL_SIZE', 10)
+    session = requests.Session()
+    # Повторы отключены: Init/Charge не идемпотентны, повторять их вслепую нельзя
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0, pool_block=False)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({
+        'Content-Type': 'application/json',
+        'User-Agent': 'miniapp-expert/1.0',
+    })
+    if not getattr(settings, 'TBANK_HTTP_KEEPALIVE', True):
+        session.headers['Connection'] = 'close'
+    return session
+
+
+def get_http_session() -> requests.Session:
+    """Общая для процесса HTTP-сессия к T-Bank.
+    
+    Сессия создается лениво и пересоздается после fork (gunicorn sync workers,
+    Celery prefork): сокеты родителя не должны использоваться в дочерних процессах.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                _session = _build_session()
+                _session_pid = pid
+    return _session
+
+
+def reset_http_session():
+    """Сбросить сессию (закрывает соединения пула только в процессе-владельце)"""
+    global _session, _session_pid
+    with _session_lock:
+        if _session is not None and _session_pid == os.getpid():
+            _session.close()
+        _session = None
+        _session_pid = None
+
+
+def _reset_after_fork():
+    # В дочернем процессе унаследованные сокеты не закрываем (они принадлежат родителю),
+    # просто забываем сессию - следующий запрос создаст новую
+    global _session, _session_pid, _session_lock
+    _session = None
+    _session_pid = None
+    _session_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_endpoint_timeout(endpoint: str) -> Tuple[float, float]:
+    """Таймаут (connect, read) для метода T-Bank API"""
+    timeouts = dict(DEFAULT_TBANK_TIMEOUTS)
+    timeouts.update(getattr(settings, 'TBANK_HTTP_TIMEOUTS', None) or {})
+    timeout = timeouts.get(endpoint, timeouts['default'])
+    if isinstance(timeout, (int, float)):
+        return (timeout, timeout)
+    return tuple(timeout)
 
 
 class TBankService:
     """Сервис для работы с T-Bank API"""
     
-    def __init__(self):
+    def __init__(self, session: Optional[requests.Session] = None):
         self.terminal_key = settings.TBANK_TERMINAL_KEY
         self.password = settings.TBANK_PASSWORD
         self.api_url = settings.TBANK_API_URL
+        self._session = session
+    
+    @property
+    def session(self) -> requests.Session:
+        return self._session or get_http_session()
+    
+    def _post(self, endpoint: str, payload: Dict) -> requests.Response:
+        """POST-запрос к методу T-Bank API через общий пул соединений"""
+        return self.session.post(
+            f"{self.api_url}/{endpoint}",
+            json=payload,
+            timeout=get_endpoint_timeout(endpoint),
+        )
     
     def _generate_token(self, params: Dict) -> str:
         """Генерация токена для T-Bank API
@@ -60,6 +158,34 @@ class TBankService:
         
         return token
     
+    def verify_notification_token(self, payload: Dict) -> bool:
+        """Проверка подписи уведомления (webhook) T-Bank
+        
+        Для уведомлений в токене участвуют только параметры корневого уровня,
+        вложенные объекты (Data, Receipt) не учитываются, bool передаются как true/false.
+        """
+        import hmac
+        
+        token = payload.get('Token')
+        if not token:
+            return False
+        
+        token_params = {
+            k: v for k, v in payload.items()
+            if k != 'Token' and not isinstance(v, (dict, list))
+        }
+        token_params['Password'] = self.password
+        
+        token_parts = []
+        for key in sorted(token_params.keys()):
+            value = token_params[key]
+            if isinstance(value, bool):
+                value = 'true' if value else 'false'
+            token_parts.append(str(value))
+        
+        expected = hashlib.sha256(''.join(token_parts).encode('utf-8')).hexdigest()
+        return hmac.compare_digest(expected, str(token))
+    
     def init_payment(
         self,
         amount: float,
@@ -151,15 +277,7 @@ class TBankService:
         logger.debug(f"T-Bank Init request: {debug_data}")
         
         try:
-            response = requests.post(
-                f"{self.api_url}/Init", 
-                json=payment_data,
-                timeout=30,  # Таймаут 30 секунд
-                headers={
-                    'Content-Type': 'application/json',
-                    'User-Agent': 'miniapp-expert/1.0'
-                }
-            )
+            response = self._post('Init', payment_data)
             response.raise_for_status()  # Проверяем HTTP статус
             result = response.json()
             
@@ -172,7 +290,7 @@ class TBankService:
             
             return result
         except requests.exceptions.Timeout:
-            logger.error("T-Bank Init timeout after 30 seconds")
+            logger.error(f"T-Bank Init timeout after {get_endpoint_timeout('Init')[1]} seconds")
             return {
                 'Success': False,
                 'ErrorCode': 'TIMEOUT',
@@ -208,7 +326,22 @@ class TBankService:
         }
         payload['Token'] = self._generate_token(payload)
         
-        response = requests.post(f"{self.api_url}/GetState", json=payload)
+        response = self._post('GetState', payload)
+        return response.json()
+    
+    def check_order(self, order_id: str) -> Dict:
+        """Статусы всех платежей по заказу (CheckOrder)
+        
+        Нужен, когда PaymentId неизвестен: например, прогон списаний упал
+        между вызовом Charge и записью результата.
+        """
+        payload = {
+            'TerminalKey': self.terminal_key,
+            'OrderId': order_id,
+        }
+        payload['Token'] = self._generate_token(payload)
+        
+        response = self._post('CheckOrder', payload)
         return response.json()
     
     def confirm_payment(self, payment_id: str, amount: int = None) -> Dict:
@@ -234,7 +367,7 @@ class TBankService:
         logger.info(f"Confirming payment {payment_id} with amount {amount}")
         
         try:
-            response = requests.post(f"{self.api_url}/Confirm", json=payload, timeout=30)
+            response = self._post('Confirm', payload)
             result = response.json()
             logger.info(f"Confirm response: {result}")
             return result
@@ -260,7 +393,7 @@ class TBankService:
         payload['Token'] = self._generate_token(payload)
         
         try:
-            response = requests.post(f"{self.api_url}/Cancel", json=payload, timeout=30)
+            response = self._post('Cancel', payload)
             result = response.json()
             logger.info(f"Cancel response for payment {payment_id}: {result}")
             return result
@@ -331,7 +464,7 @@ class TBankService:
         init_payload['Token'] = self._generate_token(init_payload)
         
         # Выполняем Init
-        init_response = requests.post(f"{self.api_url}/Init", json=init_payload)
+        init_response = self._post('Init', init_payload)
         init_result = init_response.json()
         
         if not init_result.get('Success'):
@@ -357,7 +490,7 @@ class TBankService:
         charge_payload['Token'] = self._generate_token(charge_payload)
         
         # Выполняем Charge
-        charge_response = requests.post(f"{self.api_url}/Charge", json=charge_payload)
+        charge_response = self._post('Charge', charge_payload)
         return charge_response.json()
     
     def get_receipt(self, payment_id: str) -> Dict:
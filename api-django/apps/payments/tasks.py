@@ -13,17 +13,107 @@ def process_recurring_payments():
     """
     Обработка рекуррентных платежей для истекающих подписок
     Запускается автоматически через Celery Beat каждый день
+    
+    Прогон фиксируется в BillingRun (незавершенный прогон продолжается), его
+    необработанные подписки делятся на RECURRING_BILLING_SHARDS шардов по диапазонам id,
+    каждый шард обрабатывается отдельной задачей, итоги собираются chord-ом.
+    После завершения продолженного прогона начинается прогон на сегодня.
     """
+    from celery import chord
+    from django.conf import settings
+    from apps.common.batching import stream_queryset
+    from apps.payments.billing import BillingRunInProgress, finish_run, start_or_resume_run
+    from apps.payments.models import BillingAttempt
+    
     logger.info('Starting recurring payments processing task')
     try:
-        call_command('process_recurring_payments')
-        logger.info('Recurring payments processing completed successfully')
-        return 'Success'
+        while True:
+            try:
+                run, resumed = start_or_resume_run()
+            except BillingRunInProgress as e:
+                logger.warning(f'Skipping recurring payments processing: {e}')
+                return 'Skipped - run in progress'
+            if resumed:
+                logger.info(f'Resuming billing run {run.id}: {run.processed} of {run.total} processed')
+            
+            user_product_ids = [
+                str(pk) for pk in stream_queryset(
+                    run.attempts.filter(
+                        status__in=BillingAttempt.OPEN_STATUSES,
+                    ).order_by('user_product_id').values_list('user_product_id', flat=True)
+                )
+            ]
+            if user_product_ids:
+                break
+            run = finish_run(run)
+            # Продолженный прогон уже дообработан - переходим к прогону на сегодня
+            if resumed and run.status == 'completed':
+                continue
+            logger.info('No subscriptions due for recurring payment')
+            return {'success': 0, 'failed': 0, 'skipped': 0}
+        
+        shard_count = max(1, min(settings.RECURRING_BILLING_SHARDS, len(user_product_ids)))
+        shard_size = -(-len(user_product_ids) // shard_count)
+        shards = [
+            user_product_ids[i:i + shard_size]
+            for i in range(0, len(user_product_ids), shard_size)
+        ]
+        
+        run_id = str(run.id)
+        chord(
+            process_recurring_payments_shard.s(shard, run_id) for shard in shards
+        )(aggregate_recurring_payments_results.s(run_id, resumed))
+        logger.info(f'Dispatched {len(user_product_ids)} subscriptions in {len(shards)} billing shards')
+        return f'Dispatched {len(shards)} shards'
     except Exception as e:
         logger.error(f'Error processing recurring payments: {e}')
         raise
 
 
+@shared_task(name='apps.payments.tasks.process_recurring_payments_shard')
+def process_recurring_payments_shard(user_product_ids, run_id=None):
+    """
+    Списание по шарду подписок прогона. Подписка, захваченная другим шардом или
+    пересекающимся прогоном, пропускается (см. claim_subscriptions).
+    """
+    from apps.common.batching import iter_queryset
+    from apps.payments.billing import RecurringBillingEngine, due_subscriptions
+    from apps.payments.models import BillingRun
+    
+    if run_id:
+        engine = RecurringBillingEngine(run=BillingRun.objects.get(id=run_id))
+        result = engine.run_attempts(user_product_ids)
+    else:
+        user_products = due_subscriptions().filter(id__in=user_product_ids)
+        result = RecurringBillingEngine().run(iter_queryset(user_products))
+    logger.info(f'Recurring payments shard completed: {result.as_dict()}')
+    return result.as_dict()
+
+
+@shared_task(name='apps.payments.tasks.aggregate_recurring_payments_results')
+def aggregate_recurring_payments_results(shard_results, run_id=None, resumed=False):
+    """Сводка chord-а по всем шардам рекуррентных списаний, завершение прогона
+    
+    Если завершен продолженный прогон, сразу запускается прогон на сегодня.
+    """
+    from apps.payments.billing import finish_run
+    from apps.payments.models import BillingRun
+    
+    totals = {'success': 0, 'failed': 0, 'skipped': 0}
+    for shard_result in shard_results:
+        for key in totals:
+            totals[key] += (shard_result or {}).get(key, 0)
+    if run_id:
+        run = finish_run(BillingRun.objects.get(id=run_id))
+        if resumed and run.status == 'completed':
+            process_recurring_payments.delay()
+    logger.info(
+        f'Recurring payments processing completed: success={totals["success"]}, '
+        f'failed={totals["failed"]}, skipped={totals["skipped"]}'
+    )
+    return totals
+
+
 @shared_task(name='apps.payments.tasks.send_subscription_reminders')
 def send_subscription_reminders(days_before=3):
     """
@@ -40,6 +130,65 @@ def send_subscription_reminders(days_before=3):
         raise
 
 
+@shared_task(
+    name='apps.payments.tasks.process_payment_notifications',
+    bind=True,
+    acks_late=True,
+    max_retries=10,
+)
+def process_payment_notifications(self, order_id):
+    """
+    Консьюмер очереди уведомлений T-Bank (PAYMENT_WEBHOOK_ASYNC).
+    Обрабатывает все ожидающие уведомления заказа по порядку поступления.
+    """
+    from apps.payments.webhooks import drain_order_notifications
+    
+    processed, retry = drain_order_notifications(order_id)
+    logger.info(f'Processed {processed} payment notifications for order {order_id}')
+    if retry:
+        raise self.retry(countdown=min(300, 10 * 2 ** self.request.retries))
+    return processed
+
+
+@shared_task(name='apps.payments.tasks.requeue_payment_notifications')
+def requeue_payment_notifications(older_than_seconds=60, limit=500):
+    """
+    Повторная постановка зависших уведомлений (например, если брокер был недоступен
+    в момент приема webhook). Запускается через Celery Beat каждую минуту.
+    """
+    from django.utils import timezone
+    from datetime import timedelta
+    from apps.payments.models import PaymentNotification
+    from apps.payments.webhooks import get_notification_queue_metrics, schedule_order_notifications
+    
+    threshold = timezone.now() - timedelta(seconds=older_than_seconds)
+    order_ids = list(
+        PaymentNotification.objects.filter(
+            status='pending',
+            received_at__lte=threshold,
+        ).values_list('order_id', flat=True).distinct()[:limit]
+    )
+    for order_id in order_ids:
+        schedule_order_notifications(order_id)
+    
+    metrics = get_notification_queue_metrics()
+    logger.info(f'Requeued {len(order_ids)} orders with stale notifications, queue metrics: {metrics}')
+    return len(order_ids)
+
+
+@shared_task(name='apps.payments.tasks.purge_processed_webhooks')
+def purge_processed_webhooks():
+    """
+    Удаление записей дедупликации уведомлений T-Bank с истекшим TTL.
+    Запускается через Celery Beat раз в день.
+    """
+    from apps.payments.webhooks import purge_expired_webhooks
+    
+    deleted = purge_expired_webhooks()
+    logger.info(f'Purged {deleted} expired processed webhooks')
+    return deleted
+
+
 @shared_task(name='apps.payments.tasks.retry_failed_payment')
 def retry_failed_payment(payment_id):
     """
@@ -82,7 +231,7 @@ def retry_failed_payment(payment_id):
         tbank = TBankService()
         
         # Пытаемся списать еще раз
-        result = tbank.charge_by_rebill(
+        result = tbank.charge_mit(
             rebill_id=payment_method.rebill_id,
             amount=float(order.amount),
             order_id=order.order_id,
@@ -2,8 +2,10 @@
 Celery tasks для обработки запросов на отмену подписки
 """
 from celery import shared_task
+from django.db import transaction
 from django.utils import timezone
 from datetime import timedelta
+from apps.common.batching import iter_queryset
 import logging
 
 logger = logging.getLogger(__name__)
@@ -18,31 +20,32 @@ def process_expired_cancellation_requests(self):
     Запускается каждый час через Celery Beat.
     """
     from .models_cancellation import CancellationRequest
-    from apps.users.tasks import send_email_task
+    from apps.users.outbox import enqueue_plain_email
     
     try:
         # Найти все истекшие запросы со статусом pending
         expired_requests = CancellationRequest.objects.filter(
             status='pending',
             expires_at__lte=timezone.now()
-        ).select_related('user_product', 'requested_by', 'referrer')
+        ).select_related('user_product__product', 'requested_by', 'referrer')
         
-        count = expired_requests.count()
-        logger.info(f"Found {count} expired cancellation requests")
-        
-        for request in expired_requests:
+        count = 0
+        for request in iter_queryset(expired_requests):
+            count += 1
             logger.info(
                 f"Автоотмена запроса #{request.id} от {request.requested_by.email} "
                 f"(реферал {request.referrer.email if request.referrer else 'None'} не ответил)"
             )
             
-            # Отменить подписку
-            request.expire()
+            # Отмена и письма - одной транзакцией: письма в outbox только вместе с отменой
+            with transaction.atomic():
+                # Отменить подписку
+                request.expire()
             
-            # Уведомить пользователя
-            send_email_task.delay(
-                subject='Ваша подписка отменена',
-                message=f'''
+                # Уведомить пользователя
+                enqueue_plain_email(
+                    subject='Ваша подписка отменена',
+                    message=f'''
                 Здравствуйте, {request.requested_by.get_full_name()}!
                 
                 Ваша подписка "{request.user_product.product.name}" была отменена.
@@ -53,14 +56,14 @@ def process_expired_cancellation_requests(self):
                 
                 Ваш личный кабинет: https://miniapp.expert/cabinet.html
                 ''',
-                recipient_list=[request.requested_by.email],
-            )
+                    recipient_list=[request.requested_by.email],
+                )
             
-            # Уведомить реферала
-            if request.referrer:
-                send_email_task.delay(
-                    subject='Подписка реферала отменена автоматически',
-                    message=f'''
+                # Уведомить реферала
+                if request.referrer:
+                    enqueue_plain_email(
+                        subject='Подписка реферала отменена автоматически',
+                        message=f'''
                     Здравствуйте, {request.referrer.get_full_name()}!
                     
                     Подписка вашего реферала {request.requested_by.email} на "{request.user_product.product.name}" была автоматически отменена, так как вы не приняли решение в течение 24 часов.
@@ -70,8 +73,8 @@ def process_expired_cancellation_requests(self):
                     
                     Ваш личный кабинет: https://miniapp.expert/cabinet.html#referral-requests
                     ''',
-                    recipient_list=[request.referrer.email],
-                )
+                        recipient_list=[request.referrer.email],
+                    )
         
         logger.info(f"Processed {count} expired cancellation requests")
         return {
@@ -94,7 +97,7 @@ def send_cancellation_reminders(self):
     Запускается каждый час через Celery Beat.
     """
     from .models_cancellation import CancellationRequest
-    from apps.users.tasks import send_email_task
+    from apps.users.outbox import enqueue_plain_email
     
     try:
         # Найти запросы, которые истекают через 6 часов или меньше
@@ -107,10 +110,10 @@ def send_cancellation_reminders(self):
             referrer__isnull=False,
             expires_at__lte=reminder_threshold,
             expires_at__gt=timezone.now()
-        ).select_related('user_product', 'requested_by', 'referrer')
+        ).select_related('user_product__product', 'requested_by', 'referrer')
         
         count = 0
-        for request in requests_needing_reminder:
+        for request in iter_queryset(requests_needing_reminder):
             time_left = request.time_left
             
             logger.info(
@@ -118,9 +121,10 @@ def send_cancellation_reminders(self):
                 f"(time left: {time_left})"
             )
             
-            send_email_task.delay(
-                subject=f'Напоминание: Запрос на отмену подписки (осталось {time_left})',
-                message=f'''
+            with transaction.atomic():
+                enqueue_plain_email(
+                    subject=f'Напоминание: Запрос на отмену подписки (осталось {time_left})',
+                    message=f'''
                 Здравствуйте, {request.referrer.get_full_name()}!
                 
                 Напоминаем, что ваш реферал {request.requested_by.email} запросил отмену подписки "{request.user_product.product.name}".
@@ -131,11 +135,11 @@ def send_cancellation_reminders(self):
                 
                 Принять решение: https://miniapp.expert/cabinet.html#referral-requests
                 ''',
-                recipient_list=[request.referrer.email],
-            )
+                    recipient_list=[request.referrer.email],
+                )
             
-            request.reminder_sent = True
-            request.save()
+                request.reminder_sent = True
+                request.save()
             count += 1
         
         logger.info(f"Sent {count} reminders")
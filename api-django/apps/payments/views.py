@@ -2,17 +2,16 @@ import logging
 from rest_framework import views, status
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
+from django.conf import settings
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
-from django.db import transaction as db_transaction
-from datetime import timedelta
-from .models import Payment, Transaction
-from .crypto import encrypt_string
+from .models import Payment
 from .services import TBankService
+from .webhooks import PaymentNotificationProcessor, enqueue_notification
 from apps.orders.models import Order as OrderModel
-from apps.products.models import UserProduct
-from apps.affiliates.models import Referral, ReferralCommission
+
+logger = logging.getLogger(__name__)
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -160,523 +159,20 @@ class PaymentWebhookView(views.APIView):
     permission_classes = [AllowAny]
     
     def post(self, request):
-        import logging
-        logger = logging.getLogger(__name__)
-        
-        status_tbank = request.data.get('Status')
-        payment_id = request.data.get('PaymentId')
-        order_id = request.data.get('OrderId')
+        data = request.data.dict() if hasattr(request.data, 'dict') else dict(request.data)
         
-        logger.info(f"Webhook received: OrderId={order_id}, PaymentId={payment_id}, Status={status_tbank}")
+        if getattr(settings, 'TBANK_VERIFY_NOTIFICATIONS', False) and not TBankService().verify_notification_token(data):
+            logger.warning(f"Webhook with invalid Token rejected: OrderId={data.get('OrderId')}, PaymentId={data.get('PaymentId')}")
+            return Response('Invalid token', status=status.HTTP_403_FORBIDDEN)
         
-        # T-Bank может отправлять RebillId в разных местах webhook - получаем позже при обработке подписки
-        
-        if not order_id:
-            logger.warning("Webhook without OrderId, skipping")
+        if getattr(settings, 'PAYMENT_WEBHOOK_ASYNC', False) and data.get('OrderId'):
+            # Только сохраняем уведомление в очередь, тяжелая обработка - в Celery
+            enqueue_notification(data)
             return Response('OK', status=status.HTTP_200_OK)
         
-        try:
-            order = OrderModel.objects.get(order_id=order_id)
-            order.status = status_tbank
-            order.payment_id = payment_id
-            order.save()
-            logger.info(f"Order {order_id} updated with status {status_tbank}")
-            
-            # Обновление платежа
-            payment = Payment.objects.filter(order=order).first()
-
-            if order.is_card_binding:
-                return self._handle_card_binding(request, order, payment, status_tbank, payment_id)
-            if payment:
-                # Обрабатываем разные статусы T-Bank
-                if status_tbank == 'CONFIRMED':
-                    payment.status = 'success'
-                elif status_tbank == 'AUTHORIZED':
-                    payment.status = 'pending'  # Ждем подтверждения
-                else:
-                    payment.status = 'failed'
-                
-                payment.provider_ref = payment_id
-                
-                # Получаем URL чека из webhook (T-Bank может отправлять ReceiptURL, ReceiptUrl или Receipt)
-                receipt_url = (
-                    request.data.get('ReceiptURL') or 
-                    request.data.get('ReceiptUrl') or 
-                    request.data.get('Receipt') or
-                    request.data.get('receipt_url')
-                )
-                
-                # Если URL чека не пришел в webhook, пытаемся получить через API
-                if not receipt_url and status_tbank == 'CONFIRMED' and payment_id:
-                    try:
-                        tbank = TBankService()
-                        receipt_info = tbank.get_receipt(payment_id)
-                        receipt_url = receipt_info.get('receipt_url')
-                        if receipt_url:
-                            print(f"Receipt URL получен через API для платежа {payment_id}: {receipt_url}")
-                    except Exception as e:
-                        print(f"Error getting receipt URL from T-Bank API: {e}")
-                        import traceback
-                        traceback.print_exc()
-                
-                # Сохраняем URL чека, если получен
-                if receipt_url:
-                    payment.receipt_url = receipt_url
-                    print(f"Receipt URL сохранен для платежа {payment_id}: {receipt_url}")
-                else:
-                    print(f"Warning: Receipt URL не получен для платежа {payment_id}")
-                
-                payment.save()
-            
-            # Если платеж авторизован, автоматически подтверждаем его
-            if status_tbank == 'AUTHORIZED':
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.info(f"Processing AUTHORIZED webhook for order {order_id}, payment {payment_id}")
-                
-                # Автоматически подтверждаем платеж
-                try:
-                    tbank = TBankService()
-                    confirm_result = tbank.confirm_payment(payment_id)
-                    
-                    if confirm_result.get('Success'):
-                        logger.info(f"Payment {payment_id} confirmed successfully, new status: {confirm_result.get('Status')}")
-                        # Обновляем статус
-                        order.status = 'CONFIRMED'
-                        order.save()
-                        payment.status = 'success'
-                        payment.save()
-                        # Меняем статус для дальнейшей обработки
-                        status_tbank = 'CONFIRMED'
-                    else:
-                        logger.error(f"Failed to confirm payment {payment_id}: {confirm_result.get('Message')}")
-                        payment.status = 'failed'
-                        payment.failure_reason = f"Confirm failed: {confirm_result.get('Message')}"
-                        payment.save()
-                        return Response('OK', status=status.HTTP_200_OK)
-                except Exception as e:
-                    logger.exception(f"Error confirming payment {payment_id}: {e}")
-                    payment.status = 'failed'
-                    payment.failure_reason = f"Confirm error: {str(e)}"
-                    payment.save()
-                    return Response('OK', status=status.HTTP_200_OK)
-            
-            # Если платеж подтвержден, привязать к пользователю, создать продукт и транзакцию
-            if status_tbank == 'CONFIRMED':
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.info(f"Processing CONFIRMED webhook for order {order_id}, payment {payment_id}")
-                
-                try:
-                    with db_transaction.atomic():
-                        from apps.users.services import send_welcome_email
-                        from apps.users.models import User
-                        
-                        # Найти или создать пользователя по email заказа
-                        user = None
-                        if order.customer_email:
-                            user, created = User.objects.get_or_create(
-                                email=order.customer_email,
-                                defaults={
-                                    'name': order.customer_name or order.customer_email.split('@')[0],
-                                    'phone': order.customer_phone,
-                                    'role': 'client',
-                                    'is_active': True,
-                                    'email_verified': True,
-                                    'referred_by': order.referred_by,  # Установить реферера при создании
-                                }
-                            )
-                            if not created:
-                                # Обновляем данные пользователя
-                                logger.info(f"User already exists: {user.email}, updating data")
-                                if order.customer_name:
-                                    user.name = order.customer_name
-                                if order.customer_phone:
-                                    user.phone = order.customer_phone
-                                user.email_verified = True
-                                # Если пользователь еще не имеет реферера, устанавливаем его
-                                if not user.referred_by and order.referred_by:
-                                    user.referred_by = order.referred_by
-                                user.save()
-                            else:
-                                logger.info(f"New user created: {user.email}")
-                            
-                            # Привязываем заказ к пользователю
-                            order.user = user
-                            order.save()
-                            logger.info(f"Order {order.order_id} linked to user {user.email}")
-                            
-                            # Обновляем платеж - привязываем к пользователю
-                            payment.user = user
-                            logger.info(f"Payment {payment.id} linked to user {user.email}")
-                            
-                            # Если receipt_url еще не сохранен, пытаемся получить его еще раз через get_receipt
-                            if not payment.receipt_url and payment_id:
-                                try:
-                                    tbank = TBankService()
-                                    receipt_info = tbank.get_receipt(payment_id)
-                                    receipt_url = receipt_info.get('receipt_url')
-                                    if receipt_url:
-                                        payment.receipt_url = receipt_url
-                                        print(f"Receipt URL получен в CONFIRMED блоке для платежа {payment_id}: {receipt_url}")
-                                except Exception as e:
-                                    print(f"Error getting receipt URL in CONFIRMED block: {e}")
-                                    import traceback
-                                    traceback.print_exc()
-                            
-                            payment.save()
-                            
-                            # Инициализируем переменную для payment_method (для связи с UserProduct)
-                            payment_method = None
-                            
-                            # Если это подписка, сохраняем PaymentMethod для рекуррентных платежей
-                            if order.product and order.product.product_type == 'subscription':
-                                from apps.payments.models import PaymentMethod
-                                
-                                # T-Bank может отправить RebillId в webhook после успешной оплаты
-                                # Проверяем несколько возможных мест, где может быть RebillId
-                                rebill_id = (
-                                    request.data.get('RebillId') or 
-                                    request.data.get('CardId') or 
-                                    request.data.get('RebillId')  # Повторная проверка
-                                )
-                                
-                                # Если RebillId не пришел в webhook, пытаемся получить статус платежа через API
-                                if not rebill_id:
-                                    try:
-                                        tbank = TBankService()
-                                        payment_status = tbank.get_payment_status(payment_id)
-                                        rebill_id = payment_status.get('RebillId') or payment_status.get('CardId')
-                                    except Exception as e:
-                                        print(f"Error getting payment status for RebillId: {e}")
-                                
-                                if rebill_id:
-                                    # Получаем данные карты из webhook
-                                    # T-Bank может отправлять данные в разных форматах
-                                    card_info = request.data.get('CardId', {})
-                                    if isinstance(card_info, dict):
-                                        pan_mask = card_info.get('Pan', request.data.get('Pan', '**** **** **** ****'))
-                                        exp_date = card_info.get('ExpDate', request.data.get('ExpDate', ''))
-                                        card_type = card_info.get('CardType', request.data.get('CardType', ''))
-                                    else:
-                                        pan_mask = request.data.get('Pan', '**** **** **** ****')
-                                        exp_date = request.data.get('ExpDate', '')
-                                        card_type = request.data.get('CardType', '')
-                                    
-                                    # Сохраняем платежный метод для рекуррентных списаний
-                                    payment_method, created = PaymentMethod.objects.get_or_create(
-                                        user=user,
-                                        rebill_id=str(rebill_id),
-                                        defaults={
-                                            'provider': 'tbank',
-                                            'pan_mask': pan_mask or '**** **** **** ****',
-                                            'exp_date': exp_date or '',
-                                            'card_type': card_type or '',
-                                            'status': 'active',
-                                            'is_default': True,  # Делаем методом по умолчанию для подписки
-                                        }
-                                    )
-                                    
-                                    # Если метод уже существует, обновляем его
-                                    if not created:
-                                        payment_method.status = 'active'
-                                        payment_method.is_default = True
-                                        if pan_mask and pan_mask != '**** **** **** ****':
-                                            payment_method.pan_mask = pan_mask
-                                        if exp_date:
-                                            payment_method.exp_date = exp_date
-                                        if card_type:
-                                            payment_method.card_type = card_type
-                                        payment_method.save()
-                                    
-                                    # Создаем или обновляем мандат для рекуррентных платежей
-                                    from apps.payments.models import Mandate
-                                    mandate, mandate_created = Mandate.objects.get_or_create(
-                                        user=user,
-                                        mandate_number=f"TBANK_{rebill_id}",
-                                        defaults={
-                                            'type': 'rko',
-                                            'bank': 'tbank',
-                                            'status': 'active',
-                                            'signed_at': timezone.now(),
-                                        }
-                                    )
-                                    
-                                    if not mandate_created and mandate.status != 'active':
-                                        mandate.status = 'active'
-                                        mandate.signed_at = timezone.now()
-                                        mandate.save()
-                            
-                            # Создать UserProduct
-                            user_product = None
-                            if order.product:
-                                # Определить даты начала и окончания
-                                start_date = timezone.now()
-                                end_date = None
-                                
-                                if order.product.product_type == 'subscription':
-                                    # Для подписки устанавливаем период
-                                    if order.product.subscription_period == 'monthly':
-                                        end_date = start_date + timedelta(days=30)
-                                    elif order.product.subscription_period == 'yearly':
-                                        end_date = start_date + timedelta(days=365)
-                                    
-                                    # Для подписок ищем активный продукт пользователя или создаем новый
-                                    # Для подписок может быть только один активный продукт на пользователя
-                                    user_product = UserProduct.objects.filter(
-                                        user=user,
-                                        product=order.product,
-                                        status='active'
-                                    ).first()
-                                    
-                                    if user_product:
-                                        # Обновляем существующий активный продукт (продление подписки)
-                                        user_product.start_date = start_date
-                                        if end_date:
-                                            user_product.end_date = end_date
-                                        user_product.renewal_price = order.product.price
-                                        if payment_method:
-                                            user_product.payment_method = payment_method
-                                        user_product.status = 'active'
-                                        user_product.save()
-                                        logger.info(f"UserProduct обновлен для пользователя {user.email}, продукт {order.product.name}")
-                                    else:
-                                        # Создаем новый продукт пользователя (подписка) с get_or_create для idempotency
-                                        user_product, created = UserProduct.objects.get_or_create(
-                                            user=user,
-                                            product=order.product,
-                                            status='active',
-                                            defaults={
-                                                'start_date': start_date,
-                                                'end_date': end_date,
-                                                'renewal_price': order.product.price,
-                                                'payment_method': payment_method,
-                                            }
-                                        )
-                                        if created:
-                                            logger.info(f"UserProduct создан для пользователя {user.email}, продукт {order.product.name}")
-                                        else:
-                                            logger.info(f"UserProduct уже существует для пользователя {user.email}, продукт {order.product.name}")
-                                else:
-                                    # Для одноразовых продуктов (one_time) всегда создаем новый UserProduct
-                                    # Пользователь может иметь несколько одноразовых продуктов
-                                    # Используем get_or_create для idempotency
-                                    user_product, created = UserProduct.objects.get_or_create(
-                                        user=user,
-                                        product=order.product,
-                                        status='active',
-                                        defaults={
-                                            'start_date': start_date,
-                                            'end_date': None,
-                                            'renewal_price': None,
-                                            'payment_method': None,
-                                        }
-                                    )
-                                    if created:
-                                        logger.info(f"UserProduct создан (one_time) для пользователя {user.email}, продукт {order.product.name}")
-                                    else:
-                                        logger.info(f"UserProduct уже существует (one_time) для пользователя {user.email}, продукт {order.product.name}")
-                            
-                            # Отправить email о активации подписки
-                            if user_product and order.product and order.product.product_type == 'subscription':
-                                try:
-                                    from apps.products.email_services import send_subscription_activated_email
-                                    send_subscription_activated_email(user, user_product)
-                                    logger.info(f"Subscription activated email sent to {user.email}")
-                                except Exception as e:
-                                    logger.error(f"Failed to send subscription activated email: {e}")
-                            
-                            # Создать транзакцию с get_or_create для idempotency
-                            transaction, trans_created = Transaction.objects.get_or_create(
-                                payment=payment,
-                                defaults={
-                                    'user': user,
-                                    'order': order,
-                                    'transaction_type': 'payment',
-                                    'amount': order.amount,
-                                    'currency': order.currency,
-                                    'description': order.description,
-                                    'provider_ref': payment_id,
-                                }
-                            )
-                            if trans_created:
-                                logger.info(f"Transaction создана для пользователя {user.email}, сумма {order.amount} {order.currency}, платеж {payment_id}")
-                            else:
-                                logger.info(f"Transaction уже существует для платежа {payment_id}")
-                            
-                            # Начислить комиссию рефералу, если есть
-                            if order.referred_by and order.referred_by != user:
-                                try:
-                                    # Найти или создать реферальную связь
-                                    referral, created = Referral.objects.get_or_create(
-                                        referrer=order.referred_by,
-                                        referred_user=user,
-                                        defaults={
-                                            'status': 'active',
-                                            'commission_rate': 20.00,  # 20% комиссия
-                                        }
-                                    )
-                                    
-                                    if not created and referral.status != 'active':
-                                        referral.status = 'active'
-                                        referral.save()
-                                    
-                                    # Рассчитать комиссию (20% от суммы заказа)
-                                    commission_rate = referral.commission_rate
-                                    commission_amount = (order.amount * commission_rate) / 100
-                                    
-                                    # Создать запись о комиссии
-                                    ReferralCommission.objects.create(
-                                        referral=referral,
-                                        order=order,
-                                        amount=order.amount,
-                                        commission_rate=commission_rate,
-                                        commission_amount=commission_amount,
-                                        status='pending',
-                                    )
-                                    
-                                    # Обновить общий заработок реферера
-                                    referral.total_earned += commission_amount
-                                    referral.save()
-                                except Exception as e:
-                                    print(f"Error creating referral commission: {e}")
-                                    import traceback
-                                    traceback.print_exc()
-                            
-                            # Отправить welcome email
-                            try:
-                                send_welcome_email(user, order)
-                                print(f"Welcome email отправлен пользователю {user.email}")
-                            except Exception as e:
-                                print(f"Error sending welcome email to {user.email}: {e}")
-                                import traceback
-                                traceback.print_exc()
-                            
-                            print(f"✅ Успешная оплата обработана: пользователь {user.email}, продукт {order.product.name if order.product else 'N/A'}, сумма {order.amount} {order.currency}, receipt_url: {payment.receipt_url or 'не получен'}")
-                            
-                except Exception as e:
-                    logger.error(f"❌ Error processing payment confirmation for order {order_id}: {e}")
-                    import traceback
-                    traceback.print_exc()
-                    logger.error(traceback.format_exc())
-                
-        except OrderModel.DoesNotExist:
-            pass
-        
+        PaymentNotificationProcessor().process(data)
         return Response('OK', status=status.HTTP_200_OK)
 
-    def _handle_card_binding(self, request, order, payment, status_tbank, payment_id):
-        logger = logging.getLogger(__name__)
-        tbank = TBankService()
-        
-        if status_tbank == 'AUTHORIZED':
-            rebill_id = self._extract_rebill_id(request.data, payment_id, tbank)
-            if rebill_id and order.user:
-                try:
-                    self._store_payment_method(order.user, rebill_id, request.data)
-                    logger.info(f"Stored payment method for user {order.user.email} via binding flow")
-                except Exception as e:
-                    logger.error(f"Failed to store payment method in binding flow: {e}")
-            
-            cancel_result = tbank.cancel_payment(payment_id)
-            if payment:
-                payment.status = 'success' if cancel_result.get('Success') else 'failed'
-                payment.failure_reason = None if cancel_result.get('Success') else f"Cancel error: {cancel_result.get('Message')}"
-                payment.save()
-            order.status = 'CANCELLED' if cancel_result.get('Success') else status_tbank
-            order.save()
-            return Response('OK', status=status.HTTP_200_OK)
-        
-        if status_tbank in ('CANCELED', 'CANCELLED', 'REVERSED', 'REFUNDED', 'PARTIAL_REFUNDED'):
-            if payment:
-                payment.status = 'cancelled'
-                payment.save()
-            order.status = status_tbank
-            order.save()
-            return Response('OK', status=status.HTTP_200_OK)
-        
-        # Ignore other statuses for binding flow
-        return Response('OK', status=status.HTTP_200_OK)
-
-    def _extract_rebill_id(self, payload, payment_id, tbank: TBankService):
-        logger = logging.getLogger(__name__)
-        rebill_id = payload.get('RebillId') or payload.get('CardId')
-        if isinstance(rebill_id, dict):
-            rebill_id = rebill_id.get('RebillId') or rebill_id.get('CardId')
-        
-        if rebill_id:
-            return rebill_id
-        
-        try:
-            status_info = tbank.get_payment_status(payment_id)
-            rebill_id = status_info.get('RebillId') or status_info.get('CardId')
-        except Exception as e:
-            logger.error(f"Failed to fetch payment status for {payment_id}: {e}")
-            rebill_id = None
-        return rebill_id
-
-    def _store_payment_method(self, user, rebill_id, payload):
-        from apps.payments.models import PaymentMethod, Mandate
-        from django.utils import timezone
-
-        pan_mask = payload.get('Pan')
-        exp_date = payload.get('ExpDate')
-        card_type = payload.get('CardType')
-
-        card_info = payload.get('CardId')
-        if isinstance(card_info, dict):
-            pan_mask = card_info.get('Pan', pan_mask or '**** **** **** ****')
-            exp_date = card_info.get('ExpDate', exp_date)
-            card_type = card_info.get('CardType', card_type)
-        
-        try:
-            rebill_id_enc = encrypt_string(str(rebill_id))
-        except Exception:
-            rebill_id_enc = None
-
-        payment_method, created = PaymentMethod.objects.get_or_create(
-            user=user,
-            rebill_id=str(rebill_id),
-            defaults={
-                'provider': 'tbank',
-                'pan_mask': pan_mask or '**** **** **** ****',
-                'exp_date': exp_date or '',
-                'card_type': card_type or '',
-                'status': 'active',
-                'is_default': True,
-                'rebill_id_enc': rebill_id_enc,
-            }
-        )
-
-        if not created:
-            payment_method.status = 'active'
-            payment_method.is_default = True
-            if pan_mask:
-                payment_method.pan_mask = pan_mask
-            if exp_date:
-                payment_method.exp_date = exp_date
-            if card_type:
-                payment_method.card_type = card_type
-            if rebill_id_enc:
-                payment_method.rebill_id_enc = rebill_id_enc
-            payment_method.save()
-
-        mandate, mandate_created = Mandate.objects.get_or_create(
-            user=user,
-            mandate_number=f"TBANK_{rebill_id}",
-            defaults={
-                'type': 'rko',
-                'bank': 'tbank',
-                'status': 'active',
-                'signed_at': timezone.now(),
-            }
-        )
-
-        if not mandate_created and mandate.status != 'active':
-            mandate.status = 'active'
-            mandate.signed_at = timezone.now()
-            mandate.save()
-
 
 class PaymentStatusView(views.APIView):
     permission_classes = [AllowAny]
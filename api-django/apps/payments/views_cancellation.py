@@ -15,7 +15,7 @@ from .serializers_cancellation import (
 )
 from apps.products.models import UserProduct
 from apps.affiliates.models import Referral
-from apps.users.tasks import send_email_task
+from apps.users.outbox import enqueue_plain_email
 import logging
 
 logger = logging.getLogger(__name__)
@@ -70,7 +70,7 @@ class CancellationRequestCreateView(views.APIView):
             
             # Отправить email реферал у (если есть)
             if referrer:
-                send_email_task.delay(
+                enqueue_plain_email(
                     subject=f'Запрос на отмену подписки от {request.user.email}',
                     message=f'''
                     Здравствуйте, {referrer.get_full_name()}!
@@ -223,7 +223,7 @@ class CancellationRequestDecisionView(views.APIView):
                 
                 # Уведомить пользователя
                 user_email = cancellation_request.requested_by.email
-                send_email_task.delay(
+                enqueue_plain_email(
                     subject='Решение по вашему запросу на отмену подписки',
                     message=f'''
                     Здравствуйте, {cancellation_request.requested_by.get_full_name()}!
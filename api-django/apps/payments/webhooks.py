@@ -0,0 +1,733 @@
+"""
+Обработка уведомлений (webhook) T-Bank о статусе платежа
+"""
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction as db_transaction
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F, Max, Min, Q, Sum
+from django.utils import timezone
+from .models import Payment, PaymentNotification, ProcessedWebhook, Transaction
+from .crypto import encrypt_string
+from .services import TBankService
+from apps.orders.models import Order as OrderModel
+from apps.products.models import UserProduct
+from apps.affiliates.commissions import schedule_commission
+
+logger = logging.getLogger(__name__)
+
+
+class PaymentNotificationProcessor:
+    """Обработка уведомления T-Bank: обновление заказа и платежа, подтверждение,
+    выдача продукта, сохранение карты, транзакция, комиссия реферала и письма.
+    
+    Используется как синхронно из PaymentWebhookView, так и из Celery-консьюмера
+    очереди уведомлений (см. drain_order_notifications).
+    Повторы уже обработанных уведомлений отсекаются до любой работы с заказом: ключ
+    (PaymentId, Status) занимается до обработки в одной транзакции с ней, поэтому из двух
+    одновременных доставок обрабатывает только одна. Ошибка обработки (в том числе выдачи
+    продукта по CONFIRMED) пробрасывается наружу и откатывает ключ вместе с изменениями:
+    повторная доставка T-Bank обработается заново.
+    """
+    
+    def process(self, data):
+        if _dedup_key(data) is None:
+            self._process(data)
+            return
+        with db_transaction.atomic():
+            if not claim_notification(data):
+                return
+            self._process(data)
+    
+    def _process(self, data):
+        status_tbank = data.get('Status')
+        payment_id = data.get('PaymentId')
+        order_id = data.get('OrderId')
+        
+        logger.info(f"Webhook received: OrderId={order_id}, PaymentId={payment_id}, Status={status_tbank}")
+        
+        # T-Bank может отправлять RebillId в разных местах webhook - получаем позже при обработке подписки
+        
+        if not order_id:
+            logger.warning("Webhook without OrderId, skipping")
+            return
+        
+        try:
+            order = OrderModel.objects.get(order_id=order_id)
+            order.status = status_tbank
+            order.payment_id = payment_id
+            order.save()
+            logger.info(f"Order {order_id} updated with status {status_tbank}")
+            
+            # Обновление платежа
+            payment = Payment.objects.filter(order=order).first()
+
+            if order.is_card_binding:
+                return self._handle_card_binding(data, order, payment, status_tbank, payment_id)
+            if payment:
+                # Обрабатываем разные статусы T-Bank
+                if status_tbank == 'CONFIRMED':
+                    payment.status = 'success'
+                elif status_tbank == 'AUTHORIZED':
+                    payment.status = 'pending'  # Ждем подтверждения
+                else:
+                    payment.status = 'failed'
+                
+                payment.provider_ref = payment_id
+                
+                # Получаем URL чека из webhook (T-Bank может отправлять ReceiptURL, ReceiptUrl или Receipt)
+                receipt_url = (
+                    data.get('ReceiptURL') or 
+                    data.get('ReceiptUrl') or 
+                    data.get('Receipt') or
+                    data.get('receipt_url')
+                )
+                
+                # Если URL чека не пришел в webhook, пытаемся получить через API
+                if not receipt_url and status_tbank == 'CONFIRMED' and payment_id:
+                    try:
+                        tbank = TBankService()
+                        receipt_info = tbank.get_receipt(payment_id)
+                        receipt_url = receipt_info.get('receipt_url')
+                        if receipt_url:
+                            print(f"Receipt URL получен через API для платежа {payment_id}: {receipt_url}")
+                    except Exception as e:
+                        print(f"Error getting receipt URL from T-Bank API: {e}")
+                        import traceback
+                        traceback.print_exc()
+                
+                # Сохраняем URL чека, если получен
+                if receipt_url:
+                    payment.receipt_url = receipt_url
+                    print(f"Receipt URL сохранен для платежа {payment_id}: {receipt_url}")
+                else:
+                    print(f"Warning: Receipt URL не получен для платежа {payment_id}")
+                
+                payment.save()
+            
+            # Если платеж авторизован, автоматически подтверждаем его
+            if status_tbank == 'AUTHORIZED':
+                logger.info(f"Processing AUTHORIZED webhook for order {order_id}, payment {payment_id}")
+                
+                # Автоматически подтверждаем платеж
+                try:
+                    tbank = TBankService()
+                    confirm_result = tbank.confirm_payment(payment_id)
+                    
+                    if confirm_result.get('Success'):
+                        logger.info(f"Payment {payment_id} confirmed successfully, new status: {confirm_result.get('Status')}")
+                        # Обновляем статус
+                        order.status = 'CONFIRMED'
+                        order.save()
+                        payment.status = 'success'
+                        payment.save()
+                        # Меняем статус для дальнейшей обработки
+                        status_tbank = 'CONFIRMED'
+                    else:
+                        logger.error(f"Failed to confirm payment {payment_id}: {confirm_result.get('Message')}")
+                        payment.status = 'failed'
+                        payment.failure_reason = f"Confirm failed: {confirm_result.get('Message')}"
+                        payment.save()
+                        return
+                except Exception as e:
+                    logger.exception(f"Error confirming payment {payment_id}: {e}")
+                    payment.status = 'failed'
+                    payment.failure_reason = f"Confirm error: {str(e)}"
+                    payment.save()
+                    return
+            
+            # Если платеж подтвержден, привязать к пользователю, создать продукт и транзакцию
+            if status_tbank == 'CONFIRMED':
+                logger.info(f"Processing CONFIRMED webhook for order {order_id}, payment {payment_id}")
+                
+                try:
+                    with db_transaction.atomic():
+                        from apps.users.outbox import enqueue_email
+                        from apps.users.services import build_welcome_email
+                        from apps.users.models import User
+                        
+                        # Найти или создать пользователя по email заказа
+                        user = None
+                        if order.customer_email:
+                            user, created = User.objects.get_or_create(
+                                email=order.customer_email,
+                                defaults={
+                                    'name': order.customer_name or order.customer_email.split('@')[0],
+                                    'phone': order.customer_phone,
+                                    'role': 'client',
+                                    'is_active': True,
+                                    'email_verified': True,
+                                    'referred_by': order.referred_by,  # Установить реферера при создании
+                                }
+                            )
+                            if not created:
+                                # Обновляем данные пользователя
+                                logger.info(f"User already exists: {user.email}, updating data")
+                                if order.customer_name:
+                                    user.name = order.customer_name
+                                if order.customer_phone:
+                                    user.phone = order.customer_phone
+                                user.email_verified = True
+                                # Если пользователь еще не имеет реферера, устанавливаем его
+                                if not user.referred_by and order.referred_by:
+                                    user.referred_by = order.referred_by
+                                user.save()
+                            else:
+                                logger.info(f"New user created: {user.email}")
+                            
+                            # Привязываем заказ к пользователю
+                            order.user = user
+                            order.save()
+                            logger.info(f"Order {order.order_id} linked to user {user.email}")
+                            
+                            # Обновляем платеж - привязываем к пользователю
+                            payment.user = user
+                            logger.info(f"Payment {payment.id} linked to user {user.email}")
+                            
+                            # Если receipt_url еще не сохранен, пытаемся получить его еще раз через get_receipt
+                            if not payment.receipt_url and payment_id:
+                                try:
+                                    tbank = TBankService()
+                                    receipt_info = tbank.get_receipt(payment_id)
+                                    receipt_url = receipt_info.get('receipt_url')
+                                    if receipt_url:
+                                        payment.receipt_url = receipt_url
+                                        print(f"Receipt URL получен в CONFIRMED блоке для платежа {payment_id}: {receipt_url}")
+                                except Exception as e:
+                                    print(f"Error getting receipt URL in CONFIRMED block: {e}")
+                                    import traceback
+                                    traceback.print_exc()
+                            
+                            payment.save()
+                            
+                            # Инициализируем переменную для payment_method (для связи с UserProduct)
+                            payment_method = None
+                            
+                            # Если это подписка, сохраняем PaymentMethod для рекуррентных платежей
+                            if order.product and order.product.product_type == 'subscription':
+                                from apps.payments.models import PaymentMethod
+                                
+                                # T-Bank может отправить RebillId в webhook после успешной оплаты
+                                # Проверяем несколько возможных мест, где может быть RebillId
+                                rebill_id = (
+                                    data.get('RebillId') or 
+                                    data.get('CardId') or 
+                                    data.get('RebillId')  # Повторная проверка
+                                )
+                                
+                                # Если RebillId не пришел в webhook, пытаемся получить статус платежа через API
+                                if not rebill_id:
+                                    try:
+                                        tbank = TBankService()
+                                        payment_status = tbank.get_payment_status(payment_id)
+                                        rebill_id = payment_status.get('RebillId') or payment_status.get('CardId')
+                                    except Exception as e:
+                                        print(f"Error getting payment status for RebillId: {e}")
+                                
+                                if rebill_id:
+                                    # Получаем данные карты из webhook
+                                    # T-Bank может отправлять данные в разных форматах
+                                    card_info = data.get('CardId', {})
+                                    if isinstance(card_info, dict):
+                                        pan_mask = card_info.get('Pan', data.get('Pan', '**** **** **** ****'))
+                                        exp_date = card_info.get('ExpDate', data.get('ExpDate', ''))
+                                        card_type = card_info.get('CardType', data.get('CardType', ''))
+                                    else:
+                                        pan_mask = data.get('Pan', '**** **** **** ****')
+                                        exp_date = data.get('ExpDate', '')
+                                        card_type = data.get('CardType', '')
+                                    
+                                    # Сохраняем платежный метод для рекуррентных списаний
+                                    payment_method, created = PaymentMethod.objects.get_or_create(
+                                        user=user,
+                                        rebill_id=str(rebill_id),
+                                        defaults={
+                                            'provider': 'tbank',
+                                            'pan_mask': pan_mask or '**** **** **** ****',
+                                            'exp_date': exp_date or '',
+                                            'card_type': card_type or '',
+                                            'status': 'active',
+                                            'is_default': True,  # Делаем методом по умолчанию для подписки
+                                        }
+                                    )
+                                    
+                                    # Если метод уже существует, обновляем его
+                                    if not created:
+                                        payment_method.status = 'active'
+                                        payment_method.is_default = True
+                                        if pan_mask and pan_mask != '**** **** **** ****':
+                                            payment_method.pan_mask = pan_mask
+                                        if exp_date:
+                                            payment_method.exp_date = exp_date
+                                        if card_type:
+                                            payment_method.card_type = card_type
+                                        payment_method.save()
+                                    
+                                    # Создаем или обновляем мандат для рекуррентных платежей
+                                    from apps.payments.models import Mandate
+                                    mandate, mandate_created = Mandate.objects.get_or_create(
+                                        user=user,
+                                        mandate_number=f"TBANK_{rebill_id}",
+                                        defaults={
+                                            'type': 'rko',
+                                            'bank': 'tbank',
+                                            'status': 'active',
+                                            'signed_at': timezone.now(),
+                                        }
+                                    )
+                                    
+                                    if not mandate_created and mandate.status != 'active':
+                                        mandate.status = 'active'
+                                        mandate.signed_at = timezone.now()
+                                        mandate.save()
+                            
+                            # Создать UserProduct
+                            user_product = None
+                            if order.product:
+                                # Определить даты начала и окончания
+                                start_date = timezone.now()
+                                end_date = None
+                                
+                                if order.product.product_type == 'subscription':
+                                    # Для подписки устанавливаем период
+                                    if order.product.subscription_period == 'monthly':
+                                        end_date = start_date + timedelta(days=30)
+                                    elif order.product.subscription_period == 'yearly':
+                                        end_date = start_date + timedelta(days=365)
+                                    
+                                    # Для подписок ищем активный продукт пользователя или создаем новый
+                                    # Для подписок может быть только один активный продукт на пользователя
+                                    user_product = UserProduct.objects.filter(
+                                        user=user,
+                                        product=order.product,
+                                        status='active'
+                                    ).first()
+                                    
+                                    if user_product:
+                                        # Обновляем существующий активный продукт (продление подписки)
+                                        user_product.start_date = start_date
+                                        if end_date:
+                                            user_product.end_date = end_date
+                                        user_product.renewal_price = order.product.price
+                                        if payment_method:
+                                            user_product.payment_method = payment_method
+                                        user_product.status = 'active'
+                                        user_product.save()
+                                        logger.info(f"UserProduct обновлен для пользователя {user.email}, продукт {order.product.name}")
+                                    else:
+                                        # Создаем новый продукт пользователя (подписка) с get_or_create для idempotency
+                                        user_product, created = UserProduct.objects.get_or_create(
+                                            user=user,
+                                            product=order.product,
+                                            status='active',
+                                            defaults={
+                                                'start_date': start_date,
+                                                'end_date': end_date,
+                                                'renewal_price': order.product.price,
+                                                'payment_method': payment_method,
+                                            }
+                                        )
+                                        if created:
+                                            logger.info(f"UserProduct создан для пользователя {user.email}, продукт {order.product.name}")
+                                        else:
+                                            logger.info(f"UserProduct уже существует для пользователя {user.email}, продукт {order.product.name}")
+                                else:
+                                    # Для одноразовых продуктов (one_time) всегда создаем новый UserProduct
+                                    # Пользователь может иметь несколько одноразовых продуктов
+                                    # Используем get_or_create для idempotency
+                                    user_product, created = UserProduct.objects.get_or_create(
+                                        user=user,
+                                        product=order.product,
+                                        status='active',
+                                        defaults={
+                                            'start_date': start_date,
+                                            'end_date': None,
+                                            'renewal_price': None,
+                                            'payment_method': None,
+                                        }
+                                    )
+                                    if created:
+                                        logger.info(f"UserProduct создан (one_time) для пользователя {user.email}, продукт {order.product.name}")
+                                    else:
+                                        logger.info(f"UserProduct уже существует (one_time) для пользователя {user.email}, продукт {order.product.name}")
+                            
+                            # Email о активации подписки: в outbox, уйдет только после коммита
+                            if user_product and order.product and order.product.product_type == 'subscription':
+                                try:
+                                    from apps.products.email_services import build_subscription_activated_email
+                                    enqueue_email(build_subscription_activated_email(user, user_product), 'subscription_activated')
+                                    logger.info(f"Subscription activated email queued for {user.email}")
+                                except Exception as e:
+                                    logger.error(f"Failed to queue subscription activated email: {e}")
+                            
+                            # Создать транзакцию с get_or_create для idempotency
+                            transaction, trans_created = Transaction.objects.get_or_create(
+                                payment=payment,
+                                defaults={
+                                    'user': user,
+                                    'order': order,
+                                    'transaction_type': 'payment',
+                                    'amount': order.amount,
+                                    'currency': order.currency,
+                                    'description': order.description,
+                                    'provider_ref': payment_id,
+                                }
+                            )
+                            if trans_created:
+                                logger.info(f"Transaction создана для пользователя {user.email}, сумма {order.amount} {order.currency}, платеж {payment_id}")
+                            else:
+                                logger.info(f"Transaction уже существует для платежа {payment_id}")
+                            
+                            # Комиссия рефералу начисляется отдельной задачей после коммита (идемпотентно)
+                            if order.referred_by_id and order.referred_by_id != user.id:
+                                schedule_commission(order.id)
+                            
+                            # Welcome email: в outbox, уйдет только после коммита
+                            try:
+                                enqueue_email(build_welcome_email(user, order), 'welcome')
+                                print(f"Welcome email поставлен в очередь для {user.email}")
+                            except Exception as e:
+                                print(f"Error queueing welcome email to {user.email}: {e}")
+                                import traceback
+                                traceback.print_exc()
+                            
+                            print(f"✅ Успешная оплата обработана: пользователь {user.email}, продукт {order.product.name if order.product else 'N/A'}, сумма {order.amount} {order.currency}, receipt_url: {payment.receipt_url or 'не получен'}")
+                            
+                except Exception as e:
+                    # Пробрасываем: иначе ключ дедупликации закоммитится и повтор T-Bank будет отброшен
+                    logger.exception(f"❌ Error processing payment confirmation for order {order_id}: {e}")
+                    raise
+                
+        except OrderModel.DoesNotExist:
+            logger.warning(f"Webhook for unknown order {order_id}, skipping")
+
+    def _handle_card_binding(self, data, order, payment, status_tbank, payment_id):
+        tbank = TBankService()
+        
+        if status_tbank == 'AUTHORIZED':
+            rebill_id = self._extract_rebill_id(data, payment_id, tbank)
+            if rebill_id and order.user:
+                try:
+                    self._store_payment_method(order.user, rebill_id, data)
+                    logger.info(f"Stored payment method for user {order.user.email} via binding flow")
+                except Exception as e:
+                    logger.error(f"Failed to store payment method in binding flow: {e}")
+            
+            cancel_result = tbank.cancel_payment(payment_id)
+            if payment:
+                payment.status = 'success' if cancel_result.get('Success') else 'failed'
+                payment.failure_reason = None if cancel_result.get('Success') else f"Cancel error: {cancel_result.get('Message')}"
+                payment.save()
+            order.status = 'CANCELLED' if cancel_result.get('Success') else status_tbank
+            order.save()
+            return
+        
+        if status_tbank in ('CANCELED', 'CANCELLED', 'REVERSED', 'REFUNDED', 'PARTIAL_REFUNDED'):
+            if payment:
+                payment.status = 'cancelled'
+                payment.save()
+            order.status = status_tbank
+            order.save()
+            return
+        
+        # Ignore other statuses for binding flow
+        return
+
+    def _extract_rebill_id(self, payload, payment_id, tbank: TBankService):
+        rebill_id = payload.get('RebillId') or payload.get('CardId')
+        if isinstance(rebill_id, dict):
+            rebill_id = rebill_id.get('RebillId') or rebill_id.get('CardId')
+        
+        if rebill_id:
+            return rebill_id
+        
+        try:
+            status_info = tbank.get_payment_status(payment_id)
+            rebill_id = status_info.get('RebillId') or status_info.get('CardId')
+        except Exception as e:
+            logger.error(f"Failed to fetch payment status for {payment_id}: {e}")
+            rebill_id = None
+        return rebill_id
+
+    def _store_payment_method(self, user, rebill_id, payload):
+        from apps.payments.models import PaymentMethod, Mandate
+        from django.utils import timezone
+
+        pan_mask = payload.get('Pan')
+        exp_date = payload.get('ExpDate')
+        card_type = payload.get('CardType')
+
+        card_info = payload.get('CardId')
+        if isinstance(card_info, dict):
+            pan_mask = card_info.get('Pan', pan_mask or '**** **** **** ****')
+            exp_date = card_info.get('ExpDate', exp_date)
+            card_type = card_info.get('CardType', card_type)
+        
+        try:
+            rebill_id_enc = encrypt_string(str(rebill_id))
+        except Exception:
+            rebill_id_enc = None
+
+        payment_method, created = PaymentMethod.objects.get_or_create(
+            user=user,
+            rebill_id=str(rebill_id),
+            defaults={
+                'provider': 'tbank',
+                'pan_mask': pan_mask or '**** **** **** ****',
+                'exp_date': exp_date or '',
+                'card_type': card_type or '',
+                'status': 'active',
+                'is_default': True,
+                'rebill_id_enc': rebill_id_enc,
+            }
+        )
+
+        if not created:
+            payment_method.status = 'active'
+            payment_method.is_default = True
+            if pan_mask:
+                payment_method.pan_mask = pan_mask
+            if exp_date:
+                payment_method.exp_date = exp_date
+            if card_type:
+                payment_method.card_type = card_type
+            if rebill_id_enc:
+                payment_method.rebill_id_enc = rebill_id_enc
+            payment_method.save()
+
+        mandate, mandate_created = Mandate.objects.get_or_create(
+            user=user,
+            mandate_number=f"TBANK_{rebill_id}",
+            defaults={
+                'type': 'rko',
+                'bank': 'tbank',
+                'status': 'active',
+                'signed_at': timezone.now(),
+            }
+        )
+
+        if not mandate_created and mandate.status != 'active':
+            mandate.status = 'active'
+            mandate.signed_at = timezone.now()
+            mandate.save()
+
+
+def _dedup_key(data):
+    payment_id = data.get('PaymentId')
+    status = data.get('Status')
+    if not payment_id or not status:
+        return None
+    return str(payment_id), str(status)
+
+
+def is_duplicate_notification(data):
+    """Проверить, обработано ли уже уведомление (PaymentId, Status), и учесть повтор"""
+    key = _dedup_key(data)
+    if key is None:
+        return False
+    now = timezone.now()
+    # Один UPDATE по уникальному индексу: и проверка, и счетчик отсеченных повторов
+    updated = ProcessedWebhook.objects.filter(
+        payment_id=key[0],
+        status=key[1],
+        expires_at__gt=now,
+    ).update(hits=F('hits') + 1, last_seen_at=now)
+    if updated:
+        logger.info(f"Duplicate webhook skipped: OrderId={data.get('OrderId')}, PaymentId={key[0]}, Status={key[1]}")
+        return True
+    return False
+
+
+def claim_notification(data):
+    """Занять уведомление (PaymentId, Status) на PAYMENT_WEBHOOK_DEDUP_TTL_HOURS перед обработкой
+    
+    Вызывается внутри транзакции обработки: INSERT по уникальному индексу ждет параллельную
+    транзакцию с тем же ключом и после ее коммита падает с IntegrityError (повтор), после
+    отката - проходит (уведомление не было обработано). Запись с истекшим TTL занимается заново.
+    
+    Returns:
+        True - уведомление нужно обработать, False - повтор
+    """
+    key = _dedup_key(data)
+    if key is None:
+        return True
+    now = timezone.now()
+    expires_at = now + timedelta(hours=getattr(settings, 'PAYMENT_WEBHOOK_DEDUP_TTL_HOURS', 72))
+    try:
+        with db_transaction.atomic():
+            ProcessedWebhook.objects.create(
+                payment_id=key[0], status=key[1], order_id=data.get('OrderId'), expires_at=expires_at,
+            )
+        return True
+    except IntegrityError:
+        pass
+    
+    # Запись есть: после истечения TTL ее забирает ровно одна доставка (UPDATE блокирует строку)
+    if ProcessedWebhook.objects.filter(payment_id=key[0], status=key[1], expires_at__lte=now).update(
+        order_id=data.get('OrderId'), expires_at=expires_at, hits=0, last_seen_at=None,
+    ):
+        return True
+    return not is_duplicate_notification(data)
+
+
+def purge_expired_webhooks():
+    """Удалить записи дедупликации с истекшим TTL"""
+    deleted, _ = ProcessedWebhook.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
+
+
+def enqueue_notification(data):
+    """Сохранить сырое уведомление в очередь и запланировать его обработку
+    
+    Повтор уже обработанного уведомления в очередь не попадает.
+    """
+    if is_duplicate_notification(data):
+        return None
+    notification = PaymentNotification.objects.create(
+        order_id=str(data.get('OrderId')),
+        payment_id=str(data['PaymentId']) if data.get('PaymentId') else None,
+        tbank_status=data.get('Status'),
+        payload=data,
+    )
+    order_id = notification.order_id
+    db_transaction.on_commit(lambda: schedule_order_notifications(order_id))
+    return notification
+
+
+def schedule_order_notifications(order_id):
+    """Поставить в Celery обработку очереди уведомлений заказа"""
+    from .tasks import process_payment_notifications
+    try:
+        process_payment_notifications.delay(order_id)
+    except Exception as e:
+        # Уведомление уже сохранено в БД, его подберет requeue_payment_notifications
+        logger.error(f"Failed to schedule notifications processing for order {order_id}: {e}")
+
+
+def drain_order_notifications(order_id):
+    """Обработать ожидающие уведомления заказа строго в порядке поступления
+    
+    Каждое уведомление обрабатывается в своей транзакции под блокировкой строки заказа.
+    Запросы GetState (чек, RebillId) выполняются до блокировки (см. prefetch_notification),
+    под ней остается только Confirm для AUTHORIZED, ограниченный TBANK_CONFIRM_TIMEOUT.
+    
+    Returns:
+        (processed, retry): количество обработанных уведомлений и флаг, что очередное
+        уведомление упало и обработку заказа нужно повторить позже
+    """
+    max_attempts = getattr(settings, 'PAYMENT_NOTIFICATION_MAX_ATTEMPTS', 5)
+    processor = PaymentNotificationProcessor()
+    processed = 0
+    pending = PaymentNotification.objects.filter(order_id=order_id, status='pending').order_by('id')
+    
+    while True:
+        notification = pending.first()
+        if notification is None:
+            return processed, False
+        data = prefetch_notification(notification.payload)
+        
+        with db_transaction.atomic():
+            # Блокировка строки заказа сериализует консьюмеров одного OrderId: второй воркер
+            # дождется коммита первого и увидит его уведомление уже обработанным
+            list(OrderModel.objects.select_for_update().filter(order_id=order_id).values_list('id', flat=True))
+            notification = pending.filter(pk=notification.pk).first()
+            if notification is None:
+                continue
+            
+            notification.attempts += 1
+            try:
+                with db_transaction.atomic():
+                    processor.process(data)
+            except Exception as e:
+                logger.exception(f"Error processing notification {notification.id} for order {order_id}: {e}")
+                notification.last_error = str(e)
+                if notification.attempts < max_attempts:
+                    # Следующие уведомления заказа ждут, чтобы не нарушить порядок
+                    notification.save(update_fields=['attempts', 'last_error'])
+                    return processed, True
+                notification.status = 'failed'
+                notification.processed_at = timezone.now()
+                notification.save(update_fields=['status', 'attempts', 'last_error', 'processed_at'])
+                continue
+            
+            notification.status = 'processed'
+            notification.processed_at = timezone.now()
+            notification.save(update_fields=['status', 'attempts', 'processed_at'])
+            processed += 1
+
+
+def prefetch_notification(data):
+    """Дополнить уведомление CONFIRMED чеком и RebillId из GetState, если их нет в payload
+    
+    Вызывается без транзакции и блокировок: иначе эти данные запрашиваются из обработки
+    под блокировкой заказа. Ошибка запроса не мешает обработке - она повторит запрос сама.
+    """
+    payment_id = data.get('PaymentId')
+    if data.get('Status') != 'CONFIRMED' or not payment_id:
+        return data
+    has_receipt = any(data.get(key) for key in ('ReceiptURL', 'ReceiptUrl', 'Receipt', 'receipt_url'))
+    has_rebill = data.get('RebillId') or data.get('CardId')
+    if has_receipt and has_rebill:
+        return data
+    try:
+        state = TBankService().get_payment_status(payment_id)
+    except Exception as e:
+        logger.warning(f"Failed to prefetch payment state for {payment_id}: {e}")
+        return data
+    
+    data = dict(data)
+    receipt_url = state.get('ReceiptURL') or state.get('ReceiptUrl') or state.get('Receipt') or state.get('receipt_url')
+    if not has_receipt and receipt_url:
+        data['ReceiptURL'] = receipt_url
+    rebill_id = state.get('RebillId') or state.get('CardId')
+    if not has_rebill and rebill_id:
+        data['RebillId'] = rebill_id
+    return data
+
+
+def get_notification_queue_metrics():
+    """Метрики очереди уведомлений для контроля backpressure"""
+    now = timezone.now()
+    latency = ExpressionWrapper(F('processed_at') - F('received_at'), output_field=DurationField())
+    
+    queue = PaymentNotification.objects.aggregate(
+        pending=Count('id', filter=Q(status='pending')),
+        retrying=Count('id', filter=Q(status='pending', attempts__gt=0)),
+        failed=Count('id', filter=Q(status='failed')),
+        oldest_pending_at=Min('received_at', filter=Q(status='pending')),
+        received_last_minute=Count('id', filter=Q(received_at__gte=now - timedelta(minutes=1))),
+    )
+    recent = PaymentNotification.objects.filter(
+        status='processed',
+        processed_at__gte=now - timedelta(hours=1),
+    ).aggregate(
+        processed_last_hour=Count('id'),
+        avg_latency=Avg(latency),
+        max_latency=Max(latency),
+    )
+    
+    def seconds(value):
+        return round(value.total_seconds(), 3) if value is not None else None
+    
+    dedup = ProcessedWebhook.objects.filter(expires_at__gt=now).aggregate(
+        keys=Count('id'),
+        hits=Sum('hits'),
+    )
+    dedup_misses = dedup['keys']
+    dedup_hits = dedup['hits'] or 0
+    
+    oldest = queue['oldest_pending_at']
+    return {
+        'pending': queue['pending'],
+        'retrying': queue['retrying'],
+        'failed': queue['failed'],
+        'lag_seconds': seconds(now - oldest) if oldest else 0,
+        'received_last_minute': queue['received_last_minute'],
+        'processed_last_hour': recent['processed_last_hour'],
+        'avg_latency_seconds': seconds(recent['avg_latency']),
+        'max_latency_seconds': seconds(recent['max_latency']),
+        # misses - уникальные уведомления, обработанные полностью; hits - отсеченные повторы
+        'dedup_misses': dedup_misses,
+        'dedup_hits': dedup_hits,
+        'dedup_hit_ratio': round(dedup_hits / (dedup_hits + dedup_misses), 4) if dedup_hits + dedup_misses else 0,
+    }
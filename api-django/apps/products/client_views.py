@@ -1,6 +1,7 @@
 from rest_framework import views, status
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from django.db import transaction
 from django.db.models import Q
 from .models import Product, UserProduct
 from .serializers import ProductSerializer, UserProductSerializer
@@ -56,19 +57,16 @@ class CancelSubscriptionView(views.APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        from apps.products.email_services import build_subscription_cancelled_email
+        from apps.users.outbox import enqueue_email
+        
         # Отменяем подписку - меняем статус на cancelled
         # Подписка будет действовать до конца текущего периода (end_date)
-        user_product.status = 'cancelled'
-        user_product.save()
-        
-        # Отправить email о отмене подписки
-        try:
-            from apps.products.email_services import send_subscription_cancelled_email
-            send_subscription_cancelled_email(request.user, user_product)
-        except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.error(f'Failed to send subscription cancelled email: {e}')
+        # Email о отмене - в outbox в той же транзакции: уйдет только вместе с отменой
+        with transaction.atomic():
+            user_product.status = 'cancelled'
+            user_product.save()
+            enqueue_email(build_subscription_cancelled_email(request.user, user_product), 'subscription_cancelled')
         
         return Response({
             'success': True,
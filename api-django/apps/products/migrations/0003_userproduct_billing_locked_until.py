@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 12:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userproduct',
+            name='billing_locked_until',
+            field=models.DateTimeField(blank=True, help_text='Подписка захвачена прогоном рекуррентного списания до этого момента', null=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.16 on 2026-10-18 12:06
+
+from django.db import migrations, models
+
+
+def fill_next_charge_at(apps, schema_editor):
+    UserProduct = apps.get_model('products', 'UserProduct')
+    UserProduct.objects.filter(
+        status__in=['active', 'pending'],
+        end_date__isnull=False,
+        product__product_type='subscription',
+    ).update(next_charge_at=models.F('end_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_userproduct_billing_locked_until'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userproduct',
+            name='next_charge_at',
+            field=models.DateTimeField(blank=True, help_text='Дата следующего списания: end_date для активной/ожидающей подписки, иначе пусто. Заполняется в save()', null=True),
+        ),
+        migrations.RunPython(fill_next_charge_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='userproduct',
+            index=models.Index(condition=models.Q(('next_charge_at__isnull', False)), fields=['next_charge_at', 'status'], name='user_products_next_charge_idx'),
+        ),
+    ]
@@ -70,6 +70,12 @@ class UserProduct(models.Model):
         help_text='Ссылка на приложение (Mini App) для данного пользователя. Если не указана, можно задать в админке.'
     )
     payment_method = models.ForeignKey('payments.PaymentMethod', on_delete=models.SET_NULL, null=True, blank=True, related_name='user_products', help_text='Платежный метод для автоматического списания подписки')
+    billing_locked_until = models.DateTimeField(blank=True, null=True, help_text='Подписка захвачена прогоном рекуррентного списания до этого момента')
+    next_charge_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        help_text='Дата следующего списания: end_date для активной/ожидающей подписки, иначе пусто. Заполняется в save()'
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -79,7 +85,28 @@ class UserProduct(models.Model):
         verbose_name_plural = 'Продукты пользователей'
         ordering = ['-created_at']
         unique_together = [['user', 'product', 'status']]
+        indexes = [
+            # Выборки "что к списанию/напоминанию в окне X" - range scan только по подпискам к продлению
+            models.Index(
+                fields=['next_charge_at', 'status'],
+                name='user_products_next_charge_idx',
+                condition=models.Q(next_charge_at__isnull=False),
+            ),
+        ]
     
     def __str__(self):
         return f"{self.user.email} - {self.product.name}"
+    
+    def compute_next_charge_at(self):
+        """Дата следующего списания подписки (None - продлевать не нужно)"""
+        if self.status in ('active', 'pending') and self.end_date and self.product.product_type == 'subscription':
+            return self.end_date
+        return None
+    
+    def save(self, *args, **kwargs):
+        self.next_charge_at = self.compute_next_charge_at()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'next_charge_at' not in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['next_charge_at']
+        super().save(*args, **kwargs)
 
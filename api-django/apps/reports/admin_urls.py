@@ -0,0 +1,10 @@
+from django.urls import path, include
+from rest_framework.routers import DefaultRouter
+from .admin_views import ExportJobAdminViewSet
+
+router = DefaultRouter()
+router.register(r'exports', ExportJobAdminViewSet, basename='admin-export')
+
+urlpatterns = [
+    path('', include(router.urls)),
+]
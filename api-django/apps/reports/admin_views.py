@@ -0,0 +1,52 @@
+from django.http import FileResponse
+from rest_framework import viewsets, filters, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.permissions import IsAuthenticated
+from django_filters.rest_framework import DjangoFilterBackend
+from .exports import CONTENT_TYPES
+from .models import ExportJob
+from .serializers import ExportJobSerializer
+
+
+class IsAdminOrFinanceManager(IsAuthenticated):
+    def has_permission(self, request, view):
+        if not super().has_permission(request, view):
+            return False
+        return request.user.role in ['admin', 'finance_manager']
+
+
+class ExportJobAdminViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint фоновых выгрузок: прогресс и скачивание готового файла.
+    Финансовый менеджер видит только свои выгрузки, администратор - все.
+    """
+    queryset = ExportJob.objects.all()
+    serializer_class = ExportJobSerializer
+    permission_classes = [IsAdminOrFinanceManager]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+    filterset_fields = ['status', 'format']
+    ordering_fields = ['created_at']
+    ordering = ['-created_at']
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.user.role != 'admin':
+            queryset = queryset.filter(created_by=self.request.user)
+        return queryset
+    
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """Файл готовой выгрузки"""
+        job = self.get_object()
+        if job.status != 'completed' or not job.file:
+            return Response(
+                {'success': False, 'message': f'Export is not ready: {job.status}'},
+                status=status.HTTP_409_CONFLICT
+            )
+        return FileResponse(
+            job.file.open('rb'),
+            as_attachment=True,
+            filename=job.file.name.rsplit('/', 1)[-1],
+            content_type=CONTENT_TYPES[job.format],
+        )
@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+
+
+class ReportsConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'apps.reports'
+    verbose_name = 'Отчеты'
+    
+    def ready(self):
+        """Подписываем агрегаты статистики на изменения заказов, платежей и рефералов"""
+        from apps.reports.rollups import connect_signals
+        connect_signals()
@@ -0,0 +1,253 @@
+"""
+Выгрузка списков админки в CSV/XLSX.
+
+ExportMixin добавляет ViewSet'у action export (?export_format=csv|xlsx). Выгружается тот же
+набор строк, что у списка: get_queryset + фильтры, поиск и сортировка (filter_queryset).
+Строки читаются одним потоковым запросом (stream_queryset - server-side cursor на PostgreSQL)
+и только по колонкам export_fields (values_list, без моделей и сериализаторов).
+
+- CSV отдается потоково кусками ~64 КБ, в памяти только буфер.
+- XLSX пишется xlsxwriter в режиме constant_memory (каждая строка сразу уходит во временный
+  файл) и отдается готовым файлом. Без установленного xlsxwriter доступен только CSV.
+- Больше EXPORT_SYNC_MAX_ROWS строк или ?async=1 - фоновая выгрузка (ExportJob, Celery):
+  ответ 202 с задачей, прогресс в /api/admin/exports/<id>/, файл - /api/admin/exports/<id>/download/.
+"""
+import csv
+import io
+import logging
+import os
+import tempfile
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.files import File
+from django.http import FileResponse, HttpRequest, QueryDict, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from apps.common.batching import stream_queryset
+from apps.common.streaming import STREAM_BUFFER_SIZE
+from .models import ExportJob
+from .serializers import ExportJobSerializer
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+# Параметры export, не относящиеся к фильтрам списка
+SERVICE_PARAMS = ('export_format', 'async', 'page', 'page_size')
+# Как часто фоновая выгрузка сохраняет прогресс (строк)
+PROGRESS_EVERY = 5000
+# Строк на листе XLSX (с заголовком - предел Excel 1 048 576)
+XLSX_SHEET_ROWS = 1_048_575
+
+
+def _cell(value):
+    """Значение ячейки: даты - по TIME_ZONE, None - пусто, UUID и прочее - строкой"""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'да' if value else 'нет'
+    if isinstance(value, datetime):
+        value = timezone.localtime(value) if timezone.is_aware(value) else value
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, (int, float, Decimal)):
+        return value
+    return str(value)
+
+
+def iter_csv(headers, rows, buffer_size=STREAM_BUFFER_SIZE):
+    """CSV (UTF-8 с BOM - Excel корректно открывает кириллицу) кусками ~buffer_size"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(headers)
+    for row in rows:
+        writer.writerow([_cell(value) for value in row])
+        if buffer.tell() >= buffer_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def write_xlsx(output, headers, rows):
+    """XLSX в файл или файловый объект output с постоянным расходом памяти"""
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    bold = workbook.add_format({'bold': True})
+    worksheet, row_index = None, XLSX_SHEET_ROWS
+    for row in rows:
+        if row_index >= XLSX_SHEET_ROWS:
+            worksheet, row_index = workbook.add_worksheet(), 0
+            worksheet.write_row(0, 0, headers, bold)
+        row_index += 1
+        worksheet.write_row(row_index, 0, [
+            float(value) if isinstance(value, Decimal) else value for value in map(_cell, row)
+        ])
+    if worksheet is None:
+        workbook.add_worksheet().write_row(0, 0, headers, bold)
+    workbook.close()
+
+
+def write_export(export_format, path, headers, rows):
+    if export_format == 'xlsx':
+        write_xlsx(path, headers, rows)
+        return
+    with open(path, 'w', encoding='utf-8', newline='') as output:
+        for chunk in iter_csv(headers, rows):
+            output.write(chunk)
+
+
+def _with_progress(rows, on_progress):
+    processed = 0
+    for row in rows:
+        yield row
+        processed += 1
+        if processed % PROGRESS_EVERY == 0:
+            on_progress(processed)
+    on_progress(processed)
+
+
+class ExportMixin:
+    """action export для ViewSet списка
+
+    export_fields: [(заголовок колонки, поле для values_list), ...]
+    export_filename: начало имени файла
+    """
+    export_fields = ()
+    export_filename = 'export'
+
+    def get_export_queryset(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        return queryset.values_list(*(field for _, field in self.export_fields))
+
+    def get_export_headers(self):
+        return [header for header, _ in self.export_fields]
+
+    def get_export_filename(self, export_format):
+        return f'{self.export_filename}-{timezone.localtime():%Y%m%d-%H%M%S}.{export_format}'
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Выгрузка списка с фильтрами, поиском и сортировкой списка (CSV потоком, XLSX файлом)"""
+        export_format = request.query_params.get('export_format', 'csv')
+        if export_format not in CONTENT_TYPES:
+            return Response(
+                {'success': False, 'message': f'export_format: expected one of {", ".join(CONTENT_TYPES)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if export_format == 'xlsx' and xlsxwriter is None:
+            return Response(
+                {'success': False, 'message': 'XLSX export is unavailable: xlsxwriter is not installed'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        queryset = self.get_export_queryset()
+        if request.query_params.get('async') in ('1', 'true') or queryset.count() > settings.EXPORT_SYNC_MAX_ROWS:
+            job = start_export(self, export_format)
+            return Response(ExportJobSerializer(job, context={'request': request}).data, status=status.HTTP_202_ACCEPTED)
+
+        filename = self.get_export_filename(export_format)
+        rows = stream_queryset(queryset)
+        if export_format == 'csv':
+            response = StreamingHttpResponse(iter_csv(self.get_export_headers(), rows), content_type=CONTENT_TYPES['csv'])
+            response['Content-Disposition'] = f'attachment; filename="{filename}"'
+            return response
+
+        output = tempfile.TemporaryFile(suffix='.xlsx')
+        write_xlsx(output, self.get_export_headers(), rows)
+        output.seek(0)
+        return FileResponse(output, as_attachment=True, filename=filename, content_type=CONTENT_TYPES['xlsx'])
+
+
+def start_export(view, export_format) -> ExportJob:
+    """Создать фоновую выгрузку по параметрам текущего запроса списка и поставить ее в Celery"""
+    params = {
+        key: view.request.query_params.getlist(key)
+        for key in view.request.query_params
+        if key not in SERVICE_PARAMS
+    }
+    job = ExportJob.objects.create(
+        view=f'{type(view).__module__}.{type(view).__qualname__}',
+        format=export_format,
+        params=params,
+        created_by=view.request.user,
+    )
+
+    from .tasks import run_export_job
+    try:
+        run_export_job.delay(str(job.id))
+    except Exception as e:
+        logger.error(f"Failed to schedule export {job.id}: {e}")
+        job.status = 'failed'
+        job.error = f'Failed to schedule export: {e}'
+        job.save(update_fields=['status', 'error'])
+    return job
+
+
+def _build_view(job: ExportJob):
+    """ViewSet списка с запросом, восстановленным из параметров выгрузки"""
+    http_request = HttpRequest()
+    http_request.method = 'GET'
+    query = QueryDict(mutable=True)
+    for key, values in job.params.items():
+        query.setlist(key, values)
+    http_request.GET = query
+    request = Request(http_request)
+    if job.created_by is not None:
+        request.user = job.created_by
+    return import_string(job.view)(request=request, args=(), kwargs={}, format_kwarg=None, action='export')
+
+
+def run_export(job_id) -> ExportJob:
+    """Выполнить фоновую выгрузку: файл во временный каталог, затем в хранилище (MEDIA)"""
+    job = ExportJob.objects.select_related('created_by').get(pk=job_id)
+    if job.status == 'completed':
+        return job
+
+    view = _build_view(job)
+    queryset = view.get_export_queryset()
+    job.status = 'running'
+    job.started_at = timezone.now()
+    job.total = queryset.count()
+    job.processed = 0
+    job.error = None
+    job.save(update_fields=['status', 'started_at', 'total', 'processed', 'error'])
+
+    def on_progress(processed):
+        job.processed = processed
+        ExportJob.objects.filter(pk=job.pk).update(processed=processed)
+
+    descriptor, path = tempfile.mkstemp(suffix=f'.{job.format}')
+    os.close(descriptor)
+    try:
+        rows = _with_progress(stream_queryset(queryset), on_progress)
+        write_export(job.format, path, view.get_export_headers(), rows)
+        with open(path, 'rb') as output:
+            job.file.save(view.get_export_filename(job.format), File(output), save=False)
+        job.status = 'completed'
+        job.finished_at = timezone.now()
+        job.save(update_fields=['file', 'status', 'finished_at'])
+    except Exception as e:
+        logger.error(f"Export {job.id} failed: {e}")
+        ExportJob.objects.filter(pk=job.pk).update(status='failed', error=str(e), finished_at=timezone.now())
+        raise
+    finally:
+        os.remove(path)
+
+    logger.info(f"Export {job.id} completed: {job.processed} rows")
+    return job
@@ -0,0 +1,126 @@
+"""
+Бенчмарк статистики продаж админки (OrderAdminViewSet.statistics): агрегаты по таблице
+заказов на каждый запрос против почасовых/посуточных агрегатов (apps.reports).
+
+Синтетические заказы создаются в транзакции, которая откатывается в конце.
+"""
+import random
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from apps.orders.admin_views import OrderAdminViewSet
+from apps.orders.models import Order
+from apps.products.models import Product
+from apps.reports.rollups import period_start, rebuild
+from apps.users.models import User
+
+STATUSES = ['CONFIRMED'] * 6 + ['NEW', 'AUTHORIZING', 'REJECTED', 'AUTH_FAIL', 'CANCELLED']
+
+
+def legacy_statistics(period):
+    """Прежняя статистика: агрегаты по таблице заказов (created_at__date для «сегодня»)"""
+    queryset = Order.objects.all()
+    now = timezone.now()
+    if period == 'today':
+        queryset = queryset.filter(created_at__date=now.date())
+    elif period in ('week', 'month', 'year'):
+        queryset = queryset.filter(created_at__gte=now - timedelta(days={'week': 7, 'month': 30, 'year': 365}[period]))
+    queryset.count()
+    queryset.filter(status='CONFIRMED').aggregate(total=Sum('amount'))
+    queryset.filter(status='CONFIRMED').count()
+    queryset.filter(status__in=['NEW', 'AUTHORIZING']).count()
+    queryset.filter(status__in=['REJECTED', 'AUTH_FAIL']).count()
+    list(queryset.values('status').annotate(count=Count('id'), total_amount=Sum('amount')).order_by('-count'))
+    list(
+        queryset.filter(status='CONFIRMED').values('product__name')
+        .annotate(count=Count('id'), total_amount=Sum('amount')).order_by('-total_amount')
+    )
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает время статистики продаж по таблице заказов и по агрегатам (данные откатываются)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=5_000_000, help='Количество заказов')
+        parser.add_argument('--days', type=int, default=730, help='Глубина истории заказов, дней')
+        parser.add_argument('--repeat', type=int, default=3, help='Повторов на режим')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self._seed(options['orders'], options['days'])
+            started = time.perf_counter()
+            rebuild(['orders'], end=timezone.now())
+            self.stdout.write(f'Агрегаты пересобраны за {time.perf_counter() - started:.1f} с')
+            self._run(options['repeat'])
+            transaction.set_rollback(True)
+        self.stdout.write('Синтетические данные откатаны')
+
+    def _seed(self, total, days):
+        started = time.perf_counter()
+        prefix = uuid.uuid4().hex[:8]
+        products = Product.objects.bulk_create([
+            Product(name=f'Bench {i}', slug=f'bench-{prefix}-{i}', price=990, product_type='subscription')
+            for i in range(20)
+        ])
+        random.seed(42)
+        now = timezone.now()
+        span = days * 24 * 3600
+
+        # created_at задаем сами: auto_now_add перезаписал бы его при bulk_create
+        created_at = Order._meta.get_field('created_at')
+        created_at.auto_now_add = False
+        try:
+            batch = []
+            for index in range(total):
+                batch.append(Order(
+                    order_id=f'bench-{prefix}-{index}',
+                    product=products[index % len(products)],
+                    amount=Decimal(random.choice((490, 990, 1990, 4990))),
+                    status=random.choice(STATUSES),
+                    created_at=now - timedelta(seconds=random.randrange(span)),
+                ))
+                if len(batch) == 10_000:
+                    Order.objects.bulk_create(batch)
+                    batch = []
+            Order.objects.bulk_create(batch)
+        finally:
+            created_at.auto_now_add = True
+        self.stdout.write(f'Создано {total} заказов за {time.perf_counter() - started:.1f} с')
+
+    def _run(self, repeat):
+        factory = APIRequestFactory(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+        view = OrderAdminViewSet.as_view({'get': 'statistics'})
+        admin = User(email='bench-admin@bench.local', role='admin')
+
+        def rollup_statistics(period):
+            request = factory.get('/api/admin/orders/statistics/', {'period': period})
+            force_authenticate(request, user=admin)
+            response = view(request)
+            assert response.status_code == 200, response.data
+            return response.data
+
+        self.stdout.write('\n' + '=' * 72)
+        self.stdout.write(f'{"период":<10}{"по таблице, мс":>18}{"запросов":>10}{"по агрегатам, мс":>20}{"запросов":>10}')
+        for period in ('today', 'week', 'month', 'year', 'all'):
+            results = []
+            for func in (legacy_statistics, rollup_statistics):
+                with CaptureQueriesContext(connection) as queries:
+                    func(period)
+                started = time.perf_counter()
+                for _ in range(repeat):
+                    func(period)
+                results.append(((time.perf_counter() - started) / repeat * 1000, len(queries)))
+            (legacy_ms, legacy_queries), (rollup_ms, rollup_queries) = results
+            self.stdout.write(f'{period:<10}{legacy_ms:>18.1f}{legacy_queries:>10}{rollup_ms:>20.1f}{rollup_queries:>10}')
+        self.stdout.write('=' * 72)
+        self.stdout.write(f'Начало периода «today»: {period_start("today")}')
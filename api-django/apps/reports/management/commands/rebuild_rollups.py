@@ -0,0 +1,31 @@
+"""
+Пересборка агрегатов статистики (MetricRollup) из исходных таблиц: с нуля или за период.
+"""
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.reports.rollups import SOURCES, rebuild
+
+
+def _parse_date(value, name):
+    try:
+        return timezone.make_aware(datetime.combine(datetime.strptime(value, '%Y-%m-%d'), time.min))
+    except ValueError:
+        raise CommandError(f'{name}: ожидается дата в формате YYYY-MM-DD')
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает почасовые и посуточные агрегаты статистики админки'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--metric', action='append', choices=list(SOURCES), help='Метрика (по умолчанию все)')
+        parser.add_argument('--since', type=str, help='С даты включительно (YYYY-MM-DD)')
+        parser.add_argument('--until', type=str, help='По дату не включительно (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        start = _parse_date(options['since'], '--since') if options['since'] else None
+        end = _parse_date(options['until'], '--until') if options['until'] else None
+        created = rebuild(options['metric'], start=start, end=end)
+        self.stdout.write(self.style.SUCCESS(f'Создано строк агрегатов: {created}'))
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.16 on 2026-10-18 12:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Час'), ('day', 'День')], max_length=4)),
+                ('bucket_start', models.DateTimeField(help_text='Начало часа / суток (по TIME_ZONE)')),
+                ('metric', models.CharField(max_length=30)),
+                ('status', models.CharField(blank=True, default='', max_length=30)),
+                ('method', models.CharField(blank=True, default='', max_length=30)),
+                ('product', models.CharField(blank=True, default='', help_text='ID продукта', max_length=36)),
+                ('kind', models.CharField(blank=True, default='', help_text='Тип (например, тип транзакции)', max_length=30)),
+                ('count', models.BigIntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+            ],
+            options={
+                'verbose_name': 'Агрегат статистики',
+                'verbose_name_plural': 'Агрегаты статистики',
+                'db_table': 'metric_rollups',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='metricrollup',
+            constraint=models.UniqueConstraint(fields=('metric', 'granularity', 'bucket_start', 'status', 'method', 'product', 'kind'), name='metric_rollups_bucket_uniq'),
+        ),
+    ]
@@ -0,0 +1,89 @@
+import uuid
+
+from django.db import models
+
+from apps.users.models import User
+
+
+class MetricRollup(models.Model):
+    """Агрегат статистики за час или день: количество и сумма строк по измерениям
+    
+    Строка - корзина (granularity, bucket_start) метрики с конкретными значениями измерений
+    (пустая строка - измерение у метрики не используется). Корзина определяется created_at
+    исходной строки, измерения - ее текущими значениями. Ведется apps.reports.rollups.
+    """
+    GRANULARITY_CHOICES = [
+        ('hour', 'Час'),
+        ('day', 'День'),
+    ]
+    
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES)
+    bucket_start = models.DateTimeField(help_text='Начало часа / суток (по TIME_ZONE)')
+    metric = models.CharField(max_length=30)
+    status = models.CharField(max_length=30, blank=True, default='')
+    method = models.CharField(max_length=30, blank=True, default='')
+    product = models.CharField(max_length=36, blank=True, default='', help_text='ID продукта')
+    kind = models.CharField(max_length=30, blank=True, default='', help_text='Тип (например, тип транзакции)')
+    count = models.BigIntegerField(default=0)
+    amount = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    
+    class Meta:
+        db_table = 'metric_rollups'
+        verbose_name = 'Агрегат статистики'
+        verbose_name_plural = 'Агрегаты статистики'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['metric', 'granularity', 'bucket_start', 'status', 'method', 'product', 'kind'],
+                name='metric_rollups_bucket_uniq',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.metric} {self.granularity} {self.bucket_start:%Y-%m-%d %H:%M}: {self.count} / {self.amount}"
+
+
+class ExportJob(models.Model):
+    """Фоновая выгрузка списка админки в CSV/XLSX (apps.reports.exports)
+    
+    Хранит параметры запроса списка (фильтры, поиск, сортировка), прогресс и готовый файл.
+    """
+    FORMAT_CHOICES = [
+        ('csv', 'CSV'),
+        ('xlsx', 'XLSX'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('completed', 'Готова'),
+        ('failed', 'Ошибка'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    view = models.CharField(max_length=255, help_text='Путь к ViewSet списка')
+    format = models.CharField(max_length=4, choices=FORMAT_CHOICES, default='csv')
+    params = models.JSONField(default=dict, blank=True, help_text='Параметры запроса списка')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    file = models.FileField(upload_to='exports/%Y/%m/', blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='export_jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        db_table = 'export_jobs'
+        verbose_name = 'Выгрузка'
+        verbose_name_plural = 'Выгрузки'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"ExportJob {self.view.rsplit('.', 1)[-1]} {self.format} - {self.status}"
+    
+    @property
+    def progress(self):
+        """Доля выгруженных строк, 0..1"""
+        if self.status == 'completed':
+            return 1.0
+        return min(self.processed / self.total, 1.0) if self.total else 0.0
@@ -0,0 +1,341 @@
+"""
+Почасовые и посуточные агрегаты для статистики админки (MetricRollup).
+
+Ведение: сохранение/удаление заказа, платежа, транзакции, реферала, комиссии или выплаты
+дает приращения (-1/-сумма старой корзине, +1/+сумма новой) для часа и суток created_at.
+Приращения применяются после коммита короткими UPDATE ... SET count = count + n,
+поэтому горячая строка текущего часа не блокируется на время транзакции webhook.
+Пути без сигналов (bulk_create/bulk_update) передают изменения через record_changes.
+Расхождения (сбой между коммитом и применением, .update() в обход сигналов)
+устраняет rebuild - с нуля или за период; ночная задача пересобирает последние дни.
+
+Чтение: период собирается из суточных корзин, часовых корзин по краям (одним запросом) и точного
+запроса к исходной таблице для неполных часов на границах (индекс по created_at),
+поэтому ответ за любой период совпадает с агрегатом по исходной таблице.
+"""
+import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from functools import partial
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from django.apps import apps as django_apps
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.utils import timezone
+
+from apps.common.batching import stream_queryset
+from .models import MetricRollup
+
+logger = logging.getLogger(__name__)
+
+DIMENSIONS = ('status', 'method', 'product', 'kind')
+GRANULARITIES = ('hour', 'day')
+
+
+@dataclass(frozen=True)
+class RollupSource:
+    """Исходная таблица метрики: измерения (имя измерения, поле модели) и поле суммы"""
+    model: str
+    dimensions: Tuple[Tuple[str, str], ...]
+    amount: Optional[str] = None
+
+    def get_model(self):
+        return django_apps.get_model(self.model)
+
+    def field(self, dimension):
+        return dict(self.dimensions)[dimension]
+
+    @property
+    def fields(self):
+        fields = ['created_at'] + [field for _, field in self.dimensions]
+        return fields + [self.amount] if self.amount else fields
+
+
+SOURCES = {
+    'orders': RollupSource('orders.Order', (('status', 'status'), ('product', 'product_id')), 'amount'),
+    'payments': RollupSource('payments.Payment', (('status', 'status'), ('method', 'method')), 'amount'),
+    'transactions': RollupSource('payments.Transaction', (('kind', 'transaction_type'),), 'amount'),
+    'referrals': RollupSource('affiliates.Referral', (('status', 'status'),)),
+    'referral_commissions': RollupSource('affiliates.ReferralCommission', (('status', 'status'),), 'commission_amount'),
+    'referral_payouts': RollupSource('affiliates.ReferralPayout', (('status', 'status'),), 'amount'),
+}
+
+
+# Границы корзин (по TIME_ZONE, как TruncHour/TruncDay)
+
+def floor_bucket(moment: datetime, granularity: str) -> datetime:
+    local = timezone.localtime(moment)
+    if granularity == 'hour':
+        return local.replace(minute=0, second=0, microsecond=0)
+    return timezone.make_aware(datetime.combine(local.date(), time.min))
+
+
+def ceil_bucket(moment: datetime, granularity: str) -> datetime:
+    start = floor_bucket(moment, granularity)
+    if start == moment:
+        return start
+    if granularity == 'hour':
+        return start + timedelta(hours=1)
+    return timezone.make_aware(datetime.combine(start.date() + timedelta(days=1), time.min))
+
+
+def period_start(period: str, now: Optional[datetime] = None) -> Optional[datetime]:
+    """Начало периода статистики админки: today, week, month, year (иначе - за все время)"""
+    now = now or timezone.now()
+    if period == 'today':
+        return floor_bucket(now, 'day')
+    days = {'week': 7, 'month': 30, 'year': 365}.get(period)
+    return now - timedelta(days=days) if days else None
+
+
+# Ведение агрегатов
+
+def snapshot(instance, metric: str) -> Dict:
+    """Значения строки, от которых зависит ее вклад в агрегаты"""
+    source = SOURCES[metric]
+    return {field: getattr(instance, field) for field in source.fields}
+
+
+def _dimension_values(source: RollupSource, values: Dict) -> Dict[str, str]:
+    result = dict.fromkeys(DIMENSIONS, '')
+    for dimension, field in source.dimensions:
+        value = values.get(field)
+        result[dimension] = '' if value is None else str(value)
+    return result
+
+
+def _contribute(deltas, metric: str, values: Optional[Dict], sign: int):
+    if not values or not values.get('created_at'):
+        return
+    source = SOURCES[metric]
+    amount = Decimal(values.get(source.amount) or 0) if source.amount else Decimal('0')
+    dimensions = tuple(sorted(_dimension_values(source, values).items()))
+    for granularity in GRANULARITIES:
+        key = (metric, granularity, floor_bucket(values['created_at'], granularity), dimensions)
+        deltas[key][0] += sign
+        deltas[key][1] += sign * amount
+
+
+def changes_to_deltas(metric: str, changes: Iterable[Tuple[Optional[Dict], Optional[Dict]]]) -> Dict:
+    """Приращения агрегатов по парам (значения до, значения после); None - строки не было / нет"""
+    deltas = defaultdict(lambda: [0, Decimal('0')])
+    for before, after in changes:
+        _contribute(deltas, metric, before, -1)
+        _contribute(deltas, metric, after, 1)
+    return {key: value for key, value in deltas.items() if value[0] or value[1]}
+
+
+def apply_deltas(deltas: Dict):
+    """Применить приращения к строкам MetricRollup (каждое - отдельным коротким UPDATE)"""
+    for (metric, granularity, bucket, dimensions), (count, amount) in deltas.items():
+        lookup = dict(metric=metric, granularity=granularity, bucket_start=bucket, **dict(dimensions))
+        increment = {'count': F('count') + count, 'amount': F('amount') + amount}
+        if MetricRollup.objects.filter(**lookup).update(**increment):
+            continue
+        try:
+            with transaction.atomic():
+                MetricRollup.objects.create(count=count, amount=amount, **lookup)
+        except IntegrityError:
+            # Строку параллельно создал другой процесс
+            MetricRollup.objects.filter(**lookup).update(**increment)
+
+
+def record_changes(metric: str, changes: Iterable[Tuple[Optional[Dict], Optional[Dict]]]):
+    """Учесть изменения строк без сигналов (bulk_create/bulk_update) после коммита транзакции"""
+    deltas = changes_to_deltas(metric, changes)
+    if deltas:
+        transaction.on_commit(partial(apply_deltas, deltas))
+
+
+# Сигналы: регистрируются в ReportsConfig.ready()
+
+_METRICS_BY_MODEL = {}
+
+
+def _remember_previous(sender, instance, raw=False, **kwargs):
+    instance._rollup_previous = None
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    metric = _METRICS_BY_MODEL[sender]
+    instance._rollup_previous = sender.objects.filter(pk=instance.pk).values(*SOURCES[metric].fields).first()
+
+
+def _on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    metric = _METRICS_BY_MODEL[sender]
+    record_changes(metric, [(getattr(instance, '_rollup_previous', None), snapshot(instance, metric))])
+
+
+def _on_delete(sender, instance, **kwargs):
+    metric = _METRICS_BY_MODEL[sender]
+    record_changes(metric, [(snapshot(instance, metric), None)])
+
+
+def connect_signals():
+    for metric, source in SOURCES.items():
+        model = source.get_model()
+        _METRICS_BY_MODEL[model] = metric
+        uid = f'metric_rollup_{metric}'
+        pre_save.connect(_remember_previous, sender=model, dispatch_uid=f'{uid}_pre')
+        post_save.connect(_on_save, sender=model, dispatch_uid=f'{uid}_post')
+        post_delete.connect(_on_delete, sender=model, dispatch_uid=f'{uid}_delete')
+
+
+# Пересборка
+
+def rebuild(metrics: Optional[Sequence[str]] = None, start: Optional[datetime] = None,
+            end: Optional[datetime] = None, batch_size: int = 1000) -> int:
+    """Пересобрать агрегаты из исходных таблиц (за все время или за сутки [start, end))
+
+    Returns:
+        количество созданных строк MetricRollup
+    """
+    start = floor_bucket(start, 'day') if start else None
+    end = ceil_bucket(end, 'day') if end else None
+    created = 0
+    for metric in metrics or SOURCES:
+        source = SOURCES[metric]
+        rows = source.get_model().objects.all()
+        rollups = MetricRollup.objects.filter(metric=metric)
+        if start:
+            rows = rows.filter(created_at__gte=start)
+            rollups = rollups.filter(bucket_start__gte=start)
+        if end:
+            rows = rows.filter(created_at__lt=end)
+            rollups = rollups.filter(bucket_start__lt=end)
+
+        fields = [field for _, field in source.dimensions]
+        with transaction.atomic():
+            rollups.delete()
+            for granularity, trunc in (('hour', TruncHour), ('day', TruncDay)):
+                grouped = (
+                    rows.annotate(bucket=trunc('created_at'))
+                    .values('bucket', *fields)
+                    .annotate(rows_count=Count('pk'), **({'rows_amount': Sum(source.amount)} if source.amount else {}))
+                    .order_by()
+                )
+                batch = []
+                for group in stream_queryset(grouped):
+                    batch.append(MetricRollup(
+                        metric=metric,
+                        granularity=granularity,
+                        bucket_start=group['bucket'],
+                        count=group['rows_count'],
+                        amount=group.get('rows_amount') or 0,
+                        **_dimension_values(source, group),
+                    ))
+                    if len(batch) >= batch_size:
+                        MetricRollup.objects.bulk_create(batch)
+                        created += len(batch)
+                        batch = []
+                MetricRollup.objects.bulk_create(batch)
+                created += len(batch)
+        logger.info(f'Metric rollups rebuilt for {metric}')
+    return created
+
+
+# Чтение
+
+def _ranges_q(field: str, ranges) -> Optional[Q]:
+    condition = None
+    for low, high in ranges:
+        part = Q(**{f'{field}__lt': high})
+        if low is not None:
+            part &= Q(**{f'{field}__gte': low})
+        condition = part if condition is None else condition | part
+    return condition
+
+
+def _grouped(queryset, fields, **aggregates) -> List[Dict]:
+    if not fields:
+        return [queryset.aggregate(**aggregates)]
+    return list(queryset.values(*fields).annotate(**aggregates).order_by())
+
+
+def _split_period(start: Optional[datetime], end: datetime):
+    """Разбить [start, end) на суточные, часовые и «сырые» (неполные часы) интервалы"""
+    hour_end = floor_bucket(end, 'hour')
+    hour_start = ceil_bucket(start, 'hour') if start else None
+    if hour_start is not None and hour_start >= hour_end:
+        return [], [], [(start, end)]
+
+    raw = []
+    if start is not None and start < hour_start:
+        raw.append((start, hour_start))
+    if hour_end < end:
+        raw.append((hour_end, end))
+
+    day_start = ceil_bucket(hour_start, 'day') if hour_start else None
+    day_end = floor_bucket(hour_end, 'day')
+    if day_start is not None and day_start >= day_end:
+        return [], [(hour_start, hour_end)], raw
+
+    hours = []
+    if hour_start is not None and hour_start < day_start:
+        hours.append((hour_start, day_start))
+    if day_end < hour_end:
+        hours.append((day_end, hour_end))
+    return [(day_start, day_end)], hours, raw
+
+
+def period_querysets(metric: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                     scope: Optional[Q] = None):
+    """Запросы, из которых собирается период [start, end): строки агрегатов (сутки и часы - одним
+    запросом) и строки исходной таблицы за неполные часы на границах; None - часть не нужна
+
+    scope - условие на исходную таблицу, которое агрегаты не различают (например, пользователь):
+    тогда весь период читается из исходной таблицы с этим условием.
+    """
+    end = end or timezone.now()
+    if scope is not None:
+        rows = SOURCES[metric].get_model().objects.filter(scope, created_at__lt=end)
+        return None, rows.filter(created_at__gte=start) if start else rows
+    days, hours, raw = _split_period(start, end)
+    condition = None
+    for granularity, ranges in (('day', days), ('hour', hours)):
+        if ranges:
+            part = Q(granularity=granularity) & _ranges_q('bucket_start', ranges)
+            condition = part if condition is None else condition | part
+    rollups = MetricRollup.objects.filter(condition, metric=metric) if condition is not None else None
+    rows = SOURCES[metric].get_model().objects.filter(_ranges_q('created_at', raw)) if raw else None
+    return rollups, rows
+
+
+def aggregate(metric: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+              group_by: Sequence[str] = (), scope: Optional[Q] = None) -> List[Dict]:
+    """Количество и сумма строк метрики за [start, end) (start=None - за все время) по измерениям
+
+    Returns:
+        [{измерение: значение, ..., 'count': n, 'amount': Decimal}]
+    """
+    source = SOURCES[metric]
+    rollups, raw = period_querysets(metric, start, end, scope)
+    totals = defaultdict(lambda: [0, Decimal('0')])
+
+    if rollups is not None:
+        for row in _grouped(rollups, group_by, rows_count=Sum('count'), rows_amount=Sum('amount')):
+            key = tuple(row[dimension] for dimension in group_by)
+            totals[key][0] += row['rows_count'] or 0
+            totals[key][1] += row['rows_amount'] or 0
+
+    if raw is not None:
+        fields = [source.field(dimension) for dimension in group_by]
+        rows = _grouped(
+            raw, fields, rows_count=Count('pk'), **({'rows_amount': Sum(source.amount)} if source.amount else {}),
+        )
+        for row in rows:
+            key = tuple('' if row[field] is None else str(row[field]) for field in fields)
+            totals[key][0] += row['rows_count'] or 0
+            totals[key][1] += row.get('rows_amount') or 0
+
+    return [
+        {**dict(zip(group_by, key)), 'count': count, 'amount': amount}
+        for key, (count, amount) in totals.items()
+        if count
+    ]
@@ -0,0 +1,22 @@
+from rest_framework import serializers
+from .models import ExportJob
+
+
+class ExportJobSerializer(serializers.ModelSerializer):
+    progress = serializers.FloatField(read_only=True)
+    download_url = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = ExportJob
+        fields = [
+            'id', 'format', 'params', 'status', 'total', 'processed', 'progress',
+            'download_url', 'error', 'created_at', 'started_at', 'finished_at'
+        ]
+        read_only_fields = fields
+    
+    def get_download_url(self, obj):
+        if obj.status != 'completed' or not obj.file:
+            return None
+        url = f'/api/admin/exports/{obj.id}/download/'
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
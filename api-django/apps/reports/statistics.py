@@ -0,0 +1,195 @@
+"""
+Статистика админки за период поверх агрегатов (apps.reports.rollups).
+
+Все KPI метрики считаются одним проходом - условными агрегатами Sum/Count(filter=Q(...))
+в одном запросе, разбивки - одним сгруппированным запросом (aggregate), вместо отдельных
+.count()/.filter(...).count() на каждое число. Временной ряд - те же условные агрегаты,
+сгруппированные по Trunc(day/week/month).
+
+Параметры запроса:
+    period: today, week, month, year, all (по умолчанию all)
+    date_from, date_to: произвольный период (YYYY-MM-DD, date_to включительно), вместо period
+    bucket: day, week, month - добавить в ответ временной ряд KPI (series)
+"""
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from .rollups import SOURCES, aggregate, period_querysets, period_start
+
+BUCKETS = ('day', 'week', 'month')
+
+
+@dataclass(frozen=True)
+class Kpi:
+    """Показатель метрики: количество (count) или сумма (amount) строк, отобранных по измерениям"""
+    value: str = 'count'
+    where: Tuple[Tuple[str, Tuple[str, ...]], ...] = ()
+
+    def condition(self, fields: Optional[Dict[str, str]] = None) -> Optional[Q]:
+        if not self.where:
+            return None
+        return Q(**{f'{fields[name] if fields else name}__in': values for name, values in self.where})
+
+
+def kpi(value: str = 'count', **where) -> Kpi:
+    """KPI: kpi('amount', status='CONFIRMED'), kpi(status=['NEW', 'AUTHORIZING'])"""
+    return Kpi(value, tuple(
+        (name, (values,) if isinstance(values, str) else tuple(values)) for name, values in where.items()
+    ))
+
+
+@dataclass
+class Statistics:
+    period: str
+    start: Optional[datetime]
+    end: datetime
+    bucket: Optional[str]
+    totals: Dict[str, object]
+    series: List[Dict] = field(default_factory=list)
+    rows: Dict[str, List[Dict]] = field(default_factory=dict)
+
+    def response(self, **values) -> Dict:
+        """Тело ответа: период, переданные значения и временной ряд (если запрошен bucket)"""
+        data = {
+            'period': self.period,
+            'date_from': self.start.isoformat() if self.start else None,
+            'date_to': self.end.isoformat(),
+            **values,
+        }
+        if self.bucket:
+            data['bucket'] = self.bucket
+            data['series'] = self.series
+        return data
+
+
+def _parse_date(name: str, value: str) -> datetime:
+    try:
+        return timezone.make_aware(datetime.combine(datetime.strptime(value, '%Y-%m-%d').date(), time.min))
+    except ValueError:
+        raise ValueError(f'{name}: expected date in YYYY-MM-DD format')
+
+
+def resolve_period(params) -> Tuple[str, Optional[datetime], datetime]:
+    """Период запроса: (название, начало или None - за все время, конец)"""
+    now = timezone.now()
+    date_from, date_to = params.get('date_from'), params.get('date_to')
+    if not date_from and not date_to:
+        period = params.get('period', 'all')
+        return period, period_start(period, now), now
+
+    start = _parse_date('date_from', date_from) if date_from else None
+    end = _parse_date('date_to', date_to) + timedelta(days=1) if date_to else now
+    if start is not None and start >= end:
+        raise ValueError('date_from must not be later than date_to')
+    return 'custom', start, end
+
+
+def _kpi_values(metric: str, kpis: Dict[str, Kpi], start, end, bucket, scope: Optional[Q] = None) -> Dict:
+    """KPI метрики по корзинам ряда (ключ None - без ряда): один запрос к агрегатам
+    и, при неполных часах на границах, один к исходной таблице"""
+    source = SOURCES[metric]
+    fields = dict(source.dimensions)
+    rollups, raw = period_querysets(metric, start, end, scope)
+
+    parts = []
+    if rollups is not None:
+        parts.append((rollups, 'bucket_start', {
+            f'kpi_{name}': Sum(item.value, filter=item.condition(), default=0) for name, item in kpis.items()
+        }))
+    if raw is not None:
+        parts.append((raw, 'created_at', {
+            f'kpi_{name}': (
+                Count('pk', filter=item.condition(fields)) if item.value == 'count'
+                else Sum(source.amount, filter=item.condition(fields), default=0)
+            )
+            for name, item in kpis.items()
+        }))
+
+    values = defaultdict(lambda: dict.fromkeys(kpis, 0))
+    for queryset, moment, expressions in parts:
+        if bucket:
+            rows = (
+                queryset.annotate(series_bucket=Trunc(moment, bucket))
+                .values('series_bucket').annotate(**expressions).order_by()
+            )
+        else:
+            rows = [queryset.aggregate(**expressions)]
+        for row in rows:
+            totals = values[row.get('series_bucket')]
+            for name in kpis:
+                totals[name] += row[f'kpi_{name}'] or 0
+    return values
+
+
+def collect_statistics(params, kpis: Dict[str, Dict[str, Kpi]],
+                       breakdowns: Optional[Dict[str, Sequence[str]]] = None,
+                       scopes: Optional[Dict[str, Q]] = None) -> Statistics:
+    """Статистика по параметрам запроса
+
+    Args:
+        params: request.query_params (period / date_from, date_to / bucket)
+        kpis: {метрика: {имя KPI: Kpi}} - имена KPI общие для всех метрик ответа
+        breakdowns: {метрика: измерения} - строки разбивки (aggregate) для breakdown()
+        scopes: {метрика: Q} - фильтры списка, которых нет в агрегатах (например, user_id):
+            такая метрика считается по исходной таблице с фильтром
+
+    Raises:
+        ValueError: некорректный период или bucket
+    """
+    period, start, end = resolve_period(params)
+    bucket = params.get('bucket') or None
+    if bucket is not None and bucket not in BUCKETS:
+        raise ValueError(f'bucket: expected one of {", ".join(BUCKETS)}')
+
+    amounts = {name for items in kpis.values() for name, item in items.items() if item.value == 'amount'}
+    names = [name for items in kpis.values() for name in items]
+    by_bucket = defaultdict(lambda: dict.fromkeys(names, 0))
+    scopes = scopes or {}
+    for metric, items in kpis.items():
+        for key, values in _kpi_values(metric, items, start, end, bucket, scopes.get(metric)).items():
+            by_bucket[key].update(values)
+
+    def output(values):
+        return {name: float(value) if name in amounts else value for name, value in values.items()}
+
+    totals = dict.fromkeys(names, 0)
+    for values in by_bucket.values():
+        for name, value in values.items():
+            totals[name] += value
+    series = [
+        {'bucket': timezone.localtime(key).date().isoformat(), **output(by_bucket[key])}
+        for key in sorted(key for key in by_bucket if key is not None)
+    ]
+    rows = {
+        metric: aggregate(metric, start, end, group_by=tuple(group_by), scope=scopes.get(metric))
+        for metric, group_by in (breakdowns or {}).items()
+    }
+    return Statistics(period, start, end, bucket, output(totals), series, rows)
+
+
+def breakdown(rows: List[Dict], dimension: str, label: Optional[str] = None, order_by: str = 'count',
+              labels: Optional[Dict[str, object]] = None, **where) -> List[Dict]:
+    """Разбивка строк aggregate() по измерению: [{label: значение, 'count', 'total_amount'}]
+
+    labels - замена значений измерения (например, id продукта -> название), where - отбор строк.
+    """
+    totals = defaultdict(lambda: {'count': 0, 'total_amount': Decimal('0')})
+    for row in rows:
+        if any(row[name] not in ((values,) if isinstance(values, str) else values) for name, values in where.items()):
+            continue
+        totals[row[dimension]]['count'] += row['count']
+        totals[row[dimension]]['total_amount'] += row['amount']
+    return sorted(
+        (
+            {label or dimension: labels.get(value) if labels is not None else value, **values}
+            for value, values in totals.items()
+        ),
+        key=lambda item: -item[order_by],
+    )
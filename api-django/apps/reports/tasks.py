@@ -0,0 +1,56 @@
+"""
+Celery tasks отчетов: пересборка агрегатов статистики (apps.reports.rollups)
+"""
+from celery import shared_task
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(name='apps.reports.tasks.rebuild_recent_rollups')
+def rebuild_recent_rollups(days=2):
+    """
+    Пересборка агрегатов за последние сутки из исходных таблиц: устраняет расхождения
+    инкрементального ведения. Запускается через Celery Beat раз в день.
+    """
+    from datetime import timedelta
+    from django.utils import timezone
+    from apps.reports.rollups import floor_bucket, rebuild
+    
+    today = floor_bucket(timezone.now(), 'day')
+    created = rebuild(start=today - timedelta(days=days), end=today)
+    logger.info(f'Metric rollups rebuilt for {days} days: {created} rows')
+    return created
+
+
+@shared_task(name='apps.reports.tasks.run_export_job', acks_late=True)
+def run_export_job(job_id):
+    """
+    Фоновая выгрузка списка админки в CSV/XLSX (ExportJob), ставится action export
+    """
+    from apps.reports.exports import run_export
+    
+    job = run_export(job_id)
+    return {'id': str(job.id), 'rows': job.processed}
+
+
+@shared_task(name='apps.reports.tasks.delete_expired_exports')
+def delete_expired_exports():
+    """
+    Удаление выгрузок старше EXPORT_RETENTION_DAYS вместе с файлами.
+    Запускается через Celery Beat раз в день.
+    """
+    from datetime import timedelta
+    from django.conf import settings
+    from django.utils import timezone
+    from apps.reports.models import ExportJob
+    
+    expired = ExportJob.objects.filter(created_at__lt=timezone.now() - timedelta(days=settings.EXPORT_RETENTION_DAYS))
+    deleted = 0
+    for job in expired.iterator():
+        if job.file:
+            job.file.delete(save=False)
+        job.delete()
+        deleted += 1
+    logger.info(f'Deleted {deleted} expired exports')
+    return deleted
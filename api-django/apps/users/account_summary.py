@@ -0,0 +1,221 @@
+"""
+Поддержка UserAccountSummary: инкрементальные изменения по событиям и сверка.
+
+Вклад строки исходной таблицы в итоги пользователя описывается функцией
+(строка -> (user_id, {поле: значение})). На изменение строки итоги получают разницу
+«новый вклад - старый вклад» одним UPDATE с F() в той же транзакции, поэтому откат
+бизнес-изменения откатывает и итоги. Массовые обновления без сигналов (bulk_update)
+передают разницу явно через apply_deltas.
+"""
+import logging
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, Iterable, Optional, Tuple
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.utils import timezone
+
+from .models import UserAccountSummary
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_FIELDS = ('successful_payments', 'total_spent', 'referral_earned', 'payouts_pending', 'payouts_paid')
+
+# Статусы выплат, резервирующие баланс до выплаты
+PENDING_PAYOUT_STATUSES = ('pending', 'processing')
+
+
+def payment_contribution(user_id, status, amount) -> Tuple[Optional[int], Dict]:
+    if not user_id or status != 'success':
+        return user_id, {}
+    return user_id, {'successful_payments': 1, 'total_spent': Decimal(amount or 0)}
+
+
+def commission_contribution(referrer_id, commission_amount) -> Tuple[Optional[int], Dict]:
+    return referrer_id, {'referral_earned': Decimal(commission_amount or 0)}
+
+
+def payout_contribution(referrer_id, status, amount) -> Tuple[Optional[int], Dict]:
+    if status in PENDING_PAYOUT_STATUSES:
+        return referrer_id, {'payouts_pending': Decimal(amount or 0)}
+    if status == 'paid':
+        return referrer_id, {'payouts_paid': Decimal(amount or 0)}
+    return referrer_id, {}
+
+
+def _instance_contribution(instance):
+    from apps.affiliates.models import Referral, ReferralCommission, ReferralPayout
+    from apps.payments.models import Payment
+
+    if isinstance(instance, Payment):
+        return payment_contribution(instance.user_id, instance.status, instance.amount)
+    if isinstance(instance, ReferralCommission):
+        if not instance.referral_id:
+            return None, {}
+        referral = instance._state.fields_cache.get('referral')
+        if referral is not None and referral.pk == instance.referral_id:
+            referrer_id = referral.referrer_id
+        else:
+            referrer_id = Referral.objects.filter(pk=instance.referral_id).values_list('referrer_id', flat=True).first()
+        return commission_contribution(referrer_id, instance.commission_amount)
+    if isinstance(instance, ReferralPayout):
+        return payout_contribution(instance.referrer_id, instance.status, instance.amount)
+    return None, {}
+
+
+def _merge(target: Dict, user_id, deltas: Dict, sign: int = 1):
+    if not user_id:
+        return
+    for field, value in deltas.items():
+        target[user_id][field] = target[user_id].get(field, 0) + sign * value
+
+
+def apply_deltas(deltas_by_user: Dict[int, Dict]):
+    """Применить изменения итогов: {user_id: {поле: приращение}}"""
+    now = timezone.now()
+    for user_id, deltas in deltas_by_user.items():
+        deltas = {field: value for field, value in deltas.items() if value}
+        if not user_id or not deltas:
+            continue
+        updated = UserAccountSummary.objects.filter(user_id=user_id).update(
+            updated_at=now, **{field: F(field) + value for field, value in deltas.items()}
+        )
+        if not updated:
+            # Итогов еще нет: считаем по исходным таблицам (текущее изменение уже записано)
+            _create_summary(user_id, deltas)
+
+
+def _create_summary(user_id, deltas):
+    try:
+        with transaction.atomic():
+            UserAccountSummary.objects.create(user_id=user_id, **compute_totals([user_id]).get(user_id, {}))
+    except IntegrityError:
+        # Строку параллельно создала другая транзакция - дописываем приращение к ней
+        UserAccountSummary.objects.filter(user_id=user_id).update(
+            **{field: F(field) + value for field, value in deltas.items()}
+        )
+
+
+def compute_totals(user_ids: Iterable[int]) -> Dict[int, Dict]:
+    """Итоги по исходным таблицам для пачки пользователей (по запросу на таблицу)"""
+    from apps.affiliates.models import ReferralCommission, ReferralPayout
+    from apps.payments.models import Payment
+
+    user_ids = list(user_ids)
+    totals = {
+        user_id: {field: 0 if field == 'successful_payments' else Decimal('0') for field in SUMMARY_FIELDS}
+        for user_id in user_ids
+    }
+    for row in (
+        Payment.objects.filter(user_id__in=user_ids, status='success')
+        .values('user_id').annotate(count=Count('id'), total=Sum('amount'))
+    ):
+        totals[row['user_id']].update(successful_payments=row['count'], total_spent=row['total'] or Decimal('0'))
+    for row in (
+        ReferralCommission.objects.filter(referral__referrer_id__in=user_ids)
+        .values('referral__referrer_id').annotate(total=Sum('commission_amount'))
+    ):
+        totals[row['referral__referrer_id']]['referral_earned'] = row['total'] or Decimal('0')
+    for row in (
+        ReferralPayout.objects.filter(referrer_id__in=user_ids)
+        .values('referrer_id', 'status').annotate(total=Sum('amount'))
+    ):
+        _, contribution = payout_contribution(row['referrer_id'], row['status'], row['total'])
+        for field, value in contribution.items():
+            totals[row['referrer_id']][field] += value
+    return totals
+
+
+def get_account_summary(user) -> UserAccountSummary:
+    """Итоги пользователя (создаются по исходным таблицам при первом обращении)"""
+    summary = UserAccountSummary.objects.filter(user=user).first()
+    if summary is None:
+        _create_summary(user.pk, {})
+        summary = UserAccountSummary.objects.get(user=user)
+    return summary
+
+
+def reconcile(user_ids: Iterable[int], fix: bool = True) -> Dict[int, Dict]:
+    """Сверить итоги пачки пользователей с исходными таблицами
+
+    Returns:
+        {user_id: {поле: (в итогах, по таблицам)}} для расхождений (и отсутствующих строк)
+    """
+    user_ids = list(user_ids)
+    expected = compute_totals(user_ids)
+    stored = {summary.user_id: summary for summary in UserAccountSummary.objects.filter(user_id__in=user_ids)}
+    now = timezone.now()
+    mismatches = {}
+    to_create, to_update = [], []
+    for user_id, values in expected.items():
+        summary = stored.get(user_id)
+        if summary is None:
+            mismatches[user_id] = {field: (None, value) for field, value in values.items()}
+            to_create.append(UserAccountSummary(user_id=user_id, reconciled_at=now, **values))
+            continue
+        diff = {
+            field: (getattr(summary, field), value)
+            for field, value in values.items()
+            if getattr(summary, field) != value
+        }
+        if diff:
+            mismatches[user_id] = diff
+            for field, value in values.items():
+                setattr(summary, field, value)
+        summary.reconciled_at = now
+        to_update.append(summary)
+
+    if fix:
+        with transaction.atomic():
+            UserAccountSummary.objects.bulk_create(to_create, ignore_conflicts=True)
+            UserAccountSummary.objects.bulk_update(to_update, list(SUMMARY_FIELDS) + ['reconciled_at'])
+    return mismatches
+
+
+# Сигналы: регистрируются в UsersConfig.ready()
+
+def _remember_previous(sender, instance, raw=False, using=None, **kwargs):
+    """Перед сохранением запомнить вклад строки в том виде, в каком она лежит в БД
+    
+    Внутри транзакции строка блокируется до коммита: параллельное сохранение того же
+    заказа или платежа прочитает уже новое состояние, и дельта не применится дважды.
+    """
+    instance._summary_previous = None
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    queryset = sender.objects.using(using).filter(pk=instance.pk)
+    if transaction.get_connection(using).in_atomic_block:
+        queryset = queryset.select_for_update()
+    previous = queryset.first()
+    if previous is not None:
+        instance._summary_previous = _instance_contribution(previous)
+
+
+def _on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    deltas = defaultdict(dict)
+    previous = getattr(instance, '_summary_previous', None)
+    if previous is not None:
+        _merge(deltas, *previous, sign=-1)
+    _merge(deltas, *_instance_contribution(instance))
+    apply_deltas(deltas)
+
+
+def _on_delete(sender, instance, **kwargs):
+    deltas = defaultdict(dict)
+    _merge(deltas, *_instance_contribution(instance), sign=-1)
+    apply_deltas(deltas)
+
+
+def connect_signals():
+    from apps.affiliates.models import ReferralCommission, ReferralPayout
+    from apps.payments.models import Payment
+
+    for model in (Payment, ReferralCommission, ReferralPayout):
+        uid = f'account_summary_{model.__name__}'
+        pre_save.connect(_remember_previous, sender=model, dispatch_uid=f'{uid}_pre')
+        post_save.connect(_on_save, sender=model, dispatch_uid=f'{uid}_post')
+        post_delete.connect(_on_delete, sender=model, dispatch_uid=f'{uid}_delete')
@@ -3,7 +3,7 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Count, Sum
+from .account_summary import get_account_summary
 from .models import User
 from .serializers import UserSerializer, UserListSerializer
 from apps.orders.models import Order
@@ -42,34 +42,30 @@ class UserAdminViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['get'])
     def statistics(self, request, pk=None):
-        """Статистика по пользователю"""
+        """Статистика по пользователю
+        
+        Суммы - из UserAccountSummary: total_spent - сумма успешных платежей (раньше -
+        сумма заказов CONFIRMED), referrals_earned - сумма начисленных комиссий (раньше -
+        сумма Referral.total_earned).
+        """
         user = self.get_object()
         
-        # Заказы
-        orders = Order.objects.filter(user=user)
-        total_orders = orders.count()
-        total_spent = orders.filter(status='CONFIRMED').aggregate(
-            total=Sum('amount')
-        )['total'] or 0
+        summary = get_account_summary(user)
         
-        # Платежи
-        payments = Payment.objects.filter(user=user)
-        successful_payments = payments.filter(status='success').count()
+        # Заказы
+        total_orders = Order.objects.filter(user=user).count()
         
         # Рефералы
         referrals_count = Referral.objects.filter(referrer=user).count()
-        referrals_earned = Referral.objects.filter(referrer=user).aggregate(
-            total=Sum('total_earned')
-        )['total'] or 0
         
         return Response({
             'user_id': user.id,
             'email': user.email,
             'total_orders': total_orders,
-            'total_spent': float(total_spent),
-            'successful_payments': successful_payments,
+            'total_spent': float(summary.total_spent),
+            'successful_payments': summary.successful_payments,
             'referrals_count': referrals_count,
-            'referrals_earned': float(referrals_earned),
+            'referrals_earned': float(summary.referral_earned),
         })
     
     @action(detail=True, methods=['get'])
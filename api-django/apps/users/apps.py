@@ -6,3 +6,8 @@ class UsersConfig(AppConfig):
     name = 'apps.users'
     verbose_name = 'Пользователи'
 
+    
+    def ready(self):
+        """Подписываем итоги пользователей на изменения платежей и реферальных начислений"""
+        from apps.users.account_summary import connect_signals
+        connect_signals()
@@ -1,7 +1,8 @@
 from rest_framework import views, status
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Count, Sum
+from decimal import Decimal
+from django.db.models import Count, DecimalField, Q, Sum
 from django.utils import timezone
 from .models import User
 from .serializers import UserSerializer
@@ -9,6 +10,7 @@ from apps.products.models import UserProduct
 from apps.orders.models import Order
 from apps.payments.models import Payment
 from apps.affiliates.models import Referral, ReferralCommission
+from apps.common.aggregates import subquery_aggregate
 
 
 class ClientDashboardView(views.APIView):
@@ -18,30 +20,32 @@ class ClientDashboardView(views.APIView):
     def get(self, request):
         user = request.user
         
-        # Статистика продуктов
-        active_products = UserProduct.objects.filter(
-            user=user,
-            status='active'
-        ).count()
-        
-        # Статистика подписок
-        active_subscriptions = UserProduct.objects.filter(
-            user=user,
-            status='active',
-            product__product_type='subscription'
-        ).count()
-        
-        # Статистика платежей
-        total_payments = Payment.objects.filter(user=user, status='success').count()
-        total_spent = Payment.objects.filter(
-            user=user,
-            status='success'
-        ).aggregate(total=Sum('amount'))['total'] or 0
+        # Все счетчики и суммы одним запросом: скалярные подзапросы к строке пользователя
+        # (условная агрегация для продуктов/подписок)
+        stats = User.objects.filter(pk=user.pk).annotate(
+            active_products=subquery_aggregate(
+                UserProduct.objects.filter(status='active'), 'user', Count('id'),
+            ),
+            active_subscriptions=subquery_aggregate(
+                UserProduct.objects.filter(status='active'), 'user',
+                Count('id', filter=Q(product__product_type='subscription')),
+            ),
+            total_payments=subquery_aggregate(
+                Payment.objects.filter(status='success'), 'user', Count('id'),
+            ),
+            referrals_count=subquery_aggregate(Referral.objects.all(), 'referrer', Count('id')),
+            referral_earned=subquery_aggregate(
+                ReferralCommission.objects.all(), 'referral__referrer', Sum('commission_amount'),
+                default=Decimal('0'), output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+        ).values(
+            'active_products', 'active_subscriptions', 'total_payments', 'referrals_count', 'referral_earned',
+        ).get()
         
         # Последние транзакции
         recent_payments = Payment.objects.filter(
             user=user
-        ).select_related('order', 'order__product').order_by('-created_at')[:5]
+        ).select_related('order').order_by('-created_at')[:5]
         
         recent_payments_data = [{
             'id': str(p.id),
@@ -53,26 +57,20 @@ class ClientDashboardView(views.APIView):
             'created_at': p.created_at.isoformat() if p.created_at else None,
         } for p in recent_payments]
         
-        # Реферальная статистика
-        referrals_count = Referral.objects.filter(referrer=user).count()
-        referral_earned = ReferralCommission.objects.filter(
-            referral__referrer=user
-        ).aggregate(total=Sum('commission_amount'))['total'] or 0
-        
         # Уведомления (можно расширить)
         notifications = []
         
         return Response({
             'success': True,
             'balance': 0,  # Можно добавить баланс пользователя
-            'active_products': active_products,
-            'subscriptions': active_subscriptions,
-            'total_payments': total_payments,
+            'active_products': stats['active_products'],
+            'subscriptions': stats['active_subscriptions'],
+            'total_payments': stats['total_payments'],
             'notifications': notifications,
             'recent_transactions': recent_payments_data,
             'referral_stats': {
-                'invites': referrals_count,
-                'earned': float(referral_earned)
+                'invites': stats['referrals_count'],
+                'earned': float(stats['referral_earned'])
             }
         })
 
@@ -0,0 +1,344 @@
+"""
+Реестр шаблонов писем.
+
+Письмо описывается один раз (EmailSpec: тема, заголовок, блоки), из этого описания
+получаются и HTML-, и текстовая часть. При первом использовании шаблон компилируется:
+разметка макета (включая inline CSS) собирается и разбирается на план
+«литерал + переменная», план кешируется на процесс. Отправка письма только
+подставляет переменные получателя (HTML - с экранированием).
+"""
+import html
+import re
+import string
+from dataclasses import dataclass
+from decimal import Decimal
+from functools import lru_cache
+from typing import Dict, FrozenSet, Optional, Tuple
+
+_BOLD = re.compile(r'\*\*(.+?)\*\*')
+_FORMATTER = string.Formatter()
+_FORMAT_SPEC = re.compile(r'[<>=^+\- #0-9,_.a-zA-Z%]*')
+
+FOOTER_HTML = 'С уважением,<br>Команда MiniAppExpert'
+FOOTER_TEXT = 'С уважением,\nКоманда MiniAppExpert'
+
+BRAND_GRADIENT = 'linear-gradient(135deg, #10B981 0%, #0088CC 100%)'
+
+
+def _css(source: str) -> str:
+    """Литерал разметки: фигурные скобки CSS не должны считаться переменными"""
+    return source.replace('{', '{{').replace('}', '}}')
+
+
+def _strong(text: str) -> str:
+    return _BOLD.sub(r'<strong>\1</strong>', text)
+
+
+def _plain(text: str) -> str:
+    return _BOLD.sub(r'\1', text)
+
+
+# Блоки письма. Тексты - format-строки с переменными {name}; **...** - выделение.
+
+@dataclass(frozen=True)
+class P:
+    """Абзац (small - мелкий серый текст)"""
+    text: str
+    small: bool = False
+
+    def html(self, accent):
+        style = ' style="color: #6b7280; font-size: 14px;"' if self.small else ''
+        return f'<p{style}>{_strong(self.text)}</p>'
+
+    def text_part(self):
+        return _plain(self.text)
+
+
+@dataclass(frozen=True)
+class Box:
+    """Карточка со строками «Метка: значение» (и заголовком, если задан)"""
+    title: str
+    rows: Tuple[Tuple[str, str], ...]
+    background: str = '#f9fafb'
+
+    def html(self, accent):
+        title = f'<h3 style="margin-top: 0; color: {accent};">{self.title}</h3>' if self.title else ''
+        rows = ''.join(f'<p style="margin: 5px 0;"><strong>{label}:</strong> {value}</p>' for label, value in self.rows)
+        return (
+            f'<div style="background-color: {self.background}; border-left: 4px solid {accent}; '
+            f'padding: 15px; margin: 20px 0;">{title}{rows}</div>'
+        )
+
+    def text_part(self):
+        lines = [self.title] if self.title else []
+        return '\n'.join(lines + [f'{label}: {value}' for label, value in self.rows])
+
+
+@dataclass(frozen=True)
+class Steps:
+    """Нумерованный список шагов с вводной строкой"""
+    lead: str
+    items: Tuple[str, ...]
+
+    def html(self, accent):
+        items = ''.join(f'<li>{_strong(item)}</li>' for item in self.items)
+        return f'<p>{_strong(self.lead)}</p><ol>{items}</ol>'
+
+    def text_part(self):
+        lines = [_plain(self.lead)]
+        lines += [f'{index}. {_plain(item)}' for index, item in enumerate(self.items, 1)]
+        return '\n'.join(lines)
+
+
+@dataclass(frozen=True)
+class Button:
+    """Кнопка-ссылка (color=None - фирменный градиент)"""
+    text: str
+    url: str
+    color: Optional[str] = None
+
+    def html(self, accent):
+        background = self.color or BRAND_GRADIENT
+        return (
+            f'<div style="text-align: center; margin: 30px 0;">'
+            f'<a href="{self.url}" style="display: inline-block; padding: 15px 40px; background: {background}; '
+            f'color: white; text-decoration: none; border-radius: 8px; font-weight: bold; font-size: 16px;">'
+            f'{self.text}</a></div>'
+        )
+
+    def text_part(self):
+        return f'{self.text}: {self.url}'
+
+
+@dataclass(frozen=True)
+class Callout:
+    """Выделенный блок-предупреждение"""
+    title: str
+    text: str = ''
+    accent: str = '#F59E0B'
+    background: str = '#FFF7ED'
+
+    def html(self, accent):
+        body = f'<p style="margin: 5px 0 0 0; font-size: 14px;">{_strong(self.text)}</p>' if self.text else ''
+        return (
+            f'<div style="background-color: {self.background}; border-left: 4px solid {self.accent}; '
+            f'padding: 15px; margin: 20px 0;">'
+            f'<p style="margin: 0;"><strong>{self.title}</strong></p>{body}</div>'
+        )
+
+    def text_part(self):
+        return '\n'.join(part for part in (self.title, _plain(self.text)) if part)
+
+
+@dataclass(frozen=True)
+class EmailSpec:
+    """Описание письма - единый источник HTML- и текстовой части"""
+    name: str
+    subject: str
+    title: str
+    blocks: Tuple
+    accent: str = '#10B981'
+
+
+# Общий макет писем (шапка, контент, подвал). {title} и {content} - слоты макета.
+_LAYOUT_HTML = _css("""<!DOCTYPE html>
+<html lang="ru">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>""") + '{title}' + _css("""</title>
+    <style>
+        body {
+            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif;
+            line-height: 1.6;
+            color: #333;
+            margin: 0;
+            padding: 0;
+            background-color: #f5f5f5;
+        }
+        .email-container {
+            max-width: 600px;
+            margin: 0 auto;
+            background-color: #ffffff;
+        }
+        .email-header {
+            background: linear-gradient(135deg, #10B981 0%, #0088CC 100%);
+            color: white;
+            padding: 40px 20px;
+            text-align: center;
+        }
+        .email-header h1 {
+            margin: 0;
+            font-size: 28px;
+            font-weight: bold;
+        }
+        .email-content {
+            padding: 40px 30px;
+            background-color: #ffffff;
+        }
+        .email-content p {
+            margin: 15px 0;
+            font-size: 16px;
+            line-height: 1.8;
+        }
+        .email-content strong {
+            color: #0088CC;
+        }
+        .warning-box {
+            background: #fff3cd;
+            border-left: 4px solid #ffc107;
+            padding: 15px;
+            margin: 20px 0;
+            border-radius: 4px;
+        }
+        .warning-box ul {
+            margin: 10px 0;
+            padding-left: 20px;
+        }
+        .warning-box li {
+            margin: 5px 0;
+        }
+        .email-footer {
+            background-color: #f9f9f9;
+            padding: 30px;
+            text-align: center;
+            color: #666;
+            font-size: 14px;
+            border-top: 1px solid #e0e0e0;
+        }
+        .link-text {
+            word-break: break-all;
+            color: #0088CC;
+            font-size: 14px;
+            margin-top: 15px;
+        }
+    </style>
+</head>
+<body>
+    <div class="email-container">
+        <div class="email-header">
+            <h1>""") + '{title}' + _css("""</h1>
+        </div>
+        <div class="email-content">
+            """) + '{content}' + _css("""
+        </div>
+        <div class="email-footer">
+            <p>""") + '{footer}' + _css("""</p>
+            <p style="margin-top: 20px; font-size: 12px; color: #999;">
+                Это автоматическое письмо, пожалуйста, не отвечайте на него.
+            </p>
+        </div>
+    </div>
+</body>
+</html>""")
+
+
+class CompiledTemplate:
+    """Шаблон, скомпилированный в Python-функцию (f-строку) от словаря переменных
+
+    Разметка шаблона становится константами кода, при отрисовке подставляются
+    только переменные (в HTML - с экранированием).
+    """
+
+    def __init__(self, source: str, escape: bool = False, raw: FrozenSet[str] = frozenset()):
+        pieces = []
+        fields = []
+        for literal, field_name, format_spec, conversion in _FORMATTER.parse(source):
+            if literal:
+                pieces.append(repr(literal))
+            if field_name is None:
+                continue
+            if conversion or not field_name.isidentifier():
+                raise ValueError(f'Unsupported template field {{{field_name}}}: only plain names are allowed')
+            if format_spec and not _FORMAT_SPEC.fullmatch(format_spec):
+                raise ValueError(f'Unsupported format spec {{{field_name}:{format_spec}}}')
+            if field_name not in fields:
+                fields.append(field_name)
+            variable = f'v{fields.index(field_name)}'
+            pieces.append('f"{' + variable + (f':{format_spec}' if format_spec else '') + '}"')
+        self.fields = tuple(fields)
+
+        # Каждая переменная читается (и экранируется) один раз, затем одна f-строка
+        lines = ['def render(c):']
+        for index, field_name in enumerate(fields):
+            value = f'c[{field_name!r}]'
+            if escape and field_name not in raw:
+                value = f'_escape({value})'
+            lines.append(f'    v{index} = {value}')
+        lines.append(f"    return {' '.join(pieces) or repr('')}")
+        namespace = {'_escape': _escape}
+        exec(compile('\n'.join(lines), '<email template>', 'exec'), namespace)
+        self.render = namespace['render']
+
+
+def _escape(value):
+    # Числа оставляем как есть: для них в шаблоне бывает формат ({amount:.2f})
+    if isinstance(value, (int, float, Decimal)):
+        return value
+    return html.escape(str(value))
+
+
+def _compile_layout(title: str, content: str, footer: str = FOOTER_HTML, raw=frozenset()) -> CompiledTemplate:
+    # Слоты макета заполняются разметкой шаблона, переменные получателя остаются
+    source = _LAYOUT_HTML.replace('{title}', title).replace('{content}', content).replace('{footer}', footer)
+    return CompiledTemplate(source, escape=True, raw=raw)
+
+
+@dataclass(frozen=True)
+class Compiled:
+    subject: CompiledTemplate
+    html: CompiledTemplate
+    text: CompiledTemplate
+
+
+def compile_spec(spec: EmailSpec) -> Compiled:
+    """Скомпилировать шаблон (без кеша; для отправки - get_compiled)"""
+    content = '\n'.join(block.html(spec.accent) for block in spec.blocks)
+    text = '\n\n'.join([spec.title] + [block.text_part() for block in spec.blocks] + [FOOTER_TEXT])
+    return Compiled(
+        subject=CompiledTemplate(spec.subject),
+        html=_compile_layout(spec.title, content),
+        text=CompiledTemplate(text),
+    )
+
+
+_REGISTRY: Dict[str, EmailSpec] = {}
+
+
+def register(spec: EmailSpec) -> EmailSpec:
+    """Зарегистрировать шаблон письма по имени"""
+    _REGISTRY[spec.name] = spec
+    get_compiled.cache_clear()
+    return spec
+
+
+@lru_cache(maxsize=None)
+def get_compiled(name: str) -> Compiled:
+    """Скомпилированный шаблон (кеш на процесс)"""
+    return compile_spec(_REGISTRY[name])
+
+
+def render(template_name: str, /, **context) -> Tuple[str, str, str]:
+    """Отрисовать письмо: (тема, HTML, текст)"""
+    compiled = get_compiled(template_name)
+    return (
+        compiled.subject.render(context),
+        compiled.html.render(context),
+        compiled.text.render(context).strip(),
+    )
+
+
+def build_message(template_name: str, recipient_email: str, /, **context):
+    """Готовое письмо (EmailMultiAlternatives) по шаблону из реестра"""
+    from .services import build_email_message
+    subject, html_content, plain_text = render(template_name, **context)
+    return build_email_message(subject, html_content, plain_text, recipient_email)
+
+
+# Макет для писем, собирающих HTML вручную (get_email_template)
+_RAW_LAYOUT = _compile_layout('{title}', '{content}', footer='{footer}', raw=frozenset({'content', 'footer'}))
+
+
+def render_layout(title: str, content_html: str, footer_html: str = FOOTER_HTML) -> str:
+    """Общий макет вокруг готового HTML-контента (заголовок экранируется)"""
+    return _RAW_LAYOUT.render({'title': title, 'content': content_html, 'footer': footer_html})
@@ -0,0 +1,137 @@
+"""
+Транспорт исходящей почты: долгоживущее SMTP-соединение на процесс (поток)
+и пакетная отправка писем по одному соединению.
+
+Без пула каждое письмо платит за TCP-подключение, STARTTLS и AUTH. Здесь соединение
+открывается один раз и переиспользуется; перед отправкой после простоя
+(EMAIL_SMTP_HEALTHCHECK_IDLE) оно проверяется командой NOOP, после
+EMAIL_SMTP_MAX_MESSAGES_PER_CONNECTION писем переоткрывается (лимиты почтовых серверов).
+"""
+import logging
+import os
+import smtplib
+import threading
+import time
+from typing import Callable, List, Optional
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Ошибки конкретного письма: соединение живое, повторять через новое не нужно
+MESSAGE_ERRORS = (
+    smtplib.SMTPRecipientsRefused,
+    smtplib.SMTPSenderRefused,
+    smtplib.SMTPDataError,
+    smtplib.SMTPNotSupportedError,
+)
+
+
+class SMTPTransport:
+    """Переиспользуемое SMTP-соединение с проверкой здоровья"""
+
+    def __init__(
+        self,
+        connection_factory: Optional[Callable] = None,
+        max_messages: Optional[int] = None,
+        healthcheck_idle: Optional[float] = None,
+    ):
+        self.connection_factory = connection_factory or (lambda: get_connection(fail_silently=False))
+        self.max_messages = max_messages or settings.EMAIL_SMTP_MAX_MESSAGES_PER_CONNECTION
+        if healthcheck_idle is None:
+            healthcheck_idle = settings.EMAIL_SMTP_HEALTHCHECK_IDLE
+        self.healthcheck_idle = healthcheck_idle
+        self._backend = None
+        self._sent_on_connection = 0
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+
+    def _is_alive(self) -> bool:
+        connection = getattr(self._backend, 'connection', None)
+        if connection is None:
+            return False
+        if time.monotonic() - self._last_used < self.healthcheck_idle:
+            return True
+        try:
+            return connection.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _ensure_connection(self):
+        if (
+            self._backend is not None
+            and self._sent_on_connection < self.max_messages
+            and self._is_alive()
+        ):
+            return self._backend
+        self.close()
+        backend = self.connection_factory()
+        backend.open()
+        self._backend = backend
+        self._sent_on_connection = 0
+        self._last_used = time.monotonic()
+        return backend
+
+    def close(self):
+        """Закрыть соединение (следующая отправка откроет новое)"""
+        if self._backend is not None:
+            try:
+                self._backend.close()
+            except Exception:
+                pass
+        self._backend = None
+
+    def _send(self, message) -> bool:
+        recipients = ', '.join(message.recipients())
+        for attempt in (1, 2):
+            try:
+                backend = self._ensure_connection()
+                sent = backend.send_messages([message])
+                self._sent_on_connection += 1
+                self._last_used = time.monotonic()
+                return bool(sent)
+            except MESSAGE_ERRORS as e:
+                logger.error(f'SMTP rejected message to {recipients}: {e}')
+                return False
+            except (smtplib.SMTPException, OSError) as e:
+                # Соединение оборвалось или не открылось: одна повторная попытка через новое
+                self.close()
+                if attempt == 2:
+                    logger.error(f'SMTP send to {recipients} failed: {e}')
+                    return False
+                logger.warning(f'SMTP connection lost ({e}), reconnecting')
+        return False
+
+    def send(self, message) -> bool:
+        """Отправить одно письмо (EmailMessage) через общее соединение"""
+        with self._lock:
+            return self._send(message)
+
+    def send_many(self, messages) -> List[bool]:
+        """Отправить пачку писем подряд по одному соединению, результат по каждому письму"""
+        with self._lock:
+            return [self._send(message) for message in messages]
+
+
+_local = threading.local()
+
+
+def get_transport() -> SMTPTransport:
+    """SMTP-транспорт текущего процесса и потока"""
+    transport = getattr(_local, 'transport', None)
+    if transport is None or getattr(_local, 'pid', None) != os.getpid():
+        transport = SMTPTransport()
+        _local.transport = transport
+        _local.pid = os.getpid()
+    return transport
+
+
+def send_message(message) -> bool:
+    """Отправить письмо через долгоживущее SMTP-соединение"""
+    return get_transport().send(message)
+
+
+def send_many(messages) -> List[bool]:
+    """Отправить пачку писем по одному SMTP-соединению"""
+    return get_transport().send_many(messages)
@@ -0,0 +1,51 @@
+"""
+Бенчмарк отрисовки писем: компиляция шаблона (макет с inline CSS) на каждое письмо против
+скомпилированного и закешированного шаблона из реестра (apps.users.email_templates).
+"""
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from apps.users import email_templates
+from apps.users.services import SUBSCRIPTION_REMINDER
+
+
+class Command(BaseCommand):
+    help = 'Измеряет скорость отрисовки писем-напоминаний о продлении подписки'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--emails', type=int, default=10_000, help='Количество писем на режим')
+
+    def handle(self, *args, **options):
+        total = options['emails']
+        contexts = [
+            {
+                'name': f'Клиент {index}',
+                'days_before': 3,
+                'product': f'Подписка <Pro> #{index % 50}',
+                'amount': Decimal('990.00') + index % 7,
+                'currency': 'RUB',
+                'renewal_date': '21.10.2026',
+                'cabinet_url': 'https://miniapp.expert/cabinet.html#subscriptions',
+            }
+            for index in range(total)
+        ]
+
+        def per_message(context):
+            compiled = email_templates.compile_spec(SUBSCRIPTION_REMINDER)
+            return compiled.subject.render(context), compiled.html.render(context), compiled.text.render(context)
+
+        def cached(context):
+            return email_templates.render(SUBSCRIPTION_REMINDER.name, **context)
+
+        self.stdout.write(f'Писем: {total}, размер HTML: {len(cached(contexts[0])[1])} символов')
+        self.stdout.write('\n' + '=' * 60)
+        self.stdout.write(f'{"режим":<30}{"время, с":>10}{"писем/с":>12}{"мкс/письмо":>12}')
+        for label, render in (('компиляция на каждое письмо', per_message), ('реестр (кеш)', cached)):
+            started = time.perf_counter()
+            for context in contexts:
+                render(context)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'{label:<30}{elapsed:>10.2f}{total / elapsed:>12.0f}{elapsed / total * 1e6:>12.1f}')
+        self.stdout.write('=' * 60)
@@ -0,0 +1,164 @@
+"""
+Бенчмарк отправки писем: новое SMTP-соединение (TCP + STARTTLS + AUTH) на каждое письмо
+против пакетной отправки по одному соединению (apps.users.email_transport).
+Работает против локального stub SMTP-сервера, наружу письма не уходят.
+"""
+import socketserver
+import ssl
+import tempfile
+import threading
+import time
+
+from django.core.mail import EmailMultiAlternatives
+from django.core.mail.backends.smtp import EmailBackend
+from django.core.management.base import BaseCommand
+
+from apps.payments.management.commands.benchmark_tbank_http import _self_signed_cert
+from apps.users.email_transport import SMTPTransport
+
+
+class _StubSMTPHandler(socketserver.StreamRequestHandler):
+    """Минимальный ESMTP: EHLO, STARTTLS, AUTH, MAIL/RCPT/DATA, NOOP, RSET, QUIT"""
+
+    # Без TCP_NODELAY замер упирается в delayed ACK, а не в рукопожатия
+    disable_nagle_algorithm = True
+    ssl_context = None
+    latency = 0.0
+
+    def _reply(self, *lines):
+        if self.latency:
+            time.sleep(self.latency)
+        payload = ''.join(
+            f'{line[:3]}{"-" if index < len(lines) - 1 else " "}{line[4:]}\r\n'
+            for index, line in enumerate(lines)
+        )
+        self.wfile.write(payload.encode('ascii'))
+        self.wfile.flush()
+
+    def _start_tls(self):
+        self.connection = self.ssl_context.wrap_socket(self.request, server_side=True)
+        self.rfile = self.connection.makefile('rb')
+        self.wfile = self.connection.makefile('wb')
+
+    def handle(self):
+        tls = False
+        self._reply('220 stub ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', 'replace').strip().split(' ', 1)[0].upper()
+            if command in ('EHLO', 'HELO'):
+                extensions = ['250 stub', '250 8BITMIME', '250 AUTH PLAIN']
+                if not tls and self.ssl_context:
+                    extensions.append('250 STARTTLS')
+                self._reply(*extensions)
+            elif command == 'STARTTLS':
+                self._reply('220 Ready to start TLS')
+                self._start_tls()
+                tls = True
+            elif command == 'AUTH':
+                self._reply('235 Authentication successful')
+            elif command == 'DATA':
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                self._reply('250 OK queued')
+            elif command == 'QUIT':
+                self._reply('221 Bye')
+                return
+            else:
+                # MAIL, RCPT, RSET, NOOP
+                self._reply('250 OK')
+
+
+class _StubSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _StubEmailBackend(EmailBackend):
+    """SMTP-бэкенд для stub-сервера: самоподписанный сертификат не проверяется"""
+
+    @property
+    def ssl_context(self):
+        # Как у Django (SSLContext без загрузки системных CA), но без проверки сертификата
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        return context
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает пропускную способность отправки писем с пакетной отправкой и без нее (stub SMTP)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=500, help='Количество писем на режим')
+        parser.add_argument('--latency-ms', type=float, default=0, help='Искусственная задержка каждого ответа stub-сервера')
+        parser.add_argument('--no-tls', action='store_true', help='Stub-сервер без STARTTLS')
+
+    def handle(self, *args, **options):
+        total = options['messages']
+        _StubSMTPHandler.latency = options['latency_ms'] / 1000.0
+        tmpdir = tempfile.TemporaryDirectory()
+        if not options['no_tls']:
+            cert_path, key_path = _self_signed_cert(tmpdir.name)
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(cert_path, key_path)
+            _StubSMTPHandler.ssl_context = context
+
+        server = _StubSMTPServer(('127.0.0.1', 0), _StubSMTPHandler)
+        port = server.server_address[1]
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        def make_backend():
+            return _StubEmailBackend(
+                host='127.0.0.1',
+                port=port,
+                username='bench',
+                password='bench',
+                use_tls=not options['no_tls'],
+                use_ssl=False,
+                timeout=10,
+                fail_silently=False,
+            )
+
+        self.stdout.write(
+            f'Stub SMTP: 127.0.0.1:{port}, писем: {total}, '
+            f'STARTTLS: {"нет" if options["no_tls"] else "да"}, задержка ответа: {options["latency_ms"]} мс'
+        )
+
+        messages = [self._message(index) for index in range(total)]
+        try:
+            results = []
+            for label, send in (
+                ('соединение на письмо', lambda: [make_backend().send_messages([m]) for m in messages]),
+                ('одно соединение', lambda: SMTPTransport(
+                    connection_factory=make_backend, max_messages=total, healthcheck_idle=30,
+                ).send_many(messages)),
+            ):
+                started = time.perf_counter()
+                sent = send()
+                elapsed = time.perf_counter() - started
+                results.append((label, sum(1 for ok in sent if ok), elapsed))
+        finally:
+            server.shutdown()
+            server.server_close()
+            tmpdir.cleanup()
+
+        self.stdout.write('\n' + '=' * 60)
+        self.stdout.write(f'{"режим":<24}{"отправлено":>12}{"время, с":>10}{"писем/с":>12}')
+        for label, sent, elapsed in results:
+            self.stdout.write(f'{label:<24}{sent:>12}{elapsed:>10.2f}{sent / elapsed:>12.1f}')
+        self.stdout.write('=' * 60)
+
+    def _message(self, index):
+        message = EmailMultiAlternatives(
+            subject=f'Напоминание о продлении подписки #{index}',
+            body='Здравствуйте!\n\nНапоминаем о предстоящем продлении подписки.',
+            from_email='MiniAppExpert <no-reply@miniapp.expert>',
+            to=[f'bench-{index}@bench.local'],
+        )
+        message.attach_alternative('<p>Здравствуйте!</p><p>Напоминаем о предстоящем продлении подписки.</p>', 'text/html')
+        return message
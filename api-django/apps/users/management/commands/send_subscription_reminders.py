@@ -6,7 +6,8 @@ from django.utils import timezone
 from datetime import timedelta
 from apps.users.models import User
 from apps.products.models import UserProduct
-from apps.users.services import send_subscription_reminder_email
+from apps.users.services import build_subscription_reminder_email, send_bulk_emails
+from apps.common.batching import iter_chunks
 
 
 class Command(BaseCommand):
@@ -24,21 +25,58 @@ class Command(BaseCommand):
         days_before = options['days_before']
         target_date = timezone.now() + timedelta(days=days_before)
         
+        # Границы целевого дня в текущей таймзоне (как у end_date__date), но диапазоном,
+        # чтобы выборка шла по индексу next_charge_at
+        day_start = timezone.localtime(target_date).replace(hour=0, minute=0, second=0, microsecond=0)
+        day_end = day_start + timedelta(days=1)
+        
         # Находим все активные подписки, которые истекают через указанное количество дней
         user_products = UserProduct.objects.filter(
             status='active',
-            product__product_type='subscription',
-            end_date__date=target_date.date()
+            next_charge_at__gte=day_start,
+            next_charge_at__lt=day_end,
         ).select_related('user', 'product')
         
-        self.stdout.write(f'Найдено {user_products.count()} подписок, истекающих через {days_before} дня(ей)')
+        self.stdout.write(f'Поиск подписок, истекающих через {days_before} дня(ей)...')
         
         sent_count = 0
         error_count = 0
         
-        for user_product in user_products:
+        # Письма пачки уходят одним SMTP-соединением (см. apps.users.email_transport)
+        for chunk in iter_chunks(user_products):
+            outgoing = []
+            for user_product in chunk:
+                try:
+                    message = build_subscription_reminder_email(user_product.user, user_product, days_before)
+                except Exception as e:
+                    error_count += 1
+                    self.stdout.write(
+                        self.style.ERROR(
+                            f'✗ Ошибка при отправке напоминания {user_product.user.email}: {str(e)}'
+                        )
+                    )
+                    continue
+                if message is None:
+                    error_count += 1
+                    self.stdout.write(
+                        self.style.WARNING(
+                            f'⚠ Не удалось отправить: {user_product.user.email} - {user_product.product.name}'
+                        )
+                    )
+                    continue
+                outgoing.append((user_product, message))
+            
+            if not outgoing:
+                continue
             try:
-                if send_subscription_reminder_email(user_product.user, user_product, days_before):
+                results = send_bulk_emails([message for _, message in outgoing])
+            except Exception as e:
+                error_count += len(outgoing)
+                self.stdout.write(self.style.ERROR(f'✗ Ошибка при отправке пачки напоминаний: {str(e)}'))
+                continue
+            
+            for (user_product, _), sent in zip(outgoing, results):
+                if sent:
                     sent_count += 1
                     self.stdout.write(
                         self.style.SUCCESS(
@@ -52,13 +90,6 @@ class Command(BaseCommand):
                             f'⚠ Не удалось отправить: {user_product.user.email} - {user_product.product.name}'
                         )
                     )
-            except Exception as e:
-                error_count += 1
-                self.stdout.write(
-                    self.style.ERROR(
-                        f'✗ Ошибка при отправке напоминания {user_product.user.email}: {str(e)}'
-                    )
-                )
         
         self.stdout.write(
             self.style.SUCCESS(
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.16 on 2026-10-18 12:38
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_has_seen_documents'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(blank=True, default='', max_length=50, verbose_name='Тип письма')),
+                ('provider', models.CharField(choices=[('smtp', 'SMTP'), ('http', 'HTTP API (SendGrid/Mailgun)')], default='smtp', max_length=10)),
+                ('subject', models.CharField(max_length=500)),
+                ('from_email', models.CharField(max_length=255)),
+                ('to_email', models.CharField(max_length=254)),
+                ('body_text', models.TextField(blank=True, default='')),
+                ('body_html', models.TextField(blank=True, default='')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает'), ('sending', 'Отправляется'), ('sent', 'Отправлено'), ('failed', 'Ошибка')], default='pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('claim_token', models.CharField(blank=True, db_index=True, max_length=32, null=True)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Исходящее письмо',
+                'verbose_name_plural': 'Исходящие письма',
+                'db_table': 'email_outbox',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['status', 'provider', 'next_attempt_at'], name='email_outbo_status_3fdab6_idx')],
+            },
+        ),
+    ]
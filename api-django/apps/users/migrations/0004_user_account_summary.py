@@ -0,0 +1,33 @@
+# Generated by Django 4.2.16 on 2026-10-18 12:47
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_email_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserAccountSummary',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='account_summary', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('successful_payments', models.PositiveIntegerField(default=0, verbose_name='Успешных платежей')),
+                ('total_spent', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Оплачено')),
+                ('referral_earned', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Начислено комиссий')),
+                ('payouts_pending', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выплаты в обработке (pending/processing)')),
+                ('payouts_paid', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выплачено')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('reconciled_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Итоги пользователя',
+                'verbose_name_plural': 'Итоги пользователей',
+                'db_table': 'user_account_summaries',
+            },
+        ),
+    ]
@@ -71,8 +71,84 @@ class User(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return self.email
     
+    def get_full_name(self):
+        """Имя для писем и сериализаторов (в AbstractBaseUser этого метода нет)"""
+        return self.name or self.email
+    
     def save(self, *args, **kwargs):
         if not self.referral_code:
             self.referral_code = str(uuid.uuid4())[:8].upper()
         super().save(*args, **kwargs)
 
+
+
+class EmailOutbox(models.Model):
+    """Исходящее письмо в очереди отправки (transactional outbox)
+    
+    Строка пишется в той же транзакции, что и бизнес-изменение: при откате письмо не уйдет,
+    после коммита его гарантированно отправит dispatch_email_outbox (с повторами и backoff).
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Ожидает'),
+        ('sending', 'Отправляется'),
+        ('sent', 'Отправлено'),
+        ('failed', 'Ошибка'),
+    ]
+    PROVIDER_CHOICES = [
+        ('smtp', 'SMTP'),
+        ('http', 'HTTP API (SendGrid/Mailgun)'),
+    ]
+    
+    kind = models.CharField(max_length=50, blank=True, default='', verbose_name='Тип письма')
+    provider = models.CharField(max_length=10, choices=PROVIDER_CHOICES, default='smtp')
+    subject = models.CharField(max_length=500)
+    from_email = models.CharField(max_length=255)
+    to_email = models.CharField(max_length=254)
+    body_text = models.TextField(blank=True, default='')
+    body_html = models.TextField(blank=True, default='')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(blank=True, null=True)
+    claim_token = models.CharField(max_length=32, blank=True, null=True, db_index=True)
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        db_table = 'email_outbox'
+        verbose_name = 'Исходящее письмо'
+        verbose_name_plural = 'Исходящие письма'
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'provider', 'next_attempt_at']),
+        ]
+    
+    def __str__(self):
+        return f"Email {self.id} to {self.to_email}: {self.subject}"
+
+
+class UserAccountSummary(models.Model):
+    """Предрасчитанные итоги пользователя (платежи, реферальные начисления и выплаты)
+    
+    Обновляется инкрементально (apps.users.account_summary) при успешном платеже, начислении
+    комиссии и смене статуса выплаты; сверяется с исходными таблицами ночной задачей.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='account_summary')
+    successful_payments = models.PositiveIntegerField(default=0, verbose_name='Успешных платежей')
+    total_spent = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='Оплачено')
+    referral_earned = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='Начислено комиссий')
+    payouts_pending = models.DecimalField(
+        max_digits=14, decimal_places=2, default=0, verbose_name='Выплаты в обработке (pending/processing)'
+    )
+    payouts_paid = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='Выплачено')
+    updated_at = models.DateTimeField(auto_now=True)
+    reconciled_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        db_table = 'user_account_summaries'
+        verbose_name = 'Итоги пользователя'
+        verbose_name_plural = 'Итоги пользователей'
+    
+    def __str__(self):
+        return f"Summary {self.user_id}: spent {self.total_spent}, earned {self.referral_earned}"
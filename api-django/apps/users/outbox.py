@@ -0,0 +1,232 @@
+"""
+Transactional outbox исходящих писем.
+
+Письмо пишется в таблицу email_outbox в той же транзакции, что и бизнес-изменение
+(enqueue_email), а отправляет его Celery-задача dispatch_email_outbox после коммита:
+пачками, с повторами и экспоненциальным backoff. Одновременно с одним провайдером
+(SMTP / HTTP API) работает не больше EMAIL_OUTBOX_<PROVIDER>_CONCURRENCY диспетчеров.
+"""
+import logging
+import uuid
+from datetime import timedelta
+from typing import Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+# Потолок задержки между попытками отправки (секунды)
+MAX_RETRY_DELAY = 6 * 3600
+
+
+def default_provider() -> str:
+    """Провайдер для новых писем: HTTP API, если заданы ключи, иначе SMTP"""
+    from .smtp_alternatives import http_api_configured
+    return 'http' if http_api_configured() else 'smtp'
+
+
+def provider_concurrency(provider: str) -> int:
+    """Сколько диспетчеров одновременно могут отправлять через провайдера"""
+    if provider == 'http':
+        return settings.EMAIL_OUTBOX_HTTP_CONCURRENCY
+    return settings.EMAIL_OUTBOX_SMTP_CONCURRENCY
+
+
+def _html_part(message) -> str:
+    for content, mimetype in getattr(message, 'alternatives', []):
+        if mimetype == 'text/html':
+            return content
+    return ''
+
+
+def enqueue_emails(items: Iterable[Tuple[str, object]]) -> List[EmailOutbox]:
+    """Поставить письма в outbox в текущей транзакции
+
+    Args:
+        items: пары (тип письма, EmailMessage); получатели уже с учетом тестового режима
+    """
+    provider = default_provider()
+    rows = [
+        EmailOutbox(
+            kind=kind,
+            provider=provider,
+            subject=message.subject,
+            from_email=message.from_email or settings.DEFAULT_FROM_EMAIL,
+            to_email=recipient,
+            body_text=message.body,
+            body_html=_html_part(message),
+        )
+        for kind, message in items
+        if message is not None
+        for recipient in message.to
+    ]
+    if not rows:
+        return rows
+    EmailOutbox.objects.bulk_create(rows)
+    # После коммита (или сразу, вне транзакции); при откате письма не уйдут
+    transaction.on_commit(lambda: schedule_dispatch(provider))
+    return rows
+
+
+def enqueue_email(message, kind: str = '') -> List[EmailOutbox]:
+    """Поставить одно письмо (EmailMessage) в outbox в текущей транзакции"""
+    return enqueue_emails([(kind, message)])
+
+
+def enqueue_plain_email(subject, message, recipient_list, html_message=None, from_email=None, kind=''):
+    """Аналог send_mail через outbox: текстовое письмо (и HTML, если задан) списку получателей"""
+    from .services import build_email_message
+    return enqueue_emails([
+        (kind, build_email_message(subject, html_message or '', message, recipient, from_email))
+        for recipient in recipient_list
+    ])
+
+
+def schedule_dispatch(provider: Optional[str] = None):
+    """Поставить в Celery отправку outbox"""
+    from .tasks import dispatch_email_outbox
+    try:
+        dispatch_email_outbox.delay(provider)
+    except Exception as e:
+        # Письмо уже сохранено в БД, его подберет dispatch_email_outbox по расписанию
+        logger.error(f"Failed to schedule email outbox dispatch: {e}")
+
+
+def _lock_provider(provider: str):
+    """Сериализовать захват пачек одного провайдера (лимит конкурентности без гонок)"""
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', [f'email_outbox:{provider}'])
+
+
+def claim_batch(provider: str, batch_size: Optional[int] = None, now=None) -> List[EmailOutbox]:
+    """Захватить пачку писем к отправке (status=sending, аренда EMAIL_OUTBOX_LEASE_SECONDS)
+
+    Подбирает и письма, аренда которых истекла (диспетчер упал во время отправки).
+    Пустой список - писем нет или с провайдером уже работает максимум диспетчеров.
+    """
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    now = now or timezone.now()
+    with transaction.atomic():
+        _lock_provider(provider)
+        active = (
+            EmailOutbox.objects.filter(provider=provider, status='sending', locked_until__gt=now)
+            .values('claim_token').distinct().count()
+        )
+        if active >= provider_concurrency(provider):
+            return []
+
+        ids = list(
+            EmailOutbox.objects.select_for_update(skip_locked=True)
+            .filter(provider=provider)
+            .filter(
+                Q(status='pending', next_attempt_at__lte=now)
+                | Q(status='sending', locked_until__lte=now)
+            )
+            .order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return []
+        token = uuid.uuid4().hex
+        EmailOutbox.objects.filter(id__in=ids).update(
+            status='sending',
+            claim_token=token,
+            locked_until=now + timedelta(seconds=settings.EMAIL_OUTBOX_LEASE_SECONDS),
+        )
+    return list(EmailOutbox.objects.filter(claim_token=token, status='sending').order_by('id'))
+
+
+def _to_message(row: EmailOutbox):
+    from django.core.mail import EmailMultiAlternatives
+    message = EmailMultiAlternatives(
+        subject=row.subject,
+        body=row.body_text,
+        from_email=row.from_email,
+        to=[row.to_email],
+    )
+    if row.body_html:
+        message.attach_alternative(row.body_html, 'text/html')
+    return message
+
+
+def _deliver(provider: str, rows: List[EmailOutbox]) -> List[bool]:
+    if provider == 'http':
+        from .smtp_alternatives import send_email_via_http_api
+        results = []
+        for row in rows:
+            try:
+                results.append(bool(send_email_via_http_api(
+                    row.subject, row.body_html, row.body_text, row.to_email, row.from_email
+                )))
+            except Exception as e:
+                logger.error(f"HTTP API email to {row.to_email} failed: {e}")
+                results.append(False)
+        return results
+    from .email_transport import send_many
+    # Вся пачка уходит по одному SMTP-соединению
+    return send_many([_to_message(row) for row in rows])
+
+
+def retry_delay(attempts: int) -> int:
+    """Задержка перед следующей попыткой: экспоненциальный backoff с потолком"""
+    return min(MAX_RETRY_DELAY, settings.EMAIL_OUTBOX_RETRY_BASE_SECONDS * 2 ** max(0, attempts - 1))
+
+
+def send_batch(provider: str, rows: List[EmailOutbox], now=None) -> Tuple[int, int]:
+    """Отправить захваченную пачку и записать итоги
+
+    Returns:
+        (sent, failed): отправлено и не отправлено (из них исчерпавшие попытки - status=failed)
+    """
+    try:
+        results = _deliver(provider, rows)
+    except Exception as e:
+        logger.exception(f"Email outbox batch delivery failed: {e}")
+        results = [False] * len(rows)
+
+    now = now or timezone.now()
+    max_attempts = settings.EMAIL_OUTBOX_MAX_ATTEMPTS
+    sent = failed = 0
+    for row, ok in zip(rows, results):
+        row.attempts += 1
+        row.locked_until = None
+        row.claim_token = None
+        if ok:
+            sent += 1
+            row.status = 'sent'
+            row.sent_at = now
+            row.last_error = None
+            continue
+        failed += 1
+        row.last_error = f'{provider} delivery failed (attempt {row.attempts})'
+        if row.attempts >= max_attempts:
+            row.status = 'failed'
+            logger.error(f"Email {row.id} to {row.to_email} failed after {row.attempts} attempts")
+        else:
+            row.status = 'pending'
+            row.next_attempt_at = now + timedelta(seconds=retry_delay(row.attempts))
+
+    EmailOutbox.objects.bulk_update(
+        rows, ['status', 'attempts', 'locked_until', 'claim_token', 'sent_at', 'last_error', 'next_attempt_at']
+    )
+    return sent, failed
+
+
+def dispatch(provider: str, max_batches: Optional[int] = None) -> Tuple[int, int]:
+    """Отправлять пачки писем провайдера, пока очередь не опустеет (или max_batches)"""
+    total_sent = total_failed = batches = 0
+    while max_batches is None or batches < max_batches:
+        rows = claim_batch(provider)
+        if not rows:
+            break
+        sent, failed = send_batch(provider, rows)
+        total_sent += sent
+        total_failed += failed
+        batches += 1
+    return total_sent, total_failed
@@ -87,18 +87,31 @@ def send_email_via_mailgun(subject, html_content, plain_text, recipient_email, f
         return False
 
 
+def sendgrid_configured():
+    return bool(getattr(settings, 'SENDGRID_API_KEY', ''))
+
+
+def mailgun_configured():
+    return bool(getattr(settings, 'MAILGUN_API_KEY', '') and getattr(settings, 'MAILGUN_DOMAIN', ''))
+
+
+def http_api_configured():
+    """Настроен ли хотя бы один HTTP API (ключи в settings по умолчанию пустые)"""
+    return sendgrid_configured() or mailgun_configured()
+
+
 def send_email_via_http_api(subject, html_content, plain_text, recipient_email, from_email=None):
     """
     Универсальная функция для отправки через HTTP API
     Пытается использовать доступные методы по очереди
     """
     # Пробуем SendGrid
-    if hasattr(settings, 'SENDGRID_API_KEY') and settings.SENDGRID_API_KEY:
+    if sendgrid_configured():
         if send_email_via_sendgrid(subject, html_content, plain_text, recipient_email, from_email):
             return True
     
     # Пробуем Mailgun
-    if hasattr(settings, 'MAILGUN_API_KEY') and hasattr(settings, 'MAILGUN_DOMAIN'):
+    if mailgun_configured():
         if send_email_via_mailgun(subject, html_content, plain_text, recipient_email, from_email):
             return True
     
@@ -0,0 +1,68 @@
+"""
+Celery tasks пользователей: отправка писем через outbox (apps.users.outbox), сверка итогов
+"""
+from celery import shared_task
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(name='apps.users.tasks.dispatch_email_outbox')
+def dispatch_email_outbox(provider=None):
+    """
+    Отправка писем из outbox пачками до опустошения очереди.
+    Ставится после коммита транзакции, записавшей письмо, и запускается через
+    Celery Beat каждую минуту (повторы по backoff и письма, поставленные без брокера).
+    """
+    from apps.users.models import EmailOutbox
+    from apps.users.outbox import dispatch
+    
+    if provider:
+        providers = [provider]
+    else:
+        providers = list(
+            EmailOutbox.objects.filter(status__in=['pending', 'sending'])
+            .values_list('provider', flat=True).distinct()
+        )
+    
+    totals = {}
+    for name in providers:
+        sent, failed = dispatch(name)
+        totals[name] = {'sent': sent, 'failed': failed}
+        if sent or failed:
+            logger.info(f'Email outbox dispatch via {name}: sent={sent}, failed={failed}')
+    return totals
+
+
+@shared_task(name='apps.users.tasks.send_email_task')
+def send_email_task(subject, message, recipient_list, html_message=None, from_email=None):
+    """
+    Поставить текстовое письмо в outbox (аналог send_mail).
+    Внутри транзакции надежнее вызывать apps.users.outbox.enqueue_plain_email напрямую.
+    """
+    from apps.users.outbox import enqueue_plain_email
+    
+    rows = enqueue_plain_email(subject, message, recipient_list, html_message=html_message, from_email=from_email)
+    return len(rows)
+
+
+@shared_task(name='apps.users.tasks.reconcile_account_summaries')
+def reconcile_account_summaries():
+    """
+    Сверка предрасчитанных итогов пользователей (UserAccountSummary) с платежами,
+    начислениями и выплатами; расхождения логируются и исправляются.
+    Запускается через Celery Beat раз в день.
+    """
+    from apps.common.batching import iter_chunks
+    from apps.users.account_summary import reconcile
+    from apps.users.models import User
+    
+    checked, fixed = 0, 0
+    for chunk in iter_chunks(User.objects.only('id')):
+        mismatches = reconcile([user.id for user in chunk])
+        checked += len(chunk)
+        fixed += len(mismatches)
+        for user_id, diff in mismatches.items():
+            logger.warning(f'Account summary mismatch for user {user_id}: {diff}')
+    logger.info(f'Account summaries reconciled: checked={checked}, fixed={fixed}')
+    return {'checked': checked, 'fixed': fixed}
@@ -0,0 +1,105 @@
+"""
+Redis в памяти для тестов буферов на Redis stream (apps.audit.buffer, apps.audit.writer).
+
+Поддерживает только команды, которые используют буферы: XADD/XLEN/XRANGE/XDEL, consumer group
+(XGROUP CREATE, XREADGROUP, XAUTOCLAIM, XACK), INCRBY/GET/SET и pipeline. Время простоя
+записей для XAUTOCLAIM считается по clock_ms, который тест сдвигает вручную.
+"""
+import redis
+
+
+class FakeRedis:
+    def __init__(self):
+        self.clock_ms = 1_000_000
+        self.streams = {}
+        self.groups = {}
+        self.values = {}
+        self._sequence = 0
+
+    # Stream
+
+    def xadd(self, stream, fields):
+        self._sequence += 1
+        entry_id = f'{self.clock_ms}-{self._sequence}'.encode()
+        encoded = {key.encode(): value.encode() if isinstance(value, str) else value for key, value in fields.items()}
+        self.streams.setdefault(stream, []).append((entry_id, encoded))
+        return entry_id
+
+    def xlen(self, stream):
+        return len(self.streams.get(stream, []))
+
+    def xrange(self, stream, count=None):
+        return list(self.streams.get(stream, [])[:count])
+
+    def xdel(self, stream, *ids):
+        entries = self.streams.get(stream, [])
+        self.streams[stream] = [entry for entry in entries if entry[0] not in ids]
+        return len(entries) - len(self.streams[stream])
+
+    # Consumer group
+
+    def xgroup_create(self, stream, group, id='0', mkstream=False):
+        if (stream, group) in self.groups:
+            raise redis.ResponseError('BUSYGROUP Consumer Group name already exists')
+        self.streams.setdefault(stream, [])
+        self.groups[(stream, group)] = {'delivered': set(), 'pending': {}}
+        return True
+
+    def xreadgroup(self, group, consumer, streams, count=None, block=None):
+        if block == 0:
+            raise AssertionError('XREADGROUP BLOCK 0 would wait forever')
+        (stream, _), = streams.items()
+        state = self.groups[(stream, group)]
+        entries = [entry for entry in self.streams.get(stream, []) if entry[0] not in state['delivered']][:count]
+        for entry_id, _ in entries:
+            state['delivered'].add(entry_id)
+            state['pending'][entry_id] = (consumer, self.clock_ms)
+        return [[stream.encode(), entries]] if entries else []
+
+    def xautoclaim(self, stream, group, consumer, min_idle_time, start_id='0-0', count=None):
+        state = self.groups[(stream, group)]
+        present = dict(self.streams.get(stream, []))
+        claimed = []
+        for entry_id, (_, delivered_at) in list(state['pending'].items()):
+            if self.clock_ms - delivered_at >= min_idle_time and entry_id in present:
+                state['pending'][entry_id] = (consumer, self.clock_ms)
+                claimed.append((entry_id, present[entry_id]))
+        return [b'0-0', claimed[:count], []]
+
+    def xack(self, stream, group, *ids):
+        pending = self.groups[(stream, group)]['pending']
+        return sum(pending.pop(entry_id, None) is not None for entry_id in ids)
+
+    # Строки
+
+    def incrby(self, key, amount):
+        self.values[key] = int(self.values.get(key, 0)) + amount
+        return self.values[key]
+
+    def set(self, key, value):
+        self.values[key] = value
+        return True
+
+    def get(self, key):
+        value = self.values.get(key)
+        return str(value).encode() if value is not None else None
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return self
+        return call
+
+    def execute(self):
+        results = [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+        self.calls = []
+        return results
@@ -0,0 +1,73 @@
+import threading
+import uuid
+from decimal import Decimal
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+
+from apps.orders.models import Order
+from apps.payments.models import Payment
+from apps.users.models import User, UserAccountSummary
+
+
+def create_payment(**fields):
+    user = User.objects.create_user(email=f"client{uuid.uuid4().hex[:8]}@example.com", password="x")
+    order = Order.objects.create(order_id=f"sum-{uuid.uuid4().hex}", user=user, amount=100)
+    return Payment.objects.create(order=order, user=user, amount=100, **fields)
+
+
+def summary(user_id):
+    return UserAccountSummary.objects.filter(user_id=user_id).values_list('successful_payments', 'total_spent').first()
+
+
+class AccountSummaryTests(TestCase):
+    """Итоги пользователя меняются на разницу нового и прежнего вклада платежа"""
+
+    def test_resave_applies_delta_once(self):
+        payment = create_payment(status='pending')
+        self.assertIsNone(summary(payment.user_id))
+
+        payment.status = 'success'
+        payment.save()
+        payment.save()
+        self.assertEqual(summary(payment.user_id), (1, Decimal('100.00')))
+
+        payment.status = 'refunded'
+        payment.save()
+        self.assertEqual(summary(payment.user_id), (0, Decimal('0.00')))
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_previous_row_read_for_update(self):
+        payment = create_payment(status='success')
+        payment.amount = 150
+        with CaptureQueriesContext(connection) as queries:
+            payment.save()
+        self.assertTrue(any('FOR UPDATE' in query['sql'] for query in queries.captured_queries))
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentAccountSummaryTests(TransactionTestCase):
+    """Параллельные сохранения одного платежа не применяют дельту дважды"""
+
+    def test_parallel_saves(self):
+        payment = create_payment(status='pending')
+        workers = 4
+        barrier = threading.Barrier(workers)
+
+        def confirm():
+            try:
+                barrier.wait()
+                row = Payment.objects.get(pk=payment.pk)
+                row.status = 'success'
+                row.save()
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=confirm) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(summary(payment.user_id), (1, Decimal('100.00')))
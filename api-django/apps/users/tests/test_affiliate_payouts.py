@@ -0,0 +1,121 @@
+import threading
+import uuid
+from decimal import Decimal
+
+from django.db import connection
+from django.test import TransactionTestCase, skipUnlessDBFeature
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient
+
+from apps.affiliates.models import AffiliateBalance, AffiliateLedgerEntry, Referral, ReferralCommission, ReferralPayout
+from apps.orders.models import Order
+from apps.products.models import Product
+from apps.users.models import User
+
+
+def create_partner_with_commission(commission_amount):
+    partner = User.objects.create_user(email=f"partner{uuid.uuid4().hex[:8]}@example.com", password="Test1234")
+    referred = User.objects.create_user(email=f"referred{uuid.uuid4().hex[:8]}@example.com", password="x")
+    referral = Referral.objects.create(referrer=partner, referred_user=referred, status="active")
+    product = Product.objects.create(name="Sub", slug=f"sub-{uuid.uuid4().hex[:8]}", price=990, product_type="subscription")
+    order = Order.objects.create(order_id=f"pay-{uuid.uuid4().hex}", user=referred, product=product, amount=990)
+    ReferralCommission.objects.create(
+        referral=referral, order=order, amount=990, commission_rate=20, commission_amount=commission_amount,
+    )
+    return partner
+
+
+class AffiliateLedgerTests(APITestCase):
+    """Баланс партнера ведется журналом: комиссия, резерв под выплату, возврат резерва"""
+
+    def setUp(self):
+        self.partner = create_partner_with_commission(Decimal("198.00"))
+        self.client = APIClient()
+        self.client.force_authenticate(self.partner)
+
+    def balance(self):
+        return AffiliateBalance.objects.get(referrer=self.partner).balance
+
+    def test_payout_reserves_and_cancel_releases(self):
+        self.assertEqual(self.balance(), Decimal("198.00"))
+
+        resp = self.client.post("/api/client/referrals/request-payout/", {"amount": "100"}, format="json")
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED, resp.data)
+        self.assertEqual(self.balance(), Decimal("98.00"))
+        stats = self.client.get("/api/client/referrals/").json()["stats"]
+        self.assertEqual((stats["available_balance"], stats["withdrawable_balance"]), (198.0, 98.0))
+
+        resp = self.client.post("/api/client/referrals/request-payout/", {"amount": "120"}, format="json")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        for amount in ("-50", "NaN", "Infinity", "abc"):
+            resp = self.client.post("/api/client/referrals/request-payout/", {"amount": amount}, format="json")
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, amount)
+
+        payout = ReferralPayout.objects.get(referrer=self.partner)
+        payout.status = "paid"
+        payout.save()
+        self.assertEqual(self.balance(), Decimal("98.00"))
+        payout.status = "cancelled"
+        payout.save()
+        self.assertEqual(self.balance(), Decimal("198.00"))
+
+        entries = list(AffiliateLedgerEntry.objects.filter(referrer=self.partner).order_by("id"))
+        self.assertEqual(
+            [(entry.entry_type, entry.amount, entry.balance_after) for entry in entries],
+            [
+                ("commission", Decimal("198.00"), Decimal("198.00")),
+                ("payout_reserve", Decimal("-100.00"), Decimal("98.00")),
+                ("payout_release", Decimal("100.00"), Decimal("198.00")),
+            ],
+        )
+
+        resp = self.client.get("/api/client/referrals/")
+        stats = resp.json()["stats"]
+        self.assertEqual((stats["available_balance"], stats["withdrawable_balance"]), (198.0, 198.0))
+
+    def test_commissions_total_is_overall_count(self):
+        referral = Referral.objects.get(referrer=self.partner)
+        product = Product.objects.first()
+        for _ in range(2):
+            order = Order.objects.create(order_id=f"pay-{uuid.uuid4().hex}", product=product, amount=990)
+            ReferralCommission.objects.create(
+                referral=referral, order=order, amount=990, commission_rate=20, commission_amount=198,
+            )
+
+        resp = self.client.get("/api/client/referrals/commissions/", {"page_size": 2, "fields": "id"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK, resp.data)
+        self.assertEqual((len(resp.data["commissions"]), resp.data["total"]), (2, 3))
+        self.assertIsNotNone(resp.data["next"])
+
+
+@skipUnlessDBFeature("has_select_for_update")
+class ConcurrentPayoutTests(TransactionTestCase):
+    """Параллельные заявки на вывод не уводят баланс в минус"""
+
+    def test_parallel_payout_requests_do_not_overdraw(self):
+        partner = create_partner_with_commission(Decimal("1000.00"))
+        workers = 8
+        barrier = threading.Barrier(workers)
+        codes = []
+
+        def request_payout():
+            client = APIClient()
+            client.force_authenticate(partner)
+            try:
+                barrier.wait()
+                resp = client.post("/api/client/referrals/request-payout/", {"amount": "300"}, format="json")
+                codes.append(resp.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=request_payout) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(codes.count(status.HTTP_201_CREATED), 3)
+        self.assertEqual(codes.count(status.HTTP_400_BAD_REQUEST), workers - 3)
+        self.assertEqual(AffiliateBalance.objects.get(referrer=partner).balance, Decimal("100.00"))
+        reserved = sum(payout.amount for payout in ReferralPayout.objects.filter(referrer=partner))
+        self.assertEqual(reserved, Decimal("900.00"))
@@ -0,0 +1,108 @@
+import uuid
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from apps.analytics import funnels
+from apps.analytics.funnels import refresh
+from apps.analytics.models import AnalyticsSession, AnalyticsWatermark
+from apps.audit.models import TrackingEvent
+from apps.orders.models import Order, PreOrder
+from apps.products.models import Product
+from apps.users.models import User
+
+
+class AnalyticsFunnelTests(APITestCase):
+    """Сессии из событий, связь с предзаказом/заказом по cartId и инкрементальная воронка"""
+
+    def setUp(self):
+        product = Product.objects.create(name="Sub", slug=f"sub-{uuid.uuid4().hex[:8]}", price=990)
+        self.pre_order = PreOrder.objects.create(
+            product=product, amount=990, referral_code='PARTNER1', expires_at=timezone.now() + timedelta(hours=1),
+        )
+        self.order = Order.objects.create(
+            order_id=f"an-{uuid.uuid4().hex}", pre_order=self.pre_order, product=product,
+            amount=990, referral_code='PARTNER1',
+        )
+
+        self.start = start = timezone.now() - timedelta(hours=2)
+        events = [
+            ('s1', 0, {}, ''),
+            ('s1', 5, {'pre_order_id': str(self.pre_order.id)}, ''),
+            ('s1', 50, {}, ''),  # пауза больше ANALYTICS_SESSION_TIMEOUT_MINUTES - новая сессия
+            ('s2', 10, {}, 'unknown-cart'),
+            ('', 15, {}, ''),  # без sessionId и userId - не учитывается
+        ]
+        for session_id, minutes, payload, cart_id in events:
+            TrackingEvent.objects.create(
+                event='page_view', session_id=session_id, page='/', payload=payload, cart_id=cart_id,
+                created_at=start + timedelta(minutes=minutes),
+            )
+
+    def test_incremental_funnel(self):
+        result = refresh()
+        self.assertEqual(result['events'], 4)
+        self.assertEqual(AnalyticsSession.objects.count(), 3)
+        converted = AnalyticsSession.objects.get(pre_order=self.pre_order)
+        self.assertEqual((converted.step, converted.order_id, converted.referral_code, converted.events_count),
+                         (AnalyticsSession.STEP_PAYMENT, self.order.id, 'PARTNER1', 2))
+
+        # Повторный запуск не перечитывает уже учтенные события
+        self.assertEqual(refresh()['events'], 0)
+
+        self.order.status = 'CONFIRMED'
+        self.order.save()
+        later = timezone.now() + timedelta(seconds=settings.ANALYTICS_LATENESS_SECONDS + 1)
+        self.assertEqual(refresh(now=later)['orders'], 1)
+        converted.refresh_from_db()
+        self.assertEqual(converted.step, AnalyticsSession.STEP_CONFIRMED)
+
+        admin = User.objects.create_user(email=f"an{uuid.uuid4().hex[:8]}@example.com", password="x", role='admin')
+        self.client.force_authenticate(admin)
+        resp = self.client.get('/api/admin/analytics/sessions/funnel/', {'period': 'all'})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK, resp.data)
+        self.assertEqual([step['count'] for step in resp.data['steps']], [3, 1, 1, 1])
+        self.assertEqual(resp.data['totals']['confirmed_amount'], 990)
+        self.assertEqual(resp.data['referral_stats'][0]['referral_code'], '')
+
+    def watermark(self, source='tracking_events'):
+        return AnalyticsWatermark.objects.get(source=source).position
+
+    @mock.patch.object(funnels, 'CHUNK_SIZE', 2)
+    def test_failed_run_keeps_committed_chunks(self):
+        rebuild_daily = funnels.rebuild_daily
+        with mock.patch.object(funnels, 'rebuild_daily', side_effect=[1, RuntimeError('db is gone')]):
+            with self.assertRaises(RuntimeError):
+                refresh()
+        # Первая пачка (два события s1) сохранена вместе с водяным знаком, вторая откатилась
+        self.assertEqual(self.watermark(), self.start + timedelta(minutes=5))
+        self.assertEqual(list(AnalyticsSession.objects.values_list('events_count', flat=True)), [2])
+
+        with mock.patch.object(funnels, 'rebuild_daily', side_effect=rebuild_daily):
+            self.assertEqual(refresh()['events'], 2)
+        self.assertEqual(AnalyticsSession.objects.count(), 3)
+        self.assertEqual(AnalyticsSession.objects.get(pre_order=self.pre_order).events_count, 2)
+
+    @override_settings(TRACKING_BUFFER_BACKEND='redis')
+    def test_buffer_lag_holds_events_back(self):
+        buffer = mock.Mock()
+        buffer.metrics.return_value = {'lag_seconds': 3 * 60 * 60}
+        with mock.patch.object(funnels, 'get_buffer', return_value=buffer):
+            self.assertEqual(refresh()['events'], 0)
+        # События еще могут лежать в буфере: водяной знак не дошел до них
+        self.assertLess(self.watermark(), self.start)
+
+        buffer.metrics.side_effect = ConnectionError('redis is down')
+        with mock.patch.object(funnels, 'get_buffer', return_value=buffer):
+            self.assertEqual(refresh()['events'], 0)
+        self.assertLess(self.watermark(), self.start)
+
+        buffer.metrics.side_effect = None
+        buffer.metrics.return_value = {'lag_seconds': 0}
+        with mock.patch.object(funnels, 'get_buffer', return_value=buffer):
+            self.assertEqual(refresh()['events'], 4)
@@ -0,0 +1,70 @@
+import json
+import uuid
+from unittest import mock
+
+from django.test import TransactionTestCase, override_settings
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from apps.audit import writer
+from apps.audit.middleware import AuditLogMiddleware
+from apps.audit.models import AuditLog
+from apps.orders.models import Order
+from apps.users.models import User
+from .fake_redis import FakeRedis
+
+
+class OrderUpdateAuditTests(APITestCase):
+    """Аудит изменения заказа в админке: один снимок до и после, режим хранения только изменений"""
+
+    def setUp(self):
+        self.admin = User.objects.create_user(email=f"au{uuid.uuid4().hex[:8]}@example.com", password="x", role='admin')
+        self.client.force_authenticate(self.admin)
+        self.order = Order.objects.create(order_id=f"au-{uuid.uuid4().hex}", amount=990, customer_name='Old')
+
+    @override_settings(AUDIT_LOG_STORAGE='diff')
+    def test_diff_storage(self):
+        resp = self.client.patch(f'/api/admin/orders/{self.order.id}/', {'customer_name': 'New'}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK, resp.data)
+
+        entry = AuditLog.objects.get(entity_type='Order', entity_id=str(self.order.id))
+        self.assertEqual((entry.action, entry.actor_id), ('order_updated', self.admin.id))
+        self.assertEqual(entry.before, {'customer_name': 'Old'})
+        self.assertEqual(entry.after, {'customer_name': 'New'})
+
+
+@override_settings(AUDIT_LOG_WRITER='redis')
+class RedisAuditWriterTests(TransactionTestCase):
+    """Очередь журнала аудита: запись после коммита, сброс пачкой, повтор без дублей"""
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch('redis.Redis.from_url', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(writer._writer.update, pid=None, instance=None)
+        writer._writer.update(pid=None, instance=None)
+
+    def test_queued_entries_flushed_once(self):
+        for index in range(3):
+            AuditLogMiddleware.log('order_updated', 'Order', index, None, before={'a': 1}, after={'a': 2})
+        self.assertEqual(AuditLog.objects.count(), 0)
+        self.assertEqual(self.redis.xlen('audit:log'), 3)
+
+        self.assertEqual(writer.flush(consumer='worker'), 3)
+        self.assertEqual(AuditLog.objects.count(), 3)
+        # Пустая очередь - возврат сразу (без XREADGROUP BLOCK 0)
+        self.assertEqual(writer.flush(consumer='worker'), 0)
+
+    def test_abandoned_batch_reclaimed_without_duplicates(self):
+        AuditLogMiddleware.log('order_updated', 'Order', 1, None, after={'a': 2})
+        queue = writer.get_writer()
+        queue.ensure_group()
+        # Воркер сохранил пачку и упал до XACK: запись остается в очереди
+        (_, entries), = self.redis.xreadgroup(queue.group, 'dead', {queue.stream: '>'}, count=10)
+        writer.persist_rows([json.loads(fields[b'row']) for _, fields in entries])
+
+        self.redis.clock_ms += 61_000
+        self.assertEqual(writer.flush(consumer='worker'), 1)
+        self.assertEqual(AuditLog.objects.count(), 1)
+        self.assertEqual(self.redis.xlen(queue.stream), 0)
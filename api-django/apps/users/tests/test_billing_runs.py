@@ -0,0 +1,176 @@
+import time
+import uuid
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from apps.orders.models import Order
+from apps.payments.billing import RecurringBillingEngine, finish_run, start_or_resume_run
+from apps.payments.models import BillingAttempt, BillingRun, PaymentMethod
+from apps.payments.tasks import process_recurring_payments
+from apps.products.models import Product, UserProduct
+from apps.users.models import User
+
+
+class ResumedBillingRunTests(TestCase):
+    """Продолженный после сбоя прогон дообрабатывается, и в том же запуске начинается прогон на сегодня"""
+
+    def setUp(self):
+        stale = timezone.now() - timedelta(days=1)
+        self.stale_run = BillingRun.objects.create(heartbeat_at=stale)
+        BillingRun.objects.filter(pk=self.stale_run.pk).update(started_at=stale)
+
+    def assert_both_runs_completed(self):
+        self.stale_run.refresh_from_db()
+        self.assertEqual((self.stale_run.status, self.stale_run.resumed_count), ('completed', 1))
+        runs = BillingRun.objects.exclude(pk=self.stale_run.pk)
+        self.assertEqual(runs.count(), 1)
+        self.assertEqual(runs.get().status, 'completed')
+
+    def test_command(self):
+        call_command('process_recurring_payments', stdout=StringIO())
+        self.assert_both_runs_completed()
+
+    def test_task(self):
+        process_recurring_payments()
+        self.assert_both_runs_completed()
+
+
+class FakeTBank:
+    """T-Bank для движка списаний: карты из declined отклоняются, CheckOrder видит прошедшие списания"""
+    terminal_key = 'test-terminal'
+
+    def __init__(self, declined=(), delay=0):
+        self.declined = set(declined)
+        self.delay = delay
+        self.charges = []
+        self.charged_orders = {}
+
+    def charge_mit(self, rebill_id, amount, order_id, **kwargs):
+        time.sleep(self.delay)
+        self.charges.append((rebill_id, order_id))
+        if rebill_id in self.declined:
+            return {'Success': False, 'Status': 'REJECTED', 'Message': 'Insufficient funds'}
+        payment_id = f'pay-{len(self.charges)}'
+        self.charged_orders[order_id] = payment_id
+        return {'Success': True, 'Status': 'CONFIRMED', 'PaymentId': payment_id}
+
+    def check_order(self, order_id):
+        payment_id = self.charged_orders.get(order_id)
+        return {'Success': True, 'Payments': [{'Status': 'CONFIRMED', 'PaymentId': payment_id}] if payment_id else []}
+
+
+class RecurringBillingEngineTests(TestCase):
+    """Списание по прогону: основная и альтернативная карта, продолжение после сбоя, чужая аренда"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email=f"bill{uuid.uuid4().hex[:8]}@example.com", password="x")
+        product = Product.objects.create(
+            name="Sub", slug=f"sub-{uuid.uuid4().hex[:8]}", price=990, product_type='subscription',
+            subscription_period='monthly',
+        )
+        self.card = self.add_card('rebill-main')
+        self.end_date = timezone.now() + timedelta(days=1)
+        self.subscription = UserProduct.objects.create(
+            user=self.user, product=product, status='active', end_date=self.end_date, payment_method=self.card,
+        )
+
+    def add_card(self, rebill_id):
+        return PaymentMethod.objects.create(user=self.user, rebill_id=rebill_id, pan_mask='430000******0777')
+
+    def run_billing(self, tbank):
+        run, _ = start_or_resume_run()
+        result = RecurringBillingEngine(tbank=tbank, run=run, workers=2).run_attempts()
+        return finish_run(run), result
+
+    def test_charge(self):
+        tbank = FakeTBank()
+        run, result = self.run_billing(tbank)
+        self.assertEqual((result.success, result.failed, run.status, run.success_count), (1, 0, 'completed', 1))
+
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.subscription.end_date, self.end_date + timedelta(days=30))
+        attempt = BillingAttempt.objects.get(run=run)
+        self.assertEqual((attempt.status, attempt.order.status, attempt.payment.status), ('success', 'CONFIRMED', 'success'))
+        self.assertEqual(attempt.payment.provider_ref, 'pay-1')
+
+    def test_alternative_card(self):
+        backup = self.add_card('rebill-backup')
+        tbank = FakeTBank(declined={'rebill-main'})
+        _, result = self.run_billing(tbank)
+        self.assertEqual(result.success, 1)
+        self.assertEqual([rebill_id for rebill_id, _ in tbank.charges], ['rebill-main', 'rebill-backup'])
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.subscription.payment_method, backup)
+
+    def test_declined_gives_grace_period(self):
+        _, result = self.run_billing(FakeTBank(declined={'rebill-main'}))
+        self.assertEqual(result.failed, 1)
+        self.subscription.refresh_from_db()
+        self.assertEqual((self.subscription.status, self.subscription.end_date), ('pending', self.end_date))
+
+    def test_resumed_run_does_not_charge_twice(self):
+        tbank = FakeTBank()
+        run, _ = start_or_resume_run()
+        # Прогон упал после Charge, до записи итогов
+        with mock.patch.object(RecurringBillingEngine, '_save_results', side_effect=RuntimeError('worker killed')):
+            with self.assertRaises(RuntimeError):
+                RecurringBillingEngine(tbank=tbank, run=run).run_attempts()
+        self.assertEqual(BillingAttempt.objects.get(run=run).status, 'charging')
+
+        # Упавший движок больше не продлевает heartbeat ни прогона, ни своих попыток
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        BillingRun.objects.filter(pk=run.pk).update(heartbeat_at=an_hour_ago)
+        BillingAttempt.objects.filter(run=run).update(updated_at=an_hour_ago)
+        resumed, is_resumed = start_or_resume_run()
+        self.assertEqual((resumed.pk, is_resumed), (run.pk, True))
+        result = RecurringBillingEngine(tbank=tbank, run=resumed).run_attempts()
+        self.assertEqual(result.success, 1)
+        self.assertEqual(len(tbank.charges), 1)
+        self.assertEqual(Order.objects.get(user=self.user).status, 'CONFIRMED')
+
+    def test_attempt_of_live_engine_is_not_taken_over(self):
+        tbank = FakeTBank()
+        run, _ = start_or_resume_run()
+        with mock.patch.object(RecurringBillingEngine, '_save_results', side_effect=RuntimeError('still running')):
+            with self.assertRaises(RuntimeError):
+                RecurringBillingEngine(tbank=tbank, run=run).run_attempts()
+        attempt = BillingAttempt.objects.get(run=run)
+
+        # Прогон выглядит упавшим, но попытку ее владелец продлевал только что
+        BillingRun.objects.filter(pk=run.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        resumed, _ = start_or_resume_run()
+        result = RecurringBillingEngine(tbank=tbank, run=resumed).run_attempts()
+        self.assertEqual((result.success, result.failed, result.skipped), (0, 0, 0))
+        self.assertEqual(len(tbank.charges), 1)
+        self.assertEqual(BillingAttempt.objects.get(pk=attempt.pk).owner, attempt.owner)
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 1)
+
+    @override_settings(RECURRING_BILLING_HEARTBEAT_SECONDS=0.05)
+    def test_heartbeat_while_charging(self):
+        run, _ = start_or_resume_run()
+        long_ago = timezone.now() - timedelta(hours=1)
+        BillingRun.objects.filter(pk=run.pk).update(heartbeat_at=long_ago)
+        engine = RecurringBillingEngine(tbank=FakeTBank(delay=0.3), run=run)
+        started_at = timezone.now()
+        with mock.patch.object(RecurringBillingEngine, '_save_results'):
+            engine.run_attempts()
+        run.refresh_from_db()
+        attempt = BillingAttempt.objects.get(run=run)
+        self.assertEqual((attempt.status, attempt.owner), ('charging', engine.owner))
+        # Итоги не записывались: оба heartbeat продлены во время списания
+        self.assertGreater(run.heartbeat_at, started_at)
+        self.assertGreaterEqual(attempt.updated_at, started_at + timedelta(seconds=0.05))
+
+    def test_subscription_leased_by_another_run_is_skipped(self):
+        UserProduct.objects.filter(pk=self.subscription.pk).update(
+            billing_locked_until=timezone.now() + timedelta(hours=1),
+        )
+        tbank = FakeTBank()
+        run, result = self.run_billing(tbank)
+        self.assertEqual((result.skipped, run.skipped_count, tbank.charges), (1, 1, []))
+        self.assertEqual(BillingAttempt.objects.get(run=run).status, 'skipped')
@@ -0,0 +1,81 @@
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient
+
+from apps.affiliates.models import Referral, ReferralCommission
+from apps.orders.models import Order
+from apps.payments.models import Payment
+from apps.products.models import Product, UserProduct
+from apps.users.models import User
+
+
+class ClientDashboardQueryTests(APITestCase):
+    """
+    Дашборд клиента собирается за фиксированное число запросов
+    (счетчики одним запросом + последние платежи), независимо от объема данных.
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(email=f"dash{uuid.uuid4().hex[:8]}@example.com", password="Test1234")
+        self.client.force_authenticate(self.user)
+
+        now = timezone.now()
+        subscription = Product.objects.create(
+            name="Sub", slug=f"sub-{uuid.uuid4().hex[:8]}", price=990, product_type="subscription",
+        )
+        one_time = Product.objects.create(
+            name="Once", slug=f"once-{uuid.uuid4().hex[:8]}", price=500, product_type="one_time",
+        )
+        UserProduct.objects.create(user=self.user, product=subscription, status="active", end_date=now + timedelta(days=30))
+        UserProduct.objects.create(user=self.user, product=one_time, status="active")
+        UserProduct.objects.create(user=self.user, product=subscription, status="cancelled")
+
+        for index in range(7):
+            order = Order.objects.create(
+                order_id=f"dash-{uuid.uuid4().hex}", user=self.user, product=subscription,
+                amount=990, description=f"Order {index}",
+            )
+            Payment.objects.create(
+                order=order, user=self.user, amount=990, status="success" if index % 2 == 0 else "failed",
+            )
+
+        for index in range(2):
+            referred = User.objects.create_user(email=f"ref{index}{uuid.uuid4().hex[:6]}@example.com", password="x")
+            referral = Referral.objects.create(referrer=self.user, referred_user=referred, status="active")
+            order = Order.objects.create(
+                order_id=f"dash-{uuid.uuid4().hex}", user=referred, product=subscription, amount=990,
+            )
+            ReferralCommission.objects.create(
+                referral=referral, order=order, amount=990, commission_rate=20, commission_amount=Decimal("198.00"),
+            )
+
+    def test_dashboard_query_count(self):
+        with self.assertNumQueries(2):
+            resp = self.client.get("/api/client/dashboard/")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK, resp.data)
+
+        data = resp.json()
+        self.assertEqual(data["active_products"], 2)
+        self.assertEqual(data["subscriptions"], 1)
+        self.assertEqual(data["total_payments"], 4)
+        self.assertEqual(len(data["recent_transactions"]), 5)
+        self.assertEqual(data["referral_stats"], {"invites": 2, "earned": 396.0})
+
+    def test_dashboard_empty_user(self):
+        user = User.objects.create_user(email=f"empty{uuid.uuid4().hex[:8]}@example.com", password="Test1234")
+        self.client.force_authenticate(user)
+
+        with self.assertNumQueries(2):
+            resp = self.client.get("/api/client/dashboard/")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK, resp.data)
+
+        data = resp.json()
+        self.assertEqual(data["active_products"], 0)
+        self.assertEqual(data["total_payments"], 0)
+        self.assertEqual(data["recent_transactions"], [])
+        self.assertEqual(data["referral_stats"], {"invites": 0, "earned": 0.0})
@@ -0,0 +1,121 @@
+import uuid
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.payments.models_cancellation import CancellationRequest
+from apps.payments.tasks_cancellation import process_expired_cancellation_requests
+from apps.products.models import Product, UserProduct
+from apps.users import outbox
+from apps.users.models import EmailOutbox, User
+from apps.users.outbox import claim_batch, retry_delay, send_batch
+
+
+def create_emails(count, **fields):
+    return EmailOutbox.objects.bulk_create([
+        EmailOutbox(subject='Hi', from_email='noreply@example.com', to_email=f'user{index}@example.com', **fields)
+        for index in range(count)
+    ])
+
+
+@override_settings(
+    EMAIL_OUTBOX_BATCH_SIZE=2, EMAIL_OUTBOX_SMTP_CONCURRENCY=1, EMAIL_OUTBOX_LEASE_SECONDS=300,
+    EMAIL_OUTBOX_RETRY_BASE_SECONDS=60, EMAIL_OUTBOX_MAX_ATTEMPTS=3,
+)
+class EmailOutboxTests(TestCase):
+    """Захват пачек с арендой и лимитом диспетчеров, повторы с экспоненциальным backoff"""
+
+    def test_claim_batch_respects_lease_and_concurrency(self):
+        create_emails(3)
+        now = timezone.now()
+        batch = claim_batch('smtp', now=now)
+        self.assertEqual(len(batch), 2)
+        self.assertEqual({row.status for row in batch}, {'sending'})
+        self.assertEqual(len({row.claim_token for row in batch}), 1)
+        self.assertEqual(batch[0].locked_until, now + timedelta(seconds=300))
+
+        # С провайдером уже работает EMAIL_OUTBOX_SMTP_CONCURRENCY диспетчеров
+        self.assertEqual(claim_batch('smtp', now=now), [])
+        self.assertEqual(claim_batch('http', now=now), [])
+
+        # Аренда истекла (диспетчер упал): письма пачки подбираются снова, первыми
+        later = now + timedelta(seconds=301)
+        reclaimed = claim_batch('smtp', now=later)
+        self.assertEqual([row.id for row in reclaimed], [row.id for row in batch])
+        self.assertNotEqual(reclaimed[0].claim_token, batch[0].claim_token)
+
+    def test_claim_batch_waits_for_next_attempt(self):
+        create_emails(1, next_attempt_at=timezone.now() + timedelta(minutes=5))
+        self.assertEqual(claim_batch('smtp'), [])
+        self.assertEqual(len(claim_batch('smtp', now=timezone.now() + timedelta(minutes=6))), 1)
+
+    def test_send_batch_backoff(self):
+        create_emails(2)
+        now = timezone.now()
+        rows = claim_batch('smtp', now=now)
+        with mock.patch.object(outbox, '_deliver', return_value=[True, False]):
+            self.assertEqual(send_batch('smtp', rows, now=now), (1, 1))
+
+        sent, retried = EmailOutbox.objects.order_by('id')
+        self.assertEqual((sent.status, sent.attempts, sent.sent_at, sent.claim_token), ('sent', 1, now, None))
+        self.assertEqual((retried.status, retried.attempts, retried.locked_until), ('pending', 1, None))
+        self.assertEqual(retried.next_attempt_at, now + timedelta(seconds=60))
+
+        # Задержка удваивается с каждой попыткой, последняя неудача - failed
+        self.assertEqual([retry_delay(attempt) for attempt in (1, 2, 3)], [60, 120, 240])
+        self.assertEqual(retry_delay(100), outbox.MAX_RETRY_DELAY)
+        for attempt in (2, 3):
+            now = retried.next_attempt_at
+            rows = claim_batch('smtp', now=now)
+            self.assertEqual([row.id for row in rows], [retried.id])
+            with mock.patch.object(outbox, '_deliver', side_effect=ConnectionError('smtp is down')):
+                self.assertEqual(send_batch('smtp', rows, now=now), (0, 1))
+            retried.refresh_from_db()
+            self.assertEqual(retried.attempts, attempt)
+        self.assertEqual(retried.status, 'failed')
+        self.assertEqual(claim_batch('smtp', now=now + timedelta(days=1)), [])
+
+
+class OutboxTransactionTests(TestCase):
+    """Письмо об отмене подписки пишется в outbox в одной транзакции с самой отменой"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email=f"client{uuid.uuid4().hex[:8]}@example.com", password="x")
+        product = Product.objects.create(name="Sub", slug=f"sub-{uuid.uuid4().hex[:8]}", price=990, product_type="subscription")
+        self.user_product = UserProduct.objects.create(user=self.user, product=product, status='active')
+        self.client = APIClient(raise_request_exception=False)
+        self.client.force_authenticate(self.user)
+        self.url = f"/api/client/subscriptions/{self.user_product.id}/cancel/"
+
+    def test_cancel_view_rolls_back_without_outbox_row(self):
+        with mock.patch.object(outbox, 'enqueue_emails', side_effect=RuntimeError('outbox is down')):
+            resp = self.client.post(self.url)
+        self.assertEqual(resp.status_code, 500)
+        self.user_product.refresh_from_db()
+        self.assertEqual(self.user_product.status, 'active')
+
+        resp = self.client.post(self.url)
+        self.assertEqual(resp.status_code, 200, resp.data)
+        self.user_product.refresh_from_db()
+        self.assertEqual(self.user_product.status, 'cancelled')
+        self.assertEqual(EmailOutbox.objects.filter(kind='subscription_cancelled').count(), 1)
+
+    def test_expired_request_rolls_back_without_outbox_row(self):
+        request = CancellationRequest.objects.create(
+            user_product=self.user_product, requested_by=self.user, expires_at=timezone.now() - timedelta(minutes=1),
+        )
+        with mock.patch.object(outbox, 'enqueue_emails', side_effect=RuntimeError('outbox is down')):
+            with self.assertRaises(RuntimeError):
+                process_expired_cancellation_requests()
+        request.refresh_from_db()
+        self.user_product.refresh_from_db()
+        self.assertEqual((request.status, self.user_product.status), ('pending', 'active'))
+
+        self.assertEqual(process_expired_cancellation_requests()['processed'], 1)
+        request.refresh_from_db()
+        self.user_product.refresh_from_db()
+        self.assertEqual((request.status, self.user_product.status), ('expired', 'cancelled'))
+        self.assertEqual(EmailOutbox.objects.count(), 1)
@@ -0,0 +1,109 @@
+import csv
+import io
+import shutil
+import tempfile
+import uuid
+from unittest import mock
+
+from django.test import override_settings
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from apps.orders.models import Order
+from apps.reports import exports
+from apps.reports.exports import _build_view, run_export
+from apps.reports.models import ExportJob
+from apps.reports.tasks import run_export_job
+from apps.users.models import User
+
+
+def read_csv(content):
+    return list(csv.reader(io.StringIO(content.decode('utf-8-sig'))))
+
+
+class ExportTests(APITestCase):
+    """Выгрузка списка повторяет фильтры, поиск и сортировку списка; фоновая - только своему автору"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.manager = self.create_user('finance_manager')
+        for email, amount, order_status in (('alice@example.com', 300, 'CONFIRMED'), ('alice@example.com', 100, 'CONFIRMED'),
+                                            ('alice@example.com', 200, 'NEW'), ('bob@example.com', 50, 'CONFIRMED')):
+            Order.objects.create(
+                order_id=f"ex-{uuid.uuid4().hex}", amount=amount, status=order_status, customer_email=email,
+            )
+        self.client.force_authenticate(self.manager)
+        self.params = {'status': 'CONFIRMED', 'search': 'alice', 'ordering': 'amount'}
+
+    def create_user(self, role):
+        return User.objects.create_user(email=f"{role}{uuid.uuid4().hex[:8]}@example.com", password="x", role=role)
+
+    def test_csv_honours_list_filters(self):
+        resp = self.client.get('/api/admin/orders/export/', self.params)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertIn('attachment; filename="orders-', resp['Content-Disposition'])
+        header, *rows = read_csv(b''.join(resp.streaming_content))
+        self.assertEqual(header[:4], ['Номер заказа', 'Создан', 'Статус', 'Сумма'])
+        self.assertEqual([(row[2], row[3], row[7]) for row in rows], [
+            ('CONFIRMED', '100.00', 'alice@example.com'),
+            ('CONFIRMED', '300.00', 'alice@example.com'),
+        ])
+
+    def test_bad_export_format(self):
+        resp = self.client.get('/api/admin/orders/export/', {'export_format': 'pdf'})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(ExportJob.objects.exists())
+
+    def start_async_export(self):
+        with mock.patch.object(run_export_job, 'delay') as delay:
+            resp = self.client.get('/api/admin/orders/export/', {**self.params, 'async': '1'})
+        self.assertEqual(resp.status_code, status.HTTP_202_ACCEPTED, resp.data)
+        job = ExportJob.objects.get(pk=resp.data['id'])
+        delay.assert_called_once_with(str(job.id))
+        return job
+
+    def test_async_export(self):
+        job = self.start_async_export()
+        self.assertEqual(job.params, {key: [value] for key, value in self.params.items()})
+        self.assertEqual((job.status, job.created_by), ('pending', self.manager))
+
+        # Запрос списка восстанавливается из параметров задачи
+        view = _build_view(job)
+        self.assertEqual(
+            list(view.get_export_queryset().values_list('amount', flat=True)), [100, 300],
+        )
+
+        with mock.patch.object(exports, 'PROGRESS_EVERY', 1), \
+                mock.patch.object(ExportJob.objects, 'filter', wraps=ExportJob.objects.filter) as progress:
+            run_export(job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.total, job.processed), ('completed', 2, 2))
+        self.assertGreaterEqual(progress.call_count, 2)
+        with job.file.open('rb') as output:
+            header, *rows = read_csv(output.read())
+        self.assertEqual([row[3] for row in rows], ['100.00', '300.00'])
+
+    def test_download_permissions(self):
+        job = self.start_async_export()
+        resp = self.client.get(f'/api/admin/exports/{job.id}/download/')
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        run_export(job.id)
+
+        resp = self.client.get(f'/api/admin/exports/{job.id}/download/')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(read_csv(b''.join(resp.streaming_content))), 3)
+
+        self.client.force_authenticate(self.create_user('finance_manager'))
+        self.assertEqual(self.client.get(f'/api/admin/exports/{job.id}/download/').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/api/admin/exports/').data['count'], 0)
+
+        self.client.force_authenticate(self.create_user('admin'))
+        self.assertEqual(self.client.get(f'/api/admin/exports/{job.id}/download/').status_code, status.HTTP_200_OK)
+
+        self.client.force_authenticate(self.create_user('client'))
+        self.assertEqual(self.client.get(f'/api/admin/exports/{job.id}/download/').status_code, status.HTTP_403_FORBIDDEN)
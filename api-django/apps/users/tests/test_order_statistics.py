@@ -0,0 +1,34 @@
+import uuid
+
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from apps.orders.models import Order
+from apps.users.models import User
+
+
+class OrderStatisticsScopeTests(APITestCase):
+    """Статистика заказов с user_id считается только по заказам пользователя, а не по агрегатам"""
+
+    def setUp(self):
+        admin = User.objects.create_user(email=f"st{uuid.uuid4().hex[:8]}@example.com", password="x", role='admin')
+        self.buyer = User.objects.create_user(email=f"buyer{uuid.uuid4().hex[:8]}@example.com", password="x")
+        other = User.objects.create_user(email=f"other{uuid.uuid4().hex[:8]}@example.com", password="x")
+        with self.captureOnCommitCallbacks(execute=True):
+            for user, amount, order_status in ((self.buyer, 100, 'CONFIRMED'), (self.buyer, 50, 'NEW'),
+                                               (other, 1000, 'CONFIRMED')):
+                Order.objects.create(
+                    order_id=f"st-{uuid.uuid4().hex}", user=user, amount=amount, status=order_status,
+                )
+        self.client.force_authenticate(admin)
+
+    def test_user_scope(self):
+        resp = self.client.get('/api/admin/orders/statistics/', {'bucket': 'day'})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK, resp.data)
+        self.assertEqual((resp.data['total_orders'], resp.data['total_amount']), (3, 1100))
+
+        resp = self.client.get('/api/admin/orders/statistics/', {'user_id': self.buyer.id, 'bucket': 'day'})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK, resp.data)
+        self.assertEqual((resp.data['total_orders'], resp.data['total_amount'], resp.data['pending_orders']), (2, 100, 1))
+        self.assertEqual(sum(row['total_orders'] for row in resp.data['series']), 2)
+        self.assertEqual({row['status']: row['count'] for row in resp.data['status_stats']}, {'CONFIRMED': 1, 'NEW': 1})
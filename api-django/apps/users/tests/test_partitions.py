@@ -0,0 +1,81 @@
+from datetime import datetime, timezone as dt_timezone
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+
+from apps.audit import partitions
+from apps.audit.partitions import ensure_partitions, expire_partitions, month_start
+
+
+def msk(year, month, day=1):
+    return timezone.make_aware(datetime(year, month, day))
+
+
+def connection():
+    """Соединение PostgreSQL без сервера: выполненный SQL собирается в executed"""
+    conn = mock.MagicMock(vendor='postgresql')
+    conn.ops.quote_name = lambda name: f'"{name}"'
+    conn.executed = conn.cursor.return_value.__enter__.return_value.execute.call_args_list
+    return conn
+
+
+@override_settings(PARTITION_MONTHS_AHEAD=2, PARTITION_RETENTION_ACTION='detach')
+class PartitionMaintenanceTests(SimpleTestCase):
+    """Границы месяцев по TIME_ZONE, создание недостающих секций и отключение истекших"""
+
+    def test_month_start_uses_local_time(self):
+        # 31 марта 22:00 UTC - уже 1 апреля по Москве
+        self.assertEqual(month_start(datetime(2026, 3, 31, 22, tzinfo=dt_timezone.utc)), msk(2026, 4))
+        self.assertEqual(month_start(msk(2026, 11, 15), 2), msk(2027, 1))
+        self.assertEqual(month_start(msk(2026, 1, 31), -1), msk(2025, 12))
+
+    def test_ensure_partitions_skips_covered_months(self):
+        existing = [
+            ('tracking_events_legacy', None, msk(2026, 6)),
+            ('tracking_events_p202606', msk(2026, 6), msk(2026, 7)),
+            ('tracking_events_default', None, None),
+        ]
+        conn = connection()
+        with mock.patch.object(partitions, 'list_partitions', return_value=existing):
+            created = ensure_partitions('tracking_events', now=msk(2026, 5, 20), connection=conn)
+        self.assertEqual(created, ['tracking_events_p202607'])
+        (sql, params), _ = conn.executed[0]
+        self.assertIn('"tracking_events_p202607" PARTITION OF "tracking_events"', sql)
+        self.assertEqual(params, [msk(2026, 7), msk(2026, 8)])
+
+    def test_ensure_partitions_dry_run(self):
+        conn = connection()
+        with mock.patch.object(partitions, 'list_partitions', return_value=[]):
+            created = ensure_partitions('audit_logs', months_ahead=1, now=msk(2026, 12, 5), connection=conn, dry_run=True)
+        self.assertEqual(created, ['audit_logs_p202612', 'audit_logs_p202701'])
+        self.assertEqual(conn.executed, [])
+
+    def test_expire_partitions(self):
+        existing = [
+            ('audit_logs_legacy', None, msk(2025, 2)),
+            ('audit_logs_p202502', msk(2025, 2), msk(2025, 3)),
+            ('audit_logs_p202503', msk(2025, 3), msk(2025, 4)),
+            ('audit_logs_default', None, None),
+        ]
+        conn = connection()
+        with mock.patch.object(partitions, 'list_partitions', return_value=existing):
+            expired = expire_partitions('audit_logs', 12, now=msk(2026, 3, 10), connection=conn)
+            self.assertEqual(expire_partitions('audit_logs', 0, now=msk(2026, 3, 10), connection=conn), [])
+        # Граница - 1 марта 2025: мартовская секция еще в сроке, default не трогается
+        self.assertEqual(expired, ['audit_logs_legacy', 'audit_logs_p202502'])
+        self.assertEqual(
+            [call.args[0] for call in conn.executed],
+            [
+                'ALTER TABLE "audit_logs" DETACH PARTITION "audit_logs_legacy"',
+                'ALTER TABLE "audit_logs" DETACH PARTITION "audit_logs_p202502"',
+            ],
+        )
+
+    def test_expire_partitions_drop(self):
+        conn = connection()
+        with mock.patch.object(partitions, 'list_partitions', return_value=[('t_p202401', msk(2024, 1), msk(2024, 2))]):
+            self.assertEqual(expire_partitions('t', 1, action='drop', now=msk(2024, 5), connection=conn), ['t_p202401'])
+            with self.assertRaises(ValueError):
+                expire_partitions('t', 1, action='truncate', now=msk(2024, 5), connection=conn)
+        self.assertEqual([call.args[0] for call in conn.executed][-1], 'DROP TABLE "t_p202401"')
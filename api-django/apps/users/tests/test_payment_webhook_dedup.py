@@ -0,0 +1,103 @@
+import uuid
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from apps.orders.models import Order
+from apps.payments.models import Payment, PaymentNotification, ProcessedWebhook, Transaction
+from apps.payments.services import TBankService
+from apps.payments.webhooks import PaymentNotificationProcessor, drain_order_notifications
+
+
+class WebhookDedupTests(TestCase):
+    """Повтор уведомления (PaymentId, Status) не обрабатывается второй раз, упавшая обработка - повторяется"""
+
+    def setUp(self):
+        order = Order.objects.create(order_id=f"wh-{uuid.uuid4().hex}", amount=100, status='NEW')
+        Payment.objects.create(order=order, amount=100)
+        self.data = {'OrderId': order.order_id, 'PaymentId': '7001', 'Status': 'REJECTED'}
+        self.order = order
+
+    def test_duplicate_processed_once(self):
+        processor = PaymentNotificationProcessor()
+        with mock.patch.object(PaymentNotificationProcessor, '_process',
+                               autospec=True, side_effect=PaymentNotificationProcessor._process) as handler:
+            processor.process(self.data)
+            processor.process(dict(self.data))
+        self.assertEqual(handler.call_count, 1)
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'REJECTED')
+        self.assertEqual(Payment.objects.get(order=self.order).status, 'failed')
+        self.assertEqual(ProcessedWebhook.objects.get(payment_id='7001', status='REJECTED').hits, 1)
+
+    def test_failed_processing_releases_claim(self):
+        processor = PaymentNotificationProcessor()
+        with mock.patch.object(PaymentNotificationProcessor, '_process', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                processor.process(self.data)
+        self.assertFalse(ProcessedWebhook.objects.exists())
+
+        processor.process(self.data)
+        self.assertEqual(Payment.objects.get(order=self.order).status, 'failed')
+        self.assertEqual(ProcessedWebhook.objects.get(payment_id='7001', status='REJECTED').hits, 0)
+
+    def test_failed_grant_is_retried_on_redelivery(self):
+        self.order.customer_email = 'buyer@example.com'
+        self.order.save()
+        data = {**self.data, 'Status': 'CONFIRMED', 'ReceiptURL': 'https://receipt.example.com/1'}
+        processor = PaymentNotificationProcessor()
+        with mock.patch.object(Transaction.objects, 'get_or_create', side_effect=RuntimeError('db is down')):
+            with self.assertRaises(RuntimeError):
+                processor.process(data)
+        self.assertFalse(ProcessedWebhook.objects.exists())
+        self.assertFalse(Transaction.objects.exists())
+
+        processor.process(dict(data))
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.status, self.order.user.email), ('CONFIRMED', 'buyer@example.com'))
+        self.assertEqual(Transaction.objects.get().payment.order, self.order)
+        self.assertEqual(ProcessedWebhook.objects.get(payment_id='7001', status='CONFIRMED').hits, 0)
+
+
+@override_settings(PAYMENT_NOTIFICATION_MAX_ATTEMPTS=2)
+class DrainNotificationsTests(TestCase):
+    """Консьюмер очереди: упавшая выдача по CONFIRMED повторяется, GetState - до блокировки заказа"""
+
+    def setUp(self):
+        self.order = Order.objects.create(
+            order_id=f"wh-{uuid.uuid4().hex}", amount=100, status='NEW', customer_email='buyer@example.com',
+        )
+        self.payment = Payment.objects.create(order=self.order, amount=100)
+
+    def enqueue(self, **payload):
+        data = {'OrderId': self.order.order_id, 'PaymentId': '7002', 'Status': 'CONFIRMED', **payload}
+        return PaymentNotification.objects.create(
+            order_id=self.order.order_id, payment_id='7002', tbank_status=data['Status'], payload=data,
+        )
+
+    def test_failed_grant_retried_then_failed(self):
+        notification = self.enqueue(ReceiptURL='https://receipt.example.com/2')
+        with mock.patch.object(Transaction.objects, 'get_or_create', side_effect=RuntimeError('db is down')):
+            self.assertEqual(drain_order_notifications(self.order.order_id), (0, True))
+            notification.refresh_from_db()
+            self.assertEqual((notification.status, notification.attempts), ('pending', 1))
+            self.assertEqual(drain_order_notifications(self.order.order_id), (0, False))
+        notification.refresh_from_db()
+        self.assertEqual((notification.status, notification.attempts), ('failed', 2))
+        self.assertIn('db is down', notification.last_error)
+        self.assertFalse(ProcessedWebhook.objects.exists())
+
+    def test_payment_state_prefetched_before_processing(self):
+        notification = self.enqueue()
+        state = {'Success': True, 'Status': 'CONFIRMED', 'ReceiptURL': 'https://receipt.example.com/3'}
+        with mock.patch.object(TBankService, 'get_payment_status', return_value=state) as get_state:
+            self.assertEqual(drain_order_notifications(self.order.order_id), (1, False))
+        # Один GetState до блокировки, обработке чек уже не нужно запрашивать
+        get_state.assert_called_once_with('7002')
+        notification.refresh_from_db()
+        self.payment.refresh_from_db()
+        self.assertEqual(notification.status, 'processed')
+        self.assertNotIn('ReceiptURL', notification.payload)
+        self.assertEqual(self.payment.receipt_url, 'https://receipt.example.com/3')
+        self.assertTrue(Transaction.objects.filter(payment=self.payment).exists())
@@ -0,0 +1,115 @@
+import uuid
+from decimal import Decimal
+
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase
+
+from apps.affiliates.commissions import accrue_commission, accrue_missing_commissions
+from apps.affiliates.models import AffiliateBalance, Referral, ReferralCommission
+from apps.orders.models import Order
+from apps.users.models import User
+
+
+def create_referral_order(partner, order_status='CONFIRMED', amount=1000):
+    buyer = User.objects.create_user(email=f"buyer{uuid.uuid4().hex[:8]}@example.com", password="x")
+    return Order.objects.create(
+        order_id=f"ref-{uuid.uuid4().hex}", user=buyer, referred_by=partner, amount=amount, status=order_status,
+    )
+
+
+class AccrueCommissionTests(TestCase):
+    """Комиссия одна на (реферал, заказ): повтор задачи и добор пропущенных ничего не удваивают"""
+
+    def setUp(self):
+        self.partner = User.objects.create_user(email=f"partner{uuid.uuid4().hex[:8]}@example.com", password="x")
+
+    def test_same_order_accrued_twice(self):
+        order = create_referral_order(self.partner)
+        commission = accrue_commission(order.pk)
+        self.assertEqual(commission.commission_amount, Decimal('200.00'))
+        self.assertIsNone(accrue_commission(order.pk))
+
+        self.assertEqual(ReferralCommission.objects.filter(order=order).count(), 1)
+        referral = Referral.objects.get(referrer=self.partner)
+        self.assertEqual((referral.status, referral.total_earned), ('active', Decimal('200.00')))
+        self.assertEqual(AffiliateBalance.objects.get(referrer=self.partner).balance, Decimal('200.00'))
+
+    def test_not_accrued_for_unconfirmed_or_self_referral(self):
+        self.assertIsNone(accrue_commission(create_referral_order(self.partner, order_status='NEW').pk))
+        own = Order.objects.create(
+            order_id=f"own-{uuid.uuid4().hex}", user=self.partner, referred_by=self.partner, amount=500, status='CONFIRMED',
+        )
+        self.assertIsNone(accrue_commission(own.pk))
+        self.assertFalse(ReferralCommission.objects.exists())
+
+    def test_accrue_missing_commissions(self):
+        accrued_order = create_referral_order(self.partner)
+        accrue_commission(accrued_order.pk)
+        missing = [create_referral_order(self.partner, amount=500) for _ in range(2)]
+        create_referral_order(self.partner, order_status='NEW')
+
+        self.assertEqual(accrue_missing_commissions(dry_run=True), (2, 0))
+        self.assertEqual(accrue_missing_commissions(chunk_size=1), (2, 2))
+        self.assertEqual(accrue_missing_commissions(), (0, 0))
+        self.assertEqual(
+            set(ReferralCommission.objects.values_list('order_id', flat=True)),
+            {accrued_order.pk, *(order.pk for order in missing)},
+        )
+        self.assertEqual(
+            sum(Referral.objects.filter(referrer=self.partner).values_list('total_earned', flat=True)),
+            Decimal('400.00'),
+        )
+
+
+class DuplicateCommissionMigrationTests(TransactionTestCase):
+    """Миграция affiliates 0005 оставляет одну комиссию на заказ: привязанную к выплате, иначе первую"""
+
+    before = [('affiliates', '0004_affiliate_ledger')]
+    after = [('affiliates', '0005_referral_commission_unique_order')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_duplicates_removed(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        # Остальные приложения - в последнем состоянии, affiliates - до 0005
+        nodes = [node for node in executor.loader.graph.leaf_nodes() if node[0] != 'affiliates'] + self.before
+        apps = executor.loader.project_state(nodes).apps
+        HistoricalUser = apps.get_model('users', 'User')
+        HistoricalOrder = apps.get_model('orders', 'Order')
+        HistoricalReferral = apps.get_model('affiliates', 'Referral')
+        HistoricalCommission = apps.get_model('affiliates', 'ReferralCommission')
+        HistoricalPayout = apps.get_model('affiliates', 'ReferralPayout')
+        HistoricalBalance = apps.get_model('affiliates', 'AffiliateBalance')
+
+        partner = HistoricalUser.objects.create(email=f"partner{uuid.uuid4().hex[:8]}@example.com", password="x")
+        buyer = HistoricalUser.objects.create(email=f"buyer{uuid.uuid4().hex[:8]}@example.com", password="x")
+        referral = HistoricalReferral.objects.create(referrer=partner, referred_user=buyer, total_earned=600)
+        payout = HistoricalPayout.objects.create(referrer=partner, amount=200, status='paid')
+        HistoricalBalance.objects.create(referrer=partner, balance=600)
+
+        def commission(order, payout=None):
+            return HistoricalCommission.objects.create(
+                referral=referral, order=order, amount=1000, commission_rate=20, commission_amount=200, payout=payout,
+            )
+
+        paid_order, first_order = (
+            HistoricalOrder.objects.create(order_id=f"dup-{uuid.uuid4().hex}", user=buyer, amount=1000)
+            for _ in range(2)
+        )
+        commission(paid_order)
+        kept_paid = commission(paid_order, payout=payout)
+        kept_first = commission(first_order)
+        commission(first_order)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+
+        self.assertEqual(
+            set(ReferralCommission.objects.values_list('id', flat=True)), {kept_paid.id, kept_first.id},
+        )
+        self.assertEqual(Referral.objects.get(pk=referral.pk).total_earned, Decimal('400.00'))
+        self.assertEqual(AffiliateBalance.objects.get(referrer_id=partner.pk).balance, Decimal('200.00'))
@@ -0,0 +1,90 @@
+import uuid
+from datetime import datetime
+from decimal import Decimal
+
+from django.db.models import Count, Sum
+from django.test import SimpleTestCase
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from apps.orders.models import Order
+from apps.reports.rollups import _split_period, aggregate, rebuild
+from apps.users.models import User
+
+
+def msk(day, hour=0, minute=0):
+    return timezone.make_aware(datetime(2026, 3, day, hour, minute))
+
+
+class SplitPeriodTests(SimpleTestCase):
+    """Период делится на полные сутки, полные часы по краям и неполные часы (исходная таблица)"""
+
+    def test_mid_hour_to_mid_hour(self):
+        days, hours, raw = _split_period(msk(1, 10, 30), msk(4, 15, 20))
+        self.assertEqual(days, [(msk(2), msk(4))])
+        self.assertEqual(hours, [(msk(1, 11), msk(2)), (msk(4), msk(4, 15))])
+        self.assertEqual(raw, [(msk(1, 10, 30), msk(1, 11)), (msk(4, 15), msk(4, 15, 20))])
+
+    def test_short_periods(self):
+        self.assertEqual(_split_period(msk(1, 10, 5), msk(1, 10, 55)), ([], [], [(msk(1, 10, 5), msk(1, 10, 55))]))
+        self.assertEqual(
+            _split_period(msk(1, 10, 30), msk(1, 13, 15)),
+            ([], [(msk(1, 11), msk(1, 13))], [(msk(1, 10, 30), msk(1, 11)), (msk(1, 13), msk(1, 13, 15))]),
+        )
+        self.assertEqual(_split_period(None, msk(3)), ([(None, msk(3))], [], []))
+
+
+class PeriodStatisticsTests(APITestCase):
+    """Агрегаты за произвольный период совпадают с запросом к исходной таблице"""
+
+    orders = [
+        (msk(1, 10, 10), 'CONFIRMED', 10),
+        (msk(1, 10, 40), 'CONFIRMED', 20),
+        (msk(1, 18, 5), 'NEW', 30),
+        (msk(2, 12), 'CONFIRMED', 40),
+        (msk(3, 23, 59), 'REJECTED', 50),
+        (msk(4, 9), 'CONFIRMED', 60),
+        (msk(4, 15, 10), 'NEW', 70),
+        (msk(4, 15, 20), 'CONFIRMED', 80),
+        (msk(5, 1), 'CONFIRMED', 90),
+    ]
+
+    def setUp(self):
+        for created_at, order_status, amount in self.orders:
+            order = Order.objects.create(order_id=f"st-{uuid.uuid4().hex}", amount=amount, status=order_status)
+            Order.objects.filter(pk=order.pk).update(created_at=created_at)
+        rebuild(['orders'])
+        admin = User.objects.create_user(email=f"st{uuid.uuid4().hex[:8]}@example.com", password="x", role='admin')
+        self.client.force_authenticate(admin)
+
+    def test_aggregate_matches_source_table(self):
+        start, end = msk(1, 10, 30), msk(4, 15, 20)
+        expected = {
+            row['status']: (row['count'], row['amount'])
+            for row in Order.objects.filter(created_at__gte=start, created_at__lt=end)
+            .values('status').annotate(count=Count('pk'), amount=Sum('amount')).order_by()
+        }
+        rows = aggregate('orders', start, end, group_by=('status',))
+        self.assertEqual({row['status']: (row['count'], row['amount']) for row in rows}, expected)
+        self.assertEqual(expected['CONFIRMED'], (3, Decimal('120.00')))
+
+    def test_date_range_is_inclusive_with_series(self):
+        resp = self.client.get('/api/admin/orders/statistics/', {
+            'date_from': '2026-03-02', 'date_to': '2026-03-03', 'bucket': 'day',
+        })
+        self.assertEqual(resp.status_code, status.HTTP_200_OK, resp.data)
+        self.assertEqual(resp.data['period'], 'custom')
+        self.assertEqual(
+            (resp.data['total_orders'], resp.data['total_amount'], resp.data['failed_orders']), (2, 40.0, 1),
+        )
+        self.assertEqual(
+            [(row['bucket'], row['total_orders'], row['total_amount']) for row in resp.data['series']],
+            [('2026-03-02', 1, 40.0), ('2026-03-03', 1, 0)],
+        )
+
+    def test_bad_input(self):
+        for params in ({'date_from': '02.03.2026'}, {'bucket': 'hour'},
+                       {'date_from': '2026-03-04', 'date_to': '2026-03-02'}):
+            resp = self.client.get('/api/admin/orders/statistics/', params)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, params)
@@ -0,0 +1,51 @@
+import gzip
+import json
+
+from django.test import override_settings
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from apps.audit.models import TrackingEvent
+
+
+class TrackingEventBatchTests(APITestCase):
+    """Пачки фронтовых событий: форматы тела, gzip и поштучные отклонения"""
+
+    url = '/api/events/batch'
+
+    def test_json_array_with_rejections(self):
+        events = [
+            {'event': 'page_view', 'sessionId': 's1', 'page': '/' + 'x' * 400},
+            'not an object',
+            {'event': {'nested': True}},
+            {'event': 'click', 'data': {'page': '/pricing', 'cartId': 'c1'}},
+            {'event': 'click', 'data': {'text': 'bad\u0000value'}},
+        ]
+        resp = self.client.post(self.url, json.dumps(events), content_type='application/json')
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED, resp.content)
+        self.assertEqual(resp.json()['accepted'], 2)
+        self.assertEqual([item['index'] for item in resp.json()['rejected']], [1, 2, 4])
+
+        page_view = TrackingEvent.objects.get(event='page_view')
+        self.assertEqual(len(page_view.page), 255)
+        self.assertEqual(TrackingEvent.objects.get(event='click').cart_id, 'c1')
+
+    def test_gzip_ndjson(self):
+        lines = '\n'.join([json.dumps({'event': 'page_view', 'session_id': f's{i}'}) for i in range(3)] + ['{broken'])
+        resp = self.client.post(
+            self.url, gzip.compress(lines.encode()), content_type='application/x-ndjson', HTTP_CONTENT_ENCODING='gzip',
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED, resp.content)
+        self.assertEqual(resp.json()['rejected'], [{'index': 3, 'error': 'invalid JSON'}])
+        self.assertEqual(TrackingEvent.objects.filter(event='page_view').count(), 3)
+
+    @override_settings(TRACKING_BATCH_MAX_EVENTS=2, TRACKING_BATCH_MAX_BYTES=200)
+    def test_limits(self):
+        resp = self.client.post(self.url, json.dumps({'events': [{}, {}, {}]}), content_type='application/json')
+        self.assertEqual(resp.json()['accepted'], 2)
+        self.assertEqual(resp.json()['rejected'], [{'index': 2, 'error': 'batch limit exceeded'}])
+
+        bomb = gzip.compress(json.dumps([{'event': 'x' * 1000}]).encode())
+        resp = self.client.post(self.url, bomb, content_type='application/json', HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(TrackingEvent.objects.count(), 2)
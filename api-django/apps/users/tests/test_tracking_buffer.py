@@ -0,0 +1,81 @@
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import TransactionTestCase
+
+from apps.audit import buffer
+from apps.audit.buffer import MemoryBuffer, RedisStreamBuffer, to_row
+from apps.audit.models import TrackingEvent
+from apps.audit.tracking import build_event
+from .fake_redis import FakeRedis
+
+
+def _rows(count):
+    return [to_row(build_event({'event': 'page_view', 'sessionId': f's{index}'})) for index in range(count)]
+
+
+@mock.patch.object(MemoryBuffer, '_ensure_thread')
+class MemoryBufferTests(TransactionTestCase):
+    """Буфер в памяти: переполнение drop/block и возврат пачки при недоступной БД (сброс без потока)"""
+
+    def test_overflow_drop(self, _):
+        memory = MemoryBuffer(max_pending=2, flush_size=100, overflow='drop')
+        self.assertEqual(len(memory.put(_rows(3))), 1)
+        self.assertEqual((memory.accepted, memory.dropped), (2, 1))
+
+    def test_overflow_block_returns_rows_after_timeout(self, _):
+        memory = MemoryBuffer(max_pending=2, flush_size=100, overflow='block', block_timeout=10)
+        self.assertEqual(len(memory.put(_rows(3))), 1)
+        # block не отбрасывает: не поместившееся сохраняет вызывающий (submit)
+        self.assertEqual(memory.dropped, 0)
+
+    def test_batch_requeued_after_database_error(self, _):
+        memory = MemoryBuffer(flush_size=100)
+        rows = _rows(2)
+        memory.put(rows)
+        with mock.patch.object(buffer, 'persist_rows', side_effect=OperationalError('database is down')):
+            memory.flush_all()
+        self.assertEqual(memory.metrics()['pending'], 2)
+        self.assertEqual([row for _, row in memory._items], rows)
+
+        memory.flush_all()
+        self.assertEqual(TrackingEvent.objects.count(), 2)
+        self.assertEqual((memory.metrics()['pending'], memory.flushed), (0, 2))
+
+
+class RedisStreamBufferTests(TransactionTestCase):
+    """Буфер в Redis stream: сброс без ожидания, переполнение и события упавшего флашера"""
+
+    def setUp(self):
+        self.client = FakeRedis()
+        self.stream = RedisStreamBuffer(client=self.client, stream='test:events', max_pending=10, overflow='drop')
+        self.stream.ensure_group()
+
+    def test_flush_and_drop(self):
+        self.assertEqual(self.stream.put(_rows(3)), [])
+        self.assertEqual(len(self.stream.put(_rows(8))), 8)
+        self.assertEqual(self.stream.flush('a', block_ms=0), 3)
+        # Пустой stream: возврат сразу, без XREADGROUP BLOCK 0
+        self.assertEqual(self.stream.flush('a', block_ms=0), 0)
+
+        metrics = self.stream.metrics()
+        self.assertEqual((metrics['pending'], metrics['accepted'], metrics['dropped'], metrics['flushed']), (0, 3, 8, 3))
+        self.assertEqual(TrackingEvent.objects.count(), 3)
+
+    def test_abandoned_entries_are_reclaimed(self):
+        self.stream.put(_rows(2))
+        # Флашер прочитал пачку и упал до XACK
+        self.client.xreadgroup(self.stream.group, 'dead', {self.stream.stream: '>'}, count=10)
+        self.assertEqual(self.stream.flush('b', block_ms=0), 0)
+
+        self.client.clock_ms += 61_000
+        self.assertEqual(self.stream.flush('b', block_ms=0), 2)
+        self.assertEqual(TrackingEvent.objects.count(), 2)
+        self.assertEqual(self.client.xlen(self.stream.stream), 0)
+
+    def test_flusher_once_exits_when_drained(self):
+        self.stream.put(_rows(2))
+        with mock.patch('apps.audit.management.commands.run_tracking_flusher.get_buffer', return_value=self.stream):
+            call_command('run_tracking_flusher', '--once', stdout=mock.Mock())
+        self.assertEqual(TrackingEvent.objects.count(), 2)
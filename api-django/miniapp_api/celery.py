@@ -37,10 +37,50 @@ app.conf.beat_schedule = {
         'task': 'apps.payments.tasks_cancellation.process_expired_cancellation_requests',
         'schedule': crontab(minute=0),  # Каждый час
     },
+    'requeue-payment-notifications': {
+        'task': 'apps.payments.tasks.requeue_payment_notifications',
+        'schedule': crontab(),  # Каждую минуту
+    },
+    'purge-processed-webhooks-daily': {
+        'task': 'apps.payments.tasks.purge_processed_webhooks',
+        'schedule': crontab(hour=4, minute=30),  # Каждый день в 04:30
+    },
+    'dispatch-email-outbox': {
+        'task': 'apps.users.tasks.dispatch_email_outbox',
+        'schedule': crontab(),  # Каждую минуту
+    },
     'send-cancellation-reminders-hourly': {
         'task': 'apps.payments.tasks_cancellation.send_cancellation_reminders',
         'schedule': crontab(minute=30),  # Каждый час в :30
     },
+    'accrue-missing-referral-commissions': {
+        'task': 'apps.affiliates.tasks.accrue_missing_commissions',
+        'schedule': crontab(minute=15),  # Каждый час в :15
+    },
+    'rebuild-recent-rollups-daily': {
+        'task': 'apps.reports.tasks.rebuild_recent_rollups',
+        'schedule': crontab(hour=4, minute=0),  # Каждый день в 04:00
+    },
+    'reconcile-account-summaries-daily': {
+        'task': 'apps.users.tasks.reconcile_account_summaries',
+        'schedule': crontab(hour=3, minute=30),  # Каждый день в 03:30
+    },
+    'delete-expired-exports-daily': {
+        'task': 'apps.reports.tasks.delete_expired_exports',
+        'schedule': crontab(hour=4, minute=30),  # Каждый день в 04:30
+    },
+    'maintain-audit-partitions-daily': {
+        'task': 'apps.audit.tasks.maintain_partitions',
+        'schedule': crontab(hour=2, minute=45),  # Каждый день в 02:45
+    },
+    'refresh-analytics': {
+        'task': 'apps.analytics.tasks.refresh_analytics',
+        'schedule': crontab(minute='*/5'),  # Каждые 5 минут
+    },
+    'flush-audit-log': {
+        'task': 'apps.audit.tasks.flush_audit_log',
+        'schedule': crontab(),  # Каждую минуту
+    },
 }
 
 # Celery configuration
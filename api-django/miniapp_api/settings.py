@@ -37,6 +37,8 @@ INSTALLED_APPS = [
     'apps.affiliates',
     'apps.audit',
     'apps.documents',
+    'apps.reports',
+    'apps.analytics',
 ]
 
 MIDDLEWARE = [
@@ -169,6 +171,89 @@ TBANK_TERMINAL_KEY = config('TBANK_TERMINAL_KEY', default='')
 TBANK_PASSWORD = config('TBANK_PASSWORD', default='')
 TBANK_API_URL = config('TBANK_API_URL', default='https://securepay.tinkoff.ru/v2')
 
+# HTTP-пул к T-Bank: одна сессия на процесс (gunicorn worker / Celery child),
+# соединения переиспользуются через keep-alive, после fork сессия создается заново
+TBANK_HTTP_POOL_SIZE = config('TBANK_HTTP_POOL_SIZE', default=10, cast=int)
+TBANK_HTTP_KEEPALIVE = config('TBANK_HTTP_KEEPALIVE', default=True, cast=bool)
+TBANK_HTTP_CONNECT_TIMEOUT = config('TBANK_HTTP_CONNECT_TIMEOUT', default=5, cast=float)
+# Таймауты (connect, read) по методам API, секунды
+TBANK_HTTP_TIMEOUTS = {
+    'default': (TBANK_HTTP_CONNECT_TIMEOUT, config('TBANK_HTTP_READ_TIMEOUT', default=30, cast=float)),
+    'Init': (TBANK_HTTP_CONNECT_TIMEOUT, config('TBANK_INIT_TIMEOUT', default=30, cast=float)),
+    'GetState': (TBANK_HTTP_CONNECT_TIMEOUT, config('TBANK_GETSTATE_TIMEOUT', default=15, cast=float)),
+    'Confirm': (TBANK_HTTP_CONNECT_TIMEOUT, config('TBANK_CONFIRM_TIMEOUT', default=30, cast=float)),
+    'Cancel': (TBANK_HTTP_CONNECT_TIMEOUT, config('TBANK_CANCEL_TIMEOUT', default=30, cast=float)),
+    'Charge': (TBANK_HTTP_CONNECT_TIMEOUT, config('TBANK_CHARGE_TIMEOUT', default=60, cast=float)),
+}
+
+# Рекуррентные списания: число параллельных вызовов T-Bank, лимит списаний в секунду
+# на терминал (TerminalKey) и размер пачки записи результатов в БД
+RECURRING_BILLING_WORKERS = config('RECURRING_BILLING_WORKERS', default=8, cast=int)
+RECURRING_BILLING_RATE_LIMIT = config('RECURRING_BILLING_RATE_LIMIT', default=10, cast=float)
+RECURRING_BILLING_BATCH_SIZE = config('RECURRING_BILLING_BATCH_SIZE', default=200, cast=int)
+# Число шардов (Celery-задач) ежедневного прогона и время аренды подписки прогоном (секунды)
+RECURRING_BILLING_SHARDS = config('RECURRING_BILLING_SHARDS', default=4, cast=int)
+RECURRING_BILLING_LEASE_SECONDS = config('RECURRING_BILLING_LEASE_SECONDS', default=6 * 60 * 60, cast=int)
+# Прогон без heartbeat дольше этого времени (секунды) считается упавшим и продолжается
+RECURRING_BILLING_RUN_STALE_SECONDS = config('RECURRING_BILLING_RUN_STALE_SECONDS', default=15 * 60, cast=int)
+# Как часто (секунды) идущий прогон продлевает heartbeat, пока ждет списаний пачки
+RECURRING_BILLING_HEARTBEAT_SECONDS = config('RECURRING_BILLING_HEARTBEAT_SECONDS', default=60, cast=int)
+
+# Размер пачки при итерации больших выборок в фоновых задачах (apps.common.batching)
+BATCH_ITERATION_CHUNK_SIZE = config('BATCH_ITERATION_CHUNK_SIZE', default=1000, cast=int)
+
+# Выгрузки списков админки (apps.reports.exports): больше строк - фоновая задача с файлом;
+# сколько дней хранить файлы фоновых выгрузок
+EXPORT_SYNC_MAX_ROWS = config('EXPORT_SYNC_MAX_ROWS', default=50000, cast=int)
+EXPORT_RETENTION_DAYS = config('EXPORT_RETENTION_DAYS', default=7, cast=int)
+
+# Webhook T-Bank: проверка Token в уведомлениях и асинхронный режим обработки
+# (webhook только сохраняет уведомление в payment_notifications, обработка - в Celery)
+TBANK_VERIFY_NOTIFICATIONS = config('TBANK_VERIFY_NOTIFICATIONS', default=False, cast=bool)
+PAYMENT_WEBHOOK_ASYNC = config('PAYMENT_WEBHOOK_ASYNC', default=False, cast=bool)
+PAYMENT_NOTIFICATION_MAX_ATTEMPTS = config('PAYMENT_NOTIFICATION_MAX_ATTEMPTS', default=5, cast=int)
+# Сколько часов помнить обработанные (PaymentId, Status), чтобы отсекать повторные уведомления
+PAYMENT_WEBHOOK_DEDUP_TTL_HOURS = config('PAYMENT_WEBHOOK_DEDUP_TTL_HOURS', default=72, cast=int)
+
+# Пачки фронтовых событий (/api/events/batch): максимум событий в пачке
+# и размер тела после распаковки gzip (байт)
+TRACKING_BATCH_MAX_EVENTS = config('TRACKING_BATCH_MAX_EVENTS', default=500, cast=int)
+TRACKING_BATCH_MAX_BYTES = config('TRACKING_BATCH_MAX_BYTES', default=1024 * 1024, cast=int)
+# Write-behind буфер фронтовых событий (apps.audit.buffer): sync - INSERT в запросе,
+# memory - буфер процесса с потоком сброса, redis - Redis stream и manage.py run_tracking_flusher.
+# Сброс - раз в FLUSH_INTERVAL_MS или по FLUSH_SIZE событий; при MAX_PENDING несброшенных
+# событий OVERFLOW=drop отбрасывает новые, block ждет BLOCK_TIMEOUT_MS и пишет событие в запросе
+TRACKING_BUFFER_BACKEND = config('TRACKING_BUFFER_BACKEND', default='sync')
+TRACKING_BUFFER_REDIS_URL = config('TRACKING_BUFFER_REDIS_URL', default='redis://localhost:6379/0')
+TRACKING_BUFFER_STREAM = config('TRACKING_BUFFER_STREAM', default='tracking:events')
+TRACKING_BUFFER_FLUSH_INTERVAL_MS = config('TRACKING_BUFFER_FLUSH_INTERVAL_MS', default=500, cast=int)
+TRACKING_BUFFER_FLUSH_SIZE = config('TRACKING_BUFFER_FLUSH_SIZE', default=1000, cast=int)
+TRACKING_BUFFER_MAX_PENDING = config('TRACKING_BUFFER_MAX_PENDING', default=100000, cast=int)
+TRACKING_BUFFER_OVERFLOW = config('TRACKING_BUFFER_OVERFLOW', default='block')
+TRACKING_BUFFER_BLOCK_TIMEOUT_MS = config('TRACKING_BUFFER_BLOCK_TIMEOUT_MS', default=200, cast=int)
+
+# Помесячные секции tracking_events и audit_logs (PostgreSQL): срок хранения в месяцах (0 - хранить все),
+# что делать с истекшими секциями (detach - отключить от таблицы, drop - удалить) и запас будущих секций
+TRACKING_EVENTS_RETENTION_MONTHS = config('TRACKING_EVENTS_RETENTION_MONTHS', default=12, cast=int)
+AUDIT_LOGS_RETENTION_MONTHS = config('AUDIT_LOGS_RETENTION_MONTHS', default=36, cast=int)
+PARTITION_RETENTION_ACTION = config('PARTITION_RETENTION_ACTION', default='detach')
+PARTITION_MONTHS_AHEAD = config('PARTITION_MONTHS_AHEAD', default=3, cast=int)
+
+# Сессии и воронка продаж (apps.analytics.funnels): пауза, после которой начинается новая сессия,
+# задержка учета событий (запас на write-behind буфер) и глубина первого расчета
+ANALYTICS_SESSION_TIMEOUT_MINUTES = config('ANALYTICS_SESSION_TIMEOUT_MINUTES', default=30, cast=int)
+ANALYTICS_LATENESS_SECONDS = config('ANALYTICS_LATENESS_SECONDS', default=300, cast=int)
+ANALYTICS_BACKFILL_DAYS = config('ANALYTICS_BACKFILL_DAYS', default=90, cast=int)
+
+# Журнал аудита (apps.audit.writer): sync - INSERT в запросе, redis - очередь в Redis stream,
+# которую пачками сохраняет Celery; diff - хранить только измененные поля вместо снимков целиком
+AUDIT_LOG_WRITER = config('AUDIT_LOG_WRITER', default='sync')
+AUDIT_LOG_STORAGE = config('AUDIT_LOG_STORAGE', default='full')
+AUDIT_LOG_REDIS_URL = config('AUDIT_LOG_REDIS_URL', default=TRACKING_BUFFER_REDIS_URL)
+AUDIT_LOG_STREAM = config('AUDIT_LOG_STREAM', default='audit:log')
+AUDIT_LOG_FLUSH_SIZE = config('AUDIT_LOG_FLUSH_SIZE', default=500, cast=int)
+AUDIT_LOG_MAX_PENDING = config('AUDIT_LOG_MAX_PENDING', default=100000, cast=int)
+
 # Email settings (Mail.ru SMTP)
 # Mail.ru поддерживает два варианта:
 # - Порт 465 с SSL (EMAIL_USE_SSL=True, EMAIL_USE_TLS=False) - может быть заблокирован
@@ -182,6 +267,20 @@ EMAIL_HOST_USER = config('SMTP_USER', default='no-reply@miniapp.expert')
 EMAIL_HOST_PASSWORD = config('SMTP_PASS', default='WjjmVlTb3OmQ3MxEfavh')
 DEFAULT_FROM_EMAIL = config('MAIL_FROM', default='MiniAppExpert <no-reply@miniapp.expert>')
 EMAIL_TIMEOUT = 10  # Таймаут подключения к SMTP (секунды)
+# Долгоживущее SMTP-соединение (apps.users.email_transport): переоткрывается после N писем,
+# после простоя проверяется командой NOOP (секунды)
+EMAIL_SMTP_MAX_MESSAGES_PER_CONNECTION = config('EMAIL_SMTP_MAX_MESSAGES_PER_CONNECTION', default=100, cast=int)
+EMAIL_SMTP_HEALTHCHECK_IDLE = config('EMAIL_SMTP_HEALTHCHECK_IDLE', default=30, cast=float)
+
+# Outbox исходящих писем (apps.users.outbox): размер пачки, число попыток, базовая задержка
+# повтора (удваивается с каждой попыткой), аренда пачки диспетчером (секунды)
+# и число одновременных диспетчеров на провайдера
+EMAIL_OUTBOX_BATCH_SIZE = config('EMAIL_OUTBOX_BATCH_SIZE', default=100, cast=int)
+EMAIL_OUTBOX_MAX_ATTEMPTS = config('EMAIL_OUTBOX_MAX_ATTEMPTS', default=8, cast=int)
+EMAIL_OUTBOX_RETRY_BASE_SECONDS = config('EMAIL_OUTBOX_RETRY_BASE_SECONDS', default=60, cast=int)
+EMAIL_OUTBOX_LEASE_SECONDS = config('EMAIL_OUTBOX_LEASE_SECONDS', default=300, cast=int)
+EMAIL_OUTBOX_SMTP_CONCURRENCY = config('EMAIL_OUTBOX_SMTP_CONCURRENCY', default=2, cast=int)
+EMAIL_OUTBOX_HTTP_CONCURRENCY = config('EMAIL_OUTBOX_HTTP_CONCURRENCY', default=4, cast=int)
 
 # Тестовый режим: перенаправление всех писем на тестовый email
 EMAIL_TEST_MODE = config('EMAIL_TEST_MODE', default=True, cast=bool)
@@ -1593,8 +1593,8 @@ async function loadPartnersData() {
             console.log('✅ Updated availableBalance to:', stats.available_balance || 0);
         }
         if (withdrawBalanceEl) {
-            withdrawBalanceEl.textContent = formatAmountRub(stats.available_balance || 0);
-            console.log('✅ Updated withdrawBalance to:', stats.available_balance || 0);
+            withdrawBalanceEl.textContent = formatAmountRub(stats.withdrawable_balance ?? stats.available_balance ?? 0);
+            console.log('✅ Updated withdrawBalance to:', stats.withdrawable_balance ?? stats.available_balance ?? 0);
         }
         
         // Calculate conversion rate